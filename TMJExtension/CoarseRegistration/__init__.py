@@ -2,8 +2,14 @@
 Coarse Registration 模块
 用于基于基准点的粗配准
 """
+import importlib.util
 
-from .coarse_registration_widget import CoarseRegistrationWidget
-from .coarse_registration_logic import CoarseRegistrationLogic
+# 批量配准的工作进程中没有 Slicer 环境,只导入 landmark_registration 和 batch_registration;
+# 在 Slicer 中照常导入界面和逻辑,导入错误直接抛出
+if importlib.util.find_spec("slicer") is not None:
+    from .coarse_registration_widget import CoarseRegistrationWidget
+    from .coarse_registration_logic import CoarseRegistrationLogic
 
-__all__ = ['CoarseRegistrationWidget', 'CoarseRegistrationLogic']
+    __all__ = ['CoarseRegistrationWidget', 'CoarseRegistrationLogic']
+else:
+    __all__ = []
@@ -0,0 +1,225 @@
+"""
+Batch Registration - 由已保存的基准点文件批量计算粗配准
+读取每位患者成对的 Fixed / Moving 基准点文件 (.mrk.json 或 .fcsv),求解相似变换并计算误差统计,
+写出 ITK 变换文件和 CSV 汇总。
+只使用 numpy 和标准库,不访问 MRML 场景,可以在进程池的工作进程中运行
+"""
+import csv
+import fnmatch
+import json
+import os
+import numpy as np
+from . import landmark_registration
+
+
+# 识别基准点文件角色的默认文件名模式 (fnmatch 通配符,不区分大小写)
+DEFAULT_FIDUCIAL_PATTERNS = {
+    "fixed": ["*fixed*", "*cbct*"],
+    "moving": ["*moving*", "*mri*"],
+}
+
+FIDUCIAL_FILE_EXTENSIONS = (".mrk.json", ".fcsv")
+
+# 变换文件名 (与交互式粗配准保存到场景时的节点名一致)
+TRANSFORM_FILE_NAME = "CoarseReg_Transform.tfm"
+
+SUMMARY_FILE_NAME = "coarse_registration_summary.csv"
+
+SUMMARY_COLUMNS = ["patient_id", "status", "pairs", "inliers", "scale", "rotation_deg", "translation_mm",
+                   "fre_rms_mm", "loo_tre_rms_mm", "fle_mm", "max_fre_mm", "transform_file", "error"]
+
+# RAS 与 LPS 坐标系之间的转换矩阵 (自身的逆)
+_RAS_TO_LPS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+
+def readFiducialFile(filePath):
+    """
+    读取基准点文件,坐标统一为 RAS
+
+    :param filePath: .mrk.json 或 .fcsv 文件路径
+    :return: (标签列表, [N, 3] RAS 坐标数组)
+    """
+    labels, points = [], []
+    if filePath.lower().endswith(".mrk.json"):
+        with open(filePath, "r", encoding="utf-8") as f:
+            document = json.load(f)
+        markups = document.get("markups", [])
+        if not markups:
+            raise ValueError(f"文件中没有标注点: {filePath}")
+        markup = markups[0]
+        lps = markup.get("coordinateSystem", "LPS").upper() == "LPS"
+        for controlPoint in markup.get("controlPoints", []):
+            if controlPoint.get("positionStatus", "defined") != "defined":
+                continue
+            labels.append(controlPoint.get("label", ""))
+            points.append(controlPoint["position"])
+    elif filePath.lower().endswith(".fcsv"):
+        # 旧版本 fcsv 的 CoordinateSystem 为 0 (RAS) 或 1 (LPS)
+        lps = False
+        columns = None
+        with open(filePath, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("#"):
+                    key, _, value = line[1:].partition("=")
+                    if key.strip() == "CoordinateSystem":
+                        lps = value.strip().upper() in ("LPS", "1")
+                    elif key.strip() == "columns":
+                        columns = [column.strip() for column in value.split(",")]
+                    continue
+                if not line:
+                    continue
+                fields = next(csv.reader([line]))
+                row = dict(zip(columns, fields)) if columns else {}
+                labels.append(row.get("label", fields[11] if len(fields) > 11 else ""))
+                points.append([float(row.get("x", fields[1])), float(row.get("y", fields[2])),
+                               float(row.get("z", fields[3]))])
+    else:
+        raise ValueError(f"不支持的基准点文件格式: {filePath}")
+
+    points = np.array(points, dtype=float).reshape(-1, 3)
+    if lps:
+        points[:, :2] *= -1.0
+    return labels, points
+
+
+def pairFiducials(fixedLabels, fixedPoints, movingLabels, movingPoints):
+    """
+    配对两组基准点: 两组标签相同且不重复时按标签配对,否则与交互式粗配准一致按顺序配对
+
+    点数不同且无法按标签配对时无法确定对应关系,不截断而是报错
+
+    :return: (Fixed 点 [N, 3], Moving 点 [N, 3], 是否按标签配对)
+    """
+    if (len(set(fixedLabels)) == len(fixedLabels) and set(fixedLabels) == set(movingLabels)
+            and len(set(movingLabels)) == len(movingLabels)):
+        movingIndex = {label: index for index, label in enumerate(movingLabels)}
+        order = [movingIndex[label] for label in fixedLabels]
+        return fixedPoints, movingPoints[order], True
+    if len(fixedPoints) != len(movingPoints):
+        raise ValueError(f"Fixed ({len(fixedPoints)} 个) 与 Moving ({len(movingPoints)} 个) 基准点数量不同,"
+                         f"且标签无法一一对应")
+    return fixedPoints, movingPoints, False
+
+
+def writeItkTransformFile(filePath, matrixToParent):
+    """
+    写出 ITK 文本变换文件 (.tfm),可直接由 Slicer 加载为线性变换
+
+    ITK 文件保存的是重采样方向 (Fixed → Moving, LPS) 的变换
+
+    :param filePath: 输出路径
+    :param matrixToParent: Slicer 约定的 4x4 变换 (Moving → Fixed, RAS)
+    """
+    itkMatrix = _RAS_TO_LPS @ np.linalg.inv(matrixToParent) @ _RAS_TO_LPS
+    parameters = list(itkMatrix[:3, :3].ravel()) + list(itkMatrix[:3, 3])
+    with open(filePath, "w", encoding="utf-8") as f:
+        f.write("#Insight Transform File V1.0\n")
+        f.write("#Transform 0\n")
+        f.write("Transform: AffineTransform_double_3_3\n")
+        f.write("Parameters: " + " ".join(repr(float(value)) for value in parameters) + "\n")
+        f.write("FixedParameters: 0 0 0\n")
+
+
+def findFiducialPairs(cohortDir, patterns=None):
+    """
+    扫描病例目录,每个子文件夹 (患者) 中查找 Fixed 和 Moving 基准点文件
+
+    :param cohortDir: 病例根目录
+    :param patterns: 角色到文件名模式列表的字典,默认使用 DEFAULT_FIDUCIAL_PATTERNS
+    :return: 列表,每项为 {"patient_id", "fixed", "moving"} (缺少的角色为 None)
+    """
+    if not os.path.isdir(cohortDir):
+        raise ValueError(f"病例目录不存在: {cohortDir}")
+    patterns = patterns or DEFAULT_FIDUCIAL_PATTERNS
+
+    pairs = []
+    for patientFolder in sorted(entry.path for entry in os.scandir(cohortDir) if entry.is_dir()):
+        assigned = {"fixed": None, "moving": None}
+        for root, dirs, files in os.walk(patientFolder):
+            dirs.sort()
+            for fileName in sorted(files):
+                lowerName = fileName.lower()
+                if not lowerName.endswith(FIDUCIAL_FILE_EXTENSIONS):
+                    continue
+                role = next((role for role, rolePatterns in patterns.items()
+                             if assigned.get(role) is None and
+                             any(fnmatch.fnmatch(lowerName, pattern.lower()) for pattern in rolePatterns)), None)
+                if role:
+                    assigned[role] = os.path.join(root, fileName)
+        pairs.append({"patient_id": os.path.basename(patientFolder), **assigned})
+    return pairs
+
+
+def registerFiducialFiles(patientId, fixedPath, movingPath, outputDir, robust=False,
+                          inlierThresholdMm=landmark_registration.DEFAULT_INLIER_THRESHOLD_MM):
+    """
+    计算一位患者的粗配准并写出变换文件 (工作进程入口)
+
+    :param patientId: 患者ID
+    :param fixedPath: Fixed 基准点文件
+    :param movingPath: Moving 基准点文件
+    :param outputDir: 输出根目录,变换写入 <outputDir>/<患者ID>/CoarseReg_Transform.tfm
+    :param robust: 是否使用 RANSAC 排除错误点对
+    :param inlierThresholdMm: RANSAC 内点阈值 (mm)
+    :return: CSV 汇总的一行 (字典)
+    """
+    row = {column: "" for column in SUMMARY_COLUMNS}
+    row["patient_id"] = patientId
+    try:
+        if not fixedPath or not movingPath:
+            raise ValueError("缺少 Fixed 或 Moving 基准点文件")
+        fixedLabels, fixedPoints = readFiducialFile(fixedPath)
+        movingLabels, movingPoints = readFiducialFile(movingPath)
+        fixedPoints, movingPoints, _ = pairFiducials(fixedLabels, fixedPoints, movingLabels, movingPoints)
+        if len(fixedPoints) < 3:
+            raise ValueError(f"基准点对不足 3 对 ({len(fixedPoints)} 对)")
+
+        inliers = np.ones(len(fixedPoints), dtype=bool)
+        if robust and len(fixedPoints) >= 4:
+            result = landmark_registration.ransacSimilarity(movingPoints, fixedPoints, inlierThresholdMm)
+            matrix, inliers = result["matrix"], result["inliers"]
+        else:
+            matrix = landmark_registration.similarityMatrix(
+                *landmark_registration.umeyamaSimilarity(movingPoints, fixedPoints))
+
+        quality = landmark_registration.registrationQuality(movingPoints[inliers], fixedPoints[inliers], matrix)
+        linear = matrix[:3, :3]
+        scale = float(np.cbrt(np.linalg.det(linear)))
+        rotationDeg = float(np.degrees(np.arccos(np.clip((np.trace(linear) / scale - 1.0) / 2.0, -1.0, 1.0))))
+
+        patientDir = os.path.join(outputDir, patientId)
+        os.makedirs(patientDir, exist_ok=True)
+        transformPath = os.path.join(patientDir, TRANSFORM_FILE_NAME)
+        writeItkTransformFile(transformPath, matrix)
+
+        row.update({
+            "status": "ok",
+            "pairs": len(fixedPoints),
+            "inliers": int(inliers.sum()),
+            "scale": f"{scale:.6f}",
+            "rotation_deg": f"{rotationDeg:.3f}",
+            "translation_mm": f"{np.linalg.norm(matrix[:3, 3]):.3f}",
+            "fre_rms_mm": f"{quality['fre_rms']:.4f}",
+            "loo_tre_rms_mm": "" if quality["loo_tre_rms"] is None else f"{quality['loo_tre_rms']:.4f}",
+            "fle_mm": "" if quality["fle"] is None else f"{quality['fle']:.4f}",
+            "max_fre_mm": f"{np.max(quality['fre']):.4f}",
+            "transform_file": os.path.relpath(transformPath, outputDir).replace(os.sep, "/"),
+        })
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = str(e)
+    return row
+
+
+def writeSummary(filePath, rows):
+    """
+    写出 CSV 汇总 (UTF-8 BOM,便于 Excel 直接打开)
+
+    :param filePath: 输出路径
+    :param rows: registerFiducialFiles 返回的行列表
+    """
+    with open(filePath, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -2,9 +2,17 @@
 Coarse Registration Logic - 基于基准点的粗配准业务逻辑
 """
 import logging
+import os
 import vtk
 import slicer
 import numpy as np
+from Common.scene_utils import sceneBatch, createModuleFolder, placeNodeInFolder
+from Common.transform_chain import getMatrixToParent, getMatrixToWorld, transformPoints
+from DataManager.memory_manager import markRegenerable, reloadEvictedVolume
+from . import landmark_registration
+from . import batch_registration
+from . import landmark_proposals
+from . import surface_icp
 
 
 class CoarseRegistrationLogic:
@@ -20,6 +28,10 @@ class CoarseRegistrationLogic:
         :param logCallback: 日志回调函数
         """
         self.logCallback = logCallback
+        # 最近一次鲁棒配准的结果 (内点/外点、残差),未使用鲁棒模式时为 None
+        self.lastRobustResult = None
+        # 重采样预览缓存: 变换节点 ID -> {node, key, matrix, observerTag}
+        self.previewCache = {}
 
     def log(self, message):
         """日志输出"""
@@ -27,13 +39,16 @@ class CoarseRegistrationLogic:
         if self.logCallback:
             self.logCallback(message)
 
-    def computeSimilarityTransform(self, fixedFiducials, movingFiducials):
+    def computeSimilarityTransform(self, fixedFiducials, movingFiducials, robust=False,
+                                   inlierThresholdMm=landmark_registration.DEFAULT_INLIER_THRESHOLD_MM):
         """
         基于对应的基准点对计算相似性变换 (Similarity Transform)
-        使用 VTK 的 LandmarkTransform 计算
+        默认使用 VTK 的 LandmarkTransform 计算;鲁棒模式下使用 RANSAC 剔除错误的点对
         
         :param fixedFiducials: Fixed 标注点节点
         :param movingFiducials: Moving 标注点节点
+        :param robust: 是否使用鲁棒模式 (RANSAC + Umeyama),结果保存在 self.lastRobustResult
+        :param inlierThresholdMm: 鲁棒模式的内点残差阈值 (mm)
         :return: 变换节点 (如果成功)
         """
         try:
@@ -70,15 +85,20 @@ class CoarseRegistrationLogic:
                 
                 self.log(f"  点对 {i+1}: Fixed{fixedPos} -> Moving{movingPos}")
             
-            # 使用 VTK 的 LandmarkTransform 计算相似变换
-            landmarkTransform = vtk.vtkLandmarkTransform()
-            landmarkTransform.SetSourceLandmarks(movingPoints)  # Moving 点
-            landmarkTransform.SetTargetLandmarks(fixedPoints)   # Fixed 点
-            landmarkTransform.SetModeToSimilarity()  # 相似变换模式 (平移+旋转+统一缩放)
-            landmarkTransform.Update()
-            
-            # 获取变换矩阵
-            transformMatrix = landmarkTransform.GetMatrix()
+            self.lastRobustResult = None
+            if robust:
+                # 鲁棒模式: 批量评价最小子集假设,剔除与多数点对不一致的点对
+                transformMatrix = self._computeRobustSimilarity(fixedPoints, movingPoints, inlierThresholdMm)
+            else:
+                # 使用 VTK 的 LandmarkTransform 计算相似变换
+                landmarkTransform = vtk.vtkLandmarkTransform()
+                landmarkTransform.SetSourceLandmarks(movingPoints)  # Moving 点
+                landmarkTransform.SetTargetLandmarks(fixedPoints)   # Fixed 点
+                landmarkTransform.SetModeToSimilarity()  # 相似变换模式 (平移+旋转+统一缩放)
+                landmarkTransform.Update()
+
+                # 获取变换矩阵
+                transformMatrix = landmarkTransform.GetMatrix()
             
             # 计算变换参数用于日志
             self._logTransformParameters(transformMatrix)
@@ -98,6 +118,37 @@ class CoarseRegistrationLogic:
             self.log(f"计算相似变换失败: {str(e)}")
             raise
 
+    def _computeRobustSimilarity(self, fixedPoints, movingPoints, inlierThresholdMm):
+        """
+        RANSAC 鲁棒相似变换,并在日志中报告内点/外点
+
+        :param fixedPoints: Fixed 点集 (vtkPoints)
+        :param movingPoints: Moving 点集 (vtkPoints)
+        :param inlierThresholdMm: 内点残差阈值 (mm)
+        :return: vtkMatrix4x4 变换矩阵
+        """
+        import vtk.util.numpy_support as vtk_np
+        fixedArray = vtk_np.vtk_to_numpy(fixedPoints.GetData()).astype(float)
+        movingArray = vtk_np.vtk_to_numpy(movingPoints.GetData()).astype(float)
+        if len(fixedArray) < 4:
+            self.log("⚠ 只有3个点对时无法识别错误点对,鲁棒模式等同于普通配准")
+
+        result = landmark_registration.ransacSimilarity(movingArray, fixedArray, inlierThresholdMm)
+        self.lastRobustResult = result
+
+        inliers = result["inliers"]
+        self.log(f"--- 鲁棒配准 (RANSAC, {result['hypotheses']} 个假设, 阈值 {inlierThresholdMm:.1f} mm) ---")
+        for i, residual in enumerate(result["residuals"]):
+            marker = "✓" if inliers[i] else "✗ 外点"
+            self.log(f"  点对 {i+1}: 残差 {residual:.2f} mm {marker}")
+        outlierCount = int((~inliers).sum())
+        if outlierCount:
+            outlierLabels = ", ".join(str(i + 1) for i in np.where(~inliers)[0])
+            self.log(f"⚠ 检测到 {outlierCount} 个不一致的点对 ({outlierLabels}),已从变换计算中排除,请检查标注")
+        self.log(f"  内点: {int(inliers.sum())}/{len(inliers)}, 内点 RMS: {result['rms']:.2f} mm")
+
+        return slicer.util.vtkMatrixFromArray(result["matrix"])
+
     def _logTransformParameters(self, matrix):
         """
         解析并记录变换参数
@@ -148,50 +199,340 @@ class CoarseRegistrationLogic:
         except Exception as e:
             self.log(f"解析变换参数时出错: {str(e)}")
 
-    def _computeRegistrationError(self, fixedPoints, movingPoints, transformMatrix):
+    def getControlPointArrays(self, fixedFiducials, movingFiducials):
         """
-        计算配准后的 RMS 误差
-        
-        :param fixedPoints: Fixed 点集
-        :param movingPoints: Moving 点集
-        :param transformMatrix: 变换矩阵
-        :return: RMS 误差 (mm)
+        读取成对的基准点坐标
+
+        :param fixedFiducials: Fixed 标注点节点
+        :param movingFiducials: Moving 标注点节点
+        :return: ([N, 3] Fixed 点, [N, 3] Moving 点)
+        """
+        fixedArray = slicer.util.arrayFromMarkupsControlPoints(fixedFiducials).astype(float)
+        movingArray = slicer.util.arrayFromMarkupsControlPoints(movingFiducials).astype(float)
+        if len(fixedArray) != len(movingArray):
+            raise ValueError(f"标注点数量不匹配: Fixed={len(fixedArray)}, Moving={len(movingArray)}")
+        return fixedArray, movingArray
+
+    def proposeLandmarkPairs(self, fixedVolume, movingVolume, spacingMm=2.0,
+                             maxPairs=landmark_proposals.DEFAULT_MAX_PAIRS,
+                             inlierThresholdMm=landmark_proposals.DEFAULT_PROPOSAL_INLIER_THRESHOLD_MM):
+        """
+        自动推荐基准点对
+
+        两幅图像先平滑并重采样到轴向与 RAS 对齐、间距为 spacingMm 的网格 (各自的局部坐标,不含父变换),
+        再由 landmark_proposals 检测显著点、匹配 MIND 描述子并用 RANSAC 验证
+
+        :param fixedVolume: Fixed Volume 节点
+        :param movingVolume: Moving Volume 节点
+        :param spacingMm: 检测网格间距 (mm)
+        :param maxPairs: 推荐的最大点对数
+        :param inlierThresholdMm: RANSAC 内点阈值 (mm)
+        :return: landmark_proposals.proposeLandmarkPairs 的结果字典
         """
+        import time
         try:
-            numPoints = fixedPoints.GetNumberOfPoints()
-            squaredErrors = []
-            
-            for i in range(numPoints):
-                # 获取 Moving 点
-                movingPos = movingPoints.GetPoint(i)
-                movingPos4 = [movingPos[0], movingPos[1], movingPos[2], 1.0]
-                
-                # 应用变换
-                transformedPos = transformMatrix.MultiplyPoint(movingPos4)
-                
-                # 获取 Fixed 点
-                fixedPos = fixedPoints.GetPoint(i)
-                
-                # 计算欧氏距离的平方
-                dx = transformedPos[0] - fixedPos[0]
-                dy = transformedPos[1] - fixedPos[1]
-                dz = transformedPos[2] - fixedPos[2]
-                squaredError = dx*dx + dy*dy + dz*dz
-                
-                squaredErrors.append(squaredError)
-            
-            # 计算 RMS
-            rms = np.sqrt(np.mean(squaredErrors))
-            
-            return rms
-            
+            startTime = time.time()
+            self.log(f"开始自动推荐基准点对 (检测网格 {spacingMm} mm)...")
+            fixedArray, fixedIJKToRAS = self._resampleToRASGrid(fixedVolume, spacingMm)
+            movingArray, movingIJKToRAS = self._resampleToRASGrid(movingVolume, spacingMm)
+
+            result = landmark_proposals.proposeLandmarkPairs(
+                fixedArray, fixedIJKToRAS, movingArray, movingIJKToRAS,
+                maxPairs=maxPairs, inlierThresholdMm=inlierThresholdMm)
+
+            self.log(f"  候选点: Fixed {result['keypoints'][0]} 个, Moving {result['keypoints'][1]} 个; "
+                     f"描述子匹配 {result['matches']} 对, RANSAC 内点 {result['inliers']} 对")
+            if len(result["fixed_points"]):
+                self.log(f"✓ 推荐 {len(result['fixed_points'])} 对基准点 ({time.time() - startTime:.1f} s)")
+            else:
+                self.log(f"⚠ 未找到一致的点对,请手动放置基准点")
+            return result
+
+        except Exception as e:
+            self.log(f"✗ 自动推荐基准点对失败: {str(e)}")
+            raise
+
+    def _resampleToRASGrid(self, volumeNode, spacingMm):
+        """
+        高斯抗混叠平滑后,用 vtkImageReslice 重采样到覆盖体积范围、轴向与 RAS 对齐的各向同性网格
+
+        :param volumeNode: 体积节点
+        :param spacingMm: 网格间距 (mm)
+        :return: ([k, j, i] float32 数组, 4x4 IJK→RAS 矩阵)
+        """
+        import vtk.util.numpy_support as vtk_np
+        reloadEvictedVolume(volumeNode)
+        bounds = [0.0] * 6
+        volumeNode.GetBounds(bounds)
+        lower = np.array(bounds[0::2])
+        dims = np.floor((np.array(bounds[1::2]) - lower) / spacingMm).astype(int) + 1
+        gridIJKToRAS = np.diag([spacingMm, spacingMm, spacingMm, 1.0])
+        gridIJKToRAS[:3, 3] = lower
+
+        volumeIJKToRAS = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(volumeIJKToRAS)
+        volumeIJKToRAS = slicer.util.arrayFromVTKMatrix(volumeIJKToRAS)
+
+        # 平滑尺度约为目标间距的一半 (以各轴体素为单位)
+        smooth = vtk.vtkImageGaussianSmooth()
+        smooth.SetInputData(volumeNode.GetImageData())
+        smooth.SetDimensionality(3)
+        smooth.SetStandardDeviations(*[max(0.0, 0.5 * spacingMm / spacing) for spacing in volumeNode.GetSpacing()])
+        smooth.SetRadiusFactors(2.0, 2.0, 2.0)
+
+        reslice = vtk.vtkImageReslice()
+        reslice.SetInputConnection(smooth.GetOutputPort())
+        reslice.SetResliceAxes(slicer.util.vtkMatrixFromArray(np.linalg.inv(volumeIJKToRAS) @ gridIJKToRAS))
+        reslice.SetInterpolationModeToLinear()
+        reslice.SetOutputSpacing(1.0, 1.0, 1.0)
+        reslice.SetOutputOrigin(0.0, 0.0, 0.0)
+        reslice.SetOutputExtent(0, int(dims[0]) - 1, 0, int(dims[1]) - 1, 0, int(dims[2]) - 1)
+        reslice.SetOutputScalarType(vtk.VTK_FLOAT)
+        reslice.SetBackgroundLevel(float(volumeNode.GetImageData().GetScalarRange()[0]))
+        reslice.Update()
+
+        array = vtk_np.vtk_to_numpy(reslice.GetOutput().GetPointData().GetScalars())
+        return array.reshape(dims[::-1]).astype(np.float32), gridIJKToRAS
+
+    def batchRegisterCohort(self, cohortDir, outputDir, patterns=None, robust=False,
+                            inlierThresholdMm=landmark_registration.DEFAULT_INLIER_THRESHOLD_MM, maxWorkers=None):
+        """
+        无界面批量粗配准: 由每位患者已保存的基准点文件计算相似变换
+
+        cohortDir 下每个子文件夹视为一位患者,其中的 .mrk.json / .fcsv 文件按文件名模式识别为 Fixed 或 Moving 基准点。
+        各患者在进程池中并行计算,变换写为 <outputDir>/<患者ID>/CoarseReg_Transform.tfm,
+        误差统计汇总到 <outputDir>/coarse_registration_summary.csv。不访问 MRML 场景
+
+        :param cohortDir: 病例根目录
+        :param outputDir: 输出目录
+        :param patterns: 文件名模式,默认使用 batch_registration.DEFAULT_FIDUCIAL_PATTERNS
+        :param robust: 是否使用 RANSAC 排除错误点对
+        :param inlierThresholdMm: RANSAC 内点阈值 (mm)
+        :param maxWorkers: 工作进程数,为 None 时使用全部 CPU 核心
+        :return: 每位患者的结果列表 (CSV 汇总的行)
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+
+        try:
+            self.log(f"===== 开始批量粗配准: {cohortDir} =====")
+            pairs = batch_registration.findFiducialPairs(cohortDir, patterns)
+            if not pairs:
+                raise ValueError("病例目录中没有患者子文件夹")
+            os.makedirs(outputDir, exist_ok=True)
+            workers = min(maxWorkers or os.cpu_count() or 1, len(pairs))
+            arguments = [(pair["patient_id"], pair["fixed"], pair["moving"], outputDir, robust, inlierThresholdMm)
+                         for pair in pairs]
+
+            def runAll(executor):
+                futures = [executor.submit(batch_registration.registerFiducialFiles, *args) for args in arguments]
+                return [future.result() for future in futures]
+
+            try:
+                # spawn 方式在各平台上行为一致,工作进程只导入 numpy 和本模块的数值计算部分
+                with ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context("spawn")) as executor:
+                    rows = runAll(executor)
+                self.log(f"  使用 {workers} 个进程计算 {len(pairs)} 位患者")
+            except (BrokenProcessPool, OSError) as e:
+                self.log(f"⚠ 无法启动进程池 ({str(e)}),改用线程计算")
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    rows = runAll(executor)
+
+            summaryPath = os.path.join(outputDir, batch_registration.SUMMARY_FILE_NAME)
+            batch_registration.writeSummary(summaryPath, rows)
+
+            for row in rows:
+                if row["status"] == "ok":
+                    self.log(f"✓ {row['patient_id']}: {row['inliers']}/{row['pairs']} 对, "
+                             f"FRE RMS {row['fre_rms_mm']} mm")
+                else:
+                    self.log(f"✗ {row['patient_id']}: {row['error']}")
+            okRows = [row for row in rows if row["status"] == "ok"]
+            if okRows:
+                freValues = np.array([float(row["fre_rms_mm"]) for row in okRows])
+                self.log(f"  FRE RMS: 平均 {freValues.mean():.3f} mm, 最大 {freValues.max():.3f} mm")
+            self.log(f"===== 批量粗配准完成: {len(okRows)}/{len(rows)} 位患者成功 =====")
+            self.log(f"  汇总: {summaryPath}")
+            return rows
+
+        except Exception as e:
+            self.log(f"✗ 批量粗配准失败: {str(e)}")
+            raise
+
+    def computeRegistrationQuality(self, fixedFiducials, movingFiducials, transformNode, targetPoints=None):
+        """
+        计算配准质量: 逐点 FRE、RMS、留一法 TRE 和 Fitzpatrick 预期 TRE
+
+        鲁棒配准排除了外点时,FLE 和预期 TRE 只用内点估计;外点的 FRE 和留一 TRE 仍然给出
+
+        :param fixedFiducials: Fixed 标注点节点
+        :param movingFiducials: Moving 标注点节点
+        :param transformNode: 粗配准变换节点 (Moving → Fixed)
+        :param targetPoints: [M, 3] 需要估计预期 TRE 的目标点 (Fixed 坐标),默认为各 Fixed 基准点
+        :return: landmark_registration.registrationQuality 的结果字典,附加 inliers
+        """
+        try:
+            fixedArray, movingArray = self.getControlPointArrays(fixedFiducials, movingFiducials)
+            matrix = getMatrixToParent(transformNode)
+
+            inliers = np.ones(len(fixedArray), dtype=bool)
+            if self.lastRobustResult is not None and len(self.lastRobustResult["inliers"]) == len(fixedArray):
+                inliers = self.lastRobustResult["inliers"]
+
+            quality = landmark_registration.registrationQuality(movingArray[inliers], fixedArray[inliers], matrix,
+                                                                fixedArray if targetPoints is None else targetPoints)
+            # 逐点 FRE 和留一 TRE 对所有点对给出(包括外点)
+            quality["fre"] = landmark_registration.fiducialRegistrationErrors(movingArray, fixedArray, matrix)
+            looTre = landmark_registration.leaveOneOutErrors(movingArray, fixedArray)
+            quality["loo_tre"] = looTre
+            quality["loo_tre_rms"] = float(np.sqrt(np.mean(looTre ** 2))) if looTre is not None else None
+            quality["inliers"] = inliers
+
+            self.log("--- 配准质量 ---")
+            self.log(f"  FRE RMS: {quality['fre_rms']:.2f} mm (最大 {quality['fre'].max():.2f} mm)")
+            if quality["loo_tre_rms"] is not None:
+                worst = int(np.argmax(quality["loo_tre"]))
+                self.log(f"  留一法 TRE RMS: {quality['loo_tre_rms']:.2f} mm "
+                         f"(最大为点对 {worst + 1}: {quality['loo_tre'][worst]:.2f} mm)")
+            else:
+                self.log("  ⚠ 点对少于4个,无法进行留一法分析")
+            if quality["expected_tre"] is not None:
+                self.log(f"  估计 FLE: {quality['fle']:.2f} mm, "
+                         f"预期 TRE: {quality['expected_tre'].min():.2f} - {quality['expected_tre'].max():.2f} mm")
+            return quality
+
         except Exception as e:
             self.log(f"计算配准误差时出错: {str(e)}")
-            return -1.0
+            raise
+
+    def refineWithSurfaceICP(self, fixedVolume, movingVolume, transformNode, roiNode,
+                             fixedThresholdHU=surface_icp.DEFAULT_BONE_THRESHOLD_HU, movingThreshold=None,
+                             movingAbove=True, spacingMm=surface_icp.DEFAULT_SURFACE_SPACING_MM,
+                             maxCorrespondenceMm=surface_icp.DEFAULT_MAX_CORRESPONDENCE_MM,
+                             iterations=surface_icp.DEFAULT_ICP_ITERATIONS):
+        """
+        用髁突 / 关节窝骨表面的点到面 ICP 精修粗配准变换 (原地更新变换节点)
+
+        只在 ROI 包围盒内提取表面: CBCT 按 HU 阈值取骨表面,MRI 按阈值 (默认 ROI 内的 Otsu 阈值) 取对应表面。
+        Moving 表面在 ROI 经当前变换反算到 Moving 坐标的包围盒内提取;Fixed 包围盒外扩最大对应距离,
+        使 ROI 边缘的 Moving 点也能找到对应点
+
+        :param fixedVolume: Fixed Volume (CBCT)
+        :param movingVolume: Moving Volume (MRI)
+        :param transformNode: 粗配准变换节点 (CoarseReg_Transform),精修结果写回此节点
+        :param roiNode: ROI 掩膜 (Fixed_ROI_Mask 等,取非零体素包围盒) 或 Markups ROI 节点
+        :param fixedThresholdHU: CBCT 骨阈值 (HU)
+        :param movingThreshold: MRI 表面阈值,为 None 时使用 ROI 内的 Otsu 阈值
+        :param movingAbove: MRI 中高于阈值为前景 (False 时低于阈值为前景,如低信号皮质骨)
+        :param spacingMm: 表面点云下采样间距 (mm)
+        :param maxCorrespondenceMm: 对应点最大距离 (mm)
+        :param iterations: 最大迭代次数
+        :return: surface_icp.pointToPlaneICP 的结果字典,附加表面点数
+        """
+        import time
+        try:
+            if not fixedVolume or not movingVolume or not transformNode or not roiNode:
+                raise ValueError("Fixed Volume、Moving Volume、变换和 ROI 都不能为空")
+            if not transformNode.IsLinear():
+                raise ValueError("ICP 精修只支持线性变换")
+            if transformNode.GetParentTransformNode():
+                self.log(f"⚠ 变换节点带有父变换,精修按其到世界坐标系的矩阵计算,写回时换算到父坐标系")
+            # 已换出到磁盘的体积 (如 Fixed_ROI_Mask) 先重新加载再读取体素
+            for volumeNode in (fixedVolume, movingVolume, roiNode):
+                if volumeNode.IsA("vtkMRMLVolumeNode"):
+                    reloadEvictedVolume(volumeNode)
+
+            startTime = time.time()
+            self.log(f"开始 ICP 表面精修 (ROI: {roiNode.GetName()})...")
+            initialMatrix = getMatrixToWorld(transformNode)
+            inverseInitialMatrix = getMatrixToWorld(transformNode, inverse=True)
+            roiBounds = self._getROIBounds(roiNode)
+
+            fixedBounds = np.array(roiBounds) + np.tile([-maxCorrespondenceMm, maxCorrespondenceMm], 3)
+            fixedPoints = surface_icp.extractSurfacePoints(
+                slicer.util.arrayFromVolume(fixedVolume), self._getIJKToRASArray(fixedVolume), fixedThresholdHU,
+                rasBounds=fixedBounds, above=True, spacingMm=spacingMm)
+
+            # ROI 包围盒角点经当前变换的逆映射到 Moving 坐标
+            corners = np.array([[x, y, z] for x in roiBounds[0:2] for y in roiBounds[2:4] for z in roiBounds[4:6]])
+            movingCorners = transformPoints(corners, inverseInitialMatrix)
+            movingBounds = np.column_stack([movingCorners.min(axis=0), movingCorners.max(axis=0)]).ravel()
+            movingArray = slicer.util.arrayFromVolume(movingVolume)
+            movingIJKToRAS = self._getIJKToRASArray(movingVolume)
+            if movingThreshold is None:
+                region, _ = surface_icp.cropToBounds(movingArray, movingIJKToRAS, movingBounds)
+                movingThreshold = surface_icp.otsuThreshold(region)
+                self.log(f"  MRI 表面阈值 (ROI 内 Otsu): {movingThreshold:.1f}")
+            movingPoints = surface_icp.extractSurfacePoints(
+                movingArray, movingIJKToRAS, movingThreshold, rasBounds=movingBounds, above=movingAbove,
+                spacingMm=spacingMm)
+
+            self.log(f"  表面点云: Fixed {len(fixedPoints)} 点 (阈值 {fixedThresholdHU:.0f} HU), "
+                     f"Moving {len(movingPoints)} 点")
+            if len(fixedPoints) < 10 or len(movingPoints) < 10:
+                raise ValueError("表面点过少,请检查阈值和 ROI 范围")
+
+            result = surface_icp.pointToPlaneICP(
+                movingPoints, fixedPoints, initialMatrix, iterations=iterations,
+                maxCorrespondenceMm=maxCorrespondenceMm)
+            result["fixed_points"] = len(fixedPoints)
+            result["moving_points"] = len(movingPoints)
+
+            # ICP 结果为到世界坐标系的矩阵,写回节点前去掉父变换链: toParent = inv(parentToWorld) @ toWorld
+            matrixToParent = result["matrix"]
+            parentTransformNode = transformNode.GetParentTransformNode()
+            if parentTransformNode:
+                matrixToParent = getMatrixToWorld(parentTransformNode, inverse=True) @ result["matrix"]
+            transformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(matrixToParent))
+
+            correction = result["matrix"] @ inverseInitialMatrix
+            rotationDeg = np.degrees(np.arccos(np.clip((np.trace(correction[:3, :3]) - 1.0) / 2.0, -1.0, 1.0)))
+            self.log(f"✓ ICP 表面精修完成: {result['iterations']} 次迭代, {result['correspondences']} 对对应点 "
+                     f"({time.time() - startTime:.1f} s)")
+            self.log(f"  表面距离 RMS: {result['rms_before']:.2f} → {result['rms_after']:.2f} mm")
+            self.log(f"  修正量: 平移 {np.linalg.norm(correction[:3, 3]):.2f} mm, 旋转 {rotationDeg:.2f}°")
+            return result
+
+        except Exception as e:
+            self.log(f"✗ ICP 表面精修失败: {str(e)}")
+            raise
+
+    def _getROIBounds(self, roiNode):
+        """
+        ROI 的 RAS 包围盒
+
+        :param roiNode: 掩膜体积 (非零体素) 或 Markups ROI 节点
+        :return: [xmin, xmax, ymin, ymax, zmin, zmax]
+        """
+        if roiNode.IsA("vtkMRMLVolumeNode"):
+            kji = np.argwhere(slicer.util.arrayFromVolume(roiNode) != 0)
+            if len(kji) == 0:
+                raise ValueError("ROI 掩膜为空")
+            corners = np.array([[i, j, k, 1.0] for i in (kji[:, 2].min(), kji[:, 2].max())
+                                for j in (kji[:, 1].min(), kji[:, 1].max())
+                                for k in (kji[:, 0].min(), kji[:, 0].max())])
+            ras = (corners @ self._getIJKToRASArray(roiNode).T)[:, :3]
+            return list(np.column_stack([ras.min(axis=0), ras.max(axis=0)]).ravel())
+        bounds = [0.0] * 6
+        roiNode.GetRASBounds(bounds)
+        return bounds
+
+    def _getIJKToRASArray(self, volumeNode):
+        """
+        体积自身的 IJK→RAS 矩阵 (不含父变换)
+
+        :param volumeNode: 体积节点
+        :return: 4x4 numpy 数组
+        """
+        ijkToRAS = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRAS)
+        return slicer.util.arrayFromVTKMatrix(ijkToRAS)
 
     def saveCoarseRegistrationToScene(self, fixedVolume, movingVolume, transformNode,
                                      fixedFiducials, movingFiducials,
-                                     mainFolderName, moduleFolderName):
+                                     mainFolderName, moduleFolderName, previewDownsample=None):
         """
         将粗配准结果保存到场景文件夹中
         
@@ -202,113 +543,110 @@ class CoarseRegistrationLogic:
         :param movingFiducials: Moving 标注点
         :param mainFolderName: 配准流程总文件夹名称
         :param moduleFolderName: 模块子文件夹名称
+        :param previewDownsample: 重采样预览网格相对 Fixed 网格的下采样因子,为 None 时不生成预览
         :return: 成功状态
         """
         try:
-            # 获取 Subject Hierarchy 节点
-            shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
-            sceneItemID = shNode.GetSceneItemID()
-            
-            # 检查总文件夹是否已存在
-            mainFolderItemID = shNode.GetItemChildWithName(sceneItemID, mainFolderName)
-            
-            if mainFolderItemID == 0:  # 不存在，创建新的总文件夹
-                mainFolderItemID = shNode.CreateFolderItem(sceneItemID, mainFolderName)
-                self.log(f"✓ 创建配准流程总文件夹: {mainFolderName}")
-            else:
-                self.log(f"✓ 使用已存在的总文件夹: {mainFolderName}")
-            
-            # 在总文件夹下创建模块子文件夹
-            moduleFolderItemID = shNode.CreateFolderItem(mainFolderItemID, moduleFolderName)
-            self.log(f"✓ 创建模块子文件夹: {moduleFolderName}")
-            
-            # 1. 保存变换矩阵
-            if transformNode:
-                # 重命名变换节点
-                transformNode.SetName("CoarseReg_Transform")
+            # 文件夹和所有节点在同一个批处理中创建,结束时只刷新一次
+            with sceneBatch():
+                # 获取或创建总文件夹,并在其下创建模块子文件夹
+                shNode, mainFolderItemID, moduleFolderItemID = createModuleFolder(
+                    mainFolderName, moduleFolderName, logCallback=self.log)
+            
+                # 1. 保存变换矩阵
+                if transformNode:
+                    # 重命名变换节点
+                    transformNode.SetName("CoarseReg_Transform")
                 
-                # 移动到文件夹
-                transformItemID = shNode.GetItemByDataNode(transformNode)
-                shNode.SetItemParent(transformItemID, moduleFolderItemID)
-                self.log(f"✓ 变换矩阵已保存")
-            
-            # 2. 创建粗配准后的 Moving Volume (深拷贝 + 应用变换)
-            if movingVolume and transformNode:
-                movingCopy = slicer.mrmlScene.AddNewNodeByClass(
-                    movingVolume.GetClassName(), 
-                    "CoarseReg_Moving"
-                )
+                    # 移动到文件夹
+                    placeNodeInFolder(shNode, transformNode, moduleFolderItemID)
+                    self.log(f"✓ 变换矩阵已保存")
+            
+                # 2. 创建粗配准后的 Moving Volume (深拷贝 + 应用变换)
+                if movingVolume and transformNode:
+                    movingCopy = slicer.mrmlScene.AddNewNodeByClass(
+                        movingVolume.GetClassName(), 
+                        "CoarseReg_Moving"
+                    )
                 
-                # 深拷贝图像数据
-                imageData = vtk.vtkImageData()
-                imageData.DeepCopy(movingVolume.GetImageData())
-                movingCopy.SetAndObserveImageData(imageData)
+                    # 深拷贝图像数据
+                    reloadEvictedVolume(movingVolume)
+                    imageData = vtk.vtkImageData()
+                    imageData.DeepCopy(movingVolume.GetImageData())
+                    movingCopy.SetAndObserveImageData(imageData)
                 
-                # 复制几何属性
-                movingCopy.SetOrigin(movingVolume.GetOrigin())
-                movingCopy.SetSpacing(movingVolume.GetSpacing())
+                    # 复制几何属性
+                    movingCopy.SetOrigin(movingVolume.GetOrigin())
+                    movingCopy.SetSpacing(movingVolume.GetSpacing())
                 
-                # 复制方向矩阵
-                directionMatrix = vtk.vtkMatrix4x4()
-                movingVolume.GetIJKToRASDirectionMatrix(directionMatrix)
-                movingCopy.SetIJKToRASDirectionMatrix(directionMatrix)
+                    # 复制方向矩阵
+                    directionMatrix = vtk.vtkMatrix4x4()
+                    movingVolume.GetIJKToRASDirectionMatrix(directionMatrix)
+                    movingCopy.SetIJKToRASDirectionMatrix(directionMatrix)
                 
-                # 应用粗配准变换
-                movingCopy.SetAndObserveTransformNodeID(transformNode.GetID())
+                    # 应用粗配准变换
+                    movingCopy.SetAndObserveTransformNodeID(transformNode.GetID())
+                    # 可由 Moving Volume 和变换重新生成,内存不足时允许换出到磁盘
+                    markRegenerable(movingCopy)
                 
-                # 移动到文件夹
-                movingItemID = shNode.GetItemByDataNode(movingCopy)
-                shNode.SetItemParent(movingItemID, moduleFolderItemID)
+                    # 移动到文件夹
+                    placeNodeInFolder(shNode, movingCopy, moduleFolderItemID)
                 
-                self.log(f"✓ 粗配准后的 Moving Volume 已保存并绑定变换")
-            
-            # 3. 保存 Fixed Fiducials (红色)
-            if fixedFiducials and fixedFiducials.GetNumberOfControlPoints() > 0:
-                fixedFidCopy = self._copyFiducials(
-                    fixedFiducials, 
-                    "CoarseReg_Fixed_Fiducials", 
-                    shNode, 
-                    moduleFolderItemID
-                )
-                # 设置为红色
-                fidDisplayNode = fixedFidCopy.GetDisplayNode()
-                if fidDisplayNode:
-                    fidDisplayNode.SetSelectedColor(1.0, 0.0, 0.0)  # 红色
-                    fidDisplayNode.SetColor(1.0, 0.0, 0.0)
-                    fidDisplayNode.SetGlyphScale(2.5)
-                    fidDisplayNode.SetTextScale(2.5)
-                self.log(f"✓ Fixed 标注点已保存 (红色, {fixedFiducials.GetNumberOfControlPoints()} 个点)")
-            
-            # 4. 保存 Moving Fiducials (绿色)
-            if movingFiducials and movingFiducials.GetNumberOfControlPoints() > 0:
-                movingFidCopy = self._copyFiducials(
-                    movingFiducials, 
-                    "CoarseReg_Moving_Fiducials", 
-                    shNode, 
-                    moduleFolderItemID
-                )
-                # 设置为绿色
-                fidDisplayNode = movingFidCopy.GetDisplayNode()
-                if fidDisplayNode:
-                    fidDisplayNode.SetSelectedColor(0.0, 1.0, 0.0)  # 绿色
-                    fidDisplayNode.SetColor(0.0, 1.0, 0.0)
-                    fidDisplayNode.SetGlyphScale(2.5)
-                    fidDisplayNode.SetTextScale(2.5)
-                self.log(f"✓ Moving 标注点已保存 (绿色, {movingFiducials.GetNumberOfControlPoints()} 个点)")
-            
-            # 5. 删除原始的基准点节点
-            if fixedFiducials:
-                slicer.mrmlScene.RemoveNode(fixedFiducials)
-                self.log(f"✓ 已删除原始 Fixed 基准点")
-            
-            if movingFiducials:
-                slicer.mrmlScene.RemoveNode(movingFiducials)
-                self.log(f"✓ 已删除原始 Moving 基准点")
-            
-            self.log(f"✓ 粗配准结果保存完成")
-            self.log(f"  - 保存的体积: CoarseReg_Moving (已应用变换)")
-            self.log(f"  - 变换关系: CoarseReg_Moving → CoarseReg_Transform")
-            self.log(f"  - 标注点对: {fixedFiducials.GetNumberOfControlPoints() if fixedFiducials else 0} 对")
+                    self.log(f"✓ 粗配准后的 Moving Volume 已保存并绑定变换")
+
+                    # 重采样到 Fixed 网格的预览,切片浏览时无需经变换实时重采样
+                    if previewDownsample and fixedVolume:
+                        previewNode = self.createResampledPreview(movingVolume, transformNode, fixedVolume,
+                                                                  previewDownsample)
+                        placeNodeInFolder(shNode, previewNode, moduleFolderItemID)
+            
+                # 3. 保存 Fixed Fiducials (红色)
+                if fixedFiducials and fixedFiducials.GetNumberOfControlPoints() > 0:
+                    fixedFidCopy = self._copyFiducials(
+                        fixedFiducials, 
+                        "CoarseReg_Fixed_Fiducials", 
+                        shNode, 
+                        moduleFolderItemID
+                    )
+                    # 设置为红色
+                    fidDisplayNode = fixedFidCopy.GetDisplayNode()
+                    if fidDisplayNode:
+                        fidDisplayNode.SetSelectedColor(1.0, 0.0, 0.0)  # 红色
+                        fidDisplayNode.SetColor(1.0, 0.0, 0.0)
+                        fidDisplayNode.SetGlyphScale(2.5)
+                        fidDisplayNode.SetTextScale(2.5)
+                    self.log(f"✓ Fixed 标注点已保存 (红色, {fixedFiducials.GetNumberOfControlPoints()} 个点)")
+            
+                # 4. 保存 Moving Fiducials (绿色)
+                if movingFiducials and movingFiducials.GetNumberOfControlPoints() > 0:
+                    movingFidCopy = self._copyFiducials(
+                        movingFiducials, 
+                        "CoarseReg_Moving_Fiducials", 
+                        shNode, 
+                        moduleFolderItemID
+                    )
+                    # 设置为绿色
+                    fidDisplayNode = movingFidCopy.GetDisplayNode()
+                    if fidDisplayNode:
+                        fidDisplayNode.SetSelectedColor(0.0, 1.0, 0.0)  # 绿色
+                        fidDisplayNode.SetColor(0.0, 1.0, 0.0)
+                        fidDisplayNode.SetGlyphScale(2.5)
+                        fidDisplayNode.SetTextScale(2.5)
+                    self.log(f"✓ Moving 标注点已保存 (绿色, {movingFiducials.GetNumberOfControlPoints()} 个点)")
+            
+                # 5. 删除原始的基准点节点
+                if fixedFiducials:
+                    slicer.mrmlScene.RemoveNode(fixedFiducials)
+                    self.log(f"✓ 已删除原始 Fixed 基准点")
+            
+                if movingFiducials:
+                    slicer.mrmlScene.RemoveNode(movingFiducials)
+                    self.log(f"✓ 已删除原始 Moving 基准点")
+            
+                self.log(f"✓ 粗配准结果保存完成")
+                self.log(f"  - 保存的体积: CoarseReg_Moving (已应用变换)")
+                self.log(f"  - 变换关系: CoarseReg_Moving → CoarseReg_Transform")
+                self.log(f"  - 标注点对: {fixedFiducials.GetNumberOfControlPoints() if fixedFiducials else 0} 对")
             
             return True
             
@@ -316,6 +654,184 @@ class CoarseRegistrationLogic:
             self.log(f"保存粗配准结果到场景时出错: {str(e)}")
             raise
 
+    def createResampledPreview(self, movingVolume, transformNode, referenceVolume, downsampleFactor=1,
+                               numberOfThreads=None):
+        """
+        将 Moving Volume 经变换重采样到 Fixed 网格 (或其下采样网格),生成 CoarseReg_Moving_Preview
+
+        输出只覆盖 Moving 图像视野与 Fixed 网格的交集。结果按变换节点缓存,
+        变换矩阵不变时直接返回已有节点;矩阵被修改后自动重新重采样
+
+        :param movingVolume: Moving Volume 节点
+        :param transformNode: 线性变换节点 (Moving → Fixed)
+        :param referenceVolume: 参考网格 (Fixed Volume)
+        :param downsampleFactor: 相对参考网格的下采样因子 (整数)
+        :param numberOfThreads: 重采样线程数,为 None 时使用全部 CPU 核心
+        :return: 预览体积节点
+        """
+        try:
+            reloadEvictedVolume(movingVolume)
+            key = (movingVolume.GetID(), movingVolume.GetImageData().GetMTime(),
+                   referenceVolume.GetID(), referenceVolume.GetMTime(), int(downsampleFactor))
+            matrix = self._getTransformMatrix(transformNode)
+            entry = self.previewCache.get(transformNode.GetID())
+            if entry and slicer.mrmlScene.IsNodePresent(entry["node"]):
+                if entry["key"] == key and np.array_equal(entry["matrix"], matrix):
+                    self.log(f"✓ 变换未改变,使用已缓存的重采样预览")
+                    reloadEvictedVolume(entry["node"])
+                    return entry["node"]
+                previewNode = entry["node"]
+            else:
+                self._removePreviewObserver(transformNode.GetID())
+                previewNode = slicer.mrmlScene.AddNewNodeByClass(movingVolume.GetClassName(),
+                                                                 "CoarseReg_Moving_Preview")
+                previewNode.CreateDefaultDisplayNodes()
+                # 可由 Moving Volume 和变换重新生成,内存不足时允许换出到磁盘
+                markRegenerable(previewNode)
+
+            self._resamplePreview(previewNode, movingVolume, matrix, referenceVolume, int(downsampleFactor),
+                                  numberOfThreads)
+
+            observerTag = entry["observerTag"] if entry and entry["node"] is previewNode else None
+            if observerTag is None:
+                observerTag = transformNode.AddObserver(slicer.vtkMRMLTransformNode.TransformModifiedEvent,
+                                                        self._onPreviewTransformModified)
+            self.previewCache[transformNode.GetID()] = {
+                "node": previewNode, "key": key, "matrix": matrix, "observerTag": observerTag,
+                "moving": movingVolume, "reference": referenceVolume, "downsample": int(downsampleFactor),
+                "threads": numberOfThreads, "pending": False}
+            return previewNode
+
+        except Exception as e:
+            self.log(f"✗ 生成重采样预览失败: {str(e)}")
+            raise
+
+    def _resamplePreview(self, previewNode, movingVolume, matrix, referenceVolume, downsampleFactor,
+                         numberOfThreads):
+        """
+        用 vtkImageReslice 多线程三线性插值重采样,结果写入 previewNode
+
+        Fixed 网格 IJK → Fixed RAS → Moving RAS → Moving IJK 合并为一个 reslice 矩阵
+        """
+        import time
+        startTime = time.time()
+        # 变换修改后的自动刷新也经过这里,Moving Volume 可能已被换出
+        reloadEvictedVolume(movingVolume)
+        reloadEvictedVolume(referenceVolume)
+
+        referenceIJKToRAS = vtk.vtkMatrix4x4()
+        referenceVolume.GetIJKToRASMatrix(referenceIJKToRAS)
+        referenceIJKToRAS = slicer.util.arrayFromVTKMatrix(referenceIJKToRAS)
+        # 下采样网格: 体素边长放大 downsampleFactor 倍,原点保持在第一个体素中心
+        referenceIJKToRAS[:3, :3] *= downsampleFactor
+        referenceDims = np.ceil(np.array(referenceVolume.GetImageData().GetDimensions()) / downsampleFactor)
+
+        movingIJKToRAS = vtk.vtkMatrix4x4()
+        movingVolume.GetIJKToRASMatrix(movingIJKToRAS)
+        movingIJKToRAS = slicer.util.arrayFromVTKMatrix(movingIJKToRAS)
+        movingToReferenceIJK = np.linalg.inv(referenceIJKToRAS) @ matrix @ movingIJKToRAS
+
+        # 输出范围裁剪到 Moving 图像视野 (8 个角点) 与参考网格的交集
+        movingDims = np.array(movingVolume.GetImageData().GetDimensions())
+        corners = np.array([[i, j, k, 1.0] for i in (0, movingDims[0] - 1) for j in (0, movingDims[1] - 1)
+                            for k in (0, movingDims[2] - 1)])
+        cornersIJK = (corners @ movingToReferenceIJK.T)[:, :3]
+        lower = np.clip(np.floor(cornersIJK.min(axis=0)), 0, referenceDims - 1).astype(int)
+        upper = np.clip(np.ceil(cornersIJK.max(axis=0)), 0, referenceDims - 1).astype(int)
+        if np.any(upper <= lower):
+            raise ValueError("变换后的 Moving 图像与 Fixed 图像没有重叠")
+        outputIJKToRAS = referenceIJKToRAS.copy()
+        outputIJKToRAS[:3, 3] = (referenceIJKToRAS @ np.append(lower, 1.0))[:3]
+
+        # reslice 矩阵把输出体素坐标映射到输入 (Moving) 体素坐标
+        resliceAxes = np.linalg.inv(movingIJKToRAS) @ np.linalg.inv(matrix) @ outputIJKToRAS
+
+        reslice = vtk.vtkImageReslice()
+        reslice.SetInputData(movingVolume.GetImageData())
+        reslice.SetResliceAxes(slicer.util.vtkMatrixFromArray(resliceAxes))
+        reslice.SetInterpolationModeToLinear()
+        reslice.SetOutputSpacing(1.0, 1.0, 1.0)
+        reslice.SetOutputOrigin(0.0, 0.0, 0.0)
+        reslice.SetOutputExtent(0, int(upper[0] - lower[0]), 0, int(upper[1] - lower[1]),
+                                0, int(upper[2] - lower[2]))
+        reslice.SetBackgroundLevel(float(movingVolume.GetImageData().GetScalarRange()[0]))
+        reslice.SetNumberOfThreads(numberOfThreads or os.cpu_count() or 1)
+        reslice.Update()
+
+        imageData = vtk.vtkImageData()
+        imageData.DeepCopy(reslice.GetOutput())
+        previewNode.SetAndObserveImageData(imageData)
+        previewNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(outputIJKToRAS))
+
+        # 沿用 Moving Volume 的窗宽窗位
+        movingDisplayNode = movingVolume.GetDisplayNode()
+        previewDisplayNode = previewNode.GetDisplayNode()
+        if movingDisplayNode and previewDisplayNode and hasattr(movingDisplayNode, "GetWindow"):
+            previewDisplayNode.SetAutoWindowLevel(False)
+            previewDisplayNode.SetWindowLevel(movingDisplayNode.GetWindow(), movingDisplayNode.GetLevel())
+
+        dims = imageData.GetDimensions()
+        self.log(f"✓ 重采样预览已更新: {dims[0]} x {dims[1]} x {dims[2]} "
+                 f"(下采样 {downsampleFactor}x, {time.time() - startTime:.2f} s)")
+
+    def _getTransformMatrix(self, transformNode):
+        """
+        变换节点到世界坐标系的 4x4 矩阵
+
+        :param transformNode: 线性变换节点
+        :return: 4x4 numpy 数组
+        """
+        if not transformNode.IsLinear():
+            raise ValueError("重采样预览只支持线性变换")
+        return getMatrixToWorld(transformNode)
+
+    def _onPreviewTransformModified(self, transformNode, event):
+        """
+        变换修改事件: 矩阵确实改变时,短暂延迟后重新重采样 (拖动变换时合并连续事件)
+        """
+        import qt
+        entry = self.previewCache.get(transformNode.GetID())
+        if not entry or entry["pending"]:
+            return
+        entry["pending"] = True
+        qt.QTimer.singleShot(300, lambda: self._refreshPreview(transformNode))
+
+    def _refreshPreview(self, transformNode):
+        """
+        若变换矩阵与缓存不同则重新生成预览;预览节点已被删除时移除观察者
+        """
+        entry = self.previewCache.get(transformNode.GetID())
+        if not entry:
+            return
+        entry["pending"] = False
+        if not slicer.mrmlScene.IsNodePresent(entry["node"]) or \
+                not slicer.mrmlScene.IsNodePresent(entry["moving"]) or \
+                not slicer.mrmlScene.IsNodePresent(entry["reference"]):
+            self._removePreviewObserver(transformNode.GetID())
+            return
+        try:
+            if not np.array_equal(entry["matrix"], self._getTransformMatrix(transformNode)):
+                self.createResampledPreview(entry["moving"], transformNode, entry["reference"], entry["downsample"],
+                                            entry["threads"])
+        except Exception as e:
+            self.log(f"⚠ 重采样预览更新失败: {str(e)}")
+
+    def clearPreviewCache(self):
+        """
+        移除所有重采样预览缓存和变换观察者 (预览节点保留在场景中)
+        """
+        for transformNodeID in list(self.previewCache):
+            self._removePreviewObserver(transformNodeID)
+
+    def _removePreviewObserver(self, transformNodeID):
+        """
+        移除预览缓存及其变换观察者
+        """
+        entry = self.previewCache.pop(transformNodeID, None)
+        transformNode = slicer.mrmlScene.GetNodeByID(transformNodeID)
+        if entry and transformNode:
+            transformNode.RemoveObserver(entry["observerTag"])
+
     def _createVolumeInFolder(self, sourceVolume, newName, shNode, folderItemID):
         """
         创建体积的深度副本并将其放入指定的场景文件夹中
@@ -327,6 +843,7 @@ class CoarseRegistrationLogic:
         :return: 新创建的体积节点
         """
         # 创建新的体积节点
+        reloadEvictedVolume(sourceVolume)
         volumeNode = slicer.mrmlScene.AddNewNodeByClass(sourceVolume.GetClassName(), newName)
         
         # 深拷贝图像数据
@@ -347,8 +864,7 @@ class CoarseRegistrationLogic:
         volumeNode.SetName(newName)
         
         # 将新节点移动到文件夹中
-        volumeItemID = shNode.GetItemByDataNode(volumeNode)
-        shNode.SetItemParent(volumeItemID, folderItemID)
+        placeNodeInFolder(shNode, volumeNode, folderItemID)
         
         return volumeNode
 
@@ -384,7 +900,6 @@ class CoarseRegistrationLogic:
                 targetDisplayNode.SetTextScale(sourceDisplayNode.GetTextScale())
         
         # 移动到文件夹
-        fidItemID = shNode.GetItemByDataNode(fidCopy)
-        shNode.SetItemParent(fidItemID, folderItemID)
+        placeNodeInFolder(shNode, fidCopy, folderItemID)
         
         return fidCopy
@@ -3,8 +3,10 @@ Coarse Registration Widget - 粗配准模块的UI界面
 """
 import qt
 import ctk
+import vtk
 import slicer
 from .coarse_registration_logic import CoarseRegistrationLogic
+from .landmark_registration import IncrementalSimilarityFit
 
 
 class CoarseRegistrationWidget:
@@ -32,11 +34,29 @@ class CoarseRegistrationWidget:
         self.crFixedFiducialsSelector = None
         self.crMovingFiducialsSelector = None
         self.crModuleFolderNameEdit = None
+        self.previewComboBox = None
+        self.proposeButton = None
+        self.proposalsTable = None
+        self.acceptProposalsButton = None
+        # 最近一次自动推荐的点对 (Fixed / Moving RAS 坐标)
+        self.landmarkProposals = None
         self.crStatusLabel = None
         self.pointPairsTable = None
         self.placePairButton = None
         self.registerButton = None
+        self.icpROISelector = None
+        self.icpBoneThresholdSpinBox = None
+        self.icpDarkBoneCheckBox = None
+        self.icpButton = None
         self.pointAddedObserver = None
+        # 最近一次配准的质量分析结果 (逐点 FRE / 留一 TRE / 预期 TRE)
+        self.registrationQuality = None
+        # 实时预览: 增量拟合、预览变换节点、标注点观察者、预览前 Moving 节点的父变换
+        self.liveFit = IncrementalSimilarityFit()
+        self.livePreviewTransform = None
+        self.liveObservers = []
+        self.livePreviousParents = {}
+        self.liveFiducialCounts = (None, None)
         
         self.setupUI()
 
@@ -126,21 +146,54 @@ class CoarseRegistrationWidget:
 
         coarseRegFormLayout.addRow(fiducialButtonsLayout)
 
+        self.livePreviewCheckBox = qt.QCheckBox("实时预览粗配准")
+        self.livePreviewCheckBox.checked = False
+        self.livePreviewCheckBox.setToolTip("放置3对点后,每添加或移动一个点即更新相似变换,Moving Volume 和 Moving 基准点"
+                                            "临时跟随预览变换 (CoarseReg_LivePreview) 显示")
+        self.livePreviewCheckBox.connect('toggled(bool)', self.onLivePreviewToggled)
+        coarseRegFormLayout.addRow(self.livePreviewCheckBox)
+
         clearButtonsLayout = qt.QHBoxLayout()
         self.clearPointsButton = qt.QPushButton("清除所有点")
         self.clearPointsButton.toolTip = "清除所有基准点"
         self.clearPointsButton.connect('clicked(bool)', self.onClearPoints)
         clearButtonsLayout.addWidget(self.clearPointsButton)
+
+        self.proposeButton = qt.QPushButton("自动推荐点对")
+        self.proposeButton.toolTip = "在两幅图像上自动检测显著点并匹配,推荐对应的基准点对供确认"
+        self.proposeButton.connect('clicked(bool)', self.onProposeLandmarks)
+        clearButtonsLayout.addWidget(self.proposeButton)
         coarseRegFormLayout.addRow(clearButtonsLayout)
 
+        # 推荐点对列表 (勾选后添加到基准点)
+        self.proposalsTable = qt.QTableWidget()
+        self.proposalsTable.setColumnCount(5)
+        self.proposalsTable.setHorizontalHeaderLabels(["接受", "Fixed (RAS)", "Moving (RAS)", "残差 (mm)", "分数"])
+        self.proposalsTable.setMaximumHeight(160)
+        self.proposalsTable.horizontalHeader().setStretchLastSection(True)
+        self.proposalsTable.verticalHeader().setVisible(False)
+        self.proposalsTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+        self.proposalsTable.setVisible(False)
+        coarseRegFormLayout.addRow(self.proposalsTable)
+
+        self.acceptProposalsButton = qt.QPushButton("添加选中的推荐点对")
+        self.acceptProposalsButton.toolTip = "将勾选的推荐点对追加到 Fixed / Moving 基准点 (可在视图中继续调整位置)"
+        self.acceptProposalsButton.connect('clicked(bool)', self.onAcceptProposals)
+        self.acceptProposalsButton.setVisible(False)
+        coarseRegFormLayout.addRow(self.acceptProposalsButton)
+
         # 基准点对列表显示
         self.pointPairsTable = qt.QTableWidget()
-        self.pointPairsTable.setColumnCount(2)
-        self.pointPairsTable.setHorizontalHeaderLabels(["Fixed 点数", "Moving 点数"])
-        self.pointPairsTable.setMaximumHeight(80)
+        self.pointPairsTable.setColumnCount(6)
+        self.pointPairsTable.setHorizontalHeaderLabels(
+            ["点对", "Fixed", "Moving", "FRE (mm)", "留一 TRE (mm)", "预期 TRE (mm)"])
+        self.pointPairsTable.setMaximumHeight(200)
         self.pointPairsTable.horizontalHeader().setStretchLastSection(True)
-        self.pointPairsTable.setColumnWidth(0, 120)
-        coarseRegFormLayout.addRow("基准点对数量:", self.pointPairsTable)
+        self.pointPairsTable.verticalHeader().setVisible(False)
+        self.pointPairsTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+        self.pointPairsTable.setToolTip("FRE: 基准点配准误差; 留一 TRE: 去掉该点对后拟合,该点的误差; "
+                                        "预期 TRE: 由估计的定位误差按 Fitzpatrick 公式计算")
+        coarseRegFormLayout.addRow("基准点对:", self.pointPairsTable)
 
         # 提示信息
         hintLabel = qt.QLabel("提示:请分别在固定图像和浮动图像上选择对应的解剖标志点，确保点数相同且顺序对应")
@@ -153,12 +206,64 @@ class CoarseRegistrationWidget:
         registrationLabel.setStyleSheet("font-weight: bold; margin-top: 10px;")
         coarseRegFormLayout.addRow(registrationLabel)
 
+        robustLayout = qt.QHBoxLayout()
+        self.robustCheckBox = qt.QCheckBox("鲁棒配准 (RANSAC)")
+        self.robustCheckBox.checked = False
+        self.robustCheckBox.setToolTip("对大量3点子集批量求解相似变换,自动识别并排除标错的点对 (至少需要4对点)")
+        robustLayout.addWidget(self.robustCheckBox)
+        self.inlierThresholdSpinBox = qt.QDoubleSpinBox()
+        self.inlierThresholdSpinBox.setRange(0.5, 20.0)
+        self.inlierThresholdSpinBox.setSingleStep(0.5)
+        self.inlierThresholdSpinBox.setValue(3.0)
+        self.inlierThresholdSpinBox.setSuffix(" mm")
+        self.inlierThresholdSpinBox.setToolTip("配准后残差小于此值的点对视为内点")
+        robustLayout.addWidget(qt.QLabel("内点阈值:"))
+        robustLayout.addWidget(self.inlierThresholdSpinBox)
+        coarseRegFormLayout.addRow(robustLayout)
+
         self.registerButton = qt.QPushButton("计算粗配准变换")
         self.registerButton.toolTip = "基于基准点对计算相似变换 (至少需要3对点)"
         self.registerButton.enabled = False
         self.registerButton.connect('clicked(bool)', self.onRegister)
         coarseRegFormLayout.addRow(self.registerButton)
 
+        # ICP 表面精修 (可选): 在 ROI 内对齐 CBCT 骨表面与 MRI 对应表面
+        icpLabel = qt.QLabel("ICP 表面精修 (可选):")
+        icpLabel.setStyleSheet("font-weight: bold; margin-top: 10px;")
+        coarseRegFormLayout.addRow(icpLabel)
+
+        self.icpROISelector = slicer.qMRMLNodeComboBox()
+        self.icpROISelector.nodeTypes = ["vtkMRMLLabelMapVolumeNode", "vtkMRMLMarkupsROINode"]
+        self.icpROISelector.selectNodeUponCreation = False
+        self.icpROISelector.addEnabled = False
+        self.icpROISelector.removeEnabled = False
+        self.icpROISelector.noneEnabled = True
+        self.icpROISelector.showHidden = False
+        self.icpROISelector.setMRMLScene(slicer.mrmlScene)
+        self.icpROISelector.setToolTip("只在该 ROI 的包围盒内提取表面,通常是 ROI Mask Set 生成的 Fixed_ROI_Mask")
+        coarseRegFormLayout.addRow("ICP ROI: ", self.icpROISelector)
+
+        icpThresholdLayout = qt.QHBoxLayout()
+        self.icpBoneThresholdSpinBox = qt.QDoubleSpinBox()
+        self.icpBoneThresholdSpinBox.setRange(-1000.0, 3000.0)
+        self.icpBoneThresholdSpinBox.setSingleStep(50.0)
+        self.icpBoneThresholdSpinBox.setValue(400.0)
+        self.icpBoneThresholdSpinBox.setSuffix(" HU")
+        self.icpBoneThresholdSpinBox.setToolTip("CBCT 中高于此值的体素视为骨")
+        icpThresholdLayout.addWidget(qt.QLabel("CBCT 骨阈值:"))
+        icpThresholdLayout.addWidget(self.icpBoneThresholdSpinBox)
+        self.icpDarkBoneCheckBox = qt.QCheckBox("MRI 骨为低信号")
+        self.icpDarkBoneCheckBox.checked = False
+        self.icpDarkBoneCheckBox.setToolTip("MRI 表面阈值取 ROI 内的 Otsu 阈值;勾选时低于阈值的区域视为骨 (皮质骨低信号)")
+        icpThresholdLayout.addWidget(self.icpDarkBoneCheckBox)
+        coarseRegFormLayout.addRow(icpThresholdLayout)
+
+        self.icpButton = qt.QPushButton("ICP 表面精修粗配准变换")
+        self.icpButton.toolTip = "以当前粗配准变换为初值,用髁突 / 关节窝表面的点到面 ICP 精修 (原地更新变换)"
+        self.icpButton.enabled = False
+        self.icpButton.connect('clicked(bool)', self.onSurfaceICP)
+        coarseRegFormLayout.addRow(self.icpButton)
+
         # 保存配准结果
         saveLabel = qt.QLabel("保存粗配准结果:")
         saveLabel.setStyleSheet("font-weight: bold; margin-top: 10px;")
@@ -170,6 +275,16 @@ class CoarseRegistrationWidget:
         self.crModuleFolderNameEdit.setToolTip("Coarse Registration 模块在总场景文件夹下的子文件夹名称")
         coarseRegFormLayout.addRow("Coarse Registration场景子文件夹:", self.crModuleFolderNameEdit)
 
+        # 重采样预览: 一次性重采样到 Fixed 网格,切片浏览时无需经变换实时插值
+        self.previewComboBox = qt.QComboBox()
+        self.previewComboBox.addItem("不生成", None)
+        self.previewComboBox.addItem("Fixed 网格", 1)
+        self.previewComboBox.addItem("Fixed 网格 2x 下采样", 2)
+        self.previewComboBox.addItem("Fixed 网格 4x 下采样", 4)
+        self.previewComboBox.setToolTip("额外保存重采样到 Fixed 网格的 CoarseReg_Moving_Preview,大体积 MRI 浏览更流畅;\n"
+                                        "变换矩阵修改后自动重新生成")
+        coarseRegFormLayout.addRow("重采样预览:", self.previewComboBox)
+
         self.saveResultButton = qt.QPushButton("保存粗配准结果到场景")
         self.saveResultButton.toolTip = "将粗配准后的体积、变换矩阵和基准点保存到场景文件夹"
         self.saveResultButton.enabled = False
@@ -308,39 +423,290 @@ class CoarseRegistrationWidget:
             self.placeMovingButton.setChecked(False)
 
     def updatePointPairsTable(self):
-        """更新基准点对列表显示"""
+        """更新基准点对列表显示(配准后附带逐点误差)"""
         try:
             fixedFiducials = self.crFixedFiducialsSelector.currentNode()
             movingFiducials = self.crMovingFiducialsSelector.currentNode()
 
             fixedCount = fixedFiducials.GetNumberOfControlPoints() if fixedFiducials else 0
             movingCount = movingFiducials.GetNumberOfControlPoints() if movingFiducials else 0
+            rowCount = max(fixedCount, movingCount)
+
+            # 点数变化后,之前的误差分析不再对应当前点对
+            quality = self.registrationQuality
+            if quality is not None and len(quality["fre"]) != rowCount:
+                quality = None
 
-            self.pointPairsTable.setRowCount(1)
-            
-            fixedItem = qt.QTableWidgetItem(str(fixedCount))
-            movingItem = qt.QTableWidgetItem(str(movingCount))
-            
             # 根据点数设置颜色
             if fixedCount != movingCount:
                 # 点数不匹配 - 红色
-                fixedItem.setForeground(qt.QColor(255, 0, 0))
-                movingItem.setForeground(qt.QColor(255, 0, 0))
+                countColor = qt.QColor(255, 0, 0)
             elif fixedCount >= 3:
                 # 点数足够 - 绿色
-                fixedItem.setForeground(qt.QColor(0, 128, 0))
-                movingItem.setForeground(qt.QColor(0, 128, 0))
-            elif fixedCount > 0:
+                countColor = qt.QColor(0, 128, 0)
+            else:
                 # 点数不足 - 橙色
-                fixedItem.setForeground(qt.QColor(255, 140, 0))
-                movingItem.setForeground(qt.QColor(255, 140, 0))
-            
-            self.pointPairsTable.setItem(0, 0, fixedItem)
-            self.pointPairsTable.setItem(0, 1, movingItem)
+                countColor = qt.QColor(255, 140, 0)
+
+            def formatError(values, index):
+                return f"{values[index]:.2f}" if values is not None else ""
+
+            summaryRow = 1 if quality is not None else 0
+            self.pointPairsTable.setRowCount(rowCount + summaryRow)
+            for row in range(rowCount):
+                values = [str(row + 1),
+                          "✓" if row < fixedCount else "—",
+                          "✓" if row < movingCount else "—"]
+                if quality is not None:
+                    values += [formatError(quality["fre"], row),
+                               formatError(quality["loo_tre"], row),
+                               formatError(quality["expected_tre"], row)]
+                else:
+                    values += ["", "", ""]
+                isOutlier = quality is not None and not quality["inliers"][row]
+                for column, text in enumerate(values):
+                    item = qt.QTableWidgetItem(text + (" ✗" if isOutlier and column == 3 else ""))
+                    if column in (1, 2):
+                        item.setForeground(countColor)
+                    elif isOutlier:
+                        item.setForeground(qt.QColor(255, 0, 0))
+                    self.pointPairsTable.setItem(row, column, item)
+
+            if quality is not None:
+                summary = ["RMS", str(fixedCount), str(movingCount), f"{quality['fre_rms']:.2f}",
+                           f"{quality['loo_tre_rms']:.2f}" if quality["loo_tre_rms"] is not None else "",
+                           f"FLE≈{quality['fle']:.2f}" if quality["fle"] is not None else ""]
+                for column, text in enumerate(summary):
+                    item = qt.QTableWidgetItem(text)
+                    font = item.font()
+                    font.setBold(True)
+                    item.setFont(font)
+                    self.pointPairsTable.setItem(rowCount, column, item)
 
         except Exception as e:
             self.logCallback(f"更新基准点对表格失败: {str(e)}")
 
+    def onLivePreviewToggled(self, checked):
+        """开启或关闭实时预览"""
+        try:
+            if checked:
+                self.startLivePreview()
+            else:
+                self.stopLivePreview()
+        except Exception as e:
+            self.showError(f"实时预览切换失败: {str(e)}")
+            self.livePreviewCheckBox.setChecked(False)
+
+    def startLivePreview(self):
+        """创建预览变换并观察两组标注点的变化"""
+        self.stopLivePreview()
+        fixedFiducials = self.crFixedFiducialsSelector.currentNode()
+        movingFiducials = self.crMovingFiducialsSelector.currentNode()
+        movingVolume = self.crMovingVolumeSelector.currentNode()
+        if not fixedFiducials or not movingFiducials or not movingVolume:
+            raise ValueError("请先选择 Moving Volume 和两组基准点")
+
+        self.livePreviewTransform = slicer.mrmlScene.AddNewNodeByClass(
+            "vtkMRMLLinearTransformNode", "CoarseReg_LivePreview")
+        # Moving 基准点与 Moving Volume 一起放在预览变换下,控制点坐标保持在 Moving 局部坐标系中
+        for node in (movingVolume, movingFiducials):
+            self.livePreviousParents[node.GetID()] = node.GetTransformNodeID()
+            node.SetAndObserveTransformNodeID(self.livePreviewTransform.GetID())
+
+        for node in (fixedFiducials, movingFiducials):
+            # 拖动点时只更新对应点对;添加、删除点会改变序号和点数,重新扫描全部点对
+            self.liveObservers.append((node, node.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent,
+                                                              self.onLivePointModified)))
+            for event in (slicer.vtkMRMLMarkupsNode.PointPositionDefinedEvent,
+                          slicer.vtkMRMLMarkupsNode.PointRemovedEvent):
+                self.liveObservers.append((node, node.AddObserver(event, self.onLiveFiducialsModified)))
+
+        self.liveFit.clear()
+        self.onLiveFiducialsModified()
+        self.logCallback("✓ 实时预览已开启")
+
+    def stopLivePreview(self):
+        """移除观察者和预览变换,恢复 Moving 节点原来的父变换"""
+        for node, tag in self.liveObservers:
+            node.RemoveObserver(tag)
+        self.liveObservers = []
+        for nodeID, parentID in self.livePreviousParents.items():
+            node = slicer.mrmlScene.GetNodeByID(nodeID)
+            if node:
+                node.SetAndObserveTransformNodeID(parentID)
+        self.livePreviousParents = {}
+        if self.livePreviewTransform:
+            slicer.mrmlScene.RemoveNode(self.livePreviewTransform)
+            self.livePreviewTransform = None
+            self.logCallback("✓ 实时预览已关闭")
+        self.liveFit.clear()
+        self.liveFiducialCounts = (None, None)
+
+    def onLiveFiducialsModified(self, caller=None, event=None):
+        """
+        标注点添加或删除时重新扫描全部点对并更新拟合
+        """
+        try:
+            fixedFiducials = self.crFixedFiducialsSelector.currentNode()
+            movingFiducials = self.crMovingFiducialsSelector.currentNode()
+            if not fixedFiducials or not movingFiducials or not self.livePreviewTransform:
+                return
+
+            pairCount = min(fixedFiducials.GetNumberOfControlPoints(), movingFiducials.GetNumberOfControlPoints())
+            for i in range(pairCount):
+                self._setLivePair(fixedFiducials, movingFiducials, i)
+            for key in [key for key in self.liveFit.pairs if key >= pairCount]:
+                self.liveFit.removePair(key)
+            self._applyLiveFit(fixedFiducials, movingFiducials)
+
+        except Exception as e:
+            self.logCallback(f"实时预览更新失败: {str(e)}")
+
+    @vtk.calldata_type(vtk.VTK_INT)
+    def onLivePointModified(self, caller, event, pointIndex):
+        """
+        拖动单个标注点时只更新该序号的点对 (O(1)),求解只需一次 3x3 SVD
+
+        :param pointIndex: 事件携带的控制点序号,缺失时重新扫描全部点对
+        """
+        if pointIndex is None or pointIndex < 0:
+            self.onLiveFiducialsModified()
+            return
+        try:
+            fixedFiducials = self.crFixedFiducialsSelector.currentNode()
+            movingFiducials = self.crMovingFiducialsSelector.currentNode()
+            if not fixedFiducials or not movingFiducials or not self.livePreviewTransform:
+                return
+            if self._setLivePair(fixedFiducials, movingFiducials, pointIndex):
+                self._applyLiveFit(fixedFiducials, movingFiducials)
+
+        except Exception as e:
+            self.logCallback(f"实时预览更新失败: {str(e)}")
+
+    def _setLivePair(self, fixedFiducials, movingFiducials, index):
+        """
+        按两组标注点中同一序号的控制点更新一个点对 (任一点不存在或未放置时删除该点对)
+
+        :param fixedFiducials: Fixed 标注点
+        :param movingFiducials: Moving 标注点
+        :param index: 控制点序号
+        :return: 拟合的点对是否发生变化
+        """
+        if not (index < fixedFiducials.GetNumberOfControlPoints() and
+                index < movingFiducials.GetNumberOfControlPoints() and
+                fixedFiducials.GetNthControlPointPositionStatus(index) == fixedFiducials.PositionDefined and
+                movingFiducials.GetNthControlPointPositionStatus(index) == movingFiducials.PositionDefined):
+            if index not in self.liveFit.pairs:
+                return False
+            self.liveFit.removePair(index)
+            return True
+        fixedPos = [0.0, 0.0, 0.0]
+        movingPos = [0.0, 0.0, 0.0]
+        fixedFiducials.GetNthControlPointPosition(index, fixedPos)
+        movingFiducials.GetNthControlPointPosition(index, movingPos)
+        return self.liveFit.setPair(index, movingPos, fixedPos)
+
+    def _applyLiveFit(self, fixedFiducials, movingFiducials):
+        """
+        由当前点对求解变换并写入预览变换
+
+        :param fixedFiducials: Fixed 标注点
+        :param movingFiducials: Moving 标注点
+        """
+        matrix, rms = self.liveFit.solve()
+        if matrix is not None:
+            self.livePreviewTransform.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(matrix))
+            self.crStatusLabel.text = f"状态: 实时预览 ({self.liveFit.count}对点, 拟合 RMS {rms:.2f} mm)"
+            self.crStatusLabel.setStyleSheet("color: blue;")
+        else:
+            # 点对不足3对 (例如清除基准点后) 时预览回到单位变换
+            self.livePreviewTransform.SetMatrixTransformToParent(vtk.vtkMatrix4x4())
+
+        # 点数变化时才刷新点对表格和按钮状态,拖动点时只更新变换
+        counts = (fixedFiducials.GetNumberOfControlPoints(), movingFiducials.GetNumberOfControlPoints())
+        if counts != self.liveFiducialCounts:
+            self.liveFiducialCounts = counts
+            self.updatePointPairsTable()
+            self.updateButtonStates()
+
+    def onProposeLandmarks(self):
+        """自动推荐基准点对"""
+        try:
+            fixedVolume = self.crFixedVolumeSelector.currentNode()
+            movingVolume = self.crMovingVolumeSelector.currentNode()
+            if not fixedVolume or not movingVolume:
+                self.showError("请先选择 Fixed Volume 和 Moving Volume")
+                return
+
+            self.crStatusLabel.text = "状态: 正在推荐点对..."
+            self.crStatusLabel.setStyleSheet("color: blue;")
+            slicer.app.processEvents()
+
+            self.landmarkProposals = self.logic.proposeLandmarkPairs(fixedVolume, movingVolume)
+            fixedPoints = self.landmarkProposals["fixed_points"]
+            movingPoints = self.landmarkProposals["moving_points"]
+
+            formatPoint = lambda point: f"({point[0]:.1f}, {point[1]:.1f}, {point[2]:.1f})"
+            self.proposalsTable.setRowCount(len(fixedPoints))
+            for row in range(len(fixedPoints)):
+                checkItem = qt.QTableWidgetItem(f"P{row + 1}")
+                checkItem.setFlags(qt.Qt.ItemIsUserCheckable | qt.Qt.ItemIsEnabled)
+                checkItem.setCheckState(qt.Qt.Checked)
+                self.proposalsTable.setItem(row, 0, checkItem)
+                self.proposalsTable.setItem(row, 1, qt.QTableWidgetItem(formatPoint(fixedPoints[row])))
+                self.proposalsTable.setItem(row, 2, qt.QTableWidgetItem(formatPoint(movingPoints[row])))
+                self.proposalsTable.setItem(row, 3, qt.QTableWidgetItem(
+                    f"{self.landmarkProposals['residuals'][row]:.2f}"))
+                self.proposalsTable.setItem(row, 4, qt.QTableWidgetItem(
+                    f"{self.landmarkProposals['scores'][row]:.2f}"))
+
+            hasProposals = len(fixedPoints) > 0
+            self.proposalsTable.setVisible(hasProposals)
+            self.acceptProposalsButton.setVisible(hasProposals)
+            if hasProposals:
+                self.crStatusLabel.text = f"状态: 推荐了 {len(fixedPoints)} 对基准点,请检查后添加"
+                self.crStatusLabel.setStyleSheet("color: green;")
+            else:
+                self.crStatusLabel.text = "状态: 未找到可靠的推荐点对,请手动放置"
+                self.crStatusLabel.setStyleSheet("color: orange;")
+
+        except Exception as e:
+            self.showError(f"自动推荐点对失败: {str(e)}")
+
+    def onAcceptProposals(self):
+        """将勾选的推荐点对追加到基准点节点"""
+        try:
+            if not self.landmarkProposals:
+                return
+            fixedFiducials = self.crFixedFiducialsSelector.currentNode()
+            movingFiducials = self.crMovingFiducialsSelector.currentNode()
+            if not fixedFiducials or not movingFiducials:
+                self.showError("请先选择 Fixed 和 Moving 基准点节点")
+                return
+            if fixedFiducials.GetNumberOfControlPoints() != movingFiducials.GetNumberOfControlPoints():
+                self.showError("Fixed 和 Moving 基准点数量不一致,请先补齐后再添加推荐点对")
+                return
+
+            added = 0
+            for row in range(self.proposalsTable.rowCount):
+                if self.proposalsTable.item(row, 0).checkState() != qt.Qt.Checked:
+                    continue
+                # 标签由节点按手动放置时的规则自动生成
+                fixedFiducials.AddControlPoint(list(self.landmarkProposals["fixed_points"][row]))
+                movingFiducials.AddControlPoint(list(self.landmarkProposals["moving_points"][row]))
+                added += 1
+
+            self.logCallback(f"✓ 已添加 {added} 对推荐基准点")
+            self.landmarkProposals = None
+            self.proposalsTable.setRowCount(0)
+            self.proposalsTable.setVisible(False)
+            self.acceptProposalsButton.setVisible(False)
+            self.updatePointPairsTable()
+            self.updateButtonStates()
+
+        except Exception as e:
+            self.showError(f"添加推荐点对失败: {str(e)}")
+
     def onClearPoints(self):
         """清除所有基准点"""
         try:
@@ -363,10 +729,10 @@ class CoarseRegistrationWidget:
                     movingFiducials.RemoveAllControlPoints()
                     self.logCallback("✓ 已清除 Moving 基准点")
 
+                # 重置 RMS 误差
+                self.registrationQuality = None
                 self.updatePointPairsTable()
                 self.updateButtonStates()
-                
-                # 重置 RMS 误差
 
         except Exception as e:
             self.showError(f"清除基准点失败: {str(e)}")
@@ -433,6 +799,9 @@ class CoarseRegistrationWidget:
                 self.showError(f"基准点数量不匹配 (Fixed:{fixedCount}, Moving:{movingCount})")
                 return
 
+            if self.livePreviewTransform:
+                self.livePreviewCheckBox.setChecked(False)
+
             self.logCallback(f"===== 开始粗配准 =====")
             self.logCallback(f"使用{fixedCount}对基准点计算相似变换...")
             self.logCallback(f"注意: Moving 点将配准到对应的 Fixed 点")
@@ -440,22 +809,36 @@ class CoarseRegistrationWidget:
             # 计算相似变换 (从 Moving 到 Fixed)
             self.transformNode = self.logic.computeSimilarityTransform(
                 fixedFiducials, 
-                movingFiducials
+                movingFiducials,
+                robust=self.robustCheckBox.checked,
+                inlierThresholdMm=self.inlierThresholdSpinBox.value
             )
 
             if self.transformNode:
                 self.logCallback(f"✓ 粗配准计算成功")
+                self.registrationQuality = self.logic.computeRegistrationQuality(
+                    fixedFiducials, movingFiducials, self.transformNode)
+                self.updatePointPairsTable()
                 self.crStatusLabel.text = f"状态: 粗配准完成"
                 self.crStatusLabel.setStyleSheet("color: green;")
 
-                # 启用保存按钮
+                # 启用保存和 ICP 精修按钮
                 self.saveResultButton.enabled = True
+                self.icpButton.enabled = True
+
+                robustSummary = ""
+                robustResult = self.logic.lastRobustResult
+                if robustResult is not None:
+                    outliers = [str(i + 1) for i, inlier in enumerate(robustResult["inliers"]) if not inlier]
+                    robustSummary = (f"内点 RMS: {robustResult['rms']:.2f} mm\n"
+                                     f"外点 (已排除): {', '.join(outliers) if outliers else '无'}\n\n")
 
                 qt.QMessageBox.information(
                     None,
                     "粗配准完成",
                     f"粗配准计算成功！\n\n"
                     f"基准点对数量: {fixedCount}\n\n"
+                    f"{robustSummary}"
                     f"请点击\"保存粗配准结果到场景\"按钮保存结果。"
                 )
             else:
@@ -464,6 +847,47 @@ class CoarseRegistrationWidget:
         except Exception as e:
             self.showError(f"粗配准失败: {str(e)}")
 
+    def onSurfaceICP(self):
+        """用骨表面 ICP 精修粗配准变换"""
+        try:
+            if not hasattr(self, 'transformNode') or not self.transformNode:
+                self.showError("请先执行粗配准")
+                return
+
+            fixedVolume = self.crFixedVolumeSelector.currentNode()
+            movingVolume = self.crMovingVolumeSelector.currentNode()
+            roiNode = self.icpROISelector.currentNode()
+            if not fixedVolume or not movingVolume:
+                self.showError("请选择 Fixed 和 Moving Volume")
+                return
+            if not roiNode:
+                self.showError("请选择 ICP ROI (例如 Fixed_ROI_Mask)")
+                return
+
+            self.crStatusLabel.text = "状态: 正在进行 ICP 表面精修..."
+            self.crStatusLabel.setStyleSheet("color: blue;")
+            slicer.app.processEvents()
+
+            result = self.logic.refineWithSurfaceICP(
+                fixedVolume, movingVolume, self.transformNode, roiNode,
+                fixedThresholdHU=self.icpBoneThresholdSpinBox.value,
+                movingAbove=not self.icpDarkBoneCheckBox.checked)
+
+            # 变换已更新,重新计算基准点误差
+            fixedFiducials = self.crFixedFiducialsSelector.currentNode()
+            movingFiducials = self.crMovingFiducialsSelector.currentNode()
+            if fixedFiducials and movingFiducials:
+                self.registrationQuality = self.logic.computeRegistrationQuality(
+                    fixedFiducials, movingFiducials, self.transformNode)
+                self.updatePointPairsTable()
+
+            self.crStatusLabel.text = (f"状态: ICP 表面精修完成 (表面距离 RMS "
+                                       f"{result['rms_before']:.2f} → {result['rms_after']:.2f} mm)")
+            self.crStatusLabel.setStyleSheet("color: green;")
+
+        except Exception as e:
+            self.showError(f"ICP 表面精修失败: {str(e)}")
+
     def onSaveResult(self):
         """保存粗配准结果到场景"""
         try:
@@ -492,7 +916,8 @@ class CoarseRegistrationWidget:
             success = self.logic.saveCoarseRegistrationToScene(
                 fixedVolume, movingVolume, self.transformNode,
                 fixedFiducials, movingFiducials,
-                mainFolderName, moduleFolderName
+                mainFolderName, moduleFolderName,
+                previewDownsample=self.previewComboBox.currentData
             )
 
             if success:
@@ -501,6 +926,8 @@ class CoarseRegistrationWidget:
                 self.crStatusLabel.text = "状态: 粗配准结果已保存"
                 self.crStatusLabel.setStyleSheet("color: green;")
 
+                previewLine = "- CoarseReg_Moving_Preview (重采样预览)\n" if self.previewComboBox.currentData else ""
+
                 qt.QMessageBox.information(
                     None,
                     "保存成功",
@@ -508,6 +935,7 @@ class CoarseRegistrationWidget:
                     f"{mainFolderName}/{moduleFolderName}\n\n"
                     f"包含内容:\n"
                     f"- CoarseReg_Moving (粗配准后的浮动图像)\n"
+                    f"{previewLine}"
                     f"- CoarseReg_Transform (相似变换矩阵)\n"
                     f"- CoarseReg_Fixed_Fiducials (基准点)\n"
                     f"- CoarseReg_Moving_Fiducials (基准点)"
@@ -518,6 +946,11 @@ class CoarseRegistrationWidget:
         except Exception as e:
             self.showError(f"保存粗配准结果失败: {str(e)}")
 
+    def cleanup(self):
+        """清理资源"""
+        self.stopLivePreview()
+        self.logic.clearPreviewCache()
+
     def showError(self, errorMessage):
         """显示错误信息"""
         self.logCallback(f"✗ 错误: {errorMessage}")
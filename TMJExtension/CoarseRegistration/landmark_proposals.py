@@ -0,0 +1,293 @@
+"""
+Landmark Proposals - 粗配准基准点对的自动推荐
+在两幅 (已重采样到 RAS 对齐的低分辨率网格的) 图像上用多尺度 3D Harris 检测显著点,
+以 MIND 自相似描述子 (对 CBCT/MRI 模态差异不敏感) 描述局部结构,互为最近邻匹配后用 RANSAC 相似变换验证。
+只使用 numpy,不访问 MRML 场景
+"""
+import numpy as np
+from . import landmark_registration
+
+
+# 默认每幅图像保留的候选点数
+DEFAULT_MAX_KEYPOINTS = 400
+
+# 默认推荐的点对数
+DEFAULT_MAX_PAIRS = 6
+
+# 默认 RANSAC 内点阈值 (mm),低分辨率网格上的定位精度约为一个体素
+DEFAULT_PROPOSAL_INLIER_THRESHOLD_MM = 6.0
+
+# 最近邻与次近邻描述子距离之比的上限
+DEFAULT_RATIO = 0.9
+
+# Harris 响应 det(M) - k·trace(M)³ 中的 k
+_HARRIS_K = 0.005
+
+# MIND 自相似的 6 个邻域方向
+_MIND_SHIFTS = np.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]])
+
+# 描述子在关键点周围的采样偏移 (体素, 3x3x3 网格,间距 2)
+_DESCRIPTOR_OFFSETS = np.array([[i, j, k] for i in (-2, 0, 2) for j in (-2, 0, 2) for k in (-2, 0, 2)])
+
+
+def gaussianSmooth(volume, sigma):
+    """
+    可分离高斯平滑 (边界复制),沿每个轴累加加权平移切片
+
+    :param volume: [k, j, i] 数组
+    :param sigma: 标准差 (体素)
+    :return: float32 数组
+    """
+    result = volume.astype(np.float32)
+    if sigma <= 0:
+        return result
+    radius = max(1, int(np.ceil(3.0 * sigma)))
+    weights = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    weights = (weights / weights.sum()).astype(np.float32)
+    for axis in range(3):
+        padding = [(0, 0)] * 3
+        padding[axis] = (radius, radius)
+        padded = np.pad(result, padding, mode="edge")
+        length = result.shape[axis]
+        smoothed = np.zeros_like(result)
+        for offset, weight in enumerate(weights):
+            smoothed += weight * np.take(padded, range(offset, offset + length), axis=axis)
+        result = smoothed
+    return result
+
+
+def downsample2(volume):
+    """
+    2x2x2 块平均下采样 (奇数尺寸时丢弃最后一层)
+
+    :param volume: [k, j, i] 数组
+    :return: 下采样后的数组
+    """
+    k, j, i = (dimension // 2 * 2 for dimension in volume.shape)
+    cropped = volume[:k, :j, :i]
+    return cropped.reshape(k // 2, 2, j // 2, 2, i // 2, 2).mean(axis=(1, 3, 5))
+
+
+def harrisResponse(volume, sigma=1.5):
+    """
+    3D Harris 角点响应: 结构张量 M = Gσ * (∇I ∇Iᵀ),R = det(M) - k·trace(M)³
+
+    :param volume: [k, j, i] 数组 (已归一化强度)
+    :param sigma: 结构张量的积分尺度 (体素)
+    :return: [k, j, i] 响应
+    """
+    gradients = np.gradient(gaussianSmooth(volume, 0.7 * sigma))
+    tensor = {}
+    for a in range(3):
+        for b in range(a, 3):
+            tensor[a, b] = gaussianSmooth(gradients[a] * gradients[b], sigma)
+    m = lambda a, b: tensor[min(a, b), max(a, b)]
+    determinant = (m(0, 0) * (m(1, 1) * m(2, 2) - m(1, 2) ** 2)
+                   - m(0, 1) * (m(0, 1) * m(2, 2) - m(1, 2) * m(0, 2))
+                   + m(0, 2) * (m(0, 1) * m(1, 2) - m(1, 1) * m(0, 2)))
+    trace = m(0, 0) + m(1, 1) + m(2, 2)
+    return determinant - _HARRIS_K * trace ** 3
+
+
+def _localMaxima(response, border):
+    """
+    3x3x3 邻域内的局部极大值 (移位比较,边界 border 体素内的点排除)
+
+    :return: [N, 3] (k, j, i) 坐标
+    """
+    isMaximum = response > 0
+    padded = np.pad(response, 1, mode="constant", constant_values=-np.inf)
+    shape = response.shape
+    for dk in (0, 1, 2):
+        for dj in (0, 1, 2):
+            for di in (0, 1, 2):
+                if (dk, dj, di) != (1, 1, 1):
+                    isMaximum &= response >= padded[dk:dk + shape[0], dj:dj + shape[1], di:di + shape[2]]
+    if border > 0:
+        interior = np.zeros(shape, dtype=bool)
+        interior[border:-border, border:-border, border:-border] = True
+        isMaximum &= interior
+    return np.argwhere(isMaximum)
+
+
+def detectKeypoints(volume, maxKeypoints=DEFAULT_MAX_KEYPOINTS, levels=2, border=4, foreground=0.05):
+    """
+    多尺度 Harris 显著点检测: 在 2x 下采样金字塔的每层检测局部极大值,坐标换算回原网格
+
+    :param volume: [k, j, i] 已归一化到 [0, 1] 的数组
+    :param maxKeypoints: 保留的最大点数 (按响应排序,每层响应各自归一化)
+    :param levels: 金字塔层数
+    :param border: 排除边界的宽度 (原网格体素),需容纳描述子邻域
+    :param foreground: 前景强度下限,排除空气中的点
+    :return: [N, 3] (k, j, i) 坐标 (浮点,原网格)
+    """
+    candidates, scores = [], []
+    level = volume
+    for index in range(levels):
+        factor = 2 ** index
+        if min(level.shape) < 2 * border // factor + 3:
+            break
+        response = harrisResponse(level)
+        maxima = _localMaxima(response, int(np.ceil(border / factor)))
+        if len(maxima):
+            values = response[tuple(maxima.T)]
+            # 块平均后的体素中心: 原网格坐标 = factor·x + (factor-1)/2
+            candidates.append(maxima * factor + (factor - 1) / 2.0)
+            scores.append(values / values.max())
+        level = downsample2(level)
+    if not candidates:
+        return np.zeros((0, 3))
+
+    points = np.vstack(candidates)
+    scores = np.concatenate(scores)
+    index = np.round(points).astype(int)
+    keep = volume[tuple(index.T)] > foreground
+    points, scores = points[keep], scores[keep]
+
+    # 按响应从大到小保留,跨尺度重复的点 (距离小于 2 体素) 只保留一个
+    order = np.argsort(-scores)
+    selected = []
+    for candidate in points[order]:
+        if selected and np.min(np.sum((np.array(selected) - candidate) ** 2, axis=1)) < 4.0:
+            continue
+        selected.append(candidate)
+        if len(selected) >= maxKeypoints:
+            break
+    return np.array(selected).reshape(-1, 3)
+
+
+def mindFeatures(volume, sigma=1.0):
+    """
+    稠密 MIND 特征: D_r = Gσ * (I - I(x+r))²,MIND_r = exp(-D_r / V),V 为 6 个方向 D_r 的均值
+
+    :param volume: [k, j, i] 数组
+    :param sigma: 块距离的平滑尺度 (体素)
+    :return: [6, k, j, i] float32
+    """
+    padded = np.pad(volume.astype(np.float32), 1, mode="edge")
+    shape = volume.shape
+    distances = np.empty((len(_MIND_SHIFTS),) + shape, dtype=np.float32)
+    for index, (dk, dj, di) in enumerate(_MIND_SHIFTS):
+        shifted = padded[1 + dk:1 + dk + shape[0], 1 + dj:1 + dj + shape[1], 1 + di:1 + di + shape[2]]
+        distances[index] = gaussianSmooth((volume - shifted) ** 2, sigma)
+    variance = distances.mean(axis=0)
+    variance = np.maximum(variance, 1e-3 * max(float(variance.mean()), 1e-12))
+    features = np.exp(-distances / variance)
+    return features / np.maximum(features.max(axis=0), 1e-12)
+
+
+def sampleDescriptors(features, keypoints):
+    """
+    在关键点周围的 3x3x3 网格上采样 MIND 特征,拼接为零均值、单位长度的描述子
+
+    :param features: [6, k, j, i] MIND 特征
+    :param keypoints: [N, 3] (k, j, i) 坐标
+    :return: [N, 162] 描述子
+    """
+    shape = np.array(features.shape[1:])
+    positions = np.round(keypoints).astype(int)[:, None, :] + _DESCRIPTOR_OFFSETS[None, :, :]
+    positions = np.clip(positions, 0, shape - 1)
+    samples = features[:, positions[..., 0], positions[..., 1], positions[..., 2]]
+    descriptors = samples.transpose(1, 2, 0).reshape(len(keypoints), -1)
+    descriptors = descriptors - descriptors.mean(axis=1, keepdims=True)
+    return descriptors / np.maximum(np.linalg.norm(descriptors, axis=1, keepdims=True), 1e-12)
+
+
+def matchDescriptors(fixedDescriptors, movingDescriptors, ratio=DEFAULT_RATIO):
+    """
+    互为最近邻且通过比值检验的描述子匹配
+
+    :return: ([M] Fixed 索引, [M] Moving 索引, [M] 描述子距离)
+    """
+    if len(fixedDescriptors) < 2 or len(movingDescriptors) < 2:
+        return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+    # 单位向量的平方欧氏距离 = 2 - 2·点积
+    distances = np.maximum(2.0 - 2.0 * fixedDescriptors @ movingDescriptors.T, 0.0)
+    nearest = np.argmin(distances, axis=1)
+    reverse = np.argmin(distances, axis=0)
+    fixedIndex = np.arange(len(fixedDescriptors))
+    mutual = reverse[nearest] == fixedIndex
+
+    partitioned = np.partition(distances, 1, axis=1)
+    passRatio = partitioned[:, 0] < (ratio ** 2) * partitioned[:, 1]
+    keep = mutual & passRatio
+    return fixedIndex[keep], nearest[keep], distances[fixedIndex[keep], nearest[keep]]
+
+
+def _normalizeIntensity(volume):
+    """按 1% / 99% 分位数归一化到 [0, 1]"""
+    low, high = np.percentile(volume, [1, 99])
+    return np.clip((volume.astype(np.float32) - low) / max(high - low, 1e-6), 0.0, 1.0)
+
+
+def _spreadSelection(points, scores, count):
+    """
+    按分数选第一个点,之后每次选离已选点最远的点 (分数加权),使推荐点对在空间上分散
+
+    :return: 选中的索引
+    """
+    selected = [int(np.argmax(scores))]
+    while len(selected) < min(count, len(points)):
+        distances = np.min(np.linalg.norm(points[:, None, :] - points[selected][None, :, :], axis=2), axis=1)
+        distances[selected] = -1.0
+        selected.append(int(np.argmax(distances * (0.5 + 0.5 * scores))))
+    return selected
+
+
+def proposeLandmarkPairs(fixedArray, fixedIJKToRAS, movingArray, movingIJKToRAS,
+                         maxKeypoints=DEFAULT_MAX_KEYPOINTS, maxPairs=DEFAULT_MAX_PAIRS,
+                         inlierThresholdMm=DEFAULT_PROPOSAL_INLIER_THRESHOLD_MM, ratio=DEFAULT_RATIO, seed=0):
+    """
+    推荐 Fixed / Moving 对应点对
+
+    两幅图像应已重采样到轴向与 RAS 对齐、间距相同的网格上,使描述子的采样方向一致
+
+    :param fixedArray: Fixed 图像 [k, j, i]
+    :param fixedIJKToRAS: Fixed 网格的 4x4 IJK→RAS 矩阵
+    :param movingArray: Moving 图像 [k, j, i]
+    :param movingIJKToRAS: Moving 网格的 4x4 IJK→RAS 矩阵
+    :param maxKeypoints: 每幅图像的最大候选点数
+    :param maxPairs: 推荐的最大点对数
+    :param inlierThresholdMm: RANSAC 内点阈值 (mm)
+    :param ratio: 描述子比值检验阈值
+    :param seed: RANSAC 随机种子
+    :return: 字典 {fixed_points, moving_points, residuals, scores, matrix, keypoints, matches, inliers};
+             验证失败时 fixed_points / moving_points 为空数组
+    """
+    def toRAS(keypoints, ijkToRAS):
+        ijk = keypoints[:, ::-1]
+        return ijk @ np.asarray(ijkToRAS, dtype=float)[:3, :3].T + np.asarray(ijkToRAS, dtype=float)[:3, 3]
+
+    fixedVolume = _normalizeIntensity(fixedArray)
+    movingVolume = _normalizeIntensity(movingArray)
+    fixedKeypoints = detectKeypoints(fixedVolume, maxKeypoints)
+    movingKeypoints = detectKeypoints(movingVolume, maxKeypoints)
+
+    fixedDescriptors = sampleDescriptors(mindFeatures(fixedVolume), fixedKeypoints)
+    movingDescriptors = sampleDescriptors(mindFeatures(movingVolume), movingKeypoints)
+    fixedIndex, movingIndex, distances = matchDescriptors(fixedDescriptors, movingDescriptors, ratio)
+
+    result = {
+        "fixed_points": np.zeros((0, 3)), "moving_points": np.zeros((0, 3)),
+        "residuals": np.zeros(0), "scores": np.zeros(0), "matrix": None,
+        "keypoints": (len(fixedKeypoints), len(movingKeypoints)), "matches": len(fixedIndex), "inliers": 0,
+    }
+    if len(fixedIndex) < 3:
+        return result
+
+    fixedPoints = toRAS(fixedKeypoints[fixedIndex], fixedIJKToRAS)
+    movingPoints = toRAS(movingKeypoints[movingIndex], movingIJKToRAS)
+    ransac = landmark_registration.ransacSimilarity(movingPoints, fixedPoints, inlierThresholdMm, seed=seed)
+    inliers = np.flatnonzero(ransac["inliers"])
+    if len(inliers) < 3:
+        return result
+
+    # 描述子距离越小、RANSAC 残差越小的点对分数越高
+    scores = (1.0 - distances[inliers] / 4.0) * np.exp(-(ransac["residuals"][inliers] / inlierThresholdMm) ** 2)
+    chosen = inliers[_spreadSelection(fixedPoints[inliers], scores, maxPairs)]
+    result.update({
+        "fixed_points": fixedPoints[chosen], "moving_points": movingPoints[chosen],
+        "residuals": ransac["residuals"][chosen], "scores": scores[np.searchsorted(inliers, chosen)],
+        "matrix": ransac["matrix"], "inliers": len(inliers),
+    })
+    return result
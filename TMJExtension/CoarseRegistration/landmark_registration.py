@@ -0,0 +1,341 @@
+"""
+Landmark Registration - 基准点配准的数值计算
+只使用 numpy,不访问 MRML 场景;所有点集均为 [N, 3] 的 RAS 坐标数组 (mm)
+"""
+import itertools
+import numpy as np
+
+
+# RANSAC 默认参数
+DEFAULT_RANSAC_HYPOTHESES = 2000
+DEFAULT_INLIER_THRESHOLD_MM = 3.0
+# 最小子集的三角形面积低于此值 (mm²) 视为共线,不参与评分
+_DEGENERATE_AREA_MM2 = 1e-3
+
+
+def umeyamaSimilarity(movingPoints, fixedPoints):
+    """
+    闭式求解相似变换 (Umeyama 1991): fixed ≈ s·R·moving + t
+
+    支持批量输入: 前置维度相同的多组点集一次性求解,每组独立计算 SVD
+
+    :param movingPoints: [..., N, 3] Moving 点
+    :param fixedPoints: [..., N, 3] Fixed 点
+    :return: (缩放 [...], 旋转 [..., 3, 3], 平移 [..., 3])
+    """
+    movingPoints = np.asarray(movingPoints, dtype=float)
+    fixedPoints = np.asarray(fixedPoints, dtype=float)
+    movingCentroid = movingPoints.mean(axis=-2)
+    fixedCentroid = fixedPoints.mean(axis=-2)
+    movingCentered = movingPoints - movingCentroid[..., None, :]
+    fixedCentered = fixedPoints - fixedCentroid[..., None, :]
+    count = movingPoints.shape[-2]
+
+    covariance = np.swapaxes(fixedCentered, -1, -2) @ movingCentered / count
+    U, S, Vt = np.linalg.svd(covariance)
+    # 保证为旋转而非镜像
+    sign = np.where(np.linalg.det(U) * np.linalg.det(Vt) < 0, -1.0, 1.0)
+    D = np.ones(S.shape)
+    D[..., 2] = sign
+    rotation = (U * D[..., None, :]) @ Vt
+
+    movingVariance = (movingCentered ** 2).sum(axis=(-1, -2)) / count
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(movingVariance > 0, (S * D).sum(axis=-1) / movingVariance, 1.0)
+    translation = fixedCentroid - scale[..., None] * (rotation @ movingCentroid[..., None])[..., 0]
+    return scale, rotation, translation
+
+
+def similarityMatrix(scale, rotation, translation):
+    """
+    组装 4x4 齐次变换矩阵
+
+    :param scale: 统一缩放
+    :param rotation: 3x3 旋转矩阵
+    :param translation: 平移向量
+    :return: 4x4 numpy 矩阵
+    """
+    matrix = np.eye(4)
+    matrix[:3, :3] = scale * np.asarray(rotation)
+    matrix[:3, 3] = translation
+    return matrix
+
+
+def applyMatrix(matrix, points):
+    """
+    对点集应用 4x4 变换
+
+    :param matrix: 4x4 矩阵
+    :param points: [N, 3] 点集
+    :return: [N, 3] 变换后的点集
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    return np.asarray(points, dtype=float) @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def _sampleSubsets(count, sampleSize, hypotheses, rng):
+    """
+    生成最小子集的索引: 组合数不超过 hypotheses 时枚举全部组合,否则随机抽取(每行无重复)
+
+    :return: [H, sampleSize] 索引数组
+    """
+    combinations = 1
+    for k in range(sampleSize):
+        combinations = combinations * (count - k) // (k + 1)
+    if combinations <= hypotheses:
+        return np.array(list(itertools.combinations(range(count), sampleSize)), dtype=int)
+    # 对每行的随机数排序取前 sampleSize 个,得到无重复的随机子集
+    return np.argsort(rng.random((hypotheses, count)), axis=1)[:, :sampleSize]
+
+
+def ransacSimilarity(movingPoints, fixedPoints, inlierThresholdMm=DEFAULT_INLIER_THRESHOLD_MM,
+                     hypotheses=DEFAULT_RANSAC_HYPOTHESES, seed=0):
+    """
+    鲁棒相似变换估计 (RANSAC + Umeyama)
+
+    对大量 3 点最小子集批量求解相似变换,以 MSAC 代价(截断的残差平方和)评价每个假设对所有点对的一致性,
+    取最优假设的内点用全部内点重新拟合,再按新的残差更新内点集合直到收敛
+
+    :param movingPoints: [N, 3] Moving 点
+    :param fixedPoints: [N, 3] Fixed 点
+    :param inlierThresholdMm: 内点残差阈值 (mm)
+    :param hypotheses: 最多评价的假设数
+    :param seed: 随机数种子(结果可复现)
+    :return: 字典 {matrix, scale, inliers, residuals, rms, hypotheses}
+    """
+    movingPoints = np.asarray(movingPoints, dtype=float)
+    fixedPoints = np.asarray(fixedPoints, dtype=float)
+    count = len(movingPoints)
+    if count < 3:
+        raise ValueError(f"至少需要3个点对,当前只有{count}个")
+
+    rng = np.random.default_rng(seed)
+    subsets = _sampleSubsets(count, 3, hypotheses, rng)
+
+    # 剔除近似共线的子集(两组点中任一组共线时相似变换不唯一)
+    def triangleAreas(points):
+        a, b, c = points[subsets[:, 0]], points[subsets[:, 1]], points[subsets[:, 2]]
+        return 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1)
+    valid = (triangleAreas(movingPoints) > _DEGENERATE_AREA_MM2) & (triangleAreas(fixedPoints) > _DEGENERATE_AREA_MM2)
+    subsets = subsets[valid]
+    if len(subsets) == 0:
+        raise ValueError("所有点对近似共线,无法计算相似变换")
+
+    # 批量求解 H 个假设并计算全部点对的残差: [H, N]
+    scales, rotations, translations = umeyamaSimilarity(movingPoints[subsets], fixedPoints[subsets])
+    predicted = scales[:, None, None] * np.einsum('hij,nj->hni', rotations, movingPoints) + translations[:, None, :]
+    squaredResiduals = ((predicted - fixedPoints[None]) ** 2).sum(axis=2)
+    threshold2 = inlierThresholdMm ** 2
+    costs = np.minimum(squaredResiduals, threshold2).sum(axis=1)
+    best = int(np.argmin(costs))
+    inliers = squaredResiduals[best] < threshold2
+    # 最小子集本身总是内点(数值误差下保证至少 3 个点参与重新拟合)
+    inliers[subsets[best]] = True
+
+    # 用全部内点重新拟合,直到内点集合不再变化
+    for _ in range(10):
+        scale, rotation, translation = umeyamaSimilarity(movingPoints[inliers], fixedPoints[inliers])
+        matrix = similarityMatrix(scale, rotation, translation)
+        residuals = np.linalg.norm(applyMatrix(matrix, movingPoints) - fixedPoints, axis=1)
+        newInliers = residuals < inlierThresholdMm
+        if newInliers.sum() < 3 or np.array_equal(newInliers, inliers):
+            break
+        inliers = newInliers
+
+    return {
+        "matrix": matrix,
+        "scale": float(scale),
+        "inliers": inliers,
+        "residuals": residuals,
+        "rms": float(np.sqrt(np.mean(residuals[inliers] ** 2))),
+        "hypotheses": int(len(subsets))
+    }
+
+
+def fiducialRegistrationErrors(movingPoints, fixedPoints, matrix):
+    """
+    逐点配准误差 (FRE): 变换后的 Moving 点与对应 Fixed 点的距离
+
+    :param movingPoints: [N, 3] Moving 点
+    :param fixedPoints: [N, 3] Fixed 点
+    :param matrix: 4x4 变换矩阵 (Moving → Fixed)
+    :return: [N] 误差 (mm)
+    """
+    return np.linalg.norm(applyMatrix(matrix, movingPoints) - np.asarray(fixedPoints, dtype=float), axis=1)
+
+
+def leaveOneOutErrors(movingPoints, fixedPoints):
+    """
+    留一法 TRE 估计: 依次去掉每个点对,用其余点对拟合相似变换,计算被去掉点的误差
+
+    N 次拟合组成 [N, N-1, 3] 的批量点集,一次批量 SVD 完成
+
+    :param movingPoints: [N, 3] Moving 点
+    :param fixedPoints: [N, 3] Fixed 点
+    :return: [N] 误差 (mm);点对少于 4 个时返回 None
+    """
+    movingPoints = np.asarray(movingPoints, dtype=float)
+    fixedPoints = np.asarray(fixedPoints, dtype=float)
+    count = len(movingPoints)
+    if count < 4:
+        return None
+    # 第 i 行为去掉 i 之后的索引
+    keep = ~np.eye(count, dtype=bool)
+    indices = np.broadcast_to(np.arange(count), (count, count))[keep].reshape(count, count - 1)
+    scales, rotations, translations = umeyamaSimilarity(movingPoints[indices], fixedPoints[indices])
+    predicted = scales[:, None] * np.einsum('nij,nj->ni', rotations, movingPoints) + translations
+    return np.linalg.norm(predicted - fixedPoints, axis=1)
+
+
+def expectedTargetRegistrationErrors(fixedPoints, targetPoints, fiducialLocalizationError):
+    """
+    Fitzpatrick 预期 TRE (Fitzpatrick, West & Maurer 1998)
+
+    TRE²(r) ≈ FLE²/N · (1 + 1/3 · Σ_k d_k²/f_k²),
+    d_k 为目标点到基准点主轴 k 的距离,f_k 为基准点到主轴 k 的均方根距离
+
+    :param fixedPoints: [N, 3] Fixed 基准点
+    :param targetPoints: [M, 3] 目标点
+    :param fiducialLocalizationError: 基准点定位误差 FLE (mm, 均方根)
+    :return: [M] 预期 TRE (mm)
+    """
+    fixedPoints = np.asarray(fixedPoints, dtype=float)
+    targetPoints = np.atleast_2d(np.asarray(targetPoints, dtype=float))
+    count = len(fixedPoints)
+    centroid = fixedPoints.mean(axis=0)
+    centered = fixedPoints - centroid
+    # 主轴为基准点分布协方差的特征向量
+    _, axes = np.linalg.eigh(centered.T @ centered)
+    fiducialCoords = centered @ axes
+    targetCoords = (targetPoints - centroid) @ axes
+
+    # 到主轴 k 的距离 = 在另外两个主轴方向上的分量的模
+    total2 = (fiducialCoords ** 2).sum(axis=1, keepdims=True)
+    f2 = (total2 - fiducialCoords ** 2).mean(axis=0)
+    d2 = (targetCoords ** 2).sum(axis=1, keepdims=True) - targetCoords ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(f2 > 0, d2 / f2, 0.0).sum(axis=1)
+    return np.sqrt(fiducialLocalizationError ** 2 / count * (1.0 + ratio / 3.0))
+
+
+def registrationQuality(movingPoints, fixedPoints, matrix, targetPoints=None):
+    """
+    配准质量分析: 逐点 FRE、RMS、留一法 TRE 和 Fitzpatrick 预期 TRE
+
+    FLE 由 FRE 估计: FLE² ≈ N/(N-2) · FRE²;目标点默认取各 Fixed 基准点位置
+
+    :param movingPoints: [N, 3] Moving 点
+    :param fixedPoints: [N, 3] Fixed 点
+    :param matrix: 4x4 变换矩阵 (Moving → Fixed)
+    :param targetPoints: [M, 3] 需要估计预期 TRE 的目标点 (Fixed 坐标)
+    :return: 字典 {fre, fre_rms, loo_tre, loo_tre_rms, fle, expected_tre, target_points}
+    """
+    movingPoints = np.asarray(movingPoints, dtype=float)
+    fixedPoints = np.asarray(fixedPoints, dtype=float)
+    count = len(fixedPoints)
+    fre = fiducialRegistrationErrors(movingPoints, fixedPoints, matrix)
+    freRms = float(np.sqrt(np.mean(fre ** 2)))
+    looTre = leaveOneOutErrors(movingPoints, fixedPoints)
+
+    targetPoints = fixedPoints if targetPoints is None else np.atleast_2d(np.asarray(targetPoints, dtype=float))
+    fle = float(np.sqrt(count / (count - 2.0)) * freRms) if count > 2 else None
+    expectedTre = expectedTargetRegistrationErrors(fixedPoints, targetPoints, fle) if fle is not None else None
+
+    return {
+        "fre": fre,
+        "fre_rms": freRms,
+        "loo_tre": looTre,
+        "loo_tre_rms": float(np.sqrt(np.mean(looTre ** 2))) if looTre is not None else None,
+        "fle": fle,
+        "expected_tre": expectedTre,
+        "target_points": targetPoints
+    }
+
+
+class IncrementalSimilarityFit:
+    """
+    增量相似变换拟合
+
+    维护点对的充分统计量 (Σm, Σf, Σf·mᵀ, Σ|m|², Σ|f|²),添加、移动或删除一个点对只需 O(1) 更新,
+    求解只需一次 3x3 SVD,与点对数量无关
+    """
+
+    def __init__(self):
+        """初始化空的统计量"""
+        self.pairs = {}
+        self.count = 0
+        self.sumMoving = np.zeros(3)
+        self.sumFixed = np.zeros(3)
+        self.sumCross = np.zeros((3, 3))
+        self.sumMovingSquared = 0.0
+        self.sumFixedSquared = 0.0
+
+    def _accumulate(self, movingPoint, fixedPoint, sign):
+        """按 sign (+1 / -1) 累加或移除一个点对的贡献"""
+        self.count += sign
+        self.sumMoving += sign * movingPoint
+        self.sumFixed += sign * fixedPoint
+        self.sumCross += sign * np.outer(fixedPoint, movingPoint)
+        self.sumMovingSquared += sign * float(movingPoint @ movingPoint)
+        self.sumFixedSquared += sign * float(fixedPoint @ fixedPoint)
+
+    def setPair(self, key, movingPoint, fixedPoint):
+        """
+        添加或更新一个点对
+
+        :param key: 点对标识(例如控制点序号)
+        :param movingPoint: Moving 点坐标
+        :param fixedPoint: Fixed 点坐标
+        :return: 点对是否发生变化
+        """
+        movingPoint = np.asarray(movingPoint, dtype=float)
+        fixedPoint = np.asarray(fixedPoint, dtype=float)
+        previous = self.pairs.get(key)
+        if previous is not None:
+            if np.array_equal(previous[0], movingPoint) and np.array_equal(previous[1], fixedPoint):
+                return False
+            self._accumulate(previous[0], previous[1], -1)
+        self._accumulate(movingPoint, fixedPoint, +1)
+        self.pairs[key] = (movingPoint, fixedPoint)
+        return True
+
+    def removePair(self, key):
+        """
+        删除一个点对
+
+        :param key: 点对标识
+        """
+        previous = self.pairs.pop(key, None)
+        if previous is not None:
+            self._accumulate(previous[0], previous[1], -1)
+
+    def clear(self):
+        """删除所有点对"""
+        self.__init__()
+
+    def solve(self):
+        """
+        由充分统计量求解相似变换
+
+        :return: (4x4 变换矩阵, 拟合 RMS 误差 mm);点对少于 3 个时返回 (None, None)
+        """
+        if self.count < 3:
+            return None, None
+        n = float(self.count)
+        movingMean = self.sumMoving / n
+        fixedMean = self.sumFixed / n
+        covariance = self.sumCross / n - np.outer(fixedMean, movingMean)
+        movingVariance = self.sumMovingSquared / n - float(movingMean @ movingMean)
+        fixedVariance = self.sumFixedSquared / n - float(fixedMean @ fixedMean)
+        if movingVariance <= 0:
+            return None, None
+
+        U, S, Vt = np.linalg.svd(covariance)
+        D = np.array([1.0, 1.0, -1.0 if np.linalg.det(U) * np.linalg.det(Vt) < 0 else 1.0])
+        rotation = (U * D) @ Vt
+        trace = float((S * D).sum())
+        scale = trace / movingVariance
+        translation = fixedMean - scale * rotation @ movingMean
+        # Umeyama 最小残差: e² = σf² - tr(DS)²/σm²
+        rms = float(np.sqrt(max(0.0, fixedVariance - trace ** 2 / movingVariance)))
+        return similarityMatrix(scale, rotation, translation), rms
@@ -0,0 +1,244 @@
+"""
+Surface ICP - 骨表面点云的点到面 ICP 精修
+在 ROI 包围盒内按阈值提取 CBCT 骨表面 (髁突、关节窝) 和 MRI 对应表面的点云,
+以粗配准变换为初值做点到面 ICP,最近邻查询使用 KD 树 (优先 scipy cKDTree,不可用时使用 vtkKdTreePointLocator)。
+不访问 MRML 场景
+"""
+import numpy as np
+
+
+# CBCT 骨阈值 (HU)
+DEFAULT_BONE_THRESHOLD_HU = 400.0
+
+# 表面点云的体素网格下采样间距 (mm)
+DEFAULT_SURFACE_SPACING_MM = 1.0
+
+# ICP 参数
+DEFAULT_ICP_ITERATIONS = 50
+DEFAULT_MAX_CORRESPONDENCE_MM = 5.0
+DEFAULT_TRIM_FRACTION = 0.8
+
+# 估计法向量的邻域点数
+_NORMAL_NEIGHBOURS = 12
+
+
+class NearestNeighbourIndex:
+    """
+    点集最近邻查询 (KD 树)
+    """
+
+    def __init__(self, points):
+        """
+        建立索引
+
+        :param points: [N, 3] 点集
+        """
+        self.points = np.asarray(points, dtype=float)
+        try:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(self.points)
+            self.locator = None
+        except ImportError:
+            import vtk
+            import vtk.util.numpy_support as vtk_np
+            self.tree = None
+            vtkPoints = vtk.vtkPoints()
+            vtkPoints.SetData(vtk_np.numpy_to_vtk(self.points, deep=True))
+            polyData = vtk.vtkPolyData()
+            polyData.SetPoints(vtkPoints)
+            self.locator = vtk.vtkKdTreePointLocator()
+            self.locator.SetDataSet(polyData)
+            self.locator.BuildLocator()
+
+    def query(self, queryPoints, k=1):
+        """
+        k 近邻查询
+
+        :param queryPoints: [M, 3] 查询点
+        :param k: 近邻数
+        :return: (距离 [M] 或 [M, k], 索引 [M] 或 [M, k])
+        """
+        queryPoints = np.asarray(queryPoints, dtype=float)
+        if self.tree is not None:
+            return self.tree.query(queryPoints, k=k)
+
+        import vtk
+        indices = np.empty((len(queryPoints), k), dtype=np.int64)
+        idList = vtk.vtkIdList()
+        for row, point in enumerate(queryPoints):
+            self.locator.FindClosestNPoints(k, point, idList)
+            indices[row] = [idList.GetId(column) for column in range(k)]
+        distances = np.linalg.norm(self.points[indices] - queryPoints[:, None, :], axis=2)
+        if k == 1:
+            return distances[:, 0], indices[:, 0]
+        return distances, indices
+
+
+def otsuThreshold(values, bins=256):
+    """
+    Otsu 阈值 (类间方差最大),用于没有固定强度标尺的 MRI
+
+    :param values: 强度数组
+    :param bins: 直方图区间数
+    :return: 阈值
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    histogram, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    weightLow = np.cumsum(histogram)
+    weightHigh = weightLow[-1] - weightLow
+    sumLow = np.cumsum(histogram * centers)
+    meanLow = sumLow / np.maximum(weightLow, 1)
+    meanHigh = (sumLow[-1] - sumLow) / np.maximum(weightHigh, 1)
+    between = weightLow * weightHigh * (meanLow - meanHigh) ** 2
+    return float(centers[np.argmax(between)])
+
+
+def cropToBounds(volumeArray, ijkToRAS, rasBounds):
+    """
+    RAS 包围盒在体积中对应的体素范围
+
+    :param volumeArray: [k, j, i] 体积数组
+    :param ijkToRAS: 4x4 IJK→RAS 矩阵
+    :param rasBounds: [xmin, xmax, ymin, ymax, zmin, zmax],为 None 时返回整个体积
+    :return: (子数组, 起始体素下标 (k, j, i))
+    """
+    shape = np.array(volumeArray.shape)
+    lower, upper = np.zeros(3, dtype=int), shape - 1
+    if rasBounds is not None:
+        # 包围盒 8 个角点换算到体素坐标,取外接范围
+        corners = np.array([[x, y, z, 1.0] for x in rasBounds[0:2] for y in rasBounds[2:4] for z in rasBounds[4:6]])
+        cornersKJI = (corners @ np.linalg.inv(np.asarray(ijkToRAS, dtype=float)).T)[:, 2::-1]
+        lower = np.clip(np.floor(cornersKJI.min(axis=0)).astype(int), 0, shape - 1)
+        upper = np.clip(np.ceil(cornersKJI.max(axis=0)).astype(int), 0, shape - 1)
+    return volumeArray[lower[0]:upper[0] + 1, lower[1]:upper[1] + 1, lower[2]:upper[2] + 1], lower
+
+
+def extractSurfacePoints(volumeArray, ijkToRAS, threshold, rasBounds=None, above=True,
+                         spacingMm=DEFAULT_SURFACE_SPACING_MM):
+    """
+    按阈值提取表面体素点云 (前景体素中至少有一个 6 邻域为背景的体素)
+
+    :param volumeArray: [k, j, i] 体积数组
+    :param ijkToRAS: 4x4 IJK→RAS 矩阵
+    :param threshold: 阈值
+    :param rasBounds: 只在该 RAS 包围盒 [xmin, xmax, ymin, ymax, zmin, zmax] 内提取,为 None 时使用整个体积
+    :param above: True 时高于阈值为前景 (CBCT 骨),False 时低于阈值为前景
+    :param spacingMm: 体素网格下采样间距 (mm),每个网格单元保留一个点
+    :return: [N, 3] RAS 点集
+    """
+    ijkToRAS = np.asarray(ijkToRAS, dtype=float)
+    region, lower = cropToBounds(volumeArray, ijkToRAS, rasBounds)
+    if region.size == 0:
+        return np.zeros((0, 3))
+
+    foreground = region > threshold if above else region < threshold
+    padded = np.pad(foreground, 1, mode="edge")
+    interior = foreground.copy()
+    size = foreground.shape
+    for axis in range(3):
+        for step in (0, 2):
+            index = [slice(1, 1 + size[0]), slice(1, 1 + size[1]), slice(1, 1 + size[2])]
+            index[axis] = slice(step, step + size[axis])
+            interior &= padded[tuple(index)]
+    surface = np.argwhere(foreground & ~interior) + lower
+
+    ijk = np.hstack([surface[:, ::-1], np.ones((len(surface), 1))])
+    points = (ijk @ ijkToRAS.T)[:, :3]
+    if spacingMm and len(points):
+        cells = np.floor((points - points.min(axis=0)) / spacingMm).astype(np.int64)
+        _, first = np.unique(cells, axis=0, return_index=True)
+        points = points[np.sort(first)]
+    return points
+
+
+def estimateNormals(points, index=None, neighbours=_NORMAL_NEIGHBOURS):
+    """
+    由 k 近邻协方差的最小特征向量估计法向量 (批量特征分解)
+
+    :param points: [N, 3] 点集
+    :param index: 已建立的 NearestNeighbourIndex,为 None 时新建
+    :param neighbours: 邻域点数
+    :return: [N, 3] 单位法向量 (方向不定向)
+    """
+    index = index or NearestNeighbourIndex(points)
+    neighbours = min(neighbours, len(points))
+    _, indices = index.query(points, k=neighbours)
+    local = points[indices.reshape(len(points), -1)]
+    local = local - local.mean(axis=1, keepdims=True)
+    covariance = np.einsum("nki,nkj->nij", local, local)
+    _, eigenvectors = np.linalg.eigh(covariance)
+    return eigenvectors[:, :, 0]
+
+
+def pointToPlaneICP(movingPoints, fixedPoints, initialMatrix, fixedNormals=None, fixedIndex=None,
+                    iterations=DEFAULT_ICP_ITERATIONS, maxCorrespondenceMm=DEFAULT_MAX_CORRESPONDENCE_MM,
+                    trimFraction=DEFAULT_TRIM_FRACTION, tolerance=1e-4):
+    """
+    点到面 ICP (刚体增量,保留初始变换的缩放)
+
+    每次迭代: 变换 Moving 点 → KD 树查 Fixed 最近点 → 去掉距离过大和最差的 (1 - trimFraction) 对应 →
+    小角度线性化求解 6x6 正规方程 min Σ((R·p + t - q)·n)² → 左乘增量
+
+    :param movingPoints: [N, 3] Moving 表面点 (Moving 坐标)
+    :param fixedPoints: [M, 3] Fixed 表面点
+    :param initialMatrix: 4x4 初始变换 (Moving → Fixed)
+    :param fixedNormals: [M, 3] Fixed 法向量,为 None 时估计
+    :param fixedIndex: Fixed 点的 NearestNeighbourIndex,为 None 时新建
+    :param iterations: 最大迭代次数
+    :param maxCorrespondenceMm: 对应点最大距离 (mm)
+    :param trimFraction: 每次迭代保留的对应点比例
+    :param tolerance: 增量平移 (mm) 和旋转 (rad) 都小于此值时停止
+    :return: 字典 {matrix, rms_before, rms_after, iterations, correspondences}
+    """
+    movingPoints = np.asarray(movingPoints, dtype=float)
+    fixedPoints = np.asarray(fixedPoints, dtype=float)
+    fixedIndex = fixedIndex or NearestNeighbourIndex(fixedPoints)
+    if fixedNormals is None:
+        fixedNormals = estimateNormals(fixedPoints, fixedIndex)
+    matrix = np.asarray(initialMatrix, dtype=float).copy()
+
+    def correspondences(currentMatrix):
+        transformed = movingPoints @ currentMatrix[:3, :3].T + currentMatrix[:3, 3]
+        distances, indices = fixedIndex.query(transformed)
+        keep = distances < maxCorrespondenceMm
+        if keep.sum() > 10:
+            keep &= distances <= np.quantile(distances[keep], trimFraction)
+        return transformed[keep], indices[keep], distances[keep]
+
+    _, _, distances = correspondences(matrix)
+    rmsBefore = float(np.sqrt(np.mean(distances ** 2))) if len(distances) else None
+
+    iteration = 0
+    for iteration in range(1, iterations + 1):
+        source, indices, _ = correspondences(matrix)
+        if len(source) < 6:
+            raise ValueError("ICP 对应点不足,请检查阈值、ROI 范围或初始变换")
+        target, normals = fixedPoints[indices], fixedNormals[indices]
+        # 线性化: (p + ω×p + t - q)·n = (p×n)·ω + n·t + (p - q)·n
+        A = np.hstack([np.cross(source, normals), normals])
+        b = -np.einsum("ij,ij->i", source - target, normals)
+        x, *_ = np.linalg.lstsq(A, b, rcond=None)
+        omega, translation = x[:3], x[3:]
+
+        angle = np.linalg.norm(omega)
+        rotation = np.eye(3)
+        if angle > 0:
+            axis = omega / angle
+            K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+            rotation = np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * K @ K
+        increment = np.eye(4)
+        increment[:3, :3] = rotation
+        increment[:3, 3] = translation
+        matrix = increment @ matrix
+        if angle < tolerance and np.linalg.norm(translation) < tolerance:
+            break
+
+    _, _, distances = correspondences(matrix)
+    return {
+        "matrix": matrix,
+        "rms_before": rmsBefore,
+        "rms_after": float(np.sqrt(np.mean(distances ** 2))) if len(distances) else None,
+        "iterations": iteration,
+        "correspondences": int(len(distances)),
+    }
@@ -0,0 +1,6 @@
+# Common utilities shared by all modules
+from .scene_utils import sceneBatch, getOrCreateFolder, createModuleFolder, placeNodeInFolder
+from .transform_chain import getMatrixToParent, getMatrixToWorld, transformPoints, clearTransformCache
+
+__all__ = ['sceneBatch', 'getOrCreateFolder', 'createModuleFolder', 'placeNodeInFolder',
+           'getMatrixToParent', 'getMatrixToWorld', 'transformPoints', 'clearTransformCache']
@@ -0,0 +1,92 @@
+"""
+Scene Utils - 各模块共用的场景文件夹构建辅助函数
+批量创建节点、设置文件夹和显示节点时暂停场景事件和渲染,结束后只触发一次刷新
+"""
+import contextlib
+import slicer
+
+
+@contextlib.contextmanager
+def sceneBatch():
+    """
+    批量修改场景的上下文
+
+    进入时开始 MRML 批处理状态并暂停渲染,退出时(包括出错时)恢复,
+    Subject Hierarchy 树和视图只在结束时刷新一次。可以嵌套使用
+    """
+    scene = slicer.mrmlScene
+    scene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+    pauseRender = getattr(slicer.app, "pauseRender", None)
+    if pauseRender:
+        pauseRender()
+    try:
+        yield scene
+    finally:
+        try:
+            scene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+        finally:
+            if pauseRender:
+                slicer.app.resumeRender()
+
+
+def getOrCreateFolder(shNode, parentItemID, folderName):
+    """
+    查找或创建文件夹
+
+    :param shNode: Subject Hierarchy 节点
+    :param parentItemID: 父项目 ID
+    :param folderName: 文件夹名称
+    :return: (文件夹项目 ID, 是否新创建)
+    """
+    folderItemID = shNode.GetItemChildWithName(parentItemID, folderName)
+    if folderItemID:
+        return folderItemID, False
+    return shNode.CreateFolderItem(parentItemID, folderName), True
+
+
+def createModuleFolder(mainFolderName, moduleFolderName, replaceExisting=False, logCallback=None):
+    """
+    建立 "<总文件夹>/<模块子文件夹>" 两层文件夹结构
+
+    :param mainFolderName: 配准流程总文件夹名称(不存在时创建)
+    :param moduleFolderName: 模块子文件夹名称
+    :param replaceExisting: 为 True 时先删除已存在的同名模块子文件夹及其内容
+    :param logCallback: 日志回调函数
+    :return: (Subject Hierarchy 节点, 总文件夹项目 ID, 模块子文件夹项目 ID)
+    """
+    log = logCallback or (lambda message: None)
+    shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+    mainFolderItemID, created = getOrCreateFolder(shNode, shNode.GetSceneItemID(), mainFolderName)
+    if created:
+        log(f"✓ 创建配准流程总文件夹: {mainFolderName}")
+    else:
+        log(f"✓ 使用已存在的总文件夹: {mainFolderName}")
+
+    if replaceExisting:
+        existingItemID = shNode.GetItemChildWithName(mainFolderItemID, moduleFolderName)
+        if existingItemID:
+            log(f"  删除旧的 {moduleFolderName} 文件夹内容...")
+            shNode.RemoveItem(existingItemID)
+
+    moduleFolderItemID = shNode.CreateFolderItem(mainFolderItemID, moduleFolderName)
+    log(f"✓ 创建模块子文件夹: {moduleFolderName}")
+    return shNode, mainFolderItemID, moduleFolderItemID
+
+
+def placeNodeInFolder(shNode, node, folderItemID):
+    """
+    将节点放入文件夹
+
+    批处理状态下新节点的 Subject Hierarchy 项目可能尚未创建,此时直接在文件夹下创建
+
+    :param shNode: Subject Hierarchy 节点
+    :param node: 数据节点
+    :param folderItemID: 文件夹项目 ID
+    :return: 节点的项目 ID
+    """
+    itemID = shNode.GetItemByDataNode(node)
+    if itemID:
+        shNode.SetItemParent(itemID, folderItemID)
+    else:
+        itemID = shNode.CreateItem(folderItemID, node)
+    return itemID
@@ -0,0 +1,91 @@
+"""
+Transform Chain - 各模块共用的线性变换矩阵查询与缓存
+变换链只在节点修改后重新组合,正向和逆矩阵以节点修改时间为键缓存;
+点集变换为 numpy 向量化计算,替代逐点 MultiplyPoint
+"""
+import numpy as np
+import vtk
+import slicer
+
+
+# (节点 ID, "parent" / "world") -> (缓存键, 正向矩阵, 逆矩阵)
+_matrixCache = {}
+
+
+def _nodeKey(transformNode):
+    """
+    变换节点的缓存键: 节点和其变换对象的修改时间 (修改矩阵时至少一个会变化)
+    """
+    return (transformNode.GetID(), transformNode.GetMTime(), transformNode.GetTransformToParent().GetMTime())
+
+
+def _freeze(matrix):
+    """缓存的矩阵设为只读,防止调用方原地修改"""
+    matrix.setflags(write=False)
+    return matrix
+
+
+def getMatrixToParent(transformNode, inverse=False):
+    """
+    变换节点自身到父坐标系的 4x4 矩阵 (Moving → Fixed 方向,Slicer 约定)
+
+    :param transformNode: 线性变换节点
+    :param inverse: 为 True 时返回逆矩阵
+    :return: 4x4 numpy 数组 (只读)
+    """
+    if not transformNode.IsTransformToParentLinear():
+        raise ValueError(f"变换 {transformNode.GetName()} 不是线性变换")
+    key = _nodeKey(transformNode)
+    cached = _matrixCache.get((transformNode.GetID(), "parent"))
+    if cached is None or cached[0] != key:
+        vtkMatrix = vtk.vtkMatrix4x4()
+        transformNode.GetMatrixTransformToParent(vtkMatrix)
+        forward = slicer.util.arrayFromVTKMatrix(vtkMatrix)
+        cached = (key, _freeze(forward), _freeze(np.linalg.inv(forward)))
+        _matrixCache[(transformNode.GetID(), "parent")] = cached
+    return cached[2] if inverse else cached[1]
+
+
+def getMatrixToWorld(node, inverse=False):
+    """
+    节点坐标系到世界坐标系的 4x4 矩阵,逐级组合父变换链
+
+    :param node: 变换节点 (从其自身开始组合) 或可变换节点 (体积、标注点,从其父变换开始组合)
+    :param inverse: 为 True 时返回逆矩阵 (世界 → 节点)
+    :return: 4x4 numpy 数组 (只读),不在任何变换下时为单位矩阵
+    """
+    chain = []
+    current = node if node.IsA("vtkMRMLTransformNode") else node.GetParentTransformNode()
+    while current:
+        chain.append(current)
+        current = current.GetParentTransformNode()
+    if not chain:
+        return _freeze(np.eye(4))
+
+    key = tuple(_nodeKey(transformNode) for transformNode in chain)
+    cached = _matrixCache.get((chain[0].GetID(), "world"))
+    if cached is None or cached[0] != key:
+        forward = np.eye(4)
+        for transformNode in chain:
+            forward = getMatrixToParent(transformNode) @ forward
+        cached = (key, _freeze(forward), _freeze(np.linalg.inv(forward)))
+        _matrixCache[(chain[0].GetID(), "world")] = cached
+    return cached[2] if inverse else cached[1]
+
+
+def transformPoints(points, matrix):
+    """
+    用 4x4 矩阵变换点集 (向量化)
+
+    :param points: [N, 3] 点坐标
+    :param matrix: 4x4 变换矩阵
+    :return: [N, 3] 变换后的点坐标
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    matrix = np.asarray(matrix, dtype=float)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def clearTransformCache():
+    """清空矩阵缓存 (例如关闭场景后)"""
+    _matrixCache.clear()
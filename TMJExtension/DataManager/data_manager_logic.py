@@ -7,7 +7,33 @@ import logging
 import vtk
 import slicer
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from . import volume_io
+from . import dicom_io
+from .volume_index import VolumeMetadataIndex
+from Common.scene_utils import sceneBatch, createModuleFolder, placeNodeInFolder
+
+
+# 批量导入时可识别的体积文件扩展名
+VOLUME_FILE_EXTENSIONS = (".nrrd", ".nhdr", ".nii", ".nii.gz", ".nii.zst", ".nii.lz4", ".mha", ".mhd")
+
+# 记录无损降级前原始存储类型的节点属性名
+ORIGINAL_SCALAR_TYPE_ATTRIBUTE = "TMJ.OriginalScalarType"
+
+# 标记图像数据经去重后与其他节点共享的节点属性名
+SHARED_IMAGE_DATA_ATTRIBUTE = "TMJ.SharedImageData"
+
+# 批量导入时识别各角色文件的默认文件名模式 (fnmatch 通配符,不区分大小写)
+# 按顺序匹配: 每个文件只分配给第一个匹配的角色,因此更具体的 ROI 模式排在前面
+DEFAULT_COHORT_PATTERNS = {
+    "Moving_Volume_右斜矢": ["*右斜矢*", "*right_sag*", "*r_sag*"],
+    "Moving_Volume_左斜矢": ["*左斜矢*", "*left_sag*", "*l_sag*"],
+    "Moving_Volume_右斜冠": ["*右斜冠*", "*right_cor*", "*r_cor*"],
+    "Moving_Volume_左斜冠": ["*左斜冠*", "*left_cor*", "*l_cor*"],
+    "fixed": ["*cbct*", "*fixed*"],
+    "moving": ["*mri*", "*moving*", "*mr.*", "*_mr_*"],
+}
 
 
 class DataManagerLogic:
@@ -23,6 +49,7 @@ class DataManagerLogic:
         :param logCallback: 日志回调函数
         """
         self.logCallback = logCallback
+        self.volumeIndex = None
 
     def log(self, message):
         """日志输出"""
@@ -44,8 +71,25 @@ class DataManagerLogic:
 
             self.log(f"加载文件: {filePath}")
 
-            # 使用 Slicer 的加载函数,这会保留原始数据
-            loadedNode = slicer.util.loadVolume(filePath, returnNode=True)[1]
+            # 分块格式 (zarr) 目录,也可以选择其中的 .zarray 文件
+            if os.path.basename(filePath) == ".zarray":
+                filePath = os.path.dirname(filePath)
+            if filePath.rstrip("/\\").endswith(volume_io.ZARR_EXTENSION):
+                return self.loadZarrVolume(filePath, nodeName)
+
+            # zstd / lz4 压缩的导出文件需先解压到临时目录
+            tempDir = None
+            loadPath = filePath
+            if filePath.endswith(".nhdr") or volume_io.codecForSidecar(filePath):
+                tempDir, loadPath = self._decompressSidecarVolume(filePath)
+
+            try:
+                # 使用 Slicer 的加载函数,这会保留原始数据
+                loadedNode = slicer.util.loadVolume(loadPath, returnNode=True)[1]
+            finally:
+                if tempDir:
+                    import shutil
+                    shutil.rmtree(tempDir, ignore_errors=True)
             
             if not loadedNode:
                 raise ValueError("加载体积失败")
@@ -65,7 +109,173 @@ class DataManagerLogic:
             self.log(f"加载体积时出错: {str(e)}")
             raise
 
-    def loadDataToScene(self, fixedVolume, movingVolume, mainFolderName, moduleFolderName, roiVolumes=None):
+    def loadZarrVolume(self, zarrPath, nodeName=None, rasBounds=None, maxWorkers=None):
+        """
+        加载分块格式 (zarr) 体积,可只读取指定 RAS 包围盒覆盖的区域
+
+        只有与区域相交的分块会被解压,加载得到的子体积保留原始间距和方向,原点移到区域起点
+
+        :param zarrPath: .zarr 目录路径
+        :param nodeName: 节点名称
+        :param rasBounds: RAS 包围盒 (rasMin, rasMax),为 None 时加载整个体积;可用 getVolumeRASBounds 获取
+        :param maxWorkers: 解压线程数,默认为 CPU 核心数
+        :return: 加载的体积节点
+        """
+        try:
+            header = volume_io.readZarrHeader(zarrPath)
+            ijkMin, ijkMax = [0, 0, 0], list(header["dimensions"])
+            if rasBounds is not None:
+                ijkRange = volume_io.rasBoundsToIJKRange(header["ijk_to_ras"], header["dimensions"], *rasBounds)
+                if ijkRange is None:
+                    raise ValueError("指定的 RAS 区域与体积不相交")
+                ijkMin, ijkMax = ijkRange
+
+            with ThreadPoolExecutor(max_workers=maxWorkers or os.cpu_count() or 1) as executor:
+                array, _ = volume_io.readZarrRegion(zarrPath, ijkMin, ijkMax, executor=executor, header=header)
+
+            # 子区域的 IJK 原点平移到 ijkMin
+            ijkToRAS = np.array(header["ijk_to_ras"], dtype=float)
+            ijkToRAS[:3, 3] = ijkToRAS[:3, :3] @ np.array(ijkMin, dtype=float) + ijkToRAS[:3, 3]
+
+            name = nodeName or os.path.basename(zarrPath.rstrip("/\\"))[:-len(volume_io.ZARR_EXTENSION)]
+            volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+            volumeNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(ijkToRAS))
+            slicer.util.updateVolumeFromArray(volumeNode, array)
+            volumeNode.CreateDefaultDisplayNodes()
+
+            loadedVoxels = int(np.prod(np.array(ijkMax) - np.array(ijkMin)))
+            totalVoxels = int(np.prod(header["dimensions"]))
+            self.log(f"体积加载成功: {volumeNode.GetName()} (分块格式, 读取 {loadedVoxels}/{totalVoxels} 个体素)")
+            self.log(f"  - 维度: {volumeNode.GetImageData().GetDimensions()}")
+            self.log(f"  - 间距: {volumeNode.GetSpacing()}")
+            self.log(f"  - 原点: {volumeNode.GetOrigin()}")
+            return volumeNode
+
+        except Exception as e:
+            self.log(f"加载分块体积时出错: {str(e)}")
+            raise
+
+    def indexDicomFolder(self, folder, maxWorkers=None):
+        """
+        索引 DICOM 文件夹: 只读取文件头,按 SeriesInstanceUID 分组
+
+        :param folder: DICOM 文件夹
+        :param maxWorkers: 读取文件头的线程数,默认为 CPU 核心数
+        :return: 序列信息列表,见 dicom_io.indexDicomFolder
+        """
+        try:
+            if not os.path.isdir(folder):
+                raise ValueError(f"文件夹不存在: {folder}")
+            self.log(f"索引 DICOM 文件夹: {folder}")
+            with ThreadPoolExecutor(max_workers=maxWorkers or os.cpu_count() or 1) as executor:
+                seriesList = dicom_io.indexDicomFolder(folder, executor)
+            self.log(f"✓ 找到 {len(seriesList)} 个 DICOM 序列")
+            for series in seriesList:
+                self.log(f"  - {dicom_io.describeSeries(series)}")
+            return seriesList
+
+        except Exception as e:
+            self.log(f"索引 DICOM 文件夹时出错: {str(e)}")
+            raise
+
+    def loadDicomSeries(self, series, nodeName=None, maxWorkers=None):
+        """
+        加载一个 DICOM 序列为体积节点
+
+        切片在线程池中并行解码并直接组装为体积,应用 Rescale 参数 (CT 为 HU 值),
+        几何信息由 ImagePositionPatient / ImageOrientationPatient / PixelSpacing 计算
+
+        :param series: indexDicomFolder 返回的序列信息
+        :param nodeName: 节点名称,默认使用序列描述
+        :param maxWorkers: 解码线程数,默认为 CPU 核心数
+        :return: 加载的体积节点
+        """
+        try:
+            self.log(f"加载 DICOM 序列: {dicom_io.describeSeries(series)}")
+            with ThreadPoolExecutor(max_workers=maxWorkers or os.cpu_count() or 1) as executor:
+                array, ijkToRAS, warnings = dicom_io.assembleSeries(series, executor)
+            for warning in warnings:
+                self.log(f"⚠ {warning}")
+
+            name = nodeName or series["description"] or f"Series_{series['series_number']}"
+            volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+            volumeNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(ijkToRAS))
+            slicer.util.updateVolumeFromArray(volumeNode, array)
+            volumeNode.CreateDefaultDisplayNodes()
+            volumeNode.SetAttribute("DICOM.SeriesInstanceUID", series["series_uid"])
+
+            self.log(f"体积加载成功: {volumeNode.GetName()}")
+            self.log(f"  - 维度: {volumeNode.GetImageData().GetDimensions()}")
+            self.log(f"  - 间距: {volumeNode.GetSpacing()}")
+            self.log(f"  - 原点: {volumeNode.GetOrigin()}")
+            return volumeNode
+
+        except Exception as e:
+            self.log(f"加载 DICOM 序列时出错: {str(e)}")
+            raise
+
+    def getVolumeRASBounds(self, volumeNode, marginMm=0.0):
+        """
+        获取体积在 RAS 空间中的包围盒(考虑父变换)
+
+        :param volumeNode: 体积节点,如 ROI 高分辨率 MRI
+        :param marginMm: 向外扩展的边距 (mm)
+        :return: (rasMin, rasMax)
+        """
+        bounds = [0.0] * 6
+        volumeNode.GetRASBounds(bounds)
+        rasMin = [bounds[0] - marginMm, bounds[2] - marginMm, bounds[4] - marginMm]
+        rasMax = [bounds[1] + marginMm, bounds[3] + marginMm, bounds[5] + marginMm]
+        return rasMin, rasMax
+
+    def _decompressSidecarVolume(self, filePath):
+        """
+        解压 zstd / lz4 压缩的体积文件到临时目录
+
+        支持分离式 NRRD (.nhdr + .raw.zst / .raw.lz4) 和 .nii.zst / .nii.lz4
+
+        :param filePath: .nhdr 头文件或压缩文件路径
+        :return: (临时目录, 可直接加载的文件路径); 无需解压时临时目录为 None
+        """
+        import tempfile
+        tempDir = tempfile.mkdtemp(prefix="tmj_volume_")
+        loadPath = volume_io.decompressSidecarVolume(filePath, tempDir)
+        if loadPath is None:
+            # 普通分离式 NRRD 等无需解压的文件直接交给 Slicer 加载
+            os.rmdir(tempDir)
+            return None, filePath
+        self.log(f"  已解压 {os.path.basename(filePath)} 的压缩数据")
+        return tempDir, loadPath
+
+    def getVolumeIndex(self, indexPath=None):
+        """
+        获取本地体积元数据索引(首次调用时创建)
+
+        :param indexPath: 索引文件路径,默认保存在 Slicer 缓存目录下
+        :return: VolumeMetadataIndex 对象
+        """
+        if self.volumeIndex is None or (indexPath and self.volumeIndex.indexPath != indexPath):
+            if not indexPath:
+                indexPath = os.path.join(slicer.app.cachePath, "TMJExtension", "volume_index.jsonl")
+            self.volumeIndex = VolumeMetadataIndex(indexPath, logCallback=self.logCallback)
+        return self.volumeIndex
+
+    def indexFolder(self, folder, computeStatistics=True):
+        """
+        在后台索引文件夹中的体积文件(几何信息、数据类型、强度范围),不加载到场景
+
+        :param folder: 要索引的文件夹
+        :param computeStatistics: 是否在后台读取图像数据计算强度统计
+        :return: VolumeMetadataIndex 对象
+        """
+        if not os.path.isdir(folder):
+            raise ValueError(f"文件夹不存在: {folder}")
+        volumeIndex = self.getVolumeIndex()
+        volumeIndex.startBackgroundIndexing(folder, VOLUME_FILE_EXTENSIONS, computeStatistics)
+        return volumeIndex
+
+    def loadDataToScene(self, fixedVolume, movingVolume, mainFolderName, moduleFolderName, roiVolumes=None,
+                        downcast=False):
         """
         将配准数据加载到场景文件夹中(两层结构)
         
@@ -74,43 +284,40 @@ class DataManagerLogic:
         :param mainFolderName: 配准流程总文件夹名称
         :param moduleFolderName: 模块子文件夹名称
         :param roiVolumes: ROI高分辨率MRI字典 {internalName: volumeNode}
+        :param downcast: 是否对文件夹中的副本无损降级存储类型(见 downcastVolume)
         :return: 成功状态
         """
         try:
-            # 获取 Subject Hierarchy 节点
-            shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
-            sceneItemID = shNode.GetSceneItemID()
-            
-            # 检查总文件夹是否已存在
-            mainFolderItemID = shNode.GetItemChildWithName(sceneItemID, mainFolderName)
-            
-            if mainFolderItemID == 0:  # 不存在,创建新的总文件夹
-                mainFolderItemID = shNode.CreateFolderItem(sceneItemID, mainFolderName)
-                self.log(f"✓ 创建配准流程总文件夹: {mainFolderName}")
-            else:
-                self.log(f"✓ 使用已存在的总文件夹: {mainFolderName}")
-            
-            # 在总文件夹下创建模块子文件夹
-            moduleFolderItemID = shNode.CreateFolderItem(mainFolderItemID, moduleFolderName)
-            self.log(f"✓ 创建模块子文件夹: {moduleFolderName}")
-            
-            # 将 Fixed Volume 复制到模块子文件夹中
-            if fixedVolume:
-                fixedCopy = self._createVolumeInFolder(fixedVolume, "Fixed_Volume", shNode, moduleFolderItemID)
-                self.log(f"✓ Fixed Volume 已添加到 {moduleFolderName}")
-            
-            # 将 Moving Volume 复制到模块子文件夹中
-            if movingVolume:
-                movingCopy = self._createVolumeInFolder(movingVolume, "Moving_Volume", shNode, moduleFolderItemID)
-                self.log(f"✓ Moving Volume 已添加到 {moduleFolderName}")
-            
-            # 将 ROI Volumes 复制到模块子文件夹中
-            if roiVolumes:
-                for internalName, roiVolume in roiVolumes.items():
-                    if roiVolume:
-                        roiCopy = self._createVolumeInFolder(roiVolume, internalName, shNode, moduleFolderItemID)
-                        self.log(f"✓ {internalName} 已添加到 {moduleFolderName}")
-            
+            # 所有节点和文件夹在同一个批处理中创建,结束时只刷新一次
+            with sceneBatch():
+                shNode, mainFolderItemID, moduleFolderItemID = createModuleFolder(
+                    mainFolderName, moduleFolderName, logCallback=self.log)
+
+                # 将 Fixed Volume 复制到模块子文件夹中
+                if fixedVolume:
+                    fixedCopy = self._createVolumeInFolder(fixedVolume, "Fixed_Volume", shNode, moduleFolderItemID)
+                    self.log(f"✓ Fixed Volume 已添加到 {moduleFolderName}")
+                    if downcast:
+                        self.downcastVolume(fixedCopy)
+
+                # 将 Moving Volume 复制到模块子文件夹中
+                if movingVolume:
+                    movingCopy = self._createVolumeInFolder(movingVolume, "Moving_Volume", shNode,
+                                                            moduleFolderItemID)
+                    self.log(f"✓ Moving Volume 已添加到 {moduleFolderName}")
+                    if downcast:
+                        self.downcastVolume(movingCopy)
+
+                # 将 ROI Volumes 复制到模块子文件夹中
+                if roiVolumes:
+                    for internalName, roiVolume in roiVolumes.items():
+                        if roiVolume:
+                            roiCopy = self._createVolumeInFolder(roiVolume, internalName, shNode,
+                                                                 moduleFolderItemID)
+                            self.log(f"✓ {internalName} 已添加到 {moduleFolderName}")
+                            if downcast:
+                                self.downcastVolume(roiCopy)
+
             return True
             
         except Exception as e:
@@ -148,24 +355,497 @@ class DataManagerLogic:
         volumeNode.SetName(newName)
         
         # 将新节点移动到文件夹中
-        volumeItemID = shNode.GetItemByDataNode(volumeNode)
-        shNode.SetItemParent(volumeItemID, folderItemID)
+        placeNodeInFolder(shNode, volumeNode, folderItemID)
         
         return volumeNode
 
-    def exportData(self, fixedVolume, movingVolume, outputDir, folderName, sceneFolderName, fileFormat="nrrd"):
+    def downcastVolume(self, volumeNode):
+        """
+        无损降级体积的存储类型
+
+        浮点型 (float32/float64) 或较宽整数类型的体积,若所有值都是整数且在更小整数类型的范围内,
+        则按块转换为该类型,内存和导出大小相应减小。原始类型记录在节点属性
+        ORIGINAL_SCALAR_TYPE_ATTRIBUTE 和导出元数据的 original_scalar_type 中,
+        可用 restoreOriginalScalarType 精确还原
+
+        :param volumeNode: 体积节点
+        :return: 转换后的标量类型名称;无法无损转换时返回 None
+        """
+        import vtk.util.numpy_support as vtk_np
+        self.makeImageDataUnique(volumeNode)
+        imageData = volumeNode.GetImageData()
+        scalars = imageData.GetPointData().GetScalars()
+        originalType = imageData.GetScalarTypeAsString()
+
+        sourceArray = vtk_np.vtk_to_numpy(scalars)
+        targetCode = volume_io.findLosslessIntegerType(sourceArray)
+        if targetCode is None:
+            self.log(f"  {volumeNode.GetName()}: 数据不能无损转换为更小的整数类型,保持 {originalType}")
+            return None
+
+        self._replaceScalars(imageData, scalars, np.dtype(targetCode))
+        if not volumeNode.GetAttribute(ORIGINAL_SCALAR_TYPE_ATTRIBUTE):
+            volumeNode.SetAttribute(ORIGINAL_SCALAR_TYPE_ATTRIBUTE, originalType)
+        volumeNode.Modified()
+
+        newType = imageData.GetScalarTypeAsString()
+        savedMB = (sourceArray.nbytes - sourceArray.size * np.dtype(targetCode).itemsize) / (1024 * 1024)
+        self.log(f"✓ {volumeNode.GetName()}: 存储类型 {originalType} → {newType} (无损,节省 {savedMB:.1f} MB)")
+        return newType
+
+    def restoreOriginalScalarType(self, volumeNode):
+        """
+        将 downcastVolume 降级过的体积还原为原始存储类型
+
+        :param volumeNode: 体积节点
+        :return: 还原后的标量类型名称;未降级过时返回 None
+        """
+        originalType = volumeNode.GetAttribute(ORIGINAL_SCALAR_TYPE_ATTRIBUTE)
+        if not originalType:
+            return None
+        self.makeImageDataUnique(volumeNode)
+        imageData = volumeNode.GetImageData()
+        self._replaceScalars(imageData, imageData.GetPointData().GetScalars(),
+                             np.dtype(volume_io.numpyTypeForScalarType(originalType)))
+        volumeNode.RemoveAttribute(ORIGINAL_SCALAR_TYPE_ATTRIBUTE)
+        volumeNode.Modified()
+        self.log(f"✓ {volumeNode.GetName()}: 已还原为原始存储类型 {originalType}")
+        return originalType
+
+    def getSnapshotStore(self, storeDir=None):
+        """
+        获取会话快照存储
+
+        :param storeDir: 存储目录,默认在 Slicer 缓存目录下
+        :return: SessionSnapshotStore 对象
+        """
+        from .session_snapshot import SessionSnapshotStore
+        storeDir = storeDir or os.path.join(slicer.app.cachePath, "TMJExtension", "snapshots")
+        return SessionSnapshotStore(storeDir, logCallback=self.logCallback)
+
+    def saveSessionSnapshot(self, mainFolderName="TMJ_配准", sessionName=None, storeDir=None):
+        """
+        保存配准流程文件夹的会话快照(结构、变换和标注点为 JSON,体积按内容哈希只写一次)
+
+        :param mainFolderName: 配准流程总文件夹名称
+        :param sessionName: 快照名称,默认为 "<总文件夹>_<时间>"
+        :param storeDir: 快照存储目录
+        :return: 快照文件路径
+        """
+        try:
+            self.log(f"保存会话快照: {mainFolderName}")
+            return self.getSnapshotStore(storeDir).save(mainFolderName, sessionName)
+        except Exception as e:
+            self.log(f"保存会话快照时出错: {str(e)}")
+            raise
+
+    def restoreSessionSnapshot(self, sessionPath, closeFolderName=None, storeDir=None):
+        """
+        恢复会话快照;切换患者时可同时移除当前患者的文件夹
+
+        :param sessionPath: 快照文件路径
+        :param closeFolderName: 恢复前要从场景中移除的总文件夹名称(如当前患者),为 None 时不移除
+        :param storeDir: 快照存储目录,默认为快照文件所在存储
+        :return: 恢复的总文件夹名称
+        """
+        try:
+            self.log(f"恢复会话快照: {sessionPath}")
+            if closeFolderName:
+                shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+                folderItemID = shNode.GetItemChildWithName(shNode.GetSceneItemID(), closeFolderName)
+                if folderItemID:
+                    shNode.RemoveItem(folderItemID)
+                    self.log(f"  已关闭当前会话: {closeFolderName}")
+            storeDir = storeDir or os.path.dirname(os.path.dirname(os.path.abspath(sessionPath)))
+            return self.getSnapshotStore(storeDir).restore(sessionPath)
+        except Exception as e:
+            self.log(f"恢复会话快照时出错: {str(e)}")
+            raise
+
+    def deduplicateSceneVolumes(self, mainFolderName="TMJ_配准", maxWorkers=None):
+        """
+        合并配准流程文件夹中内容和几何完全相同的体积,使它们共享同一份图像数据
+
+        各模块保存结果时会深拷贝体积(如 Fixed_Volume、GoldStandard_Fixed、CoarseReg_Moving),
+        同一份数据在场景中可能存在多份。去重后每个节点和名称都保留,只是图像数据指向同一个 vtkImageData。
+        先按维度和标量类型预分组,只对可能重复的体积在线程池中计算内容哈希。
+        共享后的节点带有 SHARED_IMAGE_DATA_ATTRIBUTE 属性,需要原地修改数据时先调用 makeImageDataUnique
+
+        :param mainFolderName: 配准流程总文件夹名称
+        :param maxWorkers: 计算哈希的线程数,默认为 CPU 核心数
+        :return: (合并的体积数, 回收的字节数)
+        """
+        try:
+            shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+            mainFolderItemID = shNode.GetItemChildWithName(shNode.GetSceneItemID(), mainFolderName)
+            if mainFolderItemID == 0:
+                raise ValueError(f"场景中没有找到文件夹: {mainFolderName}")
+
+            # 1. 收集文件夹中的所有体积,按图像数据对象分组(已共享的节点视为同一份数据)
+            childIDs = vtk.vtkIdList()
+            shNode.GetItemChildren(mainFolderItemID, childIDs, True)
+            buffers = {}
+            for i in range(childIDs.GetNumberOfIds()):
+                node = shNode.GetItemDataNode(childIDs.GetId(i))
+                if not node or not node.IsA("vtkMRMLScalarVolumeNode") or not node.GetImageData():
+                    continue
+                imageData = node.GetImageData()
+                address = imageData.GetAddressAsString("vtkImageData")
+                buffers.setdefault(address, {"imageData": imageData, "nodes": []})["nodes"].append(node)
+
+            # 2. 维度、标量类型和分量数都相同的数据才可能重复,只对这些计算内容哈希
+            sizeGroups = {}
+            for address, buffer in buffers.items():
+                imageData = buffer["imageData"]
+                sizeKey = (imageData.GetDimensions(), imageData.GetScalarType(),
+                           imageData.GetNumberOfScalarComponents())
+                sizeGroups.setdefault(sizeKey, []).append(address)
+            hashAddresses = [address for group in sizeGroups.values() if len(group) > 1 for address in group]
+
+            with ThreadPoolExecutor(max_workers=maxWorkers or os.cpu_count() or 1) as executor:
+                hashTasks = {address: executor.submit(volume_io.computeContentHash,
+                                                      self._getVolumeArray(buffers[address]["nodes"][0]))
+                             for address in hashAddresses}
+                contentHashes = {address: task.result() for address, task in hashTasks.items()}
+
+            # 3. 内容哈希和几何指纹都相同的节点合并到同一份图像数据
+            groups = {}
+            for address in hashAddresses:
+                for node in buffers[address]["nodes"]:
+                    key = (contentHashes[address], self._computeGeometryFingerprint(node))
+                    groups.setdefault(key, []).append((address, node))
+
+            mergedCount = 0
+            reclaimedBytes = 0
+            for members in groups.values():
+                addresses = {address for address, node in members}
+                if len(addresses) < 2:
+                    continue
+                # 保留被引用最多的那份数据
+                primary = max(addresses, key=lambda address: len(buffers[address]["nodes"]))
+                sharedImageData = buffers[primary]["imageData"]
+                for address, node in members:
+                    if address != primary:
+                        node.SetAndObserveImageData(sharedImageData)
+                        buffers[address]["nodes"].remove(node)
+                        mergedCount += 1
+                        # 该数据的所有节点都已改为共享时,原数据才会被释放
+                        if not buffers[address]["nodes"]:
+                            reclaimedBytes += buffers[address]["imageData"].GetActualMemorySize() * 1024
+                    node.SetAttribute(SHARED_IMAGE_DATA_ATTRIBUTE, "1")
+                self.log(f"  共享图像数据: {', '.join(node.GetName() for address, node in members)}")
+
+            self.log(f"✓ 去重完成: 合并 {mergedCount} 个体积,回收约 {reclaimedBytes / (1024 * 1024):.1f} MB")
+            return mergedCount, reclaimedBytes
+
+        except Exception as e:
+            self.log(f"场景体积去重时出错: {str(e)}")
+            raise
+
+    def makeImageDataUnique(self, volumeNode):
+        """
+        若体积的图像数据经去重与其他节点共享,则为该节点复制一份独立的图像数据(原地修改数据前调用)
+
+        :param volumeNode: 体积节点
+        :return: 是否进行了复制
+        """
+        if not volumeNode.GetAttribute(SHARED_IMAGE_DATA_ATTRIBUTE):
+            return False
+        imageData = vtk.vtkImageData()
+        imageData.DeepCopy(volumeNode.GetImageData())
+        volumeNode.SetAndObserveImageData(imageData)
+        volumeNode.RemoveAttribute(SHARED_IMAGE_DATA_ATTRIBUTE)
+        return True
+
+    def _replaceScalars(self, imageData, scalars, dtype):
+        """
+        以指定类型的新数组替换图像标量,数据按块转换写入
+
+        :param imageData: vtkImageData
+        :param scalars: 当前标量数组
+        :param dtype: 目标 numpy 类型
+        """
+        import vtk.util.numpy_support as vtk_np
+        newScalars = vtk.vtkDataArray.CreateDataArray(vtk_np.get_vtk_array_type(dtype.type))
+        newScalars.SetName(scalars.GetName())
+        newScalars.SetNumberOfComponents(scalars.GetNumberOfComponents())
+        newScalars.SetNumberOfTuples(scalars.GetNumberOfTuples())
+        volume_io.castArrayChunked(vtk_np.vtk_to_numpy(scalars), vtk_np.vtk_to_numpy(newScalars))
+        imageData.GetPointData().SetScalars(newScalars)
+        imageData.Modified()
+
+    def scanCohortDirectory(self, cohortDir, patterns=None):
+        """
+        扫描病例目录,识别每位患者的 Fixed CBCT、Moving MRI 和 4 个 ROI MRI 文件
+
+        cohortDir 下的每个子文件夹视为一位患者(子文件夹名即患者ID),在其中递归查找体积文件。
+        以生成器方式逐个返回,不加载任何图像数据
+
+        :param cohortDir: 病例根目录
+        :param patterns: 角色到文件名模式列表的有序字典,默认使用 DEFAULT_COHORT_PATTERNS
+        :return: 生成器,每项为 {"patient_id", "folder", "files": {角色: 路径}, "unmatched": [路径]}
+        """
+        import fnmatch
+        if not os.path.isdir(cohortDir):
+            raise ValueError(f"病例目录不存在: {cohortDir}")
+        patterns = patterns or DEFAULT_COHORT_PATTERNS
+
+        patientFolders = sorted(entry.path for entry in os.scandir(cohortDir) if entry.is_dir())
+        for patientFolder in patientFolders:
+            candidates = []
+            for root, dirs, files in os.walk(patientFolder):
+                dirs.sort()
+                for fileName in sorted(files):
+                    if fileName.lower().endswith(VOLUME_FILE_EXTENSIONS):
+                        candidates.append(os.path.join(root, fileName))
+
+            assigned = {}
+            unmatched = []
+            for filePath in candidates:
+                relativePath = os.path.relpath(filePath, patientFolder).replace(os.sep, "/").lower()
+                fileName = os.path.basename(relativePath)
+                role = next((role for role, rolePatterns in patterns.items()
+                             if role not in assigned and any(fnmatch.fnmatch(fileName, p.lower()) or
+                                                             fnmatch.fnmatch(relativePath, p.lower())
+                                                             for p in rolePatterns)), None)
+                if role:
+                    assigned[role] = filePath
+                else:
+                    unmatched.append(filePath)
+
+            yield {
+                "patient_id": os.path.basename(patientFolder),
+                "folder": patientFolder,
+                "files": assigned,
+                "unmatched": unmatched
+            }
+
+    def importCohort(self, cohortDir, mainFolderName="TMJ_配准", moduleFolderName="Data Manager",
+                     patterns=None, patientCallback=None, releaseAfterCallback=True, downcast=False):
+        """
+        无界面批量导入病例目录
+
+        逐个患者加载体积并建立 "<mainFolderName>_<患者ID>/<moduleFolderName>" 场景文件夹结构。
+        每位患者处理完后立即删除加载时的原始节点(场景中只保留文件夹内的副本);
+        默认 (releaseAfterCallback 为 True) 回调返回后整个患者文件夹也会从场景中移除,
+        内存占用只与单个患者的数据量有关;为 False 时所有患者保留在场景中,内存占用随患者数增长
+
+        :param cohortDir: 病例根目录
+        :param mainFolderName: 配准流程总文件夹名称前缀
+        :param moduleFolderName: 模块子文件夹名称
+        :param patterns: 文件名模式,见 scanCohortDirectory
+        :param patientCallback: 每位患者导入完成后的回调 patientCallback(patientInfo, mainFolderName)
+        :param releaseAfterCallback: 回调后是否从场景移除该患者的数据 (默认移除)
+        :param downcast: 是否无损降级存储类型(见 downcastVolume)
+        :return: 每位患者的导入结果列表 [{"patient_id", "status", "main_folder", "message"}]
+        """
+        results = []
+        self.log(f"===== 开始批量导入病例: {cohortDir} =====")
+
+        for patientInfo in self.scanCohortDirectory(cohortDir, patterns):
+            patientID = patientInfo["patient_id"]
+            files = patientInfo["files"]
+            patientFolderName = f"{mainFolderName}_{patientID}"
+            result = {"patient_id": patientID, "status": "skipped", "main_folder": patientFolderName, "message": ""}
+            results.append(result)
+
+            if "fixed" not in files or "moving" not in files:
+                missing = [role for role in ("fixed", "moving") if role not in files]
+                result["message"] = f"缺少文件: {', '.join(missing)}"
+                self.log(f"⚠ 跳过患者 {patientID}: {result['message']}")
+                continue
+
+            self.log(f"--- 患者 {patientID} ({len(results)}) ---")
+            loadedNodes = []
+            try:
+                fixedNode, movingNode, roiVolumes = self._loadPatientVolumes(files, loadedNodes)
+                self.loadDataToScene(fixedNode, movingNode, patientFolderName, moduleFolderName, roiVolumes,
+                                     downcast)
+                result["status"] = "imported"
+                result["message"] = f"{len(loadedNodes)} 个体积"
+
+            except Exception as e:
+                result["status"] = "failed"
+                result["message"] = str(e)
+                self.log(f"✗ 患者 {patientID} 导入失败: {str(e)}")
+
+            finally:
+                # 文件夹中已有深拷贝,加载时的原始节点不再需要
+                for node in loadedNodes:
+                    slicer.mrmlScene.RemoveNode(node)
+
+            if result["status"] != "imported":
+                continue
+
+            if patientCallback:
+                patientCallback(patientInfo, patientFolderName)
+
+            if releaseAfterCallback:
+                shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+                folderItemID = shNode.GetItemChildWithName(shNode.GetSceneItemID(), patientFolderName)
+                if folderItemID:
+                    shNode.RemoveItem(folderItemID)
+                self.log(f"✓ 已释放患者 {patientID} 的场景数据")
+
+        importedCount = sum(1 for r in results if r["status"] == "imported")
+        self.log(f"===== 批量导入完成: {importedCount}/{len(results)} 位患者导入成功 =====")
+        return results
+
+    def _loadPatientVolumes(self, files, loadedNodes, decoded=None):
+        """
+        加载一位患者的 Fixed、Moving 和 ROI 体积
+
+        :param files: 角色到文件路径的字典
+        :param loadedNodes: 加载得到的节点会追加到此列表,便于调用方在出错时清理
+        :param decoded: 已在后台预取解码的体积 {角色: SimpleITK.Image},其余角色从文件加载
+        :return: (Fixed 节点, Moving 节点, ROI 体积字典 {角色: 节点})
+        """
+        decoded = decoded or {}
+        nodes = {}
+        for role, filePath in files.items():
+            if role in decoded:
+                nodes[role] = self.createVolumeFromImage(decoded[role], volume_io.volumeNameFromPath(filePath))
+            else:
+                nodes[role] = self.loadVolume(filePath)
+            loadedNodes.append(nodes[role])
+        roiVolumes = {role: node for role, node in nodes.items() if role not in ("fixed", "moving")}
+        return nodes.get("fixed"), nodes.get("moving"), roiVolumes
+
+    def createVolumeFromImage(self, image, nodeName):
+        """
+        由预取的 SimpleITK 图像创建体积节点(必须在主线程中调用)
+
+        通过 Slicer 的 ITK 接口 (sitkUtils) 创建,LPS→RAS 几何转换与 loadVolume 一致
+
+        :param image: SimpleITK.Image
+        :param nodeName: 节点名称
+        :return: 体积节点
+        """
+        import sitkUtils
+        volumeNode = sitkUtils.PushVolumeToSlicer(image, name=nodeName)
+        volumeNode.CreateDefaultDisplayNodes()
+        self.log(f"体积加载成功: {nodeName} (预取数据)")
+        return volumeNode
+
+    def openReviewQueue(self, cohortDir, patterns=None, prefetchDepth=None, maxCacheMB=None):
+        """
+        建立病例审阅队列,逐位审阅患者时在后台预取后续患者的体积
+
+        :param cohortDir: 病例根目录
+        :param patterns: 文件名模式,见 scanCohortDirectory
+        :param prefetchDepth: 预取的患者数,默认为 1
+        :param maxCacheMB: 预取缓存的内存上限 (MB)
+        :return: CohortReviewQueue 实例
+        """
+        from .review_queue import CohortReviewQueue, DEFAULT_PREFETCH_DEPTH, DEFAULT_PREFETCH_CACHE_MB
+        patients = []
+        for patientInfo in self.scanCohortDirectory(cohortDir, patterns):
+            if "fixed" in patientInfo["files"] and "moving" in patientInfo["files"]:
+                patients.append(patientInfo)
+            else:
+                self.log(f"⚠ 审阅队列跳过患者 {patientInfo['patient_id']}: 缺少 Fixed 或 Moving 文件")
+        if not patients:
+            raise ValueError(f"病例目录中没有可审阅的患者: {cohortDir}")
+        self.log(f"✓ 审阅队列: {len(patients)} 位患者")
+        return CohortReviewQueue(patients,
+                                 prefetchDepth=prefetchDepth or DEFAULT_PREFETCH_DEPTH,
+                                 maxCacheMB=maxCacheMB or DEFAULT_PREFETCH_CACHE_MB,
+                                 logCallback=self.logCallback)
+
+    def reviewNextPatient(self, reviewQueue, mainFolderName="TMJ_配准", moduleFolderName="Data Manager",
+                          index=None, releasePrevious=True, downcast=False):
+        """
+        切换到审阅队列中的下一位患者
+
+        预取已完成的体积直接由内存中的 ITK 图像创建节点,其余体积从文件加载;
+        随后建立 "<mainFolderName>_<患者ID>/<moduleFolderName>" 文件夹,并在后台开始预取之后的患者
+
+        :param reviewQueue: openReviewQueue 返回的审阅队列
+        :param mainFolderName: 配准流程总文件夹名称前缀
+        :param moduleFolderName: 模块子文件夹名称
+        :param index: 目标患者序号,为 None 时为下一位
+        :param releasePrevious: 是否从场景中移除上一位患者的文件夹
+        :param downcast: 是否无损降级存储类型(见 downcastVolume)
+        :return: (患者信息, 该患者的总文件夹名称)
+        """
+        previousPatient = reviewQueue.currentPatient()
+        patientInfo, decoded, errors = reviewQueue.advance(index)
+        patientID = patientInfo["patient_id"]
+        patientFolderName = f"{mainFolderName}_{patientID}"
+        self.log(f"--- 审阅患者 {patientID} ({reviewQueue.currentIndex + 1}/{len(reviewQueue)}) ---")
+        for role, message in errors.items():
+            self.log(f"⚠ {role} 预取失败,从文件加载: {message}")
+
+        # 释放上一位患者、创建节点和文件夹在同一个批处理中完成,切换患者只刷新一次
+        loadedNodes = []
+        try:
+            with sceneBatch():
+                if releasePrevious and previousPatient is not None:
+                    shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+                    folderItemID = shNode.GetItemChildWithName(shNode.GetSceneItemID(),
+                                                               f"{mainFolderName}_{previousPatient['patient_id']}")
+                    if folderItemID:
+                        shNode.RemoveItem(folderItemID)
+                        self.log(f"✓ 已释放患者 {previousPatient['patient_id']} 的场景数据")
+
+                try:
+                    fixedNode, movingNode, roiVolumes = self._loadPatientVolumes(patientInfo["files"], loadedNodes,
+                                                                                 decoded)
+                    self.loadDataToScene(fixedNode, movingNode, patientFolderName, moduleFolderName, roiVolumes,
+                                         downcast)
+                finally:
+                    # 文件夹中已有深拷贝,加载时的原始节点不再需要
+                    for node in loadedNodes:
+                        slicer.mrmlScene.RemoveNode(node)
+            self.log(f"✓ 患者 {patientID} 已加载 ({len(decoded)}/{len(loadedNodes)} 个体积来自预取)")
+            return patientInfo, patientFolderName
+        except Exception as e:
+            self.log(f"✗ 患者 {patientID} 加载失败: {str(e)}")
+            raise
+
+    def exportData(self, fixedVolume, movingVolume, outputDir, folderName, sceneFolderName, fileFormat="nrrd",
+                   maxWorkers=None, codec="gzip", compressionLevel=None, incremental=True, downcast=False):
         """
         导出体积数据和元数据,并在场景中创建文件夹节点来组织管理
+
+        场景操作和未压缩写盘在主线程完成,压缩与强度统计在工作线程中并行执行;
+        gzip 压缩按数据块切分,单个大文件也能利用多个 CPU 核心
+
+        压缩方式 (codec):
+          - gzip: 标准 gzip,兼容所有读取器 (默认)
+          - zstd / lz4: NRRD 导出为明文头 (.nhdr) + 压缩数据旁车文件 (.raw.zst / .raw.lz4),
+            NIfTI 导出为 .nii.zst / .nii.lz4,速度快,适合临时导出
+          - none: 不压缩
+          - archive: 不压缩的体积文件 + 单独的 zip 压缩归档,适合归档保存
+
+        分块格式 (fileFormat='zarr'): 体积按固定大小分块独立压缩,写为 zarr v2 目录布局,
+        之后可用 loadZarrVolume 只读取某个 RAS 区域(如 ROI MRI 覆盖范围)内的分块。
+        分块压缩只支持 gzip (以 zlib 存储)、zstd 和 none
+
+        增量导出 (incremental): metadata.json 中记录每个体积的内容哈希和几何指纹,
+        再次导出到同一文件夹时,内容、几何和导出设置都未变化的体积将跳过写盘
         
         :param fixedVolume: Fixed volume 节点
         :param movingVolume: Moving volume 节点
         :param outputDir: 输出目录
         :param folderName: 输出文件夹名称
         :param sceneFolderName: 场景中的文件夹名称
-        :param fileFormat: 文件格式 ('nrrd' 或 'nii.gz')
+        :param fileFormat: 文件格式 ('nrrd'、'nii.gz' 或分块格式 'zarr')
+        :param maxWorkers: 压缩线程数,默认为 CPU 核心数
+        :param codec: 压缩方式 ('gzip', 'zstd', 'lz4', 'none', 'archive')
+        :param compressionLevel: 压缩级别,默认使用各压缩方式的推荐级别
+        :param incremental: 是否跳过未变化的体积
+        :param downcast: 是否在导出前无损降级存储类型(只作用于场景副本,原始类型记录在元数据中)
         :return: (成功状态, 文件夹节点)
         """
         try:
+            if codec not in volume_io.SUPPORTED_CODECS:
+                raise ValueError(f"不支持的压缩方式: {codec},可选: {', '.join(volume_io.SUPPORTED_CODECS)}")
+            if fileFormat == "zarr" and codec not in ("gzip", "zstd", "none"):
+                raise ValueError(f"分块格式 (zarr) 不支持压缩方式: {codec}")
+            if compressionLevel is None:
+                compressionLevel = volume_io.DEFAULT_CODEC_LEVELS[codec]
+
             # 1. 在场景中创建文件夹节点
             self.log("创建场景文件夹节点...")
             folderNode = slicer.vtkMRMLFolderDisplayNode()
@@ -183,44 +863,104 @@ class DataManagerLogic:
                 os.makedirs(outputFolder)
                 self.log(f"创建输出文件夹: {outputFolder}")
 
+            metadataPath = os.path.join(outputFolder, "metadata.json")
+            previousMetadata = self._loadExportMetadata(metadataPath) if incremental else None
+
             metadata = {
                 "export_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "file_format": fileFormat,
+                "compression": {"codec": codec, "level": compressionLevel},
                 "resampled": False,
                 "scene_folder": sceneFolderName,
                 "volumes": {}
             }
+            self.log(f"压缩方式: {codec} (级别 {compressionLevel})")
 
-            # 3. 处理 Fixed Volume
+            exportItems = []
             if fixedVolume:
-                self.log("导出 Fixed Volume...")
-                fixedPath = os.path.join(outputFolder, f"fixed_volume.{fileFormat}")
-                
-                # 创建该体积的副本并放入场景文件夹
-                fixedCopy = self._createVolumeInFolder(fixedVolume, "fixed_volume", shNode, folderItemID)
-                
-                # 导出到磁盘
-                self._exportVolume(fixedCopy, fixedPath, fileFormat)
-                metadata["volumes"]["fixed"] = self._extractVolumeMetadata(fixedCopy)
-                self.log(f"✓ Fixed Volume 已保存: {fixedPath}")
-                self.log(f"✓ Fixed Volume 已添加到场景文件夹")
-
-            # 4. 处理 Moving Volume
+                exportItems.append(("fixed", "Fixed Volume", fixedVolume, "fixed_volume"))
             if movingVolume:
-                self.log("导出 Moving Volume...")
-                movingPath = os.path.join(outputFolder, f"moving_volume.{fileFormat}")
-                
-                # 创建该体积的副本并放入场景文件夹
-                movingCopy = self._createVolumeInFolder(movingVolume, "moving_volume", shNode, folderItemID)
-                
-                # 导出到磁盘
-                self._exportVolume(movingCopy, movingPath, fileFormat)
-                metadata["volumes"]["moving"] = self._extractVolumeMetadata(movingCopy)
-                self.log(f"✓ Moving Volume 已保存: {movingPath}")
-                self.log(f"✓ Moving Volume 已添加到场景文件夹")
-
-            # 5. 保存 metadata.json
-            metadataPath = os.path.join(outputFolder, "metadata.json")
+                exportItems.append(("moving", "Moving Volume", movingVolume, "moving_volume"))
+
+            workers = maxWorkers or os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=workers) as blockExecutor, \
+                    ThreadPoolExecutor(max_workers=max(1, 2 * len(exportItems))) as taskExecutor:
+                volumeCopies = {}
+                fingerprints = {}
+                hashTasks = {}
+
+                # 3. 创建场景副本,并在工作线程中计算内容哈希(MRML 操作只在主线程进行)
+                for key, label, volume, baseName in exportItems:
+                    self.log(f"导出 {label}...")
+
+                    # 创建该体积的副本并放入场景文件夹
+                    volumeCopy = self._createVolumeInFolder(volume, baseName, shNode, folderItemID)
+                    volumeCopies[key] = volumeCopy
+                    if downcast:
+                        self.downcastVolume(volumeCopy)
+                    fingerprints[key] = self._computeGeometryFingerprint(volumeCopy)
+                    self.log(f"✓ {label} 已添加到场景文件夹")
+
+                    hashTasks[key] = taskExecutor.submit(volume_io.computeContentHash,
+                                                         self._getVolumeArray(volumeCopy))
+
+                # 4. 比较上次导出的记录,只重新写出发生变化的体积
+                tasks = {}
+                statistics = {}
+                fileInfos = {}
+                for key, label, volume, baseName in exportItems:
+                    contentHash = hashTasks[key].result()
+                    previousEntry = self._findUnchangedExport(previousMetadata, key, contentHash, fingerprints[key],
+                                                              fileFormat, codec, compressionLevel, outputFolder)
+                    if previousEntry:
+                        metadata["volumes"][key] = previousEntry
+                        self.log(f"✓ {label} 未变化,跳过写盘: {previousEntry['storage']['file']}")
+                        continue
+
+                    # 强度统计在工作线程中计算
+                    imageArray = self._getVolumeArray(volumeCopies[key])
+                    tasks[taskExecutor.submit(self._computeIntensityStatistics, imageArray)] = \
+                        (key, "stats", f"{label} 元数据提取")
+
+                    # 导出到磁盘,压缩任务在工作线程中执行
+                    compressTask = self._exportVolume(volumeCopies[key], outputFolder, baseName, fileFormat,
+                                                      taskExecutor, blockExecutor, workers, codec, compressionLevel)
+                    tasks[compressTask] = (key, "write", f"{label} 已保存")
+
+                # 5. 等待全部任务完成并汇报进度
+                completed = 0
+                for future in as_completed(tasks):
+                    key, kind, description = tasks[future]
+                    result = future.result()
+                    completed += 1
+                    if kind == "stats":
+                        statistics[key] = result
+                    else:
+                        fileInfos[key] = result
+                        description = f"{description}: {os.path.join(outputFolder, result['file'])}"
+                    self.log(f"✓ [{completed}/{len(tasks)}] {description}")
+
+                # 6. 归档模式: 将未压缩的体积文件另外打包为压缩归档
+                if codec == "archive":
+                    archiveName = "volumes_archive.zip"
+                    if fileInfos or not os.path.exists(os.path.join(outputFolder, archiveName)):
+                        self._writeVolumeArchive(outputFolder, archiveName, metadata, fileInfos, compressionLevel)
+                        self.log(f"✓ 压缩归档已保存: {os.path.join(outputFolder, archiveName)}")
+                    metadata["compression"]["archive"] = archiveName
+
+            for key, label, volume, baseName in exportItems:
+                if key in fileInfos:
+                    volumeMetadata = self._extractVolumeMetadata(volumeCopies[key], statistics[key])
+                    volumeMetadata["storage"] = fileInfos[key]
+                    volumeMetadata["content_hash"] = hashTasks[key].result()
+                    volumeMetadata["geometry_fingerprint"] = fingerprints[key]
+                    metadata["volumes"][key] = volumeMetadata
+
+            skippedCount = len(exportItems) - len(fileInfos)
+            if skippedCount:
+                self.log(f"增量导出: 跳过 {skippedCount} 个未变化的体积,重新写出 {len(fileInfos)} 个")
+
+            # 7. 保存 metadata.json
             with open(metadataPath, 'w', encoding='utf-8') as f:
                 json.dump(metadata, f, indent=2, ensure_ascii=False)
             self.log(f"✓ 元数据已保存: {metadataPath}")
@@ -231,33 +971,441 @@ class DataManagerLogic:
             self.log(f"导出数据时出错: {str(e)}")
             raise
 
-    def _exportVolume(self, volumeNode, outputPath, fileFormat):
+    def exportRegistrationResults(self, mainFolderName, outputDir, fileFormat="nrrd", transformFormat="h5",
+                                  codec="gzip", compressionLevel=None, maxWorkers=None):
+        """
+        导出配准流程总文件夹中各模块的结果,不硬化变换、不重采样
+
+        - 体积按各自原始网格写出,内容和几何相同的体积只写一次,其他文件夹中的副本在清单中引用同一文件
+        - 变换 (如 CoarseReg_Transform、GoldStandard_Transform) 写为 .h5 或 .tfm 旁车文件
+        - 标注点写为 .mrk.json
+        - manifest.json 记录文件夹结构以及每个节点的文件和父变换,可据此在其他软件中组合变换
+
+        :param mainFolderName: 配准流程总文件夹名称
+        :param outputDir: 输出目录,结果写入 outputDir/<总文件夹名称>
+        :param fileFormat: 体积格式 ('nrrd'、'nii.gz' 或 'zarr')
+        :param transformFormat: 变换格式 ('h5' 或 'tfm',非线性变换总是写为 h5)
+        :param codec: 体积压缩方式 ('gzip', 'zstd', 'lz4', 'none')
+        :param compressionLevel: 压缩级别,默认使用各压缩方式的推荐级别
+        :param maxWorkers: 压缩线程数,默认为 CPU 核心数
+        :return: manifest.json 路径
+        """
+        import re
+        from .memory_manager import reloadEvictedVolume
+        try:
+            if transformFormat not in ("h5", "tfm"):
+                raise ValueError(f"不支持的变换格式: {transformFormat},可选: h5, tfm")
+            if codec not in volume_io.SUPPORTED_CODECS or codec == "archive":
+                raise ValueError(f"结果导出不支持压缩方式: {codec}")
+            if fileFormat == "zarr" and codec not in ("gzip", "zstd", "none"):
+                raise ValueError(f"分块格式 (zarr) 不支持压缩方式: {codec}")
+            if compressionLevel is None:
+                compressionLevel = volume_io.DEFAULT_CODEC_LEVELS[codec]
+
+            shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+            mainFolderItemID = shNode.GetItemChildWithName(shNode.GetSceneItemID(), mainFolderName)
+            if mainFolderItemID == 0:
+                raise ValueError(f"场景中没有找到文件夹: {mainFolderName}")
+            outputRoot = os.path.join(outputDir, mainFolderName)
+            os.makedirs(outputRoot, exist_ok=True)
+            self.log(f"===== 导出配准结果: {mainFolderName} → {outputRoot} =====")
+
+            # 1. 收集文件夹中的节点 (相对文件夹路径, 节点)
+            items = []
+
+            def collect(folderItemID, folderPath):
+                childIDs = vtk.vtkIdList()
+                shNode.GetItemChildren(folderItemID, childIDs, False)
+                for i in range(childIDs.GetNumberOfIds()):
+                    itemID = childIDs.GetId(i)
+                    node = shNode.GetItemDataNode(itemID)
+                    if node is None:
+                        collect(itemID, folderPath + [shNode.GetItemName(itemID)])
+                    else:
+                        items.append((folderPath, node))
+            collect(mainFolderItemID, [])
+
+            usedNames = set()
+
+            def outputPath(folderPath, name, extension):
+                folder = os.path.join(outputRoot, *folderPath)
+                os.makedirs(folder, exist_ok=True)
+                baseName = re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('_') or "node"
+                candidate = baseName
+                index = 1
+                while os.path.join(folder, candidate + extension) in usedNames:
+                    index += 1
+                    candidate = f"{baseName}_{index}"
+                usedNames.add(os.path.join(folder, candidate + extension))
+                return folder, candidate
+
+            manifest = {
+                "main_folder": mainFolderName,
+                "export_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "volume_format": fileFormat,
+                "transform_format": transformFormat,
+                "compression": {"codec": codec, "level": compressionLevel},
+                "resampled": False,
+                "nodes": []
+            }
+            transformFiles = {}
+            # 节点 ID -> 父变换节点 (记录写入清单前去掉 _node_id)
+            parentTransforms = {}
+
+            workers = maxWorkers or os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=workers) as blockExecutor, \
+                    ThreadPoolExecutor(max_workers=workers) as taskExecutor:
+                # 2. 在工作线程中计算体积的内容哈希,用于识别跨文件夹的重复副本
+                hashTasks = {}
+                for folderPath, node in items:
+                    if node.IsA("vtkMRMLScalarVolumeNode"):
+                        reloadEvictedVolume(node)
+                        hashTasks[node.GetID()] = taskExecutor.submit(volume_io.computeContentHash,
+                                                                      self._getVolumeArray(node))
+
+                # 3. 写出各节点
+                writtenVolumes = {}
+                writeTasks = {}
+                for folderPath, node in items:
+                    record = {"name": node.GetName(), "class": node.GetClassName(), "folder": "/".join(folderPath),
+                              "_node_id": node.GetID()}
+                    transformNode = node.GetParentTransformNode() if node.IsA("vtkMRMLTransformableNode") else None
+                    if transformNode:
+                        parentTransforms[node.GetID()] = transformNode
+
+                    if node.IsA("vtkMRMLScalarVolumeNode"):
+                        record["type"] = "volume"
+                        record["content_hash"] = hashTasks[node.GetID()].result()
+                        record["geometry_fingerprint"] = self._computeGeometryFingerprint(node)
+                        key = (record["content_hash"], record["geometry_fingerprint"])
+                        if key in writtenVolumes:
+                            record["same_as"] = writtenVolumes[key]["name"]
+                            writeTasks.setdefault(writtenVolumes[key]["_node_id"], []).append(record)
+                            self.log(f"  {node.GetName()} 与 {writtenVolumes[key]['name']} 相同,引用同一文件")
+                        else:
+                            folder, baseName = outputPath(folderPath, node.GetName(), "")
+                            future = self._exportVolume(node, folder, baseName, fileFormat, taskExecutor,
+                                                        blockExecutor, workers, codec, compressionLevel)
+                            writtenVolumes[key] = record
+                            record["_future"] = future
+                            record["_folder"] = folder
+
+                    elif node.IsA("vtkMRMLTransformNode"):
+                        record["type"] = "transform"
+                        extension = ".tfm" if transformFormat == "tfm" and node.IsLinear() else ".h5"
+                        if extension != "." + transformFormat:
+                            self.log(f"⚠ {node.GetName()} 为非线性变换,改为保存为 .h5")
+                        folder, baseName = outputPath(folderPath, node.GetName(), extension)
+                        filePath = os.path.join(folder, baseName + extension)
+                        if not slicer.util.saveNode(node, filePath):
+                            raise ValueError(f"保存变换失败: {filePath}")
+                        record["file"] = os.path.relpath(filePath, outputRoot).replace(os.sep, "/")
+                        record["linear"] = bool(node.IsLinear())
+                        transformFiles[node.GetID()] = record["file"]
+                        self.log(f"✓ 变换已保存: {record['file']}")
+
+                    elif node.IsA("vtkMRMLMarkupsNode"):
+                        record["type"] = "markups"
+                        folder, baseName = outputPath(folderPath, node.GetName(), ".mrk.json")
+                        filePath = os.path.join(folder, baseName + ".mrk.json")
+                        if not slicer.util.saveNode(node, filePath):
+                            raise ValueError(f"保存标注点失败: {filePath}")
+                        record["file"] = os.path.relpath(filePath, outputRoot).replace(os.sep, "/")
+                        record["control_points"] = node.GetNumberOfControlPoints()
+                        self.log(f"✓ 标注点已保存: {record['file']}")
+
+                    else:
+                        self.log(f"⚠ 不支持导出的节点类型,已跳过: {node.GetName()} ({node.GetClassName()})")
+                        continue
+                    manifest["nodes"].append(record)
+
+                # 4. 等待体积写出完成,填写文件路径(重复副本引用同一文件)
+                for record in manifest["nodes"]:
+                    future = record.pop("_future", None)
+                    if future is None:
+                        continue
+                    storage = future.result()
+                    record["storage"] = storage
+                    record["file"] = os.path.relpath(os.path.join(record.pop("_folder"), storage["file"]),
+                                                     outputRoot).replace(os.sep, "/")
+                    for duplicate in writeTasks.get(record["_node_id"], []):
+                        duplicate["file"] = record["file"]
+                    self.log(f"✓ 体积已保存: {record['file']}")
+
+            # 5. 父变换引用对应的变换文件(变换不在总文件夹中时只记录名称)
+            for record in manifest["nodes"]:
+                transformNode = parentTransforms.get(record.pop("_node_id"))
+                if transformNode is None:
+                    continue
+                record["parent_transform"] = {"name": transformNode.GetName(),
+                                              "file": transformFiles.get(transformNode.GetID())}
+                if record["parent_transform"]["file"] is None:
+                    self.log(f"⚠ {record['name']} 的父变换 {transformNode.GetName()} 不在总文件夹中,未导出")
+
+            manifestPath = os.path.join(outputRoot, "manifest.json")
+            with open(manifestPath, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False)
+            volumeCount = sum(1 for record in manifest["nodes"] if record["type"] == "volume")
+            self.log(f"✓ 导出完成: {len(manifest['nodes'])} 个节点 ({volumeCount} 个体积, "
+                     f"其中 {len(writtenVolumes)} 个写入文件), 清单: {manifestPath}")
+            return manifestPath
+
+        except Exception as e:
+            self.log(f"导出配准结果时出错: {str(e)}")
+            raise
+
+    def _loadExportMetadata(self, metadataPath):
+        """
+        读取上次导出的 metadata.json
+
+        :param metadataPath: metadata.json 路径
+        :return: 元数据字典,不存在或无法解析时返回 None
+        """
+        if not os.path.exists(metadataPath):
+            return None
+        try:
+            with open(metadataPath, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.log(f"⚠ 无法读取上次导出的元数据,将完整导出: {str(e)}")
+            return None
+
+    def _findUnchangedExport(self, previousMetadata, key, contentHash, geometryFingerprint,
+                             fileFormat, codec, compressionLevel, outputFolder):
+        """
+        检查上次导出中该体积是否可以直接复用
+
+        内容哈希、几何指纹、文件格式和压缩设置都一致,且导出的文件仍然存在时才复用
+
+        :return: 上次导出的体积元数据,不能复用时返回 None
+        """
+        if not previousMetadata:
+            return None
+        entry = previousMetadata.get("volumes", {}).get(key)
+        if not entry or "storage" not in entry:
+            return None
+        if entry.get("content_hash") != contentHash or entry.get("geometry_fingerprint") != geometryFingerprint:
+            return None
+        if previousMetadata.get("file_format") != fileFormat:
+            return None
+        if previousMetadata.get("compression", {}).get("codec") != codec \
+                or previousMetadata.get("compression", {}).get("level") != compressionLevel:
+            return None
+
+        storage = entry["storage"]
+        for fileName in (storage.get("file"), storage.get("data_file")):
+            if fileName and not os.path.exists(os.path.join(outputFolder, fileName)):
+                return None
+        return entry
+
+    def _computeGeometryFingerprint(self, volumeNode):
+        """
+        计算体积的几何指纹(维度、间距、原点、方向、标量类型)
+
+        :param volumeNode: 体积节点
+        :return: 十六进制指纹字符串
+        """
+        import hashlib
+        imageData = volumeNode.GetImageData()
+        directionMatrix = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASDirectionMatrix(directionMatrix)
+        geometry = {
+            "dimensions": list(imageData.GetDimensions()),
+            "spacing": [repr(v) for v in volumeNode.GetSpacing()],
+            "origin": [repr(v) for v in volumeNode.GetOrigin()],
+            "direction": [repr(directionMatrix.GetElement(i, j)) for i in range(3) for j in range(3)],
+            "scalar_type": imageData.GetScalarTypeAsString(),
+            "number_of_components": imageData.GetNumberOfScalarComponents()
+        }
+        return hashlib.sha1(json.dumps(geometry, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _exportVolume(self, volumeNode, outputFolder, baseName, fileFormat, taskExecutor, blockExecutor,
+                      blockWorkers, codec="gzip", compressionLevel=volume_io.DEFAULT_COMPRESSION_LEVEL):
         """
         导出单个体积,保留原始数据
+
+        先在主线程中用 Slicer 将未压缩文件写到临时目录,再把压缩提交到工作线程
         
         :param volumeNode: 体积节点
-        :param outputPath: 输出路径
+        :param outputFolder: 输出文件夹
+        :param baseName: 输出文件名(不含扩展名)
         :param fileFormat: 文件格式
+        :param taskExecutor: 执行压缩任务的线程池
+        :param blockExecutor: 并行压缩数据块的线程池
+        :param blockWorkers: blockExecutor 的线程数
+        :param codec: 压缩方式
+        :param compressionLevel: 压缩级别
+        :return: 压缩任务的 Future,结果为该文件的存储信息字典
         """
         try:
-            # 使用 Slicer 的保存功能,保留原始数据
-            properties = {}
-            if fileFormat == "nii.gz":
-                properties["useCompression"] = 1
-            
-            success = slicer.util.saveNode(volumeNode, outputPath, properties)
+            if fileFormat == "zarr":
+                # 数组和几何信息在主线程中复制为普通数据,工作线程不访问 VTK / MRML 对象
+                imageData = volumeNode.GetImageData()
+                ijkToRAS = vtk.vtkMatrix4x4()
+                volumeNode.GetIJKToRASMatrix(ijkToRAS)
+                snapshot = {
+                    "array": np.array(self._getVolumeArray(volumeNode), copy=True),
+                    "dimensions": imageData.GetDimensions(),
+                    "ijk_to_ras": [[ijkToRAS.GetElement(i, j) for j in range(4)] for i in range(4)],
+                    "scalar_type": imageData.GetScalarTypeAsString()
+                }
+                return taskExecutor.submit(self._writeZarrVolumeFile, snapshot, outputFolder, baseName,
+                                           blockExecutor, codec, compressionLevel)
+
+            extension = ".nii" if fileFormat == "nii.gz" else ".nrrd"
+            if codec in ("none", "archive"):
+                uncompressedPath = os.path.join(outputFolder, baseName + extension)
+            else:
+                # 未压缩的中间文件写到独立的临时目录,不会覆盖输出文件夹中的同名文件
+                import tempfile
+                uncompressedPath = os.path.join(tempfile.mkdtemp(prefix="tmj_export_"), baseName + extension)
+
+            # 使用 Slicer 的保存功能写出未压缩数据,保留原始数据
+            success = slicer.util.saveNode(volumeNode, uncompressedPath, {"useCompression": 0})
             
             if not success:
-                raise ValueError(f"保存体积失败: {outputPath}")
+                if codec not in ("none", "archive"):
+                    import shutil
+                    shutil.rmtree(os.path.dirname(uncompressedPath), ignore_errors=True)
+                raise ValueError(f"保存体积失败: {uncompressedPath}")
+
+            return taskExecutor.submit(self._compressVolumeFile, uncompressedPath, outputFolder, baseName,
+                                       fileFormat, blockExecutor, blockWorkers, codec, compressionLevel)
 
         except Exception as e:
             raise ValueError(f"导出体积时出错: {str(e)}")
 
-    def _extractVolumeMetadata(self, volumeNode):
+    def _writeZarrVolumeFile(self, snapshot, outputFolder, baseName, blockExecutor, codec, compressionLevel):
+        """
+        将体积写为分块格式 (zarr),分块在线程池中并行压缩
+
+        在工作线程中调用,只使用主线程中复制的数组和几何信息,不访问 VTK / MRML 对象
+
+        :param snapshot: 体积数据 {array, dimensions, ijk_to_ras, scalar_type}
+        :param outputFolder: 输出文件夹
+        :param baseName: 输出文件名(不含扩展名)
+        :param blockExecutor: 并行压缩分块的线程池
+        :param codec: 压缩方式 ('gzip', 'zstd', 'none')
+        :param compressionLevel: 压缩级别
+        :return: 存储信息字典 {file, codec, level, raw_bytes, stored_bytes, tile_shape}
+        """
+        import shutil
+        fileName = baseName + volume_io.ZARR_EXTENSION
+        zarrPath = os.path.join(outputFolder, fileName)
+        if os.path.isdir(zarrPath):
+            shutil.rmtree(zarrPath)
+
+        rawBytes, storedBytes = volume_io.writeZarrVolume(
+            snapshot["array"], snapshot["dimensions"], snapshot["ijk_to_ras"], zarrPath,
+            executor=blockExecutor, codec=codec, level=compressionLevel, scalarType=snapshot["scalar_type"])
+        return {"file": fileName, "codec": codec, "level": compressionLevel, "raw_bytes": rawBytes,
+                "stored_bytes": storedBytes, "tile_shape": list(volume_io.DEFAULT_TILE_SHAPE)}
+
+    def _compressVolumeFile(self, uncompressedPath, outputFolder, baseName, fileFormat, blockExecutor,
+                            blockWorkers, codec, compressionLevel):
+        """
+        将未压缩的体积文件压缩为最终格式(在工作线程中运行,不访问场景)
+
+        :param uncompressedPath: 未压缩文件路径
+        :param outputFolder: 输出文件夹
+        :param baseName: 输出文件名(不含扩展名)
+        :param fileFormat: 文件格式
+        :param blockExecutor: 并行压缩数据块的线程池
+        :param blockWorkers: blockExecutor 的线程数
+        :param codec: 压缩方式
+        :param compressionLevel: 压缩级别
+        :return: 存储信息字典 {file, codec, level, raw_bytes, stored_bytes}
+        """
+        if codec in ("none", "archive"):
+            size = os.path.getsize(uncompressedPath)
+            return {"file": os.path.basename(uncompressedPath), "codec": "none", "level": 0,
+                    "raw_bytes": size, "stored_bytes": size}
+
+        try:
+            info = {"codec": codec, "level": compressionLevel}
+            if fileFormat == "nii.gz":
+                if codec == "gzip":
+                    fileName = f"{baseName}.nii.gz"
+                    rawBytes, storedBytes = volume_io.parallelGzipFile(
+                        uncompressedPath, os.path.join(outputFolder, fileName), blockExecutor, blockWorkers,
+                        level=compressionLevel)
+                else:
+                    fileName = f"{baseName}.nii{volume_io.SIDECAR_EXTENSIONS[codec]}"
+                    rawBytes, storedBytes = volume_io.streamCompressFile(
+                        uncompressedPath, os.path.join(outputFolder, fileName), codec, compressionLevel)
+            else:
+                # NRRD 头保持明文,只压缩数据部分
+                headerLines, dataOffset = volume_io.readNrrdHeader(uncompressedPath)
+                if codec == "gzip":
+                    fileName = f"{baseName}.nrrd"
+                    headerBytes = volume_io.buildNrrdHeader(headerLines, {"encoding": "gzip"})
+                    rawBytes, storedBytes = volume_io.parallelGzipFile(
+                        uncompressedPath, os.path.join(outputFolder, fileName), blockExecutor, blockWorkers,
+                        level=compressionLevel, dataOffset=dataOffset, headerBytes=headerBytes)
+                else:
+                    # 分离式 NRRD: 明文头 (.nhdr) + 压缩数据旁车文件
+                    fileName = f"{baseName}.nhdr"
+                    dataFileName = f"{baseName}.raw{volume_io.SIDECAR_EXTENSIONS[codec]}"
+                    rawBytes, storedBytes = volume_io.streamCompressFile(
+                        uncompressedPath, os.path.join(outputFolder, dataFileName), codec, compressionLevel,
+                        dataOffset=dataOffset)
+                    headerBytes = volume_io.buildNrrdHeader(
+                        headerLines, {"encoding": "raw", "data file": dataFileName})
+                    with open(os.path.join(outputFolder, fileName), 'wb') as f:
+                        f.write(headerBytes)
+                    info["data_file"] = dataFileName
+
+            info.update({"file": fileName, "raw_bytes": rawBytes, "stored_bytes": storedBytes})
+            return info
+        finally:
+            # 删除中间文件所在的临时目录
+            import shutil
+            shutil.rmtree(os.path.dirname(uncompressedPath), ignore_errors=True)
+
+    def _writeVolumeArchive(self, outputFolder, archiveName, metadata, fileInfos, compressionLevel):
+        """
+        将导出的体积文件打包为 zip 压缩归档(包括增量导出中跳过的体积)
+
+        :param outputFolder: 输出文件夹
+        :param archiveName: 归档文件名
+        :param metadata: 本次导出的元数据(含已复用的体积)
+        :param fileInfos: 本次写出的各体积存储信息字典
+        :param compressionLevel: 压缩级别 (0-9)
+        """
+        import zipfile
+        storages = list(fileInfos.values()) + [entry["storage"] for entry in metadata["volumes"].values()]
+        archivePath = os.path.join(outputFolder, archiveName)
+        with zipfile.ZipFile(archivePath, 'w', compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=compressionLevel) as archive:
+            for storage in storages:
+                archive.write(os.path.join(outputFolder, storage["file"]), storage["file"])
+                storage["archive"] = archiveName
+
+    def _getVolumeArray(self, volumeNode):
+        """
+        获取体积标量数据的 numpy 视图(不复制数据)
+
+        :param volumeNode: 体积节点
+        :return: 一维 numpy 数组
+        """
+        import vtk.util.numpy_support as vtk_np
+        return vtk_np.vtk_to_numpy(volumeNode.GetImageData().GetPointData().GetScalars())
+
+    def _computeIntensityStatistics(self, imageArray):
+        """
+        计算强度统计信息(纯 numpy 计算,可在工作线程中调用)
+
+        :param imageArray: 体积数据数组
+        :return: 统计信息字典
+        """
+        return volume_io.computeIntensityStatistics(imageArray)
+
+    def _extractVolumeMetadata(self, volumeNode, stats=None):
         """
         提取体积的元数据
         
         :param volumeNode: 体积节点
+        :param stats: 已计算好的强度统计信息,为 None 时在此计算
         :return: 元数据字典
         """
         try:
@@ -278,30 +1426,24 @@ class DataManagerLogic:
                     row.append(directionMatrix.GetElement(i, j))
                 direction.append(row)
 
-            # 获取数组数据用于统计
-            import vtk.util.numpy_support as vtk_np
-            imageArray = vtk_np.vtk_to_numpy(imageData.GetPointData().GetScalars())
-            
             # 计算统计信息
-            stats = {
-                "min": float(np.min(imageArray)),
-                "max": float(np.max(imageArray)),
-                "mean": float(np.mean(imageArray)),
-                "std": float(np.std(imageArray)),
-                "median": float(np.median(imageArray))
-            }
+            if stats is None:
+                stats = self._computeIntensityStatistics(self._getVolumeArray(volumeNode))
 
-            # 检测数据类型 (CT通常是 HU 值,范围约 -1000 到 3000)
-            dataType = "MR"
-            if stats["min"] < -500 and stats["max"] > 1000:
-                dataType = "CT"
-                self.log(f"  检测到 CT 数据 (HU 值范围: {stats['min']:.1f} 到 {stats['max']:.1f})")
+            # 根据抽样体素在固定 HU 区间内的比例检测数据类型 (CT 具有空气和软组织)
+            modality = volume_io.classifyModality(self._getVolumeArray(volumeNode))
+            dataType = modality["data_type"]
+            if dataType == "CT":
+                self.log(f"  检测到 CT 数据 (置信度 {modality['confidence']:.2f}, "
+                         f"HU 值范围: {stats['min']:.1f} 到 {stats['max']:.1f})")
             else:
-                self.log(f"  检测到 MR 数据 (强度范围: {stats['min']:.1f} 到 {stats['max']:.1f})")
+                self.log(f"  检测到 MR 数据 (置信度 {modality['confidence']:.2f}, "
+                         f"强度范围: {stats['min']:.1f} 到 {stats['max']:.1f})")
 
             metadata = {
                 "name": volumeNode.GetName(),
                 "data_type": dataType,
+                "data_type_confidence": modality["confidence"],
                 "dimensions": list(dimensions),
                 "spacing": list(spacing),
                 "origin": list(origin),
@@ -309,6 +1451,8 @@ class DataManagerLogic:
                 "scalar_type": imageData.GetScalarTypeAsString(),
                 "number_of_components": imageData.GetNumberOfScalarComponents(),
                 "intensity_statistics": stats,
+                "original_scalar_type": volumeNode.GetAttribute(ORIGINAL_SCALAR_TYPE_ATTRIBUTE) or
+                                        imageData.GetScalarTypeAsString(),
                 "resampled": False,
                 "notes": f"Original {'HU' if dataType == 'CT' else 'intensity'} values preserved"
             }
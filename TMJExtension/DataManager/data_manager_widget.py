@@ -1,11 +1,14 @@
 """
 Data Manager Widget - 数据管理模块的UI界面
 """
+import os
 import qt
 import ctk
 import slicer
 from datetime import datetime
 from .data_manager_logic import DataManagerLogic
+from . import dicom_io
+from .memory_manager import VolumeMemoryManager, DEFAULT_BUDGET_MB
 
 
 class DataManagerWidget:
@@ -24,6 +27,11 @@ class DataManagerWidget:
         self.parent = parent
         self.logCallback = logCallback
         self.logic = DataManagerLogic(logCallback=logCallback)
+        self.memoryManager = VolumeMemoryManager(self.getMainFolderName, logCallback=logCallback)
+        self.reviewQueue = None
+        self.reviewFolderPrefix = None
+        # 最近一次索引的文件夹,搜索时只在其中查找
+        self.indexFolder = None
         
         # UI 组件引用
         self.fixedVolumeSelector = None
@@ -127,6 +135,19 @@ class DataManagerWidget:
         self.loadMovingButton.connect('clicked(bool)', self.onLoadMovingVolume)
         importButtonsLayout.addWidget(self.loadMovingButton)
         dataManagerFormLayout.addRow(importButtonsLayout)
+
+        # DICOM 文件夹导入按钮(并行解码,不经过 DICOM 数据库)
+        dicomButtonsLayout = qt.QHBoxLayout()
+        self.loadFixedDicomButton = qt.QPushButton("从 DICOM 文件夹加载 Fixed")
+        self.loadFixedDicomButton.toolTip = "索引 DICOM 文件夹并直接加载选择的序列为 Fixed Volume (CBCT)"
+        self.loadFixedDicomButton.connect('clicked(bool)', lambda: self.onLoadDicomVolume("fixed_volume"))
+        dicomButtonsLayout.addWidget(self.loadFixedDicomButton)
+
+        self.loadMovingDicomButton = qt.QPushButton("从 DICOM 文件夹加载 Moving")
+        self.loadMovingDicomButton.toolTip = "索引 DICOM 文件夹并直接加载选择的序列为 Moving Volume (整体MRI)"
+        self.loadMovingDicomButton.connect('clicked(bool)', lambda: self.onLoadDicomVolume("Moving_Volume"))
+        dicomButtonsLayout.addWidget(self.loadMovingDicomButton)
+        dataManagerFormLayout.addRow(dicomButtonsLayout)
         
         # ROI MRI导入按钮
         roiImportButtonsLayout1 = qt.QHBoxLayout()
@@ -153,6 +174,61 @@ class DataManagerWidget:
         roiImportButtonsLayout2.addWidget(self.loadLeftCorButton)
         dataManagerFormLayout.addRow(roiImportButtonsLayout2)
 
+        # 本地体积索引(无需加载即可浏览病例)
+        indexLabel = qt.QLabel("本地体积索引:")
+        indexLabel.setStyleSheet("font-weight: bold; margin-top: 2px;")
+        dataManagerFormLayout.addRow(indexLabel)
+
+        indexButtonsLayout = qt.QHBoxLayout()
+        self.indexFolderButton = qt.QPushButton("索引文件夹")
+        self.indexFolderButton.toolTip = "在后台读取文件夹中体积文件的几何信息和强度统计,不加载到场景"
+        self.indexFolderButton.connect('clicked(bool)', self.onIndexFolder)
+        indexButtonsLayout.addWidget(self.indexFolderButton)
+        self.indexSearchEdit = qt.QLineEdit()
+        self.indexSearchEdit.placeholderText = "搜索: 文件名 / CT / MRI / 维度..."
+        self.indexSearchEdit.connect('textChanged(QString)', lambda text: self.refreshIndexList())
+        indexButtonsLayout.addWidget(self.indexSearchEdit)
+        dataManagerFormLayout.addRow(indexButtonsLayout)
+
+        self.indexListWidget = qt.QListWidget()
+        self.indexListWidget.setMaximumHeight(150)
+        dataManagerFormLayout.addRow(self.indexListWidget)
+
+        indexLoadButtonsLayout = qt.QHBoxLayout()
+        self.indexLoadFixedButton = qt.QPushButton("加载为 Fixed")
+        self.indexLoadFixedButton.connect('clicked(bool)', lambda: self.onLoadIndexedVolume("fixed_volume"))
+        indexLoadButtonsLayout.addWidget(self.indexLoadFixedButton)
+        self.indexLoadMovingButton = qt.QPushButton("加载为 Moving")
+        self.indexLoadMovingButton.connect('clicked(bool)', lambda: self.onLoadIndexedVolume("Moving_Volume"))
+        indexLoadButtonsLayout.addWidget(self.indexLoadMovingButton)
+        dataManagerFormLayout.addRow(indexLoadButtonsLayout)
+
+        # 后台索引进行时定时刷新列表
+        self.indexRefreshTimer = qt.QTimer()
+        self.indexRefreshTimer.setInterval(1000)
+        self.indexRefreshTimer.connect('timeout()', self.onIndexRefreshTimer)
+
+        # 病例审阅队列(后台预取下一位患者)
+        reviewLabel = qt.QLabel("病例审阅队列:")
+        reviewLabel.setStyleSheet("font-weight: bold; margin-top: 2px;")
+        dataManagerFormLayout.addRow(reviewLabel)
+
+        reviewButtonsLayout = qt.QHBoxLayout()
+        self.openReviewQueueButton = qt.QPushButton("打开病例目录")
+        self.openReviewQueueButton.toolTip = "按患者子文件夹建立审阅队列,审阅当前患者时在后台解码下一位患者的体积"
+        self.openReviewQueueButton.connect('clicked(bool)', self.onOpenReviewQueue)
+        reviewButtonsLayout.addWidget(self.openReviewQueueButton)
+        self.nextPatientButton = qt.QPushButton("下一位患者")
+        self.nextPatientButton.toolTip = "释放当前患者的场景数据,加载下一位患者(优先使用已预取的数据)"
+        self.nextPatientButton.enabled = False
+        self.nextPatientButton.connect('clicked(bool)', self.onNextPatient)
+        reviewButtonsLayout.addWidget(self.nextPatientButton)
+        dataManagerFormLayout.addRow(reviewButtonsLayout)
+
+        self.reviewStatusLabel = qt.QLabel("未打开审阅队列")
+        self.reviewStatusLabel.setStyleSheet("color: gray;")
+        dataManagerFormLayout.addRow(self.reviewStatusLabel)
+
         # 配准流程总文件夹名称
         folderLabel = qt.QLabel("场景文件夹设置:")
         folderLabel.setStyleSheet("font-weight: bold; margin-top: 2px;")
@@ -169,6 +245,13 @@ class DataManagerWidget:
         self.moduleFolderNameEdit.setToolTip("Data Manager在总场景文件夹下的子文件夹名称")
         dataManagerFormLayout.addRow("Data Manager场景子文件夹: ", self.moduleFolderNameEdit)
 
+        # 无损降级存储类型
+        self.downcastCheckBox = qt.QCheckBox("无损降级存储类型")
+        self.downcastCheckBox.checked = False
+        self.downcastCheckBox.setToolTip("浮点型体积若全为整数值,则在副本中转换为 short 等更小的整数类型以节省内存,"
+                                         "原始类型记录在元数据中,可精确还原")
+        dataManagerFormLayout.addRow(self.downcastCheckBox)
+
         # 加载到场景按钮
         self.loadDataButton = qt.QPushButton("加载配准数据")
         self.loadDataButton.toolTip = "将选择的 Fixed 和 Moving Volume 组织到配准流程文件夹中"
@@ -176,6 +259,51 @@ class DataManagerWidget:
         self.loadDataButton.connect('clicked(bool)', self.onLoadData)
         dataManagerFormLayout.addRow(self.loadDataButton)
 
+        # 会话快照按钮
+        snapshotButtonsLayout = qt.QHBoxLayout()
+        self.saveSnapshotButton = qt.QPushButton("保存会话快照")
+        self.saveSnapshotButton.toolTip = "保存总文件夹的结构、变换、标注点和体积,相同体积数据只写一次"
+        self.saveSnapshotButton.connect('clicked(bool)', self.onSaveSnapshot)
+        snapshotButtonsLayout.addWidget(self.saveSnapshotButton)
+        self.restoreSnapshotButton = qt.QPushButton("恢复会话快照")
+        self.restoreSnapshotButton.toolTip = "从快照恢复配准流程文件夹,并关闭当前总文件夹"
+        self.restoreSnapshotButton.connect('clicked(bool)', self.onRestoreSnapshot)
+        snapshotButtonsLayout.addWidget(self.restoreSnapshotButton)
+        dataManagerFormLayout.addRow(snapshotButtonsLayout)
+
+        # 场景体积去重按钮
+        self.deduplicateButton = qt.QPushButton("场景体积去重")
+        self.deduplicateButton.toolTip = "合并总文件夹下各模块中内容和几何完全相同的体积,共享同一份图像数据以节省内存"
+        self.deduplicateButton.connect('clicked(bool)', self.onDeduplicateVolumes)
+        dataManagerFormLayout.addRow(self.deduplicateButton)
+
+        # 导出配准结果按钮
+        self.exportResultsButton = qt.QPushButton("导出配准结果 (不重采样)")
+        self.exportResultsButton.toolTip = ("导出总文件夹下各模块的体积、变换和标注点,体积保持原始网格,"
+                                            "变换另存为 .h5 文件,并写出 manifest.json 描述节点与变换的关系")
+        self.exportResultsButton.connect('clicked(bool)', self.onExportRegistrationResults)
+        dataManagerFormLayout.addRow(self.exportResultsButton)
+
+        # 内存预算
+        memoryLayout = qt.QHBoxLayout()
+        self.memoryBudgetSpinBox = qt.QSpinBox()
+        self.memoryBudgetSpinBox.setRange(256, 1024 * 1024)
+        self.memoryBudgetSpinBox.setSingleStep(512)
+        self.memoryBudgetSpinBox.setSuffix(" MB")
+        self.memoryBudgetSpinBox.value = DEFAULT_BUDGET_MB
+        self.memoryBudgetSpinBox.setToolTip("TMJ 模块体积的内存预算,超出时把掩膜、粗配准结果等可重新生成的体积换出到磁盘")
+        self.memoryBudgetSpinBox.connect('valueChanged(int)', self.onMemoryBudgetChanged)
+        memoryLayout.addWidget(self.memoryBudgetSpinBox)
+        self.memoryUsageLabel = qt.QLabel("")
+        memoryLayout.addWidget(self.memoryUsageLabel)
+        dataManagerFormLayout.addRow("内存预算: ", memoryLayout)
+
+        # 定时刷新内存占用显示
+        self.memoryUsageTimer = qt.QTimer()
+        self.memoryUsageTimer.setInterval(5000)
+        self.memoryUsageTimer.connect('timeout()', self.updateMemoryUsageLabel)
+        self.memoryUsageTimer.start()
+
         # 状态信息
         self.statusLabel = qt.QLabel("状态: 等待选择数据")
         self.statusLabel.setStyleSheet("color: gray;")
@@ -201,7 +329,7 @@ class DataManagerWidget:
                 None, 
                 "选择 Fixed Volume", 
                 "", 
-                "Medical Images (*.nrrd *.nii *.nii.gz *.dcm *.mha *.mhd);;All Files (*)"
+                "Medical Images (*.nrrd *.nhdr *.nii *.nii.gz *.nii.zst *.nii.lz4 *.dcm *.mha *.mhd *.zarray);;All Files (*)"
             )
             if filePath:
                 self.logCallback(f"正在加载 Fixed Volume: {filePath}")
@@ -221,7 +349,7 @@ class DataManagerWidget:
                 None, 
                 "选择 Moving Volume (整体MRI)", 
                 "", 
-                "Medical Images (*.nrrd *.nii *.nii.gz *.dcm *.mha *.mhd);;All Files (*)"
+                "Medical Images (*.nrrd *.nhdr *.nii *.nii.gz *.nii.zst *.nii.lz4 *.dcm *.mha *.mhd *.zarray);;All Files (*)"
             )
             if filePath:
                 self.logCallback(f"正在加载 Moving Volume: {filePath}")
@@ -234,6 +362,37 @@ class DataManagerWidget:
         except Exception as e:
             self.showError(f"加载 Moving Volume 失败: {str(e)}")
     
+    def onLoadDicomVolume(self, nodeName):
+        """
+        从 DICOM 文件夹加载序列
+
+        :param nodeName: 节点名称,"fixed_volume" 或 "Moving_Volume"
+        """
+        try:
+            folder = qt.QFileDialog.getExistingDirectory(None, "选择 DICOM 文件夹", "")
+            if not folder:
+                return
+            seriesList = self.logic.indexDicomFolder(folder)
+            if not seriesList:
+                raise ValueError("文件夹中没有找到可加载的 DICOM 图像序列")
+
+            series = seriesList[0]
+            if len(seriesList) > 1:
+                descriptions = [dicom_io.describeSeries(s) for s in seriesList]
+                choice = qt.QInputDialog.getItem(None, "选择 DICOM 序列", "序列:", descriptions, 0, False)
+                if not choice:
+                    return
+                series = seriesList[descriptions.index(choice)]
+
+            volumeNode = self.logic.loadDicomSeries(series, nodeName)
+            selector = self.fixedVolumeSelector if nodeName == "fixed_volume" else self.movingVolumeSelector
+            selector.setCurrentNode(volumeNode)
+            self.logCallback(f"✓ DICOM 序列加载成功: {volumeNode.GetName()}")
+            self.statusLabel.text = f"状态: {'Fixed' if nodeName == 'fixed_volume' else 'Moving'} Volume 已加载"
+            self.statusLabel.setStyleSheet("color: green;")
+        except Exception as e:
+            self.showError(f"加载 DICOM 序列失败: {str(e)}")
+
     def onLoadROIVolume(self, internalName, displayName):
         """加载 ROI Volume"""
         try:
@@ -241,7 +400,7 @@ class DataManagerWidget:
                 None, 
                 f"选择{displayName}位高分辨率MRI", 
                 "", 
-                "Medical Images (*.nrrd *.nii *.nii.gz *.dcm *.mha *.mhd);;All Files (*)"
+                "Medical Images (*.nrrd *.nhdr *.nii *.nii.gz *.nii.zst *.nii.lz4 *.dcm *.mha *.mhd *.zarray);;All Files (*)"
             )
             if filePath:
                 self.logCallback(f"正在加载{displayName}位MRI: {filePath}")
@@ -254,6 +413,73 @@ class DataManagerWidget:
         except Exception as e:
             self.showError(f"加载{displayName}位MRI失败: {str(e)}")
 
+    def onIndexFolder(self):
+        """选择文件夹并在后台建立体积索引"""
+        try:
+            folder = qt.QFileDialog.getExistingDirectory(None, "选择要索引的病例文件夹", "")
+            if not folder:
+                return
+            self.indexFolder = folder
+            self.logic.indexFolder(folder)
+            self.refreshIndexList()
+            self.indexRefreshTimer.start()
+            self.statusLabel.text = "状态: 正在后台索引..."
+            self.statusLabel.setStyleSheet("color: orange;")
+        except Exception as e:
+            self.showError(f"索引文件夹失败: {str(e)}")
+
+    def onIndexRefreshTimer(self):
+        """后台索引进行时刷新列表和状态"""
+        volumeIndex = self.logic.getVolumeIndex()
+        self.refreshIndexList()
+        if volumeIndex.isIndexing():
+            self.statusLabel.text = f"状态: 正在后台索引 ({volumeIndex.indexedCount}/{volumeIndex.pendingCount})"
+            return
+
+        self.indexRefreshTimer.stop()
+        for filePath, error in volumeIndex.errors:
+            self.logCallback(f"⚠ 无法索引 {filePath}: {error}")
+        self.logCallback(f"✓ 索引完成: {volumeIndex.indexedCount} 个文件已更新, {len(volumeIndex.errors)} 个失败")
+        self.statusLabel.text = "状态: 索引完成"
+        self.statusLabel.setStyleSheet("color: green;")
+
+    def refreshIndexList(self):
+        """按搜索关键字刷新索引列表"""
+        volumeIndex = self.logic.getVolumeIndex()
+        currentPath = None
+        currentItem = self.indexListWidget.currentItem()
+        if currentItem:
+            currentPath = currentItem.data(qt.Qt.UserRole)
+
+        self.indexListWidget.clear()
+        for entry in volumeIndex.search(self.indexSearchEdit.text, self.indexFolder):
+            item = qt.QListWidgetItem(volumeIndex.describe(entry))
+            item.setData(qt.Qt.UserRole, entry["path"])
+            item.setToolTip(entry["path"])
+            self.indexListWidget.addItem(item)
+            if entry["path"] == currentPath:
+                self.indexListWidget.setCurrentItem(item)
+
+    def onLoadIndexedVolume(self, nodeName):
+        """
+        将索引列表中选中的体积加载到场景
+
+        :param nodeName: 节点名称,"fixed_volume" 或 "Moving_Volume"
+        """
+        try:
+            item = self.indexListWidget.currentItem()
+            if not item:
+                raise ValueError("请先在索引列表中选择一个体积")
+            filePath = item.data(qt.Qt.UserRole)
+            self.logCallback(f"正在加载: {filePath}")
+            volumeNode = self.logic.loadVolume(filePath, nodeName)
+            if volumeNode:
+                selector = self.fixedVolumeSelector if nodeName == "fixed_volume" else self.movingVolumeSelector
+                selector.setCurrentNode(volumeNode)
+                self.logCallback(f"✓ 加载成功: {volumeNode.GetName()}")
+        except Exception as e:
+            self.showError(f"加载索引体积失败: {str(e)}")
+
     def onLoadData(self):
         """加载配准数据到场景文件夹"""
         try:
@@ -292,7 +518,8 @@ class DataManagerWidget:
             
             # 调用 Logic 加载数据到场景
             success = self.logic.loadDataToScene(
-                fixedNode, movingNode, mainFolderName, moduleFolderName, roiVolumes
+                fixedNode, movingNode, mainFolderName, moduleFolderName, roiVolumes,
+                downcast=self.downcastCheckBox.checked
             )
             
             if success:
@@ -310,6 +537,109 @@ class DataManagerWidget:
         except Exception as e:
             self.showError(f"加载配准数据失败: {str(e)}")
     
+    def onSaveSnapshot(self):
+        """保存当前总文件夹的会话快照"""
+        try:
+            sessionPath = self.logic.saveSessionSnapshot(self.getMainFolderName())
+            self.statusLabel.text = f"状态: 快照已保存 {os.path.basename(sessionPath)}"
+            self.statusLabel.setStyleSheet("color: green;")
+        except Exception as e:
+            self.showError(f"保存会话快照失败: {str(e)}")
+
+    def onRestoreSnapshot(self):
+        """选择快照并恢复,关闭当前总文件夹"""
+        try:
+            sessionDir = self.logic.getSnapshotStore().sessionDir
+            sessionPath = qt.QFileDialog.getOpenFileName(None, "选择会话快照", sessionDir, "TMJ Snapshot (*.json)")
+            if not sessionPath:
+                return
+            mainFolderName = self.logic.restoreSessionSnapshot(sessionPath, closeFolderName=self.getMainFolderName())
+            self.mainFolderNameEdit.text = mainFolderName
+            self.statusLabel.text = f"状态: 已恢复会话 {mainFolderName}"
+            self.statusLabel.setStyleSheet("color: green;")
+        except Exception as e:
+            self.showError(f"恢复会话快照失败: {str(e)}")
+
+    def onDeduplicateVolumes(self):
+        """合并场景中相同的体积"""
+        try:
+            mainFolderName = self.getMainFolderName()
+            self.logCallback(f"正在对 {mainFolderName} 中的体积去重...")
+            mergedCount, reclaimedBytes = self.logic.deduplicateSceneVolumes(mainFolderName)
+            self.statusLabel.text = f"状态: 去重完成,回收 {reclaimedBytes / (1024 * 1024):.1f} MB"
+            self.statusLabel.setStyleSheet("color: green;")
+        except Exception as e:
+            self.showError(f"场景体积去重失败: {str(e)}")
+
+    def onExportRegistrationResults(self):
+        """选择输出目录并导出配准结果"""
+        try:
+            outputDir = qt.QFileDialog.getExistingDirectory(None, "选择配准结果输出目录", "")
+            if not outputDir:
+                return
+            manifestPath = self.logic.exportRegistrationResults(self.getMainFolderName(), outputDir)
+            self.statusLabel.text = f"状态: 配准结果已导出到 {os.path.dirname(manifestPath)}"
+            self.statusLabel.setStyleSheet("color: green;")
+        except Exception as e:
+            self.showError(f"导出配准结果失败: {str(e)}")
+
+    def onOpenReviewQueue(self):
+        """选择病例目录,建立审阅队列并加载第一位患者"""
+        try:
+            cohortDir = qt.QFileDialog.getExistingDirectory(None, "选择病例目录 (每位患者一个子文件夹)", "")
+            if not cohortDir:
+                return
+            if self.reviewQueue:
+                self.reviewQueue.shutdown()
+            self.reviewQueue = self.logic.openReviewQueue(cohortDir)
+            self.reviewFolderPrefix = self.getMainFolderName()
+            self.onNextPatient()
+        except Exception as e:
+            self.showError(f"打开审阅队列失败: {str(e)}")
+
+    def onNextPatient(self):
+        """切换到审阅队列中的下一位患者"""
+        try:
+            if not self.reviewQueue or not self.reviewQueue.hasNext():
+                return
+            patientInfo, patientFolderName = self.logic.reviewNextPatient(
+                self.reviewQueue, self.reviewFolderPrefix, self.moduleFolderNameEdit.text,
+                downcast=self.downcastCheckBox.checked)
+            # 其他模块通过总文件夹名称找到当前患者的数据
+            self.mainFolderNameEdit.text = patientFolderName
+            self.nextPatientButton.enabled = self.reviewQueue.hasNext()
+            self.reviewStatusLabel.text = (f"患者 {patientInfo['patient_id']} "
+                                           f"({self.reviewQueue.currentIndex + 1}/{len(self.reviewQueue)})")
+            self.reviewStatusLabel.setStyleSheet("color: green;")
+        except Exception as e:
+            self.nextPatientButton.enabled = self.reviewQueue is not None and self.reviewQueue.hasNext()
+            self.showError(f"加载下一位患者失败: {str(e)}")
+
+    def onMemoryBudgetChanged(self, budgetMB):
+        """内存预算变化时立即检查"""
+        try:
+            self.memoryManager.setBudget(budgetMB)
+            self.updateMemoryUsageLabel()
+        except Exception as e:
+            self.showError(f"内存预算检查失败: {str(e)}")
+
+    def updateMemoryUsageLabel(self):
+        """刷新内存占用显示"""
+        totalBytes, evictedCount, entries = self.memoryManager.usage()
+        text = f"已用 {totalBytes / (1024 * 1024):.0f} MB"
+        if evictedCount:
+            text += f", {evictedCount} 个体积已换出"
+        self.memoryUsageLabel.text = text
+        self.memoryUsageLabel.setStyleSheet(
+            "color: red;" if totalBytes > self.memoryManager.budgetBytes else "color: gray;")
+
+    def cleanup(self):
+        """清理资源"""
+        self.memoryUsageTimer.stop()
+        self.memoryManager.cleanup()
+        if self.reviewQueue:
+            self.reviewQueue.shutdown()
+
     def _getDisplayName(self, internalName):
         """将内部名称转换为显示名称"""
         nameMap = {
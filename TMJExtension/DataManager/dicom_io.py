@@ -0,0 +1,221 @@
+"""
+DICOM IO - DICOM 序列的索引与并行解码
+只使用 pydicom 和 numpy,不访问 MRML 场景,可以安全地在工作线程中调用
+"""
+import os
+
+
+# 索引时读取的标签(只读文件头,不读取像素数据)
+_INDEX_TAGS = [
+    "SeriesInstanceUID", "StudyInstanceUID", "PatientID", "PatientName", "Modality", "SeriesDescription",
+    "SeriesNumber", "StudyDate", "InstanceNumber", "ImagePositionPatient", "ImageOrientationPatient",
+    "PixelSpacing", "SliceThickness", "Rows", "Columns", "NumberOfFrames", "RescaleSlope", "RescaleIntercept",
+    "BitsStored", "PixelRepresentation", "SamplesPerPixel"
+]
+
+
+def _importPydicom():
+    """
+    导入 pydicom 模块 (3D Slicer 自带)
+
+    :return: pydicom 模块
+    """
+    try:
+        import pydicom
+        return pydicom
+    except ImportError:
+        raise ValueError("DICOM 导入需要 pydicom 模块,请在 Python 控制台运行: slicer.util.pip_install('pydicom')")
+
+
+def readDicomHeader(filePath):
+    """
+    只读取 DICOM 文件头中索引需要的标签
+
+    :param filePath: 文件路径
+    :return: 头信息字典;不是 DICOM 图像文件时返回 None
+    """
+    pydicom = _importPydicom()
+    from pydicom.errors import InvalidDicomError
+    try:
+        ds = pydicom.dcmread(filePath, stop_before_pixels=True, specific_tags=_INDEX_TAGS)
+    except (InvalidDicomError, OSError, ValueError, EOFError):
+        return None
+    if "SeriesInstanceUID" not in ds or "ImagePositionPatient" not in ds or "ImageOrientationPatient" not in ds:
+        return None
+    if int(ds.get("NumberOfFrames", 1) or 1) > 1 or int(ds.get("SamplesPerPixel", 1)) != 1:
+        # 多帧 (Enhanced) 和彩色图像交给 Slicer 的 DICOM 模块处理
+        return None
+
+    return {
+        "path": filePath,
+        "series_uid": str(ds.SeriesInstanceUID),
+        "study_uid": str(ds.get("StudyInstanceUID", "")),
+        "patient_id": str(ds.get("PatientID", "")),
+        "patient_name": str(ds.get("PatientName", "")),
+        "modality": str(ds.get("Modality", "")),
+        "description": str(ds.get("SeriesDescription", "")),
+        "series_number": int(ds.get("SeriesNumber", 0) or 0),
+        "study_date": str(ds.get("StudyDate", "")),
+        "instance_number": int(ds.get("InstanceNumber", 0) or 0),
+        "position": [float(v) for v in ds.ImagePositionPatient],
+        "orientation": [float(v) for v in ds.ImageOrientationPatient],
+        "pixel_spacing": [float(v) for v in ds.get("PixelSpacing", [1.0, 1.0])],
+        "slice_thickness": float(ds.get("SliceThickness", 0) or 0),
+        "rows": int(ds.Rows),
+        "columns": int(ds.Columns),
+        "rescale_slope": float(ds.get("RescaleSlope", 1) or 1),
+        "rescale_intercept": float(ds.get("RescaleIntercept", 0) or 0),
+        "bits_stored": int(ds.get("BitsStored", 16)),
+        "pixel_representation": int(ds.get("PixelRepresentation", 0))
+    }
+
+
+def indexDicomFolder(folder, executor=None):
+    """
+    递归扫描文件夹,按 SeriesInstanceUID 对 DICOM 图像分组(只读取文件头)
+
+    :param folder: DICOM 文件夹
+    :param executor: 并行读取文件头的线程池,为 None 时顺序执行
+    :return: 序列信息列表(按患者、序列号排序),每项含 series_uid、modality、description、slices 等
+    """
+    filePaths = []
+    for root, dirs, files in os.walk(folder):
+        for fileName in files:
+            filePaths.append(os.path.join(root, fileName))
+
+    headers = executor.map(readDicomHeader, filePaths) if executor else map(readDicomHeader, filePaths)
+
+    seriesByUID = {}
+    for header in headers:
+        if header is None:
+            continue
+        series = seriesByUID.get(header["series_uid"])
+        if series is None:
+            series = {key: header[key] for key in ("series_uid", "study_uid", "patient_id", "patient_name",
+                                                     "modality", "description", "series_number", "study_date",
+                                                     "rows", "columns")}
+            series["slices"] = []
+            seriesByUID[header["series_uid"]] = series
+        series["slices"].append(header)
+
+    for series in seriesByUID.values():
+        series["slice_count"] = len(series["slices"])
+    return sorted(seriesByUID.values(), key=lambda s: (s["patient_id"], s["study_date"], s["series_number"]))
+
+
+def describeSeries(series):
+    """
+    生成序列的单行摘要,用于列表显示
+
+    :param series: indexDicomFolder 返回的序列信息
+    :return: 摘要文本
+    """
+    return (f"{series['patient_id']} | #{series['series_number']} {series['modality']} "
+            f"{series['description']} | {series['columns']}x{series['rows']}x{series['slice_count']}")
+
+
+def _sortSlices(slices):
+    """
+    按切片位置在法向量上的投影排序
+
+    :param slices: 切片头信息列表
+    :return: (排序后的切片列表, 行方向, 列方向, 法向量)
+    """
+    import numpy as np
+    orientation = np.array(slices[0]["orientation"])
+    rowDirection, columnDirection = orientation[:3], orientation[3:]
+    normal = np.cross(rowDirection, columnDirection)
+    for header in slices:
+        if not np.allclose(header["orientation"], orientation, atol=1e-4):
+            raise ValueError("序列中的切片方向不一致,请使用 Slicer 的 DICOM 模块导入")
+        if (header["rows"], header["columns"]) != (slices[0]["rows"], slices[0]["columns"]):
+            raise ValueError("序列中的切片尺寸不一致,请使用 Slicer 的 DICOM 模块导入")
+    ordered = sorted(slices, key=lambda header: float(np.dot(header["position"], normal)))
+    return ordered, rowDirection, columnDirection, normal
+
+
+def _outputDtype(slices):
+    """
+    根据 BitsStored、PixelRepresentation 和 Rescale 参数选择能无损保存 HU 值的数据类型
+
+    :param slices: 切片头信息列表
+    :return: numpy 数据类型
+    """
+    import numpy as np
+    low, high = None, None
+    for header in slices:
+        slope, intercept = header["rescale_slope"], header["rescale_intercept"]
+        if not (float(slope).is_integer() and float(intercept).is_integer()):
+            return np.dtype(np.float32)
+        bits = header["bits_stored"]
+        if header["pixel_representation"]:
+            rawRange = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1)
+        else:
+            rawRange = (0, (1 << bits) - 1)
+        values = sorted(v * slope + intercept for v in rawRange)
+        low = values[0] if low is None else min(low, values[0])
+        high = values[1] if high is None else max(high, values[1])
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.float32)
+
+
+def assembleSeries(series, executor=None):
+    """
+    解码序列的所有切片并组装为体积数组
+
+    切片在线程池中并行解码,直接写入预先分配的体积数组,并应用 RescaleSlope/RescaleIntercept (CT 为 HU 值)
+
+    :param series: indexDicomFolder 返回的序列信息
+    :param executor: 并行解码切片的线程池,为 None 时顺序执行
+    :return: ([k, j, i] 形状的 numpy 数组, 4x4 IJK 到 RAS 矩阵, 警告信息列表)
+    """
+    import numpy as np
+    pydicom = _importPydicom()
+    slices, rowDirection, columnDirection, normal = _sortSlices(series["slices"])
+    rows, columns = slices[0]["rows"], slices[0]["columns"]
+    dtype = _outputDtype(slices)
+    volume = np.empty((len(slices), rows, columns), dtype=dtype)
+
+    def decodeSlice(index):
+        header = slices[index]
+        ds = pydicom.dcmread(header["path"])
+        pixels = ds.pixel_array
+        slope, intercept = header["rescale_slope"], header["rescale_intercept"]
+        if dtype.kind == 'f':
+            volume[index] = pixels.astype(np.float32) * np.float32(slope) + np.float32(intercept)
+        elif (slope, intercept) == (1.0, 0.0):
+            volume[index] = pixels
+        else:
+            volume[index] = pixels.astype(np.int32) * int(slope) + int(intercept)
+
+    indices = range(len(slices))
+    list(executor.map(decodeSlice, indices) if executor else map(decodeSlice, indices))
+
+    # 几何信息 (DICOM 为 LPS 坐标): 像素列方向为 i,行方向为 j,切片顺序为 k
+    warnings = []
+    positions = np.array([header["position"] for header in slices])
+    rowSpacing, columnSpacing = slices[0]["pixel_spacing"]
+    if len(slices) > 1:
+        distances = positions @ normal
+        gaps = np.diff(distances)
+        if gaps.min() <= 0:
+            raise ValueError("序列中存在重复位置的切片")
+        if gaps.max() - gaps.min() > 0.01 * gaps.mean():
+            warnings.append(f"切片间距不均匀 ({gaps.min():.3f} - {gaps.max():.3f} mm),使用平均间距")
+        offsets = positions[-1] - positions[0]
+        if np.linalg.norm(np.cross(offsets / np.linalg.norm(offsets), normal)) > 1e-3:
+            warnings.append("检测到机架倾斜,切片按法向量方向排列,未做倾斜校正")
+        sliceAxis = normal * gaps.mean()
+    else:
+        sliceAxis = normal * (slices[0]["slice_thickness"] or 1.0)
+
+    ijkToLPS = np.eye(4)
+    ijkToLPS[:3, 0] = rowDirection * columnSpacing
+    ijkToLPS[:3, 1] = columnDirection * rowSpacing
+    ijkToLPS[:3, 2] = sliceAxis
+    ijkToLPS[:3, 3] = positions[0]
+    ijkToRAS = np.diag([-1.0, -1.0, 1.0, 1.0]) @ ijkToLPS
+    return volume, ijkToRAS.tolist(), warnings
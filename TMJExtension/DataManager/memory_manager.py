@@ -0,0 +1,327 @@
+"""
+Memory Manager - TMJ 模块体积的内存预算管理
+统计各模块创建的体积占用的内存,超出预算时按最近最少使用顺序把可重新生成的派生体积换出到磁盘
+"""
+import os
+import time
+import logging
+import vtk
+import qt
+import slicer
+from .data_manager_logic import SHARED_IMAGE_DATA_ATTRIBUTE
+
+
+# 标记可重新生成的派生体积(掩膜、粗配准结果、重采样副本等)的节点属性名
+REGENERABLE_ATTRIBUTE = "TMJ.Regenerable"
+
+# 记录已换出体积的磁盘文件路径的节点属性名
+EVICTED_PATH_ATTRIBUTE = "TMJ.EvictedPath"
+
+# 默认内存预算 (MB)
+DEFAULT_BUDGET_MB = 4096
+
+
+def markRegenerable(volumeNode):
+    """
+    将体积标记为可重新生成的派生体积,内存超出预算时允许换出到磁盘
+
+    :param volumeNode: 体积节点
+    """
+    volumeNode.SetAttribute(REGENERABLE_ATTRIBUTE, "1")
+
+
+def reloadEvictedVolume(volumeNode):
+    """
+    若体积已被换出到磁盘,则重新加载其图像数据
+
+    :param volumeNode: 体积节点
+    :return: 是否进行了重新加载
+    """
+    import numpy as np
+    import vtk.util.numpy_support as vtk_np
+    filePath = volumeNode.GetAttribute(EVICTED_PATH_ATTRIBUTE)
+    if not filePath:
+        return False
+    with np.load(filePath) as cached:
+        data = cached["data"]
+        dimensions = [int(v) for v in cached["dimensions"]]
+        name = str(cached["name"])
+
+    scalars = vtk_np.numpy_to_vtk(data, deep=True)
+    scalars.SetName(name)
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(dimensions)
+    imageData.GetPointData().SetScalars(scalars)
+    volumeNode.SetAndObserveImageData(imageData)
+    volumeNode.RemoveAttribute(EVICTED_PATH_ATTRIBUTE)
+    os.remove(filePath)
+    return True
+
+
+class VolumeMemoryManager:
+    """
+    体积内存预算管理
+
+    统计配准流程文件夹(及其 "_<患者ID>" 批量导入文件夹)中的体积和所有标记为可重新生成的体积。
+    总内存超出预算时,按最近最少使用顺序将可重新生成、未在视图中显示、未与其他节点共享数据的体积
+    写入缓存目录并释放图像数据;节点本身(名称、几何、变换、文件夹位置)保持不变。
+    换出的体积在视图中显示或在 TMJ 模块的选择框中被选中时自动重新加载
+    """
+
+    def __init__(self, getMainFolderNameCallback, logCallback=None, budgetMB=DEFAULT_BUDGET_MB, cacheDir=None):
+        """
+        初始化内存管理器
+
+        :param getMainFolderNameCallback: 获取配准流程总文件夹名称的回调函数
+        :param logCallback: 日志回调函数
+        :param budgetMB: 内存预算 (MB)
+        :param cacheDir: 换出文件的缓存目录,默认在 Slicer 临时目录下
+        """
+        self.getMainFolderNameCallback = getMainFolderNameCallback
+        self.logCallback = logCallback
+        self.budgetBytes = int(budgetMB * 1024 * 1024)
+        self.cacheDir = cacheDir or os.path.join(slicer.app.temporaryPath, "TMJExtension", "evicted")
+        self.lastAccess = {}
+        self.enforcePending = False
+        self.observations = []
+        self.sliceCompositeObservations = []
+
+        self._addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAddedEvent, self.onNodeAdded)
+        self._addObserver(slicer.mrmlScene, slicer.mrmlScene.NodeAboutToBeRemovedEvent, self.onNodeAboutToBeRemoved)
+        self._addObserver(slicer.mrmlScene, slicer.mrmlScene.EndCloseEvent, self.onSceneClosed)
+        self._observeSliceCompositeNodes()
+
+    def log(self, message):
+        """日志输出"""
+        logging.info(message)
+        if self.logCallback:
+            self.logCallback(message)
+
+    def _addObserver(self, obj, event, callback, observations=None):
+        """添加 VTK 观察者并记录,以便 cleanup 时移除"""
+        tag = obj.AddObserver(event, callback)
+        (self.observations if observations is None else observations).append((obj, tag))
+
+    def _observeSliceCompositeNodes(self):
+        """观察所有切片视图,换出的体积被显示时自动重新加载"""
+        for obj, tag in self.sliceCompositeObservations:
+            obj.RemoveObserver(tag)
+        self.sliceCompositeObservations = []
+        for compositeNode in slicer.util.getNodesByClass("vtkMRMLSliceCompositeNode"):
+            self._addObserver(compositeNode, vtk.vtkCommand.ModifiedEvent, self.onSliceCompositeModified,
+                              self.sliceCompositeObservations)
+
+    def cleanup(self):
+        """移除所有观察者并删除缓存文件"""
+        for obj, tag in self.observations + self.sliceCompositeObservations:
+            obj.RemoveObserver(tag)
+        self.observations = []
+        self.sliceCompositeObservations = []
+        self._clearCache()
+
+    def setBudget(self, budgetMB):
+        """
+        设置内存预算并立即检查
+
+        :param budgetMB: 内存预算 (MB)
+        """
+        self.budgetBytes = int(budgetMB * 1024 * 1024)
+        self.enforceBudget()
+
+    # ========== 统计 ==========
+
+    def trackedVolumes(self):
+        """
+        获取受管理的体积节点
+
+        :return: 体积节点列表
+        """
+        shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+        mainFolderName = self.getMainFolderNameCallback()
+        nodes = {}
+
+        topLevelIDs = vtk.vtkIdList()
+        shNode.GetItemChildren(shNode.GetSceneItemID(), topLevelIDs, False)
+        for i in range(topLevelIDs.GetNumberOfIds()):
+            folderItemID = topLevelIDs.GetId(i)
+            folderName = shNode.GetItemName(folderItemID)
+            if folderName != mainFolderName and not folderName.startswith(mainFolderName + "_"):
+                continue
+            childIDs = vtk.vtkIdList()
+            shNode.GetItemChildren(folderItemID, childIDs, True)
+            for j in range(childIDs.GetNumberOfIds()):
+                node = shNode.GetItemDataNode(childIDs.GetId(j))
+                if node and node.IsA("vtkMRMLScalarVolumeNode"):
+                    nodes[node.GetID()] = node
+
+        for node in slicer.util.getNodesByClass("vtkMRMLScalarVolumeNode"):
+            if node.GetAttribute(REGENERABLE_ATTRIBUTE):
+                nodes[node.GetID()] = node
+        return list(nodes.values())
+
+    def nodeBytes(self, volumeNode):
+        """
+        体积图像数据占用的内存字节数
+
+        :param volumeNode: 体积节点
+        :return: 字节数,已换出时为 0
+        """
+        imageData = volumeNode.GetImageData()
+        if imageData is None:
+            return 0
+        return imageData.GetActualMemorySize() * 1024
+
+    def usage(self):
+        """
+        统计受管理体积的内存占用(共享的图像数据只计一次)
+
+        :return: (总字节数, 已换出体积数, [(节点, 字节数)])
+        """
+        seen = set()
+        total = 0
+        evictedCount = 0
+        entries = []
+        for node in self.trackedVolumes():
+            if node.GetAttribute(EVICTED_PATH_ATTRIBUTE):
+                evictedCount += 1
+                continue
+            imageData = node.GetImageData()
+            if imageData is None:
+                continue
+            address = imageData.GetAddressAsString("vtkImageData")
+            nodeBytes = 0 if address in seen else self.nodeBytes(node)
+            seen.add(address)
+            total += nodeBytes
+            entries.append((node, nodeBytes))
+        return total, evictedCount, entries
+
+    # ========== 预算控制 ==========
+
+    def touch(self, volumeNode):
+        """
+        记录体积被使用;已换出的体积会重新加载
+
+        :param volumeNode: 体积节点
+        """
+        if not volumeNode or not volumeNode.IsA("vtkMRMLScalarVolumeNode"):
+            return
+        self.lastAccess[volumeNode.GetID()] = time.monotonic()
+        if volumeNode.GetAttribute(EVICTED_PATH_ATTRIBUTE):
+            self.reload(volumeNode)
+            self.enforceBudget(protectedNodes=[volumeNode])
+
+    def enforceBudget(self, protectedNodes=()):
+        """
+        检查内存预算,超出时按最近最少使用顺序换出可重新生成的体积
+
+        :param protectedNodes: 本次不允许换出的节点
+        :return: 释放的字节数
+        """
+        total, evictedCount, entries = self.usage()
+        if total <= self.budgetBytes:
+            return 0
+
+        protectedIDs = {node.GetID() for node in protectedNodes} | self._displayedVolumeIDs()
+        candidates = [(node, nodeBytes) for node, nodeBytes in entries
+                      if nodeBytes > 0
+                      and node.GetAttribute(REGENERABLE_ATTRIBUTE)
+                      and not node.GetAttribute(SHARED_IMAGE_DATA_ATTRIBUTE)
+                      and node.GetID() not in protectedIDs]
+        candidates.sort(key=lambda item: self.lastAccess.get(item[0].GetID(), 0.0))
+
+        freedBytes = 0
+        for node, nodeBytes in candidates:
+            if total - freedBytes <= self.budgetBytes:
+                break
+            self.evict(node)
+            freedBytes += nodeBytes
+
+        if total - freedBytes > self.budgetBytes:
+            self.log(f"⚠ 内存占用 {(total - freedBytes) / (1024 * 1024):.0f} MB 仍超出预算 "
+                     f"{self.budgetBytes / (1024 * 1024):.0f} MB,没有更多可换出的派生体积")
+        return freedBytes
+
+    def _displayedVolumeIDs(self):
+        """当前在切片视图中显示的体积 ID"""
+        volumeIDs = set()
+        for compositeNode in slicer.util.getNodesByClass("vtkMRMLSliceCompositeNode"):
+            for volumeID in (compositeNode.GetBackgroundVolumeID(), compositeNode.GetForegroundVolumeID(),
+                             compositeNode.GetLabelVolumeID()):
+                if volumeID:
+                    volumeIDs.add(volumeID)
+        return volumeIDs
+
+    def evict(self, volumeNode):
+        """
+        将体积的图像数据写入缓存目录并从内存中释放
+
+        :param volumeNode: 体积节点
+        """
+        import numpy as np
+        import vtk.util.numpy_support as vtk_np
+        imageData = volumeNode.GetImageData()
+        scalars = imageData.GetPointData().GetScalars()
+        os.makedirs(self.cacheDir, exist_ok=True)
+        filePath = os.path.join(self.cacheDir, f"{volumeNode.GetID()}.npz")
+        np.savez(filePath, data=vtk_np.vtk_to_numpy(scalars), dimensions=np.array(imageData.GetDimensions()),
+                 name=np.array(scalars.GetName() or "ImageScalars"))
+
+        nodeBytes = self.nodeBytes(volumeNode)
+        volumeNode.SetAttribute(EVICTED_PATH_ATTRIBUTE, filePath)
+        volumeNode.SetAndObserveImageData(None)
+        self.log(f"  内存预算: 已换出 {volumeNode.GetName()} ({nodeBytes / (1024 * 1024):.1f} MB)")
+
+    def reload(self, volumeNode):
+        """
+        从缓存目录重新加载已换出的体积
+
+        :param volumeNode: 体积节点
+        """
+        reloadEvictedVolume(volumeNode)
+        self.log(f"  内存预算: 已重新加载 {volumeNode.GetName()}")
+
+    def _clearCache(self):
+        """删除缓存目录中的换出文件"""
+        if not os.path.isdir(self.cacheDir):
+            return
+        for fileName in os.listdir(self.cacheDir):
+            if fileName.endswith(".npz"):
+                try:
+                    os.remove(os.path.join(self.cacheDir, fileName))
+                except OSError:
+                    pass
+
+    # ========== 场景事件 ==========
+
+    def onNodeAdded(self, caller, event):
+        """有新节点加入场景时,在当前操作结束后检查预算"""
+        if self.enforcePending:
+            return
+        self.enforcePending = True
+        qt.QTimer.singleShot(0, self._enforceLater)
+
+    def _enforceLater(self):
+        """延迟执行的预算检查(合并同一操作中多次添加节点的事件)"""
+        self.enforcePending = False
+        self._observeSliceCompositeNodes()
+        self.enforceBudget()
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def onNodeAboutToBeRemoved(self, caller, event, node):
+        """已换出的节点被删除时同时删除缓存文件"""
+        filePath = node.GetAttribute(EVICTED_PATH_ATTRIBUTE) if node.IsA("vtkMRMLScalarVolumeNode") else None
+        if filePath and os.path.exists(filePath):
+            os.remove(filePath)
+        self.lastAccess.pop(node.GetID(), None)
+
+    def onSceneClosed(self, caller, event):
+        """场景关闭后清空记录和缓存文件"""
+        self.lastAccess = {}
+        self._clearCache()
+        self._observeSliceCompositeNodes()
+
+    def onSliceCompositeModified(self, caller, event):
+        """切片视图显示的体积变化时,重新加载其中已换出的体积"""
+        for volumeID in (caller.GetBackgroundVolumeID(), caller.GetForegroundVolumeID(), caller.GetLabelVolumeID()):
+            if volumeID:
+                self.touch(slicer.mrmlScene.GetNodeByID(volumeID))
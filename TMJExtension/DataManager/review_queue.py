@@ -0,0 +1,210 @@
+"""
+Review Queue - 批量审阅病例时的患者队列与后台预取
+在审阅当前患者时,于后台线程中解码后续患者的体积文件,切换患者时直接使用已解码的数据。
+预取只使用 volume_io 和 SimpleITK,不访问 MRML 场景;节点在主线程中由 DataManagerLogic 创建
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from . import volume_io
+
+
+# 默认预取的患者数(当前患者之后)
+DEFAULT_PREFETCH_DEPTH = 1
+
+# 预取缓存的默认内存上限 (MB)
+DEFAULT_PREFETCH_CACHE_MB = 2048
+
+
+def decodeVolumeFile(filePath):
+    """
+    在工作线程中读取并解码体积文件
+
+    使用与 Slicer 加载体积相同的 ITK 读取器 (volume_io.readVolumeImage),
+    节点在主线程中经 sitkUtils 创建,几何信息与普通加载一致
+
+    :param filePath: 文件路径
+    :return: SimpleITK.Image
+    """
+    header = volume_io.readVolumeHeader(filePath)
+    if header["format"] == "zarr":
+        raise ValueError(f"zarr 体积按需分块加载,不预取: {filePath}")
+    if header["number_of_components"] != 1:
+        raise ValueError(f"预取只支持单分量体积: {filePath}")
+    return volume_io.readVolumeImage(filePath)
+
+
+def estimateDecodedBytes(filePath):
+    """
+    由文件头估算解码后的字节数
+
+    :param filePath: 文件路径
+    :return: 字节数
+    """
+    import numpy as np
+    header = volume_io.readVolumeHeader(filePath)
+    itemSize = 4 if header["scale"] != (1.0, 0.0) else np.dtype(header["dtype"]).itemsize
+    return int(np.prod(header["dimensions"])) * header["number_of_components"] * itemSize
+
+
+class CohortReviewQueue:
+    """
+    病例审阅队列
+
+    按 DataManagerLogic.scanCohortDirectory 的顺序排列具有 Fixed 和 Moving 文件的患者。
+    每次切换患者后,在后台预取之后 prefetchDepth 位患者的 Fixed、Moving 和 ROI 体积;
+    缓存按患者数和内存上限约束,超出上限的患者不预取,切换时按普通方式从文件加载
+    """
+
+    def __init__(self, patients, prefetchDepth=DEFAULT_PREFETCH_DEPTH, maxCacheMB=DEFAULT_PREFETCH_CACHE_MB,
+                 logCallback=None):
+        """
+        初始化审阅队列
+
+        :param patients: 患者信息列表 (scanCohortDirectory 的结果)
+        :param prefetchDepth: 预取的患者数
+        :param maxCacheMB: 预取缓存的内存上限 (MB)
+        :param logCallback: 日志回调函数(只在主线程中调用)
+        """
+        self.patients = list(patients)
+        self.prefetchDepth = prefetchDepth
+        self.maxCacheBytes = int(maxCacheMB * 1024 * 1024)
+        self.logCallback = logCallback
+        self.currentIndex = -1
+
+        # 患者序号 -> 预取任务 (结果为 {角色: SimpleITK.Image} 和 {角色: 错误信息})
+        self.cache = OrderedDict()
+        self.cacheBytes = {}
+        self.lock = threading.Lock()
+        self.stopRequested = False
+        # 单线程逐个患者解码,避免与当前患者的交互操作争用磁盘和 CPU
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TMJPrefetch")
+
+    def log(self, message):
+        """日志输出"""
+        logging.info(message)
+        if self.logCallback:
+            self.logCallback(message)
+
+    def __len__(self):
+        return len(self.patients)
+
+    def currentPatient(self):
+        """
+        当前患者信息
+
+        :return: 患者信息,尚未开始审阅时返回 None
+        """
+        if 0 <= self.currentIndex < len(self.patients):
+            return self.patients[self.currentIndex]
+        return None
+
+    def hasNext(self):
+        """
+        是否还有下一位患者
+
+        :return: 是否还有下一位患者
+        """
+        return self.currentIndex + 1 < len(self.patients)
+
+    def advance(self, index=None):
+        """
+        切换到下一位(或指定序号的)患者,并开始预取其后的患者
+
+        已完成的预取结果直接返回;预取仍在进行时等待其完成
+
+        :param index: 目标患者序号,为 None 时为下一位
+        :return: (患者信息, 已解码体积 {角色: SimpleITK.Image}, 预取失败的角色 {角色: 错误信息})
+        """
+        index = self.currentIndex + 1 if index is None else index
+        if not 0 <= index < len(self.patients):
+            raise ValueError("审阅队列中没有更多患者")
+        self.currentIndex = index
+
+        with self.lock:
+            future = self.cache.pop(index, None)
+            self.cacheBytes.pop(index, None)
+        decoded, errors = {}, {}
+        if future is not None:
+            if not future.done():
+                self.log(f"等待患者 {self.patients[index]['patient_id']} 的预取完成...")
+            decoded, errors = future.result()
+
+        self._dropStaleEntries()
+        self.prefetch()
+        return self.patients[index], decoded, errors
+
+    def prefetch(self):
+        """
+        提交当前患者之后 prefetchDepth 位患者的预取任务(已在缓存中的跳过)
+        """
+        self.stopRequested = False
+        for index in range(self.currentIndex + 1, min(self.currentIndex + 1 + self.prefetchDepth,
+                                                       len(self.patients))):
+            with self.lock:
+                if index in self.cache:
+                    continue
+            patientInfo = self.patients[index]
+            try:
+                estimatedBytes = sum(estimateDecodedBytes(path) for path in patientInfo["files"].values())
+            except Exception as e:
+                self.log(f"⚠ 无法读取患者 {patientInfo['patient_id']} 的文件头,不预取: {str(e)}")
+                continue
+            with self.lock:
+                usedBytes = sum(self.cacheBytes.values())
+                if usedBytes + estimatedBytes > self.maxCacheBytes:
+                    self.log(f"⚠ 患者 {patientInfo['patient_id']} 的数据 ({estimatedBytes / (1024 * 1024):.0f} MB) "
+                             f"超出预取缓存上限,切换时从文件加载")
+                    break
+                self.cache[index] = self.executor.submit(self._decodePatient, patientInfo)
+                self.cacheBytes[index] = estimatedBytes
+            self.log(f"后台预取患者 {patientInfo['patient_id']} ({estimatedBytes / (1024 * 1024):.0f} MB)")
+
+    def _decodePatient(self, patientInfo):
+        """
+        在工作线程中解码一位患者的所有体积文件
+
+        :param patientInfo: 患者信息
+        :return: ({角色: SimpleITK.Image}, {角色: 错误信息})
+        """
+        decoded, errors = {}, {}
+        for role, filePath in patientInfo["files"].items():
+            if self.stopRequested:
+                break
+            try:
+                decoded[role] = decodeVolumeFile(filePath)
+            except Exception as e:
+                errors[role] = str(e)
+        return decoded, errors
+
+    def _dropStaleEntries(self):
+        """
+        丢弃不在当前预取范围内的缓存(例如跳转到其他患者后)
+        """
+        with self.lock:
+            for index in list(self.cache):
+                if not self.currentIndex < index <= self.currentIndex + self.prefetchDepth:
+                    self.cache.pop(index).cancel()
+                    self.cacheBytes.pop(index, None)
+
+    def cachedPatientCount(self):
+        """
+        已完成预取的患者数
+
+        :return: 患者数
+        """
+        with self.lock:
+            return sum(1 for future in self.cache.values() if future.done() and not future.cancelled())
+
+    def shutdown(self):
+        """
+        停止预取并释放缓存
+        """
+        self.stopRequested = True
+        with self.lock:
+            for future in self.cache.values():
+                future.cancel()
+            self.cache.clear()
+            self.cacheBytes.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,390 @@
+"""
+Session Snapshot - TMJ 配准流程文件夹的快速快照与恢复
+文件夹结构、变换和标注点保存为小型 JSON,体积数据按内容哈希保存为只写一次的数据块 (blob)
+"""
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import vtk
+import slicer
+from . import volume_io
+from .data_manager_logic import SHARED_IMAGE_DATA_ATTRIBUTE
+from .memory_manager import EVICTED_PATH_ATTRIBUTE
+from Common.scene_utils import sceneBatch, placeNodeInFolder
+from Common.transform_chain import getMatrixToParent
+
+SNAPSHOT_VERSION = 1
+
+
+class SessionSnapshotStore:
+    """
+    会话快照存储
+
+    目录结构:
+      blobs/<哈希前两位>/<内容哈希>-<类型>.npy   体积数据,相同内容只写一次,多个快照和多个节点共用
+      sessions/<快照名称>.json                   文件夹结构、节点属性、变换矩阵和标注点
+
+    保存时只为新内容写数据块,恢复时在线程池中并行读取数据块,不经过 NRRD 编解码和 .mrb 打包
+    """
+
+    def __init__(self, storeDir, logCallback=None):
+        """
+        初始化快照存储
+
+        :param storeDir: 存储目录
+        :param logCallback: 日志回调函数
+        """
+        self.storeDir = storeDir
+        self.blobDir = os.path.join(storeDir, "blobs")
+        self.sessionDir = os.path.join(storeDir, "sessions")
+        self.logCallback = logCallback
+
+    def log(self, message):
+        """日志输出"""
+        logging.info(message)
+        if self.logCallback:
+            self.logCallback(message)
+
+    def listSnapshots(self):
+        """
+        列出已保存的快照
+
+        :return: 快照文件路径列表(按修改时间从新到旧)
+        """
+        if not os.path.isdir(self.sessionDir):
+            return []
+        paths = [os.path.join(self.sessionDir, name) for name in os.listdir(self.sessionDir)
+                 if name.endswith(".json")]
+        return sorted(paths, key=os.path.getmtime, reverse=True)
+
+    def _blobPath(self, blobKey):
+        """数据块文件路径"""
+        return os.path.join(self.blobDir, blobKey[:2], blobKey + ".npy")
+
+    def _writeBlob(self, blobKey, array):
+        """
+        写入数据块(已存在时跳过,可在工作线程中调用)
+
+        :return: 实际写入的字节数
+        """
+        import numpy as np
+        blobPath = self._blobPath(blobKey)
+        if os.path.exists(blobPath):
+            return 0
+        os.makedirs(os.path.dirname(blobPath), exist_ok=True)
+        tempPath = blobPath + f".{os.getpid()}.partial"
+        with open(tempPath, 'wb') as f:
+            np.save(f, array)
+        os.replace(tempPath, blobPath)
+        return array.nbytes
+
+    # ========== 保存 ==========
+
+    def save(self, mainFolderName, sessionName=None, maxWorkers=None):
+        """
+        保存配准流程总文件夹的快照
+
+        :param mainFolderName: 配准流程总文件夹名称
+        :param sessionName: 快照名称,默认为 "<总文件夹>_<时间>"
+        :param maxWorkers: 计算哈希和写数据块的线程数,默认为 CPU 核心数
+        :return: 快照文件路径
+        """
+        shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+        mainFolderItemID = shNode.GetItemChildWithName(shNode.GetSceneItemID(), mainFolderName)
+        if mainFolderItemID == 0:
+            raise ValueError(f"场景中没有找到文件夹: {mainFolderName}")
+
+        sessionName = sessionName or f"{mainFolderName}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "main_folder": mainFolderName,
+            "saved_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "folders": [],
+            "transforms": [],
+            "volumes": [],
+            "markups": []
+        }
+
+        # 1. 遍历文件夹结构(主线程中读取场景)
+        volumeArrays = []
+        self._collectItems(shNode, mainFolderItemID, [], snapshot, volumeArrays)
+
+        # 2. 在线程池中计算内容哈希并写入新的数据块
+        writtenBytes = 0
+        with ThreadPoolExecutor(max_workers=maxWorkers or os.cpu_count() or 1) as executor:
+            hashTasks = [executor.submit(volume_io.computeContentHash, array) for array in volumeArrays]
+            blobKeys = [f"{task.result()}-{array.dtype.str[1:]}" for task, array in zip(hashTasks, volumeArrays)]
+            writeTasks = {}
+            for blobKey, array in zip(blobKeys, volumeArrays):
+                if blobKey not in writeTasks:
+                    writeTasks[blobKey] = executor.submit(self._writeBlob, blobKey, array)
+            for task in writeTasks.values():
+                writtenBytes += task.result()
+        for entry, blobKey in zip(snapshot["volumes"], blobKeys):
+            entry["blob"] = blobKey
+
+        # 3. 写入快照 JSON
+        os.makedirs(self.sessionDir, exist_ok=True)
+        sessionPath = os.path.join(self.sessionDir, sessionName + ".json")
+        with open(sessionPath, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, indent=2, ensure_ascii=False)
+
+        totalBytes = sum(array.nbytes for array in volumeArrays)
+        self.log(f"✓ 快照已保存: {sessionPath}")
+        self.log(f"  {len(snapshot['volumes'])} 个体积, {len(snapshot['transforms'])} 个变换, "
+                 f"{len(snapshot['markups'])} 组标注点; 新写入数据 {writtenBytes / (1024 * 1024):.1f} MB "
+                 f"(共 {totalBytes / (1024 * 1024):.1f} MB)")
+        return sessionPath
+
+    def _collectItems(self, shNode, folderItemID, folderPath, snapshot, volumeArrays):
+        """
+        递归收集文件夹中的体积、变换和标注点
+
+        :param folderPath: 相对总文件夹的文件夹路径列表
+        :param volumeArrays: 输出参数,与 snapshot["volumes"] 一一对应的体积数据数组
+        """
+        childIDs = vtk.vtkIdList()
+        shNode.GetItemChildren(folderItemID, childIDs, False)
+        for i in range(childIDs.GetNumberOfIds()):
+            itemID = childIDs.GetId(i)
+            node = shNode.GetItemDataNode(itemID)
+            if node is None:
+                subFolderPath = folderPath + [shNode.GetItemName(itemID)]
+                snapshot["folders"].append(subFolderPath)
+                self._collectItems(shNode, itemID, subFolderPath, snapshot, volumeArrays)
+            elif node.IsA("vtkMRMLScalarVolumeNode"):
+                entry, array = self._describeVolume(node)
+                entry["folder"] = folderPath
+                snapshot["volumes"].append(entry)
+                volumeArrays.append(array)
+            elif node.IsA("vtkMRMLLinearTransformNode"):
+                entry = self._describeTransform(node)
+                entry["folder"] = folderPath
+                snapshot["transforms"].append(entry)
+            elif node.IsA("vtkMRMLMarkupsNode"):
+                entry = self._describeMarkups(node)
+                entry["folder"] = folderPath
+                snapshot["markups"].append(entry)
+            else:
+                self.log(f"⚠ 快照不支持的节点类型,已跳过: {node.GetName()} ({node.GetClassName()})")
+
+    def _parentTransformName(self, node):
+        """节点的父变换名称"""
+        transformNode = node.GetParentTransformNode()
+        return transformNode.GetName() if transformNode else None
+
+    def _nodeAttributes(self, node):
+        """节点上 TMJ 模块使用的属性"""
+        attributes = {}
+        for name in node.GetAttributeNames() or ():
+            if name.startswith("TMJ.") and name not in (EVICTED_PATH_ATTRIBUTE, SHARED_IMAGE_DATA_ATTRIBUTE):
+                attributes[name] = node.GetAttribute(name)
+        return attributes
+
+    def _describeVolume(self, volumeNode):
+        """
+        记录体积节点的元信息
+
+        :return: (元信息字典, 一维数据数组)
+        """
+        import numpy as np
+        import vtk.util.numpy_support as vtk_np
+        evictedPath = volumeNode.GetAttribute(EVICTED_PATH_ATTRIBUTE)
+        if evictedPath:
+            # 已被内存管理器换出的体积直接读取换出文件
+            with np.load(evictedPath) as cached:
+                array = cached["data"]
+                dimensions = [int(v) for v in cached["dimensions"]]
+                scalarName = str(cached["name"])
+        else:
+            imageData = volumeNode.GetImageData()
+            scalars = imageData.GetPointData().GetScalars()
+            array = vtk_np.vtk_to_numpy(scalars)
+            dimensions = list(imageData.GetDimensions())
+            scalarName = scalars.GetName() or "ImageScalars"
+
+        ijkToRAS = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRAS)
+        entry = {
+            "name": volumeNode.GetName(),
+            "class": volumeNode.GetClassName(),
+            "dimensions": dimensions,
+            "number_of_components": array.shape[1] if array.ndim == 2 else 1,
+            "scalar_name": scalarName,
+            "ijk_to_ras": [[ijkToRAS.GetElement(i, j) for j in range(4)] for i in range(4)],
+            "parent_transform": self._parentTransformName(volumeNode),
+            "attributes": self._nodeAttributes(volumeNode)
+        }
+        displayNode = volumeNode.GetDisplayNode()
+        if displayNode:
+            entry["display"] = {"color_node_id": displayNode.GetColorNodeID()}
+            if displayNode.IsA("vtkMRMLScalarVolumeDisplayNode"):
+                entry["display"].update({"auto_window_level": bool(displayNode.GetAutoWindowLevel()),
+                                         "window": displayNode.GetWindow(), "level": displayNode.GetLevel()})
+        return entry, array
+
+    def _describeTransform(self, transformNode):
+        """记录线性变换节点"""
+        return {
+            "name": transformNode.GetName(),
+            "matrix_to_parent": getMatrixToParent(transformNode).tolist(),
+            "parent_transform": self._parentTransformName(transformNode),
+            "attributes": self._nodeAttributes(transformNode)
+        }
+
+    def _describeMarkups(self, markupsNode):
+        """记录标注点节点(局部坐标,不含父变换)"""
+        points = []
+        for i in range(markupsNode.GetNumberOfControlPoints()):
+            position = [0.0, 0.0, 0.0]
+            markupsNode.GetNthControlPointPosition(i, position)
+            points.append({
+                "label": markupsNode.GetNthControlPointLabel(i),
+                "position": position,
+                "selected": bool(markupsNode.GetNthControlPointSelected(i)),
+                "locked": bool(markupsNode.GetNthControlPointLocked(i)),
+                "visible": bool(markupsNode.GetNthControlPointVisibility(i))
+            })
+        entry = {
+            "name": markupsNode.GetName(),
+            "class": markupsNode.GetClassName(),
+            "points": points,
+            "parent_transform": self._parentTransformName(markupsNode),
+            "attributes": self._nodeAttributes(markupsNode)
+        }
+        displayNode = markupsNode.GetDisplayNode()
+        if displayNode:
+            entry["display"] = {"color": list(displayNode.GetColor()),
+                                "selected_color": list(displayNode.GetSelectedColor()),
+                                "glyph_scale": displayNode.GetGlyphScale(),
+                                "text_scale": displayNode.GetTextScale()}
+        return entry
+
+    # ========== 恢复 ==========
+
+    def restore(self, sessionPath, replaceExisting=True, maxWorkers=None):
+        """
+        从快照恢复配准流程总文件夹
+
+        :param sessionPath: 快照文件路径
+        :param replaceExisting: 场景中已有同名总文件夹时是否先删除
+        :param maxWorkers: 读取数据块的线程数,默认为 CPU 核心数
+        :return: 恢复的总文件夹名称
+        """
+        import numpy as np
+        import vtk.util.numpy_support as vtk_np
+        with open(sessionPath, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"不支持的快照版本: {snapshot.get('version')}")
+
+        mainFolderName = snapshot["main_folder"]
+        shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
+        sceneItemID = shNode.GetSceneItemID()
+        existingItemID = shNode.GetItemChildWithName(sceneItemID, mainFolderName)
+        if existingItemID and replaceExisting:
+            shNode.RemoveItem(existingItemID)
+            self.log(f"  已移除场景中原有的文件夹: {mainFolderName}")
+
+        # 1. 在线程池中读取数据块(相同数据块只读一次)
+        blobKeys = sorted({entry["blob"] for entry in snapshot["volumes"]})
+        with ThreadPoolExecutor(max_workers=maxWorkers or os.cpu_count() or 1) as executor:
+            blobs = dict(zip(blobKeys, executor.map(lambda key: np.load(self._blobPath(key)), blobKeys)))
+
+        # 2-5. 节点和文件夹在同一个批处理中创建,结束时只刷新一次
+        with sceneBatch():
+            # 2. 重建文件夹结构
+            mainFolderItemID = shNode.CreateFolderItem(sceneItemID, mainFolderName)
+            folderItems = {(): mainFolderItemID}
+            for folderPath in snapshot["folders"]:
+                parentItemID = folderItems[tuple(folderPath[:-1])]
+                folderItems[tuple(folderPath)] = shNode.CreateFolderItem(parentItemID, folderPath[-1])
+
+            def placeNode(node, entry):
+                for name, value in entry.get("attributes", {}).items():
+                    node.SetAttribute(name, value)
+                placeNodeInFolder(shNode, node, folderItems[tuple(entry["folder"])])
+
+            # 3. 变换(先创建全部节点,再按名称连接父变换)
+            transformNodes = {}
+            for entry in snapshot["transforms"]:
+                transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", entry["name"])
+                transformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(entry["matrix_to_parent"]))
+                placeNode(transformNode, entry)
+                transformNodes[entry["name"]] = transformNode
+
+            def observeTransform(node, entry):
+                parentName = entry.get("parent_transform")
+                if parentName in transformNodes:
+                    node.SetAndObserveTransformNodeID(transformNodes[parentName].GetID())
+                elif parentName:
+                    self.log(f"⚠ {entry['name']} 的父变换 {parentName} 不在快照中,未恢复")
+
+            for entry in snapshot["transforms"]:
+                observeTransform(transformNodes[entry["name"]], entry)
+
+            # 4. 体积(相同数据块的节点共享同一个 vtkImageData)
+            sharedImageData = {}
+            blobUseCount = {}
+            for entry in snapshot["volumes"]:
+                blobUseCount[entry["blob"]] = blobUseCount.get(entry["blob"], 0) + 1
+            for entry in snapshot["volumes"]:
+                blobKey = entry["blob"]
+                imageData = sharedImageData.get(blobKey)
+                if imageData is None:
+                    array = blobs[blobKey].reshape(-1, entry["number_of_components"]) \
+                        if entry["number_of_components"] > 1 else blobs[blobKey].reshape(-1)
+                    scalars = vtk_np.numpy_to_vtk(array, deep=False)
+                    scalars.SetName(entry["scalar_name"])
+                    imageData = vtk.vtkImageData()
+                    imageData.SetDimensions(entry["dimensions"])
+                    imageData.GetPointData().SetScalars(scalars)
+                    sharedImageData[blobKey] = imageData
+
+                volumeNode = slicer.mrmlScene.AddNewNodeByClass(entry["class"], entry["name"])
+                volumeNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(entry["ijk_to_ras"]))
+                volumeNode.SetAndObserveImageData(imageData)
+                volumeNode.CreateDefaultDisplayNodes()
+                self._restoreVolumeDisplay(volumeNode, entry.get("display"))
+                placeNode(volumeNode, entry)
+                if blobUseCount[blobKey] > 1:
+                    volumeNode.SetAttribute(SHARED_IMAGE_DATA_ATTRIBUTE, "1")
+                observeTransform(volumeNode, entry)
+
+            # 5. 标注点
+            for entry in snapshot["markups"]:
+                markupsNode = slicer.mrmlScene.AddNewNodeByClass(entry["class"], entry["name"])
+                markupsNode.CreateDefaultDisplayNodes()
+                for point in entry["points"]:
+                    index = markupsNode.AddControlPoint(point["position"], point["label"])
+                    markupsNode.SetNthControlPointSelected(index, point["selected"])
+                    markupsNode.SetNthControlPointLocked(index, point["locked"])
+                    markupsNode.SetNthControlPointVisibility(index, point["visible"])
+                display = entry.get("display")
+                displayNode = markupsNode.GetDisplayNode()
+                if display and displayNode:
+                    displayNode.SetColor(*display["color"])
+                    displayNode.SetSelectedColor(*display["selected_color"])
+                    displayNode.SetGlyphScale(display["glyph_scale"])
+                    displayNode.SetTextScale(display["text_scale"])
+                placeNode(markupsNode, entry)
+                observeTransform(markupsNode, entry)
+
+        self.log(f"✓ 快照已恢复: {mainFolderName} ({len(snapshot['volumes'])} 个体积, "
+                 f"{len(snapshot['transforms'])} 个变换, {len(snapshot['markups'])} 组标注点)")
+        return mainFolderName
+
+    def _restoreVolumeDisplay(self, volumeNode, display):
+        """恢复体积的显示设置(颜色表不存在时保持默认)"""
+        displayNode = volumeNode.GetDisplayNode()
+        if not display or not displayNode:
+            return
+        colorNodeID = display.get("color_node_id")
+        if colorNodeID and slicer.mrmlScene.GetNodeByID(colorNodeID):
+            displayNode.SetAndObserveColorNodeID(colorNodeID)
+        if "window" in display and displayNode.IsA("vtkMRMLScalarVolumeDisplayNode"):
+            displayNode.SetAutoWindowLevel(display["auto_window_level"])
+            if not display["auto_window_level"]:
+                displayNode.SetWindowLevel(display["window"], display["level"])
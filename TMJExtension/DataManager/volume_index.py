@@ -0,0 +1,273 @@
+"""
+Volume Index - 本地体积元数据索引
+以 JSON-lines 文件持久化保存体积文件的几何信息和强度统计,用于快速浏览病例而无需加载体积
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from . import volume_io
+
+
+class VolumeMetadataIndex:
+    """
+    体积元数据索引
+
+    每条记录以 (文件路径, 修改时间, 文件大小) 为键,文件变化后旧记录自动失效。
+    记录内容包括文件头几何信息和与 DataManagerLogic._extractVolumeMetadata 相同结构的元数据。
+    索引在后台线程中填充,只读取文件本身,不向场景中加载任何节点
+    """
+
+    def __init__(self, indexPath, logCallback=None):
+        """
+        初始化体积元数据索引
+
+        :param indexPath: 索引文件路径 (.jsonl)
+        :param logCallback: 日志回调函数(只在主线程中调用)
+        """
+        self.indexPath = indexPath
+        self.logCallback = logCallback
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        # 后台索引线程
+        self.indexThread = None
+        self.stopRequested = False
+        self.pendingCount = 0
+        self.indexedCount = 0
+        self.errors = []
+
+        self.load()
+
+    def log(self, message):
+        """日志输出"""
+        logging.info(message)
+        if self.logCallback:
+            self.logCallback(message)
+
+    def load(self):
+        """
+        从磁盘读取索引文件,后出现的记录覆盖先前的同路径记录
+        """
+        entries = {}
+        if os.path.exists(self.indexPath):
+            with open(self.indexPath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        entries[entry["path"]] = entry
+                    except (ValueError, KeyError):
+                        continue
+        with self.lock:
+            self.entries = entries
+
+    def compact(self):
+        """
+        重写索引文件,去除被覆盖的旧记录和已不存在的文件
+        """
+        with self.lock:
+            entries = [entry for entry in self.entries.values() if os.path.exists(entry["path"])]
+            self.entries = {entry["path"]: entry for entry in entries}
+            os.makedirs(os.path.dirname(self.indexPath) or ".", exist_ok=True)
+            tempPath = self.indexPath + ".tmp"
+            with open(tempPath, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tempPath, self.indexPath)
+
+    def lookup(self, filePath):
+        """
+        查询文件的索引记录
+
+        :param filePath: 文件路径
+        :return: 有效的索引记录;不存在或文件已变化时返回 None
+        """
+        filePath = os.path.abspath(filePath)
+        with self.lock:
+            entry = self.entries.get(filePath)
+        if not entry or not os.path.exists(filePath):
+            return None
+        stat = os.stat(filePath)
+        if entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            return None
+        return entry
+
+    def update(self, filePath, header, metadata=None):
+        """
+        写入(追加)一条索引记录,可在工作线程中调用
+
+        :param filePath: 文件路径
+        :param header: 文件头几何信息
+        :param metadata: 元数据字典,为 None 表示尚未计算统计信息
+        :return: 新的索引记录
+        """
+        filePath = os.path.abspath(filePath)
+        stat = os.stat(filePath)
+        entry = {
+            "path": filePath,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "indexed_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "header": {key: header[key] for key in ("format", "dimensions", "spacing", "origin", "direction",
+                                                      "scalar_type", "number_of_components")},
+            "metadata": metadata
+        }
+        with self.lock:
+            self.entries[filePath] = entry
+            os.makedirs(os.path.dirname(self.indexPath) or ".", exist_ok=True)
+            with open(self.indexPath, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return entry
+
+    def search(self, text="", folder=None):
+        """
+        按关键字搜索索引记录
+
+        关键字以空格分隔,每个关键字都需出现在文件路径、数据类型、维度或间距中(不区分大小写)
+
+        :param text: 搜索关键字
+        :param folder: 只返回该文件夹下的记录
+        :return: 按路径排序的索引记录列表
+        """
+        tokens = text.lower().split()
+        folder = os.path.abspath(folder) if folder else None
+        with self.lock:
+            entries = list(self.entries.values())
+
+        results = []
+        for entry in entries:
+            if folder and not entry["path"].startswith(folder + os.sep):
+                continue
+            if tokens:
+                searchText = self.describe(entry).lower() + " " + entry["path"].lower()
+                if not all(token in searchText for token in tokens):
+                    continue
+            results.append(entry)
+        return sorted(results, key=lambda entry: entry["path"])
+
+    def describe(self, entry):
+        """
+        生成索引记录的单行摘要,用于列表显示
+
+        :param entry: 索引记录
+        :return: 摘要文本
+        """
+        header = entry["header"]
+        dims = "x".join(str(v) for v in header["dimensions"])
+        spacing = "x".join(f"{v:.2f}" for v in header["spacing"])
+        text = f"{os.path.basename(entry['path'])} | {dims} | {spacing} mm | {header['scalar_type']}"
+        metadata = entry.get("metadata")
+        if metadata:
+            stats = metadata["intensity_statistics"]
+            text += f" | {metadata['data_type']} [{stats['min']:.0f}, {stats['max']:.0f}]"
+        else:
+            text += " | 统计中..."
+        return text
+
+    def _indexFile(self, filePath, computeStatistics):
+        """
+        索引单个文件: 读取文件头,按需计算强度统计
+
+        :param filePath: 文件路径
+        :param computeStatistics: 是否读取图像数据计算统计信息
+        """
+        header = volume_io.readVolumeHeader(filePath)
+        if not computeStatistics:
+            self.update(filePath, header)
+            return
+
+        imageArray = volume_io.readVolumeArray(filePath, header)
+        stats = volume_io.computeIntensityStatistics(imageArray)
+        modality = volume_io.classifyModality(imageArray)
+        dataType = modality["data_type"]
+        metadata = {
+            "name": os.path.basename(filePath),
+            "data_type": dataType,
+            "data_type_confidence": modality["confidence"],
+            "dimensions": header["dimensions"],
+            "spacing": header["spacing"],
+            "origin": header["origin"],
+            "direction": header["direction"],
+            "scalar_type": header["scalar_type"],
+            "number_of_components": header["number_of_components"],
+            "intensity_statistics": stats,
+            "resampled": False,
+            "notes": f"Original {'HU' if dataType == 'CT' else 'intensity'} values preserved"
+        }
+        self.update(filePath, header, metadata)
+
+    def startBackgroundIndexing(self, folder, extensions, computeStatistics=True):
+        """
+        在后台线程中索引文件夹下的所有体积文件
+
+        先为所有文件写入文件头信息(很快),再逐个计算强度统计。
+        已有有效记录的文件会被跳过
+
+        :param folder: 要索引的文件夹
+        :param extensions: 可识别的文件扩展名元组
+        :param computeStatistics: 是否计算强度统计信息
+        """
+        if self.isIndexing():
+            raise ValueError("已有索引任务正在运行")
+
+        filePaths = []
+        for root, dirs, files in os.walk(folder):
+            for fileName in files:
+                if fileName.lower().endswith(extensions):
+                    filePaths.append(os.path.abspath(os.path.join(root, fileName)))
+        filePaths.sort()
+
+        pending = []
+        for filePath in filePaths:
+            entry = self.lookup(filePath)
+            if not entry or (computeStatistics and not entry.get("metadata")):
+                pending.append(filePath)
+
+        self.stopRequested = False
+        self.pendingCount = len(pending)
+        self.indexedCount = 0
+        self.errors = []
+        self.log(f"开始后台索引: {folder} ({len(filePaths)} 个文件, {len(pending)} 个需要更新)")
+
+        def run():
+            # 第一遍只读文件头,使列表尽快可用
+            for filePath in pending:
+                if self.stopRequested:
+                    return
+                try:
+                    if not self.lookup(filePath):
+                        self.update(filePath, volume_io.readVolumeHeader(filePath))
+                except Exception as e:
+                    self.errors.append((filePath, str(e)))
+            # 第二遍读取图像数据计算统计信息
+            for filePath in pending:
+                if self.stopRequested:
+                    return
+                try:
+                    if computeStatistics:
+                        self._indexFile(filePath, computeStatistics)
+                except Exception as e:
+                    self.errors.append((filePath, str(e)))
+                self.indexedCount += 1
+            self.compact()
+
+        self.indexThread = threading.Thread(target=run, name="TMJVolumeIndexer", daemon=True)
+        self.indexThread.start()
+
+    def stopBackgroundIndexing(self):
+        """
+        请求停止后台索引(当前文件处理完后停止)
+        """
+        self.stopRequested = True
+
+    def isIndexing(self):
+        """
+        后台索引是否正在运行
+
+        :return: 是否正在运行
+        """
+        return self.indexThread is not None and self.indexThread.is_alive()
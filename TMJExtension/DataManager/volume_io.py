@@ -0,0 +1,960 @@
+"""
+Volume IO - 体积文件的底层读写辅助函数
+这里的函数不访问 MRML 场景,可以安全地在工作线程中调用
+"""
+import os
+import zlib
+
+
+# 分块压缩的默认块大小 (每块独立压缩为一个 gzip 成员)
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+# 默认 gzip 压缩级别
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_MODALITY_SAMPLES = 200000
+DEFAULT_CAST_CHUNK_VOXELS = 1024 * 1024
+
+
+def compressGzipBlock(data, level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    将一个数据块压缩为独立完整的 gzip 成员
+    多个 gzip 成员首尾相接仍是合法的 gzip 流 (RFC 1952),
+    因此各块可以在不同线程中并行压缩
+
+    :param data: 待压缩的字节数据
+    :param level: 压缩级别 (1-9)
+    :return: 压缩后的字节数据
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def parallelGzipFile(srcPath, dstPath, executor, workers, level=DEFAULT_COMPRESSION_LEVEL,
+                     blockSize=DEFAULT_BLOCK_SIZE, dataOffset=0, headerBytes=b"",
+                     maxPendingBlocks=None):
+    """
+    分块并行 gzip 压缩文件
+
+    源文件从 dataOffset 开始的内容被切分为固定大小的块,每块在线程池中独立压缩,
+    再按顺序写入目标文件。headerBytes 会以未压缩形式写在最前面(用于 NRRD 头)。
+    同时在途的块数量有上限,内存占用与文件大小无关。
+
+    :param srcPath: 源文件路径(未压缩)
+    :param dstPath: 目标文件路径
+    :param executor: 用于压缩数据块的线程池
+    :param workers: 线程池的线程数
+    :param level: 压缩级别 (1-9)
+    :param blockSize: 每个压缩块的字节数
+    :param dataOffset: 源文件中需要压缩的数据起始偏移
+    :param headerBytes: 写在目标文件开头的未压缩数据
+    :param maxPendingBlocks: 同时在途的最大块数,默认为线程数的2倍
+    :return: (原始数据字节数, 压缩后文件字节数)
+    """
+    if maxPendingBlocks is None:
+        maxPendingBlocks = 2 * max(1, workers)
+
+    rawBytes = 0
+    pending = []
+    with open(srcPath, 'rb') as src, open(dstPath, 'wb') as dst:
+        dst.write(headerBytes)
+        src.seek(dataOffset)
+        while True:
+            block = src.read(blockSize)
+            if block:
+                rawBytes += len(block)
+                pending.append(executor.submit(compressGzipBlock, block, level))
+            # 按提交顺序写出已完成的块,保持输出顺序与输入一致
+            while pending and (len(pending) >= maxPendingBlocks or not block):
+                dst.write(pending.pop(0).result())
+            if not block:
+                break
+
+    return rawBytes, os.path.getsize(dstPath)
+
+
+def readNrrdHeader(filePath):
+    """
+    读取 NRRD 文件头(到第一个空行为止)
+
+    分离式头文件 (.nhdr) 可以没有结尾空行,此时文件结束即为头部结束
+
+    :param filePath: NRRD 文件路径
+    :return: (头部文本行列表, 数据起始偏移)
+    """
+    with open(filePath, 'rb') as f:
+        content = f.read(65536)
+        if not content.startswith(b"NRRD"):
+            raise ValueError(f"无效的 NRRD 文件头: {filePath}")
+        while True:
+            ends = [content.find(terminator) + len(terminator) for terminator in (b"\n\n", b"\r\n\r\n")
+                    if terminator in content]
+            if ends:
+                headerEnd = min(ends)
+                break
+            chunk = f.read(65536)
+            if not chunk:
+                headerEnd = len(content)
+                break
+            content += chunk
+    lines = content[:headerEnd].decode('latin-1').splitlines()
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return lines, headerEnd
+
+
+def buildNrrdHeader(lines, fields):
+    """
+    替换 NRRD 头中的字段并重新生成头部字节
+
+    :param lines: readNrrdHeader 返回的头部文本行
+    :param fields: 需要设置的字段字典 {字段名: 值}
+    :return: 新的头部字节(以空行结尾)
+    """
+    remaining = dict(fields)
+    newLines = []
+    for line in lines:
+        key = line.split(":", 1)[0].strip() if ":" in line and not line.startswith("#") else None
+        if key in remaining:
+            newLines.append(f"{key}: {remaining.pop(key)}")
+        else:
+            newLines.append(line)
+    for key, value in remaining.items():
+        newLines.append(f"{key}: {value}")
+    return ("\n".join(newLines) + "\n\n").encode('latin-1')
+
+
+# 导出支持的压缩方式
+#   gzip    - 标准 gzip (NRRD 内嵌 / .nii.gz),兼容所有读取器
+#   zstd    - zstd 压缩数据旁车文件,速度快、压缩率高
+#   lz4     - lz4 压缩数据旁车文件,速度最快
+#   none    - 不压缩
+#   archive - 不压缩的体积文件 + 单独的 zip 压缩归档
+SUPPORTED_CODECS = ("gzip", "zstd", "lz4", "none", "archive")
+
+# 各压缩方式的默认压缩级别
+DEFAULT_CODEC_LEVELS = {"gzip": 6, "zstd": 3, "lz4": 0, "none": 0, "archive": 6}
+
+# 旁车压缩文件的扩展名
+SIDECAR_EXTENSIONS = {"zstd": ".zst", "lz4": ".lz4"}
+
+
+def _importCodec(codec):
+    """
+    导入可选的压缩模块
+
+    :param codec: 'zstd' 或 'lz4'
+    :return: 压缩模块
+    """
+    try:
+        if codec == "zstd":
+            import zstandard
+            return zstandard
+        if codec == "lz4":
+            import lz4.frame
+            return lz4.frame
+    except ImportError:
+        packageName = "zstandard" if codec == "zstd" else "lz4"
+        raise ValueError(f"{codec} 压缩需要 {packageName} 模块,"
+                         f"请在 Python 控制台运行: slicer.util.pip_install('{packageName}')")
+    raise ValueError(f"不支持的压缩方式: {codec}")
+
+
+def codecForSidecar(filePath):
+    """
+    根据文件扩展名判断旁车文件的压缩方式
+
+    :param filePath: 文件路径
+    :return: 'zstd' / 'lz4',不是压缩旁车文件时返回 None
+    """
+    for codec, extension in SIDECAR_EXTENSIONS.items():
+        if filePath.endswith(extension):
+            return codec
+    return None
+
+
+def streamCompressFile(srcPath, dstPath, codec, level, dataOffset=0, chunkSize=DEFAULT_BLOCK_SIZE):
+    """
+    以流式方式将文件压缩为 zstd / lz4 (zstd 使用其内置的多线程压缩)
+
+    :param srcPath: 源文件路径
+    :param dstPath: 目标文件路径
+    :param codec: 'zstd' 或 'lz4'
+    :param level: 压缩级别
+    :param dataOffset: 源文件中需要压缩的数据起始偏移
+    :param chunkSize: 每次读取的字节数
+    :return: (原始数据字节数, 压缩后文件字节数)
+    """
+    module = _importCodec(codec)
+    rawBytes = 0
+    with open(srcPath, 'rb') as src, open(dstPath, 'wb') as dst:
+        src.seek(dataOffset)
+        if codec == "zstd":
+            compressor = module.ZstdCompressor(level=level, threads=-1)
+            rawBytes, _ = compressor.copy_stream(src, dst, read_size=chunkSize)
+        else:
+            compressor = module.LZ4FrameCompressor(compression_level=level)
+            dst.write(compressor.begin())
+            while True:
+                chunk = src.read(chunkSize)
+                if not chunk:
+                    break
+                rawBytes += len(chunk)
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+    return rawBytes, os.path.getsize(dstPath)
+
+
+def streamDecompressFile(srcPath, dstPath, codec, chunkSize=DEFAULT_BLOCK_SIZE):
+    """
+    将 zstd / lz4 压缩文件流式解压
+
+    :param srcPath: 压缩文件路径
+    :param dstPath: 解压后文件路径
+    :param codec: 'zstd' 或 'lz4'
+    :param chunkSize: 每次读取的字节数
+    """
+    module = _importCodec(codec)
+    with open(srcPath, 'rb') as src, open(dstPath, 'wb') as dst:
+        if codec == "zstd":
+            module.ZstdDecompressor().copy_stream(src, dst, read_size=chunkSize)
+        else:
+            decompressor = module.LZ4FrameDecompressor()
+            while True:
+                chunk = src.read(chunkSize)
+                if not chunk:
+                    break
+                dst.write(decompressor.decompress(chunk))
+
+
+def readNrrdField(headerLines, fieldName):
+    """
+    读取 NRRD 头中的字段值
+
+    :param headerLines: 头部文本行
+    :param fieldName: 字段名
+    :return: 字段值,不存在时返回 None
+    """
+    for line in headerLines:
+        if line.startswith("#") or ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        if key.strip() == fieldName:
+            return value.strip()
+    return None
+
+
+def computeContentHash(array, chunkBytes=DEFAULT_BLOCK_SIZE):
+    """
+    计算体积数据内容的哈希值(blake2b,可在工作线程中调用)
+
+    :param array: 连续存储的 numpy 数组
+    :param chunkBytes: 每次送入哈希的字节数
+    :return: 十六进制哈希字符串
+    """
+    import hashlib
+    digest = hashlib.blake2b(digest_size=20)
+    buffer = memoryview(array).cast('B')
+    for offset in range(0, len(buffer), chunkBytes):
+        digest.update(buffer[offset:offset + chunkBytes])
+    return digest.hexdigest()
+
+
+# ========== 体积文件头解析与数据读取(纯 numpy,不创建场景节点) ==========
+
+# NRRD 类型名到 numpy dtype 的映射
+_NRRD_TYPES = {
+    "signed char": "i1", "int8": "i1", "int8_t": "i1",
+    "uchar": "u1", "unsigned char": "u1", "uint8": "u1", "uint8_t": "u1",
+    "short": "i2", "short int": "i2", "signed short": "i2", "signed short int": "i2", "int16": "i2",
+    "int16_t": "i2",
+    "ushort": "u2", "unsigned short": "u2", "unsigned short int": "u2", "uint16": "u2", "uint16_t": "u2",
+    "int": "i4", "signed int": "i4", "int32": "i4", "int32_t": "i4",
+    "uint": "u4", "unsigned int": "u4", "uint32": "u4", "uint32_t": "u4",
+    "longlong": "i8", "long long": "i8", "long long int": "i8", "signed long long": "i8",
+    "signed long long int": "i8", "int64": "i8", "int64_t": "i8",
+    "ulonglong": "u8", "unsigned long long": "u8", "unsigned long long int": "u8", "uint64": "u8",
+    "uint64_t": "u8",
+    "float": "f4", "double": "f8",
+}
+
+# NIfTI datatype 编码到 numpy dtype 的映射
+_NIFTI_TYPES = {2: "u1", 4: "i2", 8: "i4", 16: "f4", 64: "f8", 256: "i1", 512: "u2", 768: "u4",
+                1024: "i8", 1280: "u8"}
+
+# MetaImage 类型名到 numpy dtype 的映射
+_META_TYPES = {"MET_CHAR": "i1", "MET_UCHAR": "u1", "MET_SHORT": "i2", "MET_USHORT": "u2",
+               "MET_INT": "i4", "MET_UINT": "u4", "MET_LONG_LONG": "i8", "MET_ULONG_LONG": "u8",
+               "MET_FLOAT": "f4", "MET_DOUBLE": "f8"}
+
+# numpy dtype 到 VTK 标量类型名的映射(与 vtkImageData.GetScalarTypeAsString 一致)
+_VTK_TYPE_NAMES = {"i1": "char", "u1": "unsigned char", "i2": "short", "u2": "unsigned short",
+                   "i4": "int", "u4": "unsigned int", "i8": "long long", "u8": "unsigned long long",
+                   "f4": "float", "f8": "double"}
+
+
+def _geometryFromAxes(axes, origin, lps):
+    """
+    由各轴方向向量(含间距)和原点计算几何信息
+
+    :param axes: 3 个轴向量 (IJK 各轴在物理空间中的方向 × 间距)
+    :param origin: 原点
+    :param lps: 坐标是否为 LPS (需转换为 RAS)
+    :return: (spacing, origin, direction, ijkToRAS)
+    """
+    import numpy as np
+    flip = np.array([-1.0, -1.0, 1.0]) if lps else np.ones(3)
+    columns = np.array(axes, dtype=float).T * flip[:, None]
+    spacing = np.linalg.norm(columns, axis=0)
+    spacing[spacing == 0] = 1.0
+    direction = columns / spacing
+    rasOrigin = np.array(origin, dtype=float) * flip
+    ijkToRAS = np.eye(4)
+    ijkToRAS[:3, :3] = columns
+    ijkToRAS[:3, 3] = rasOrigin
+    return spacing.tolist(), rasOrigin.tolist(), direction.tolist(), ijkToRAS.tolist()
+
+
+def _parseNrrdVector(text):
+    """解析 NRRD 向量 '(a,b,c)',不是向量 (none) 时返回 None"""
+    text = text.strip()
+    if not text.startswith("("):
+        return None
+    return [float(v) for v in text.strip("()").split(",")]
+
+
+def _readNrrdVolumeHeader(filePath):
+    """读取 NRRD / NHDR 文件头"""
+    import re
+    lines, _ = readNrrdHeader(filePath)
+    fields = {}
+    for line in lines[1:]:
+        if line.startswith("#") or ":=" in line or ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        fields[key.strip().lower()] = value.strip()
+
+    sizes = [int(v) for v in fields["sizes"].split()]
+    components = 1
+    spatialSizes = sizes
+    axes = []
+    if "space directions" in fields:
+        vectors = [_parseNrrdVector(v) for v in re.findall(r"\([^)]*\)|none", fields["space directions"])]
+        if len(vectors) == len(sizes) and vectors[0] is None:
+            components = sizes[0]
+            spatialSizes = sizes[1:]
+            vectors = vectors[1:]
+        axes = [v for v in vectors if v is not None]
+    elif "spacings" in fields:
+        spacings = [float(v) for v in fields["spacings"].split()]
+        axes = [[spacings[i] if i == j else 0.0 for j in range(3)] for i in range(len(spacings))]
+    while len(axes) < 3:
+        axes.append([1.0 if i == len(axes) else 0.0 for i in range(3)])
+    while len(spatialSizes) < 3:
+        spatialSizes = list(spatialSizes) + [1]
+
+    space = fields.get("space", "left-posterior-superior").lower()
+    lps = space in ("left-posterior-superior", "lps", "3d-left-handed")
+    origin = _parseNrrdVector(fields.get("space origin", "(0,0,0)")) or [0.0, 0.0, 0.0]
+    spacing, rasOrigin, direction, ijkToRAS = _geometryFromAxes(axes[:3], origin, lps)
+
+    dtype = _NRRD_TYPES[fields["type"].lower()]
+    endian = fields.get("endian", "little")
+    return {
+        "format": "nrrd",
+        "dimensions": spatialSizes[:3],
+        "spacing": spacing,
+        "origin": rasOrigin,
+        "direction": direction,
+        "ijk_to_ras": ijkToRAS,
+        "number_of_components": components,
+        "dtype": ("<" if endian == "little" else ">") + dtype,
+        "scalar_type": _VTK_TYPE_NAMES[dtype],
+        "scale": (1.0, 0.0),
+    }
+
+
+def _openMaybeCompressed(filePath):
+    """打开可能经 gzip / zstd / lz4 压缩的文件,返回可读的文件对象"""
+    if filePath.endswith(".gz"):
+        import gzip
+        return gzip.open(filePath, 'rb')
+    codec = codecForSidecar(filePath)
+    if codec == "zstd":
+        return _importCodec(codec).ZstdDecompressor().stream_reader(open(filePath, 'rb'))
+    if codec == "lz4":
+        return _importCodec(codec).open(filePath, 'rb')
+    return open(filePath, 'rb')
+
+
+def _readNiftiVolumeHeader(filePath):
+    """读取 NIfTI-1 文件头 (.nii / .nii.gz / .nii.zst / .nii.lz4)"""
+    import struct
+    import numpy as np
+    with _openMaybeCompressed(filePath) as f:
+        header = f.read(348)
+    if len(header) < 348:
+        raise ValueError(f"无效的 NIfTI 文件: {filePath}")
+    endian = "<" if struct.unpack("<i", header[:4])[0] == 348 else ">"
+
+    def unpack(fmt, offset):
+        return struct.unpack_from(endian + fmt, header, offset)
+
+    dim = unpack("8h", 40)
+    datatype = unpack("h", 70)[0]
+    pixdim = unpack("8f", 76)
+    sclSlope, sclInter = unpack("2f", 112)
+    qformCode, sformCode = unpack("2h", 252)
+
+    if sformCode > 0:
+        srow = np.array([unpack("4f", 280), unpack("4f", 296), unpack("4f", 312)], dtype=float)
+        axes = srow[:, :3].T.tolist()
+        origin = srow[:, 3].tolist()
+    else:
+        b, c, d = unpack("3f", 256)
+        qoffset = unpack("3f", 268)
+        a = np.sqrt(max(0.0, 1.0 - (b * b + c * c + d * d)))
+        rotation = np.array([
+            [a * a + b * b - c * c - d * d, 2 * (b * c - a * d), 2 * (b * d + a * c)],
+            [2 * (b * c + a * d), a * a + c * c - b * b - d * d, 2 * (c * d - a * b)],
+            [2 * (b * d - a * c), 2 * (c * d + a * b), a * a + d * d - c * c - b * b]])
+        qfac = -1.0 if pixdim[0] < 0 else 1.0
+        scales = np.array([pixdim[1] or 1.0, pixdim[2] or 1.0, (pixdim[3] or 1.0) * qfac])
+        axes = (rotation * scales).T.tolist() if qformCode > 0 else np.diag(np.abs(scales)).tolist()
+        origin = list(qoffset) if qformCode > 0 else [0.0, 0.0, 0.0]
+
+    # NIfTI 使用 RAS 坐标;ITK/Slicer 读取时 x,y 的符号处理与此一致
+    spacing, rasOrigin, direction, ijkToRAS = _geometryFromAxes(axes, origin, lps=False)
+    dims = [max(1, int(v)) for v in dim[1:4]]
+    components = int(dim[5]) if dim[0] >= 5 and dim[5] > 1 else 1
+    dtype = _NIFTI_TYPES.get(datatype)
+    if dtype is None:
+        raise ValueError(f"不支持的 NIfTI 数据类型: {datatype}")
+    # NIfTI 规范: scl_slope 为 0 表示不缩放
+    applyScale = sclSlope != 0.0 and (sclSlope != 1.0 or sclInter != 0.0)
+    return {
+        "format": "nifti",
+        "dimensions": dims,
+        "spacing": spacing,
+        "origin": rasOrigin,
+        "direction": direction,
+        "ijk_to_ras": ijkToRAS,
+        "number_of_components": components,
+        "dtype": endian + dtype,
+        "scalar_type": "float" if applyScale else _VTK_TYPE_NAMES[dtype],
+        "scale": (sclSlope, sclInter) if applyScale else (1.0, 0.0),
+    }
+
+
+def _readMetaVolumeHeader(filePath):
+    """读取 MetaImage 文件头 (.mha / .mhd)"""
+    fields = {}
+    with open(filePath, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            text = line.decode('latin-1').strip()
+            if "=" not in text:
+                continue
+            key, value = [part.strip() for part in text.split("=", 1)]
+            fields[key] = value
+            if key == "ElementDataFile":
+                break
+
+    dims = [int(v) for v in fields["DimSize"].split()]
+    spacingValues = [float(v) for v in fields.get("ElementSpacing", fields.get("ElementSize", "1 1 1")).split()]
+    origin = [float(v) for v in fields.get("Offset", fields.get("Origin", fields.get("Position", "0 0 0"))).split()]
+    matrix = [float(v) for v in fields.get("TransformMatrix", fields.get("Rotation", fields.get(
+        "Orientation", "1 0 0 0 1 0 0 0 1"))).split()]
+    nDims = len(dims)
+    # TransformMatrix 按列依次存储各轴方向
+    axes = [[matrix[i * nDims + j] * spacingValues[i] for j in range(nDims)] for i in range(nDims)]
+    while len(dims) < 3:
+        dims.append(1)
+        origin.append(0.0)
+    axes = [list(axis) + [0.0] * (3 - len(axis)) for axis in axes]
+    while len(axes) < 3:
+        axes.append([1.0 if i == len(axes) else 0.0 for i in range(3)])
+    spacing, rasOrigin, direction, ijkToRAS = _geometryFromAxes(axes, origin[:3], lps=True)
+
+    dtype = _META_TYPES[fields["ElementType"]]
+    bigEndian = fields.get("BinaryDataByteOrderMSB", fields.get("ElementByteOrderMSB", "False")) == "True"
+    return {
+        "format": "meta",
+        "dimensions": dims[:3],
+        "spacing": spacing,
+        "origin": rasOrigin,
+        "direction": direction,
+        "ijk_to_ras": ijkToRAS,
+        "number_of_components": int(fields.get("ElementNumberOfChannels", "1")),
+        "dtype": (">" if bigEndian else "<") + dtype,
+        "scalar_type": _VTK_TYPE_NAMES[dtype],
+        "scale": (1.0, 0.0),
+    }
+
+
+def volumeNameFromPath(filePath):
+    """
+    由文件路径生成节点名称(去掉 .nii.gz 等多重扩展名,与 Slicer 加载时的命名一致)
+
+    :param filePath: 文件路径
+    :return: 节点名称
+    """
+    name = os.path.basename(filePath.rstrip("/\\"))
+    lowerName = name.lower()
+    for extension in (".nii.gz", ".nii.zst", ".nii.lz4", ".nrrd", ".nhdr", ".nii", ".mha", ".mhd", ZARR_EXTENSION):
+        if lowerName.endswith(extension):
+            return name[:-len(extension)]
+    return os.path.splitext(name)[0]
+
+
+def readVolumeHeader(filePath):
+    """
+    只读取体积文件头,获取几何信息和数据类型,不解码图像数据
+
+    支持 NRRD (.nrrd/.nhdr)、NIfTI (.nii/.nii.gz/.nii.zst/.nii.lz4)、MetaImage (.mha/.mhd) 和分块 zarr (.zarr)
+
+    :param filePath: 文件路径
+    :return: 头信息字典 (dimensions, spacing, origin, direction 为 RAS 坐标)
+    """
+    lowerPath = filePath.lower().rstrip("/\\")
+    if lowerPath.endswith(ZARR_EXTENSION):
+        return readZarrHeader(filePath)
+    if lowerPath.endswith((".nrrd", ".nhdr")):
+        return _readNrrdVolumeHeader(filePath)
+    if ".nii" in os.path.basename(lowerPath):
+        return _readNiftiVolumeHeader(filePath)
+    if lowerPath.endswith((".mha", ".mhd")):
+        return _readMetaVolumeHeader(filePath)
+    raise ValueError(f"不支持读取文件头的格式: {filePath}")
+
+
+def decompressSidecarVolume(filePath, tempDir):
+    """
+    将 zstd / lz4 压缩的体积解压到临时目录,使 ITK 读取器可以直接读取
+
+    支持分离式 NRRD (.nhdr + .raw.zst / .raw.lz4) 和 .nii.zst / .nii.lz4;
+    普通的分离式 NRRD 和其他文件不需要解压
+
+    :param filePath: .nhdr 头文件或压缩文件路径
+    :param tempDir: 临时目录
+    :return: 可直接读取的文件路径,无需解压时返回 None
+    """
+    if filePath.lower().endswith(".nhdr"):
+        try:
+            headerLines, _ = readNrrdHeader(filePath)
+        except ValueError:
+            return None
+        dataFile = readNrrdField(headerLines, "data file")
+        codec = codecForSidecar(dataFile) if dataFile else None
+        if not codec:
+            return None
+        rawName = dataFile[:-len(SIDECAR_EXTENSIONS[codec])]
+        streamDecompressFile(os.path.join(os.path.dirname(filePath), dataFile), os.path.join(tempDir, rawName),
+                             codec)
+        loadPath = os.path.join(tempDir, os.path.basename(filePath))
+        with open(loadPath, 'wb') as f:
+            f.write(buildNrrdHeader(headerLines, {"data file": rawName}))
+        return loadPath
+
+    codec = codecForSidecar(filePath)
+    if not codec:
+        return None
+    loadPath = os.path.join(tempDir, os.path.basename(filePath)[:-len(SIDECAR_EXTENSIONS[codec])])
+    streamDecompressFile(filePath, loadPath, codec)
+    return loadPath
+
+
+def readVolumeImage(filePath):
+    """
+    用 SimpleITK 读取体积 (与 Slicer 加载体积使用相同的 ITK 读取器,几何和强度缩放一致)
+
+    不访问 MRML 场景,可在工作线程中调用;zstd / lz4 压缩的文件先解压到临时目录
+
+    :param filePath: 文件路径
+    :return: SimpleITK.Image
+    """
+    import shutil
+    import tempfile
+    import SimpleITK as sitk
+    tempDir = tempfile.mkdtemp(prefix="tmj_volume_")
+    try:
+        loadPath = decompressSidecarVolume(filePath, tempDir) or filePath
+        return sitk.ReadImage(loadPath)
+    finally:
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+
+def readVolumeArray(filePath, header=None):
+    """
+    读取体积图像数据为一维 numpy 数组(x 变化最快,与 vtkImageData 的存储顺序一致)
+
+    图像数据由 ITK 解码 (readVolumeImage);分块 zarr 格式由 readZarrRegion 读取
+
+    :param filePath: 文件路径
+    :param header: readVolumeHeader 的结果,为 None 时自动读取
+    :return: numpy 数组 (多分量时形状为 [N, 分量数])
+    """
+    header = header or readVolumeHeader(filePath)
+    components = header["number_of_components"]
+    if header["format"] == "zarr":
+        array = readZarrRegion(filePath)[0]
+    else:
+        import SimpleITK as sitk
+        array = sitk.GetArrayFromImage(readVolumeImage(filePath))
+    return array.reshape(-1, components) if components > 1 else array.reshape(-1)
+
+
+def computeIntensityStatistics(imageArray):
+    """
+    计算强度统计信息(纯 numpy 计算,可在工作线程中调用)
+
+    :param imageArray: 体积数据数组
+    :return: 统计信息字典
+    """
+    import numpy as np
+    return {
+        "min": float(np.min(imageArray)),
+        "max": float(np.max(imageArray)),
+        "mean": float(np.mean(imageArray)),
+        "std": float(np.std(imageArray)),
+        "median": float(np.median(imageArray))
+    }
+
+
+def classifyModality(imageArray, maxSamples=DEFAULT_MODALITY_SAMPLES):
+    """
+    根据固定 HU 区间内的体素比例判断数据类型 (CT 或 MR)
+
+    按固定步长抽取最多 maxSamples 个体素,直接统计空气 (-1100 ~ -900 HU)、软组织 (-200 ~ 200 HU)
+    和骨骼 (> 300 HU) 的比例: CT 视野外的空气占相当比例,MR 强度基本非负。
+    软组织和高值区在 MR 中也可能出现,只在存在空气时计入;
+    区间固定,不依赖直方图峰值和整数强度的分箱,运行时间与体积大小无关
+
+    :param imageArray: 体积数据数组
+    :param maxSamples: 最大抽样体素数
+    :return: 字典 {data_type, confidence, fractions {air, soft_tissue, bone}, sample_count}
+    """
+    import numpy as np
+    flat = imageArray.reshape(-1)
+    step = max(1, flat.size // maxSamples)
+    sample = flat[::step].astype(np.float32)
+    if sample.size == 0:
+        return {"data_type": "MR", "confidence": 0.0, "fractions": {}, "sample_count": 0}
+
+    airFraction = float(np.mean((sample >= -1100) & (sample <= -900)))
+    softTissueFraction = float(np.mean((sample >= -200) & (sample <= 200)))
+    boneFraction = float(np.mean(sample > 300))
+
+    # 5% 空气、20% 软组织、0.5% 骨骼即视为该项证据充分
+    airEvidence = min(1.0, airFraction / 0.05)
+    ctScore = airEvidence * (0.6 + 0.25 * min(1.0, softTissueFraction / 0.2) + 0.15 * min(1.0, boneFraction / 0.005))
+
+    dataType = "CT" if ctScore >= 0.5 else "MR"
+    confidence = ctScore if dataType == "CT" else 1.0 - ctScore
+    return {
+        "data_type": dataType,
+        "confidence": round(float(confidence), 3),
+        "fractions": {"air": round(airFraction, 4), "soft_tissue": round(softTissueFraction, 4),
+                      "bone": round(boneFraction, 4)},
+        "sample_count": int(sample.size)
+    }
+
+
+# 无损降级存储类型的候选整数类型(按存储大小从小到大)
+_DOWNCAST_CANDIDATES = ("u1", "i2", "u2", "i4")
+
+
+def numpyTypeForScalarType(scalarType):
+    """
+    将 VTK 标量类型名称 (如 'float', 'short') 转换为 numpy 类型代码
+
+    :param scalarType: VTK 标量类型名称
+    :return: numpy 类型代码 (如 'f4', 'i2')
+    """
+    for code, name in _VTK_TYPE_NAMES.items():
+        if name == scalarType:
+            return code
+    raise ValueError(f"不支持的标量类型: {scalarType}")
+
+
+def findLosslessIntegerType(imageArray, chunkVoxels=DEFAULT_CAST_CHUNK_VOXELS):
+    """
+    单次遍历检查数组能否无损转换为更小的整数类型
+
+    按块检查所有值为有限整数并记录取值范围,遇到非整数值立即返回
+
+    :param imageArray: 体积数据数组
+    :param chunkVoxels: 每块的体素数
+    :return: numpy 类型代码 (如 'i2');无法无损转换或不能减小存储时返回 None
+    """
+    import numpy as np
+    flat = imageArray.reshape(-1)
+    if flat.size == 0:
+        return None
+
+    isFloat = flat.dtype.kind == 'f'
+    low, high = None, None
+    for start in range(0, flat.size, chunkVoxels):
+        chunk = flat[start:start + chunkVoxels]
+        chunkMin, chunkMax = chunk.min(), chunk.max()
+        if isFloat:
+            # NaN 会传播到 min/max,inf 不是有限值
+            if not (np.isfinite(chunkMin) and np.isfinite(chunkMax)):
+                return None
+            if not np.array_equal(chunk, np.trunc(chunk)):
+                return None
+        low = chunkMin if low is None else min(low, chunkMin)
+        high = chunkMax if high is None else max(high, chunkMax)
+
+    for code in _DOWNCAST_CANDIDATES:
+        dtype = np.dtype(code)
+        if dtype.itemsize >= flat.dtype.itemsize:
+            break
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return code
+    return None
+
+
+def castArrayChunked(sourceArray, targetArray, chunkVoxels=DEFAULT_CAST_CHUNK_VOXELS):
+    """
+    按块将数组转换写入另一类型的数组,不产生整幅大小的临时数组
+
+    :param sourceArray: 源数组
+    :param targetArray: 目标数组(元素个数与源数组相同)
+    :param chunkVoxels: 每块的体素数
+    """
+    source = sourceArray.reshape(-1)
+    target = targetArray.reshape(-1)
+    if source.size != target.size:
+        raise ValueError("源数组与目标数组大小不一致")
+    for start in range(0, source.size, chunkVoxels):
+        target[start:start + chunkVoxels] = source[start:start + chunkVoxels]
+
+
+# ========== 分块 (tile) 存储格式,与 zarr v2 目录布局兼容 ==========
+
+ZARR_EXTENSION = ".zarr"
+
+# 默认分块大小 (k, j, i)
+DEFAULT_TILE_SHAPE = (64, 64, 64)
+
+# 导出压缩方式到 zarr 压缩器的映射 (gzip 使用同为 deflate 算法的 zlib)
+_ZARR_COMPRESSORS = {"gzip": "zlib", "zstd": "zstd", "none": None}
+
+
+def _compressTile(data, compressor):
+    """按 zarr 压缩器配置压缩一个分块"""
+    if compressor is None:
+        return data
+    if compressor["id"] == "zlib":
+        return zlib.compress(data, compressor["level"])
+    if compressor["id"] == "gzip":
+        import gzip
+        return gzip.compress(data, compresslevel=compressor["level"])
+    if compressor["id"] == "zstd":
+        return _importCodec("zstd").ZstdCompressor(level=compressor["level"]).compress(data)
+    raise ValueError(f"不支持的 zarr 压缩器: {compressor['id']}")
+
+
+def _decompressTile(data, compressor):
+    """按 zarr 压缩器配置解压一个分块"""
+    if compressor is None:
+        return data
+    if compressor["id"] in ("zlib", "gzip"):
+        # wbits=47 自动识别 zlib 和 gzip 头
+        return zlib.decompress(data, 47)
+    if compressor["id"] == "zstd":
+        return _importCodec("zstd").ZstdDecompressor().decompress(data)
+    raise ValueError(f"不支持的 zarr 压缩器: {compressor['id']}")
+
+
+def writeZarrVolume(imageArray, dimensions, ijkToRAS, zarrPath, executor=None, codec="gzip",
+                    level=DEFAULT_COMPRESSION_LEVEL, tileShape=DEFAULT_TILE_SHAPE, scalarType=None):
+    """
+    将体积写为分块压缩格式(zarr v2 目录布局)
+
+    目录中包含 .zarray (数组形状、分块大小、数据类型、压缩器)、.zattrs (IJK 到 RAS 的几何信息)
+    和每个分块的压缩数据文件 "k.j.i"。边缘分块按 zarr 规范以 0 填充到完整大小
+
+    :param imageArray: 体积数据数组(一维或 [k, j, i] 形状,x 变化最快)
+    :param dimensions: 体积维度 (i, j, k)
+    :param ijkToRAS: 4x4 IJK 到 RAS 矩阵
+    :param zarrPath: 输出目录路径 (.zarr)
+    :param executor: 并行压缩分块的线程池,为 None 时顺序执行
+    :param codec: 压缩方式 ('gzip', 'zstd', 'none')
+    :param level: 压缩级别
+    :param tileShape: 分块大小 (k, j, i)
+    :param scalarType: VTK 标量类型名称,记录在 .zattrs 中
+    :return: (原始字节数, 存储字节数)
+    """
+    import json
+    import itertools
+    import numpy as np
+    if codec not in _ZARR_COMPRESSORS:
+        raise ValueError(f"zarr 格式不支持压缩方式: {codec},可选: {', '.join(_ZARR_COMPRESSORS)}")
+    compressorId = _ZARR_COMPRESSORS[codec]
+    compressor = {"id": compressorId, "level": level} if compressorId else None
+
+    shape = (int(dimensions[2]), int(dimensions[1]), int(dimensions[0]))
+    volume = imageArray.reshape(shape + ((-1,) if imageArray.size != np.prod(shape) else ()))
+    chunks = tuple(int(v) for v in tileShape) + tuple(volume.shape[3:])
+
+    os.makedirs(zarrPath, exist_ok=True)
+    with open(os.path.join(zarrPath, ".zarray"), 'w', encoding='utf-8') as f:
+        json.dump({
+            "zarr_format": 2,
+            "shape": list(volume.shape),
+            "chunks": list(chunks),
+            "dtype": volume.dtype.str,
+            "compressor": compressor,
+            "fill_value": 0,
+            "order": "C",
+            "filters": None,
+            "dimension_separator": "."
+        }, f, indent=2)
+
+    ijkToRAS = np.asarray(ijkToRAS, dtype=float)
+    spacing, origin, direction, _ = _geometryFromAxes(ijkToRAS[:3, :3].T, ijkToRAS[:3, 3], lps=False)
+    with open(os.path.join(zarrPath, ".zattrs"), 'w', encoding='utf-8') as f:
+        json.dump({
+            "axes": ["k", "j", "i"] + (["c"] if volume.ndim == 4 else []),
+            "ijk_to_ras": ijkToRAS.tolist(),
+            "spacing": spacing,
+            "origin": origin,
+            "direction": direction,
+            "scalar_type": scalarType or _VTK_TYPE_NAMES.get(volume.dtype.str[1:], volume.dtype.name)
+        }, f, indent=2)
+
+    def writeTile(tileIndex):
+        start = [t * c for t, c in zip(tileIndex, chunks)]
+        region = tuple(slice(s, s + c) for s, c in zip(start, chunks[:3]))
+        tile = volume[region]
+        if tile.shape != chunks:
+            padded = np.zeros(chunks, dtype=volume.dtype)
+            padded[tuple(slice(0, n) for n in tile.shape)] = tile
+            tile = padded
+        data = _compressTile(np.ascontiguousarray(tile).tobytes(), compressor)
+        tileName = ".".join(str(t) for t in tileIndex) + (".0" if volume.ndim == 4 else "")
+        with open(os.path.join(zarrPath, tileName), 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    tileCounts = [-(-n // c) for n, c in zip(shape, chunks)]
+    tileIndices = list(itertools.product(*(range(n) for n in tileCounts)))
+    sizes = executor.map(writeTile, tileIndices) if executor else map(writeTile, tileIndices)
+    return volume.nbytes, sum(sizes)
+
+
+def readZarrHeader(zarrPath):
+    """
+    读取分块格式 (zarr) 的头信息,返回与 readVolumeHeader 相同结构的字典
+
+    :param zarrPath: .zarr 目录路径
+    :return: 头信息字典,另含 shape (k, j, i)、chunks 和 compressor
+    """
+    import json
+    import numpy as np
+    with open(os.path.join(zarrPath, ".zarray"), 'r', encoding='utf-8') as f:
+        zarray = json.load(f)
+    attributesPath = os.path.join(zarrPath, ".zattrs")
+    attributes = {}
+    if os.path.exists(attributesPath):
+        with open(attributesPath, 'r', encoding='utf-8') as f:
+            attributes = json.load(f)
+    if zarray.get("zarr_format") != 2 or zarray.get("order", "C") != "C" or zarray.get("filters"):
+        raise ValueError(f"只支持无过滤器、C 顺序的 zarr v2 数组: {zarrPath}")
+
+    shape = zarray["shape"]
+    ijkToRAS = np.array(attributes.get("ijk_to_ras", np.eye(4).tolist()), dtype=float)
+    spacing, origin, direction, _ = _geometryFromAxes(ijkToRAS[:3, :3].T, ijkToRAS[:3, 3], lps=False)
+    dtype = np.dtype(zarray["dtype"])
+    return {
+        "format": "zarr",
+        "dimensions": [shape[2], shape[1], shape[0]],
+        "spacing": spacing,
+        "origin": origin,
+        "direction": direction,
+        "ijk_to_ras": ijkToRAS.tolist(),
+        "number_of_components": shape[3] if len(shape) == 4 else 1,
+        "dtype": dtype.str,
+        "scalar_type": attributes.get("scalar_type", _VTK_TYPE_NAMES.get(dtype.str[1:], dtype.name)),
+        "scale": (1.0, 0.0),
+        "shape": shape,
+        "chunks": zarray["chunks"],
+        "compressor": zarray.get("compressor"),
+        "fill_value": zarray.get("fill_value") or 0,
+        "dimension_separator": zarray.get("dimension_separator", ".")
+    }
+
+
+def rasBoundsToIJKRange(ijkToRAS, dimensions, rasMin, rasMax):
+    """
+    计算 RAS 包围盒在体积 IJK 索引空间中覆盖的范围
+
+    :param ijkToRAS: 4x4 IJK 到 RAS 矩阵
+    :param dimensions: 体积维度 (i, j, k)
+    :param rasMin: 包围盒最小角 (R, A, S)
+    :param rasMax: 包围盒最大角 (R, A, S)
+    :return: (ijkMin, ijkMax) 半开区间,已裁剪到体积范围;不相交时返回 None
+    """
+    import itertools
+    import numpy as np
+    rasToIJK = np.linalg.inv(np.asarray(ijkToRAS, dtype=float))
+    corners = np.array([list(corner) + [1.0] for corner in itertools.product(*zip(rasMin, rasMax))])
+    ijkCorners = (rasToIJK @ corners.T)[:3].T
+    ijkMin = np.maximum(np.floor(ijkCorners.min(axis=0)).astype(int), 0)
+    ijkMax = np.minimum(np.ceil(ijkCorners.max(axis=0)).astype(int) + 1, np.asarray(dimensions, dtype=int))
+    if np.any(ijkMax <= ijkMin):
+        return None
+    return ijkMin.tolist(), ijkMax.tolist()
+
+
+def readZarrRegion(zarrPath, ijkMin=None, ijkMax=None, executor=None, header=None):
+    """
+    读取分块格式体积的一个子区域,只解压与区域相交的分块
+
+    :param zarrPath: .zarr 目录路径
+    :param ijkMin: 区域最小索引 (i, j, k),为 None 时从 0 开始
+    :param ijkMax: 区域最大索引 (i, j, k,不含),为 None 时到体积末尾
+    :param executor: 并行解压分块的线程池,为 None 时顺序执行
+    :param header: readZarrHeader 的结果,为 None 时自动读取
+    :return: ([k, j, i(, c)] 形状的 numpy 数组, 头信息字典)
+    """
+    import itertools
+    import numpy as np
+    header = header or readZarrHeader(zarrPath)
+    shape = header["shape"]
+    chunks = header["chunks"]
+    dtype = np.dtype(header["dtype"])
+    separator = header["dimension_separator"]
+
+    # (i, j, k) 转为数组顺序 (k, j, i)
+    start = [0, 0, 0] if ijkMin is None else [int(v) for v in reversed(ijkMin)]
+    stop = list(shape[:3]) if ijkMax is None else [int(v) for v in reversed(ijkMax)]
+    start = [max(0, s) for s in start]
+    stop = [min(n, s) for n, s in zip(shape[:3], stop)]
+    if any(b <= a for a, b in zip(start, stop)):
+        raise ValueError("读取区域与体积不相交")
+
+    result = np.full([b - a for a, b in zip(start, stop)] + list(shape[3:]), header["fill_value"], dtype=dtype)
+    tileRanges = [range(a // c, (b - 1) // c + 1) for a, b, c in zip(start, stop, chunks)]
+
+    def readTile(tileIndex):
+        tileName = separator.join(str(t) for t in tileIndex) + (separator + "0" if len(shape) == 4 else "")
+        tilePath = os.path.join(zarrPath, *tileName.split("/"))
+        if not os.path.exists(tilePath):
+            return  # 缺失的分块按 zarr 规范取 fill_value
+        with open(tilePath, 'rb') as f:
+            tile = np.frombuffer(_decompressTile(f.read(), header["compressor"]), dtype=dtype).reshape(chunks)
+        tileStart = [t * c for t, c in zip(tileIndex, chunks)]
+        source = tuple(slice(max(a, t) - t, min(b, t + c) - t)
+                       for a, b, t, c in zip(start, stop, tileStart, chunks))
+        target = tuple(slice(max(a, t) - a, min(b, t + c) - a)
+                       for a, b, t, c in zip(start, stop, tileStart, chunks))
+        result[target] = tile[source]
+
+    tileIndices = list(itertools.product(*tileRanges))
+    list(executor.map(readTile, tileIndices) if executor else map(readTile, tileIndices))
+    return result, header
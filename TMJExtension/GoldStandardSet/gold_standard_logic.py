@@ -4,6 +4,9 @@ Gold Standard Set Logic - 金标准设置模块的业务逻辑
 import logging
 import vtk
 import slicer
+from Common.scene_utils import sceneBatch, createModuleFolder, placeNodeInFolder
+from Common.transform_chain import getMatrixToParent, transformPoints
+from DataManager.memory_manager import reloadEvictedVolume
 
 
 class GoldStandardLogic:
@@ -42,121 +45,108 @@ class GoldStandardLogic:
         :return: 成功状态
         """
         try:
-            # 获取 Subject Hierarchy 节点
-            shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
-            sceneItemID = shNode.GetSceneItemID()
-            
-            # 检查总文件夹是否已存在
-            mainFolderItemID = shNode.GetItemChildWithName(sceneItemID, mainFolderName)
-            
-            if mainFolderItemID == 0:  # 不存在,创建新的总文件夹
-                mainFolderItemID = shNode.CreateFolderItem(sceneItemID, mainFolderName)
-                self.log(f"✓ 创建配准流程总文件夹: {mainFolderName}")
-            else:
-                self.log(f"✓ 使用已存在的总文件夹: {mainFolderName}")
-            
-            # 在总文件夹下创建模块子文件夹
-            moduleFolderItemID = shNode.CreateFolderItem(mainFolderItemID, moduleFolderName)
-            self.log(f"✓ 创建模块子文件夹: {moduleFolderName}")
+            # 文件夹和所有节点在同一个批处理中创建,结束时只刷新一次
+            with sceneBatch():
+                # 获取或创建总文件夹,并在其下创建模块子文件夹
+                shNode, mainFolderItemID, moduleFolderItemID = createModuleFolder(
+                    mainFolderName, moduleFolderName, logCallback=self.log)
             
-            # 1. 保存配准后的 Fixed Volume (原始的,不需要变换)
-            if fixedVolume:
-                fixedCopy = self._createVolumeInFolder(fixedVolume, "GoldStandard_Fixed", shNode, moduleFolderItemID)
-                self.log(f"✓ Fixed Volume 已保存")
+                # 1. 保存配准后的 Fixed Volume (原始的,不需要变换)
+                if fixedVolume:
+                    fixedCopy = self._createVolumeInFolder(fixedVolume, "GoldStandard_Fixed", shNode, moduleFolderItemID)
+                    self.log(f"✓ Fixed Volume 已保存")
             
-            # 2. 先保存变换矩阵（因为后面要用）
-            transformCopy = None
-            if transformNode:
-                transformCopy = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "GoldStandard_Transform")
+                # 2. 先保存变换矩阵（因为后面要用）
+                transformCopy = None
+                if transformNode:
+                    transformCopy = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "GoldStandard_Transform")
                 
-                # 复制变换矩阵
-                transformMatrix = vtk.vtkMatrix4x4()
-                transformNode.GetMatrixTransformToParent(transformMatrix)
-                transformCopy.SetMatrixTransformToParent(transformMatrix)
+                    # 复制变换矩阵
+                    transformCopy.SetMatrixTransformToParent(
+                        slicer.util.vtkMatrixFromArray(getMatrixToParent(transformNode)))
                 
-                # 移动到文件夹
-                transformItemID = shNode.GetItemByDataNode(transformCopy)
-                shNode.SetItemParent(transformItemID, moduleFolderItemID)
-                self.log(f"✓ 变换矩阵已保存")
+                    # 移动到文件夹
+                    placeNodeInFolder(shNode, transformCopy, moduleFolderItemID)
+                    self.log(f"✓ 变换矩阵已保存")
             
-            # 3. 保存 Moving Volume（深拷贝创建完全独立的副本）
-            movingCopy = None
-            if movingVolume:
-                # 使用深拷贝创建独立副本
-                movingCopy = slicer.mrmlScene.AddNewNodeByClass(movingVolume.GetClassName(), "GoldStandard_Moving")
+                # 3. 保存 Moving Volume（深拷贝创建完全独立的副本）
+                movingCopy = None
+                if movingVolume:
+                    # 使用深拷贝创建独立副本
+                    reloadEvictedVolume(movingVolume)
+                    movingCopy = slicer.mrmlScene.AddNewNodeByClass(movingVolume.GetClassName(), "GoldStandard_Moving")
                 
-                # 深拷贝图像数据（确保完全独立）
-                imageData = vtk.vtkImageData()
-                imageData.DeepCopy(movingVolume.GetImageData())
-                movingCopy.SetAndObserveImageData(imageData)
+                    # 深拷贝图像数据（确保完全独立）
+                    imageData = vtk.vtkImageData()
+                    imageData.DeepCopy(movingVolume.GetImageData())
+                    movingCopy.SetAndObserveImageData(imageData)
                 
-                # 复制几何属性
-                movingCopy.SetOrigin(movingVolume.GetOrigin())
-                movingCopy.SetSpacing(movingVolume.GetSpacing())
+                    # 复制几何属性
+                    movingCopy.SetOrigin(movingVolume.GetOrigin())
+                    movingCopy.SetSpacing(movingVolume.GetSpacing())
                 
-                # 复制方向矩阵
-                directionMatrix = vtk.vtkMatrix4x4()
-                movingVolume.GetIJKToRASDirectionMatrix(directionMatrix)
-                movingCopy.SetIJKToRASDirectionMatrix(directionMatrix)
+                    # 复制方向矩阵
+                    directionMatrix = vtk.vtkMatrix4x4()
+                    movingVolume.GetIJKToRASDirectionMatrix(directionMatrix)
+                    movingCopy.SetIJKToRASDirectionMatrix(directionMatrix)
                 
-                # 确保新副本没有任何变换绑定
-                movingCopy.SetAndObserveTransformNodeID(None)
+                    # 确保新副本没有任何变换绑定
+                    movingCopy.SetAndObserveTransformNodeID(None)
                 
-                # 绑定到新的 GoldStandard_Transform
-                if transformCopy:
-                    movingCopy.SetAndObserveTransformNodeID(transformCopy.GetID())
-                    self.log(f"✓ GoldStandard_Moving 已绑定到 GoldStandard_Transform")
+                    # 绑定到新的 GoldStandard_Transform
+                    if transformCopy:
+                        movingCopy.SetAndObserveTransformNodeID(transformCopy.GetID())
+                        self.log(f"✓ GoldStandard_Moving 已绑定到 GoldStandard_Transform")
                 
-                # 移动到文件夹
-                movingItemID = shNode.GetItemByDataNode(movingCopy)
-                shNode.SetItemParent(movingItemID, moduleFolderItemID)
+                    # 移动到文件夹
+                    placeNodeInFolder(shNode, movingCopy, moduleFolderItemID)
                 
-                self.log(f"✓ Moving Volume 已深拷贝保存为 GoldStandard_Moving（完全独立）")
+                    self.log(f"✓ Moving Volume 已深拷贝保存为 GoldStandard_Moving（完全独立）")
             
-            # 4. 保存 Fixed Fiducials（金标准参考 - 红色）
-            if fixedFiducials and fixedFiducials.GetNumberOfControlPoints() > 0:
-                fixedFidCopy = self._copyFiducials(fixedFiducials, "GoldStandard_Fixed_Fiducials", shNode, moduleFolderItemID)
-                # 设置为红色（金标准参考）
-                fidDisplayNode = fixedFidCopy.GetDisplayNode()
-                if fidDisplayNode:
-                    fidDisplayNode.SetSelectedColor(1.0, 0.0, 0.0)  # 红色
-                    fidDisplayNode.SetColor(1.0, 0.0, 0.0)
-                self.log(f"✓ Fixed 标注点已保存为金标准参考 (红色, {fixedFiducials.GetNumberOfControlPoints()} 个点)")
+                # 4. 保存 Fixed Fiducials（金标准参考 - 红色）
+                if fixedFiducials and fixedFiducials.GetNumberOfControlPoints() > 0:
+                    fixedFidCopy = self._copyFiducials(fixedFiducials, "GoldStandard_Fixed_Fiducials", shNode, moduleFolderItemID)
+                    # 设置为红色（金标准参考）
+                    fidDisplayNode = fixedFidCopy.GetDisplayNode()
+                    if fidDisplayNode:
+                        fidDisplayNode.SetSelectedColor(1.0, 0.0, 0.0)  # 红色
+                        fidDisplayNode.SetColor(1.0, 0.0, 0.0)
+                    self.log(f"✓ Fixed 标注点已保存为金标准参考 (红色, {fixedFiducials.GetNumberOfControlPoints()} 个点)")
             
-            # 5. 保存 Moving Fiducials（金标准参考 - 绿色，应该和 Fixed 重叠）
-            # 注意：这里直接复制坐标，不应用变换，因为标注点是在手动配准后的位置标的
-            # 手动配准后，Moving 已经和 Fixed 对齐，所以 Moving 上的点应该和 Fixed 上的点重叠
-            if movingFiducials and movingFiducials.GetNumberOfControlPoints() > 0:
-                # 直接复制，不应用变换
-                movingFidCopy = self._copyFiducials(movingFiducials, "GoldStandard_Moving_Fiducials", shNode, moduleFolderItemID)
-                # 设置为绿色（金标准参考）
-                fidDisplayNode = movingFidCopy.GetDisplayNode()
-                if fidDisplayNode:
-                    fidDisplayNode.SetSelectedColor(0.0, 1.0, 0.0)  # 绿色
-                    fidDisplayNode.SetColor(0.0, 1.0, 0.0)
-                self.log(f"✓ Moving 标注点已保存为金标准参考 (绿色, 与红色重叠, {movingFiducials.GetNumberOfControlPoints()} 个点)")
+                # 5. 保存 Moving Fiducials（金标准参考 - 绿色，应该和 Fixed 重叠）
+                # 注意：这里直接复制坐标，不应用变换，因为标注点是在手动配准后的位置标的
+                # 手动配准后，Moving 已经和 Fixed 对齐，所以 Moving 上的点应该和 Fixed 上的点重叠
+                if movingFiducials and movingFiducials.GetNumberOfControlPoints() > 0:
+                    # 直接复制，不应用变换
+                    movingFidCopy = self._copyFiducials(movingFiducials, "GoldStandard_Moving_Fiducials", shNode, moduleFolderItemID)
+                    # 设置为绿色（金标准参考）
+                    fidDisplayNode = movingFidCopy.GetDisplayNode()
+                    if fidDisplayNode:
+                        fidDisplayNode.SetSelectedColor(0.0, 1.0, 0.0)  # 绿色
+                        fidDisplayNode.SetColor(0.0, 1.0, 0.0)
+                    self.log(f"✓ Moving 标注点已保存为金标准参考 (绿色, 与红色重叠, {movingFiducials.GetNumberOfControlPoints()} 个点)")
             
-            # 6. 验证点对数量
-            fixedCount = fixedFiducials.GetNumberOfControlPoints() if fixedFiducials else 0
-            movingCount = movingFiducials.GetNumberOfControlPoints() if movingFiducials else 0
+                # 6. 验证点对数量
+                fixedCount = fixedFiducials.GetNumberOfControlPoints() if fixedFiducials else 0
+                movingCount = movingFiducials.GetNumberOfControlPoints() if movingFiducials else 0
             
-            if fixedCount == movingCount and fixedCount > 0:
-                self.log(f"✓ 点对验证通过: {fixedCount} 对点")
-            elif fixedCount == 0 and movingCount == 0:
-                self.log(f"⚠ 警告: 未保存标注点")
-            else:
-                self.log(f"⚠ 警告: 点对数量不匹配 (Fixed: {fixedCount}, Moving: {movingCount})")
+                if fixedCount == movingCount and fixedCount > 0:
+                    self.log(f"✓ 点对验证通过: {fixedCount} 对点")
+                elif fixedCount == 0 and movingCount == 0:
+                    self.log(f"⚠ 警告: 未保存标注点")
+                else:
+                    self.log(f"⚠ 警告: 点对数量不匹配 (Fixed: {fixedCount}, Moving: {movingCount})")
             
-            # 7. 保留原始标注点，使其跟随体积移动（用于后续配准误差计算）
-            self._setupOriginalFiducialsForTracking(fixedFiducials, movingFiducials, fixedVolume, movingVolume, transformCopy, mainFolderName)
+                # 7. 保留原始标注点，使其跟随体积移动（用于后续配准误差计算）
+                self._setupOriginalFiducialsForTracking(fixedFiducials, movingFiducials, fixedVolume, movingVolume, transformCopy, mainFolderName)
             
-            # 8. 只删除临时变换节点（保留标注点用于跟踪）
-            self._cleanupTemporaryTransform(transformNode, movingVolume)
+                # 8. 只删除临时变换节点（保留标注点用于跟踪）
+                self._cleanupTemporaryTransform(transformNode, movingVolume)
             
-            self.log(f"✓ 金标准数据保存完成")
-            self.log(f"  - 保存的体积: GoldStandard_Fixed, GoldStandard_Moving")
-            self.log(f"  - 变换关系: GoldStandard_Moving → GoldStandard_Transform")
-            self.log(f"  - 标注点对: {min(fixedCount, movingCount)} 对")
+                self.log(f"✓ 金标准数据保存完成")
+                self.log(f"  - 保存的体积: GoldStandard_Fixed, GoldStandard_Moving")
+                self.log(f"  - 变换关系: GoldStandard_Moving → GoldStandard_Transform")
+                self.log(f"  - 标注点对: {min(fixedCount, movingCount)} 对")
             
             return True
             
@@ -175,6 +165,7 @@ class GoldStandardLogic:
         :return: 新创建的体积节点
         """
         # 创建新的体积节点
+        reloadEvictedVolume(sourceVolume)
         volumeNode = slicer.mrmlScene.AddNewNodeByClass(sourceVolume.GetClassName(), newName)
         
         # 深拷贝图像数据（创建独立的图像数据副本）
@@ -195,8 +186,7 @@ class GoldStandardLogic:
         volumeNode.SetName(newName)
         
         # 将新节点移动到文件夹中
-        volumeItemID = shNode.GetItemByDataNode(volumeNode)
-        shNode.SetItemParent(volumeItemID, folderItemID)
+        placeNodeInFolder(shNode, volumeNode, folderItemID)
         
         return volumeNode
 
@@ -223,8 +213,7 @@ class GoldStandardLogic:
         self._copyDisplayProperties(sourceFiducials, fidCopy)
         
         # 移动到文件夹
-        fidItemID = shNode.GetItemByDataNode(fidCopy)
-        shNode.SetItemParent(fidItemID, folderItemID)
+        placeNodeInFolder(shNode, fidCopy, folderItemID)
         
         return fidCopy
 
@@ -241,30 +230,22 @@ class GoldStandardLogic:
         """
         fidCopy = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", newName)
         
-        # 复制所有标注点(应用变换)
-        for i in range(sourceFiducials.GetNumberOfControlPoints()):
-            pos = [0, 0, 0]
-            sourceFiducials.GetNthControlPointPosition(i, pos)
-            
-            # 如果 Moving 有变换,应用变换
-            if movingVolume and movingVolume.GetTransformNodeID():
-                transformNode = slicer.mrmlScene.GetNodeByID(movingVolume.GetTransformNodeID())
-                if transformNode:
-                    pos4 = [pos[0], pos[1], pos[2], 1.0]
-                    transformMatrix = vtk.vtkMatrix4x4()
-                    transformNode.GetMatrixTransformToParent(transformMatrix)
-                    transformedPos = transformMatrix.MultiplyPoint(pos4)
-                    pos = [transformedPos[0], transformedPos[1], transformedPos[2]]
-            
+        # 如果 Moving 有变换,所有标注点一次性应用变换
+        positions = slicer.util.arrayFromMarkupsControlPoints(sourceFiducials)
+        transformNode = movingVolume.GetParentTransformNode() if movingVolume else None
+        if transformNode and len(positions):
+            positions = transformPoints(positions, getMatrixToParent(transformNode))
+        
+        # 复制所有标注点
+        for i, pos in enumerate(positions):
             label = sourceFiducials.GetNthControlPointLabel(i)
-            fidCopy.AddControlPoint(pos, label)
+            fidCopy.AddControlPoint(list(pos), label)
         
         # 复制显示属性
         self._copyDisplayProperties(sourceFiducials, fidCopy)
         
         # 移动到文件夹
-        fidItemID = shNode.GetItemByDataNode(fidCopy)
-        shNode.SetItemParent(fidItemID, folderItemID)
+        placeNodeInFolder(shNode, fidCopy, folderItemID)
         
         return fidCopy
 
@@ -318,26 +299,12 @@ class GoldStandardLogic:
             # 关键：应用金标准变换的逆矩阵，使点回到初始位置
             movingFiducials.SetName("Moving_Fiducials")
             
-            # 获取金标准变换矩阵
-            transformMatrix = vtk.vtkMatrix4x4()
-            goldStandardTransform.GetMatrixTransformToParent(transformMatrix)
-            
-            # 计算逆矩阵
-            inverseMatrix = vtk.vtkMatrix4x4()
-            vtk.vtkMatrix4x4.Invert(transformMatrix, inverseMatrix)
-            
-            # 对每个标注点应用逆变换
-            for i in range(movingFiducials.GetNumberOfControlPoints()):
-                # 获取当前位置（世界坐标，配准后）
-                pos = [0, 0, 0]
-                movingFiducials.GetNthControlPointPosition(i, pos)
-                
-                # 应用逆变换：配准后位置 -> 初始位置
-                pos4 = [pos[0], pos[1], pos[2], 1.0]
-                newPos = inverseMatrix.MultiplyPoint(pos4)
-                
-                # 更新标注点位置
-                movingFiducials.SetNthControlPointPosition(i, newPos[0], newPos[1], newPos[2])
+            # 对所有标注点一次性应用金标准变换的逆矩阵：配准后位置 -> 初始位置
+            positions = slicer.util.arrayFromMarkupsControlPoints(movingFiducials)
+            if len(positions):
+                inverseMatrix = getMatrixToParent(goldStandardTransform, inverse=True)
+                slicer.util.updateMarkupsControlPointsFromArray(movingFiducials,
+                                                                transformPoints(positions, inverseMatrix))
             
             self.log(f"✓ Moving 标注点已应用逆变换，回到初始位置")
             
@@ -359,8 +326,7 @@ class GoldStandardLogic:
                 dataManagerFolderID = shNode.GetItemChildWithName(mainFolderItemID, "Data Manager")
                 if dataManagerFolderID != 0:
                     # 移动标注点到 Data Manager 文件夹
-                    fidItemID = shNode.GetItemByDataNode(movingFiducials)
-                    shNode.SetItemParent(fidItemID, dataManagerFolderID)
+                    placeNodeInFolder(shNode, movingFiducials, dataManagerFolderID)
                     self.log(f"✓ Moving_Fiducials 已移动到 Data Manager 文件夹")
                 else:
                     self.log(f"⚠️ 未找到 Data Manager 文件夹，标注点保持在根目录")
@@ -0,0 +1,9 @@
+"""
+Intensity Refinement 模块
+用于基于图像强度 (Mattes 互信息) 的精配准
+"""
+
+from .intensity_refinement_widget import IntensityRefinementWidget
+from .intensity_refinement_logic import IntensityRefinementLogic
+
+__all__ = ['IntensityRefinementWidget', 'IntensityRefinementLogic']
@@ -0,0 +1,166 @@
+"""
+Intensity Refinement Logic - 基于图像强度的精配准业务逻辑
+以粗配准变换为初值,在 ROI 掩膜内优化 Mattes 互信息,得到精配准变换
+"""
+import logging
+import vtk
+import slicer
+import numpy as np
+from Common.scene_utils import sceneBatch, createModuleFolder, placeNodeInFolder
+from Common.transform_chain import getMatrixToWorld
+from DataManager.memory_manager import markRegenerable, reloadEvictedVolume
+from . import intensity_registration
+
+
+class IntensityRefinementLogic:
+    """
+    Intensity Refinement 的业务逻辑类
+    负责从场景节点取出图像、调用 SimpleITK 配准并创建结果变换节点
+    """
+
+    def __init__(self, logCallback=None):
+        """
+        初始化 Intensity Refinement Logic
+
+        :param logCallback: 日志回调函数
+        """
+        self.logCallback = logCallback
+        # 最近一次精配准的结果字典 (度量值、迭代次数、停止条件)
+        self.lastResult = None
+
+    def log(self, message):
+        """日志输出"""
+        logging.info(message)
+        if self.logCallback:
+            self.logCallback(message)
+
+    def refineRegistration(self, fixedVolume, movingVolume, initialTransformNode, maskVolume=None, rigid=False,
+                           pyramidLevels=intensity_registration.DEFAULT_PYRAMID_LEVELS,
+                           iterations=intensity_registration.DEFAULT_ITERATIONS,
+                           histogramBins=intensity_registration.DEFAULT_HISTOGRAM_BINS,
+                           samplingPercentage=intensity_registration.DEFAULT_SAMPLING_PERCENTAGE,
+                           samplingStrategy="random", numberOfThreads=None, iterationCallback=None):
+        """
+        在 ROI 掩膜内以 Mattes 互信息精配准
+
+        Moving 图像按其自身几何取出 (忽略其父变换),初始变换为粗配准变换在世界坐标系下的矩阵
+
+        :param fixedVolume: Fixed Volume (CBCT)
+        :param movingVolume: Moving Volume (MRI)
+        :param initialTransformNode: 粗配准变换节点 (CoarseReg_Transform)
+        :param maskVolume: Fixed 图像上的 ROI 掩膜 (Fixed_ROI_Mask),为 None 时使用整幅图像
+        :param rigid: 是否只优化旋转和平移 (保留粗配准缩放)
+        :param pyramidLevels: 金字塔层数
+        :param iterations: 每层最大迭代次数
+        :param histogramBins: 直方图区间数
+        :param samplingPercentage: 掩膜内的采样比例 (0-1]
+        :param samplingStrategy: "random" 随机采样, "regular" 规则网格 (分层) 采样
+        :param numberOfThreads: 线程数,为 None 时使用全部 CPU 核心
+        :param iterationCallback: 每次迭代后调用 (level, iteration, metricValue)
+        :return: 精配准变换节点 (Refined_Transform)
+        """
+        try:
+            import sitkUtils
+
+            if not fixedVolume or not movingVolume:
+                raise ValueError("Fixed Volume 和 Moving Volume 不能为空")
+            # 已换出到磁盘的体积 (如 Fixed_ROI_Mask) 先重新加载再读取体素
+            for volumeNode in (fixedVolume, movingVolume, maskVolume):
+                if volumeNode:
+                    reloadEvictedVolume(volumeNode)
+
+            self.log(f"开始强度精配准 ({'刚体' if rigid else '相似'}变换, Mattes 互信息)")
+            self.log(f"  Fixed: {fixedVolume.GetName()}, Moving: {movingVolume.GetName()}")
+
+            initialMatrix = np.eye(4)
+            if initialTransformNode:
+                if not initialTransformNode.IsLinear():
+                    raise ValueError("初始变换必须是线性变换")
+                initialMatrix = getMatrixToWorld(initialTransformNode)
+                self.log(f"  初始变换: {initialTransformNode.GetName()}")
+            else:
+                self.log(f"⚠ 未选择初始变换,从单位变换开始,可能无法收敛")
+            if fixedVolume.GetParentTransformNode():
+                self.log(f"⚠ Fixed Volume 带有父变换,精配准按其原始几何计算")
+
+            fixedImage = sitkUtils.PullVolumeFromSlicer(fixedVolume)
+            movingImage = sitkUtils.PullVolumeFromSlicer(movingVolume)
+            fixedMask = None
+            if maskVolume:
+                fixedMask = sitkUtils.PullVolumeFromSlicer(maskVolume)
+                self.log(f"  ROI 掩膜: {maskVolume.GetName()}")
+            else:
+                self.log(f"⚠ 未选择 ROI 掩膜,在整幅 Fixed 图像上计算互信息")
+
+            result = intensity_registration.registerMattesSimilarity(
+                fixedImage, movingImage, initialMatrix, fixedMask=fixedMask, rigid=rigid,
+                pyramidLevels=pyramidLevels, iterations=iterations, histogramBins=histogramBins,
+                samplingPercentage=samplingPercentage, samplingStrategy=samplingStrategy,
+                numberOfThreads=numberOfThreads,
+                logCallback=self.log, iterationCallback=iterationCallback)
+            self.lastResult = result
+
+            transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "Refined_Transform")
+            transformNode.SetMatrixTransformToParent(slicer.util.vtkMatrixFromArray(result["matrix"]))
+
+            # 精配准相对粗配准的修正量
+            correction = result["matrix"] @ np.linalg.inv(initialMatrix)
+            rotationDeg = np.degrees(np.arccos(np.clip(
+                (np.trace(correction[:3, :3]) / np.cbrt(np.linalg.det(correction[:3, :3])) - 1.0) / 2.0, -1.0, 1.0)))
+            self.log(f"✓ 强度精配准完成: 共 {result['iterations']} 次迭代")
+            self.log(f"  互信息: {result['initial_metric']:.4f} → {result['final_metric']:.4f}")
+            self.log(f"  修正量: 平移 {np.linalg.norm(correction[:3, 3]):.2f} mm, 旋转 {rotationDeg:.2f}°, "
+                     f"缩放 {result['scale']:.4f}")
+            self.log(f"  停止条件: {result['stop_condition']}")
+
+            return transformNode
+
+        except Exception as e:
+            self.log(f"✗ 强度精配准失败: {str(e)}")
+            raise
+
+    def saveRefinementToScene(self, movingVolume, transformNode, mainFolderName, moduleFolderName):
+        """
+        将精配准结果保存到场景文件夹中
+
+        :param movingVolume: Moving Volume 节点
+        :param transformNode: 精配准变换节点
+        :param mainFolderName: 配准流程总文件夹名称
+        :param moduleFolderName: 模块子文件夹名称
+        :return: 成功状态
+        """
+        try:
+            # 文件夹和所有节点在同一个批处理中创建,结束时只刷新一次
+            with sceneBatch():
+                shNode, mainFolderItemID, moduleFolderItemID = createModuleFolder(
+                    mainFolderName, moduleFolderName, logCallback=self.log)
+
+                # 1. 保存变换矩阵
+                transformNode.SetName("Refined_Transform")
+                placeNodeInFolder(shNode, transformNode, moduleFolderItemID)
+                self.log(f"✓ 精配准变换已保存")
+
+                # 2. 创建绑定精配准变换的 Moving Volume (深拷贝,不重采样)
+                if movingVolume:
+                    reloadEvictedVolume(movingVolume)
+                    movingCopy = slicer.mrmlScene.AddNewNodeByClass(movingVolume.GetClassName(), "Refined_Moving")
+                    imageData = vtk.vtkImageData()
+                    imageData.DeepCopy(movingVolume.GetImageData())
+                    movingCopy.SetAndObserveImageData(imageData)
+                    ijkToRAS = vtk.vtkMatrix4x4()
+                    movingVolume.GetIJKToRASMatrix(ijkToRAS)
+                    movingCopy.SetIJKToRASMatrix(ijkToRAS)
+                    movingCopy.SetAndObserveTransformNodeID(transformNode.GetID())
+                    # 可由 Moving Volume 和变换重新生成,内存不足时允许换出到磁盘
+                    markRegenerable(movingCopy)
+                    placeNodeInFolder(shNode, movingCopy, moduleFolderItemID)
+                    self.log(f"✓ 精配准后的 Moving Volume 已保存并绑定变换")
+
+                self.log(f"✓ 精配准结果保存完成")
+                self.log(f"  - 变换关系: Refined_Moving → Refined_Transform")
+
+            return True
+
+        except Exception as e:
+            self.log(f"保存精配准结果到场景时出错: {str(e)}")
+            raise
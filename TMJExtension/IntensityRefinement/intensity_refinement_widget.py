@@ -0,0 +1,299 @@
+"""
+Intensity Refinement Widget - 强度精配准模块的UI界面
+"""
+import os
+import qt
+import ctk
+import slicer
+from .intensity_refinement_logic import IntensityRefinementLogic
+from . import intensity_registration
+
+
+class IntensityRefinementWidget:
+    """
+    Intensity Refinement 的UI组件类
+    负责基于 ROI 掩膜和互信息的精配准界面
+    """
+
+    def __init__(self, parent, logCallback, getMainFolderNameCallback):
+        """
+        初始化 Intensity Refinement Widget
+
+        :param parent: 父布局
+        :param logCallback: 日志回调函数
+        :param getMainFolderNameCallback: 获取主文件夹名称的回调函数
+        """
+        self.parent = parent
+        self.logCallback = logCallback
+        self.getMainFolderNameCallback = getMainFolderNameCallback
+        self.logic = IntensityRefinementLogic(logCallback=logCallback)
+
+        # UI 组件引用
+        self.irFixedVolumeSelector = None
+        self.irMovingVolumeSelector = None
+        self.irInitialTransformSelector = None
+        self.irMaskSelector = None
+        self.transformTypeComboBox = None
+        self.pyramidLevelsSpinBox = None
+        self.iterationsSpinBox = None
+        self.samplingSpinBox = None
+        self.threadsSpinBox = None
+        self.refineButton = None
+        self.irModuleFolderNameEdit = None
+        self.saveResultButton = None
+        self.irStatusLabel = None
+
+        # 精配准得到的变换节点 (尚未保存到场景文件夹)
+        self.refinedTransform = None
+
+        self.setupUI()
+
+    def setupUI(self):
+        """设置 Intensity Refinement 的UI界面"""
+        refineCollapsibleButton = ctk.ctkCollapsibleButton()
+        refineCollapsibleButton.text = "Intensity Refinement"
+        refineCollapsibleButton.collapsed = True  # 默认折叠
+        self.parent.addWidget(refineCollapsibleButton)
+        refineFormLayout = qt.QFormLayout(refineCollapsibleButton)
+
+        # 选择数据
+        selectLabel = qt.QLabel("选择精配准的数据:")
+        selectLabel.setStyleSheet("font-weight: bold; margin-top: 10px;")
+        refineFormLayout.addRow(selectLabel)
+
+        self.irFixedVolumeSelector = self._createNodeSelector(
+            ["vtkMRMLScalarVolumeNode"], "选择 Fixed Volume (CBCT)")
+        refineFormLayout.addRow("Fixed Volume (CBCT): ", self.irFixedVolumeSelector)
+
+        self.irMovingVolumeSelector = self._createNodeSelector(
+            ["vtkMRMLScalarVolumeNode"], "选择 Moving Volume (MRI),按其原始几何配准,忽略已绑定的变换")
+        refineFormLayout.addRow("Moving Volume (MRI): ", self.irMovingVolumeSelector)
+
+        self.irInitialTransformSelector = self._createNodeSelector(
+            ["vtkMRMLLinearTransformNode"], "精配准的初始变换,通常是 Coarse Registration 生成的 CoarseReg_Transform")
+        refineFormLayout.addRow("粗配准变换: ", self.irInitialTransformSelector)
+
+        self.irMaskSelector = self._createNodeSelector(
+            ["vtkMRMLLabelMapVolumeNode"], "只在该掩膜内计算互信息,通常是 ROI Mask Set 生成的 Fixed_ROI_Mask")
+        refineFormLayout.addRow("ROI 掩膜 (可选): ", self.irMaskSelector)
+
+        # 配准参数
+        paramLabel = qt.QLabel("配准参数设置:")
+        paramLabel.setStyleSheet("font-weight: bold; margin-top: 10px;")
+        refineFormLayout.addRow(paramLabel)
+
+        self.transformTypeComboBox = qt.QComboBox()
+        self.transformTypeComboBox.addItem("相似变换 (旋转+平移+缩放)")
+        self.transformTypeComboBox.addItem("刚体变换 (保留粗配准缩放)")
+        refineFormLayout.addRow("变换类型: ", self.transformTypeComboBox)
+
+        self.pyramidLevelsSpinBox = qt.QSpinBox()
+        self.pyramidLevelsSpinBox.minimum = 1
+        self.pyramidLevelsSpinBox.maximum = 5
+        self.pyramidLevelsSpinBox.value = intensity_registration.DEFAULT_PYRAMID_LEVELS
+        self.pyramidLevelsSpinBox.setToolTip("高斯金字塔层数,每层下采样因子减半 (如 4, 2, 1)")
+        refineFormLayout.addRow("金字塔层数: ", self.pyramidLevelsSpinBox)
+
+        self.iterationsSpinBox = qt.QSpinBox()
+        self.iterationsSpinBox.minimum = 10
+        self.iterationsSpinBox.maximum = 2000
+        self.iterationsSpinBox.value = intensity_registration.DEFAULT_ITERATIONS
+        self.iterationsSpinBox.setToolTip("每层最大迭代次数")
+        refineFormLayout.addRow("每层迭代次数: ", self.iterationsSpinBox)
+
+        self.samplingSpinBox = qt.QDoubleSpinBox()
+        self.samplingSpinBox.minimum = 0.01
+        self.samplingSpinBox.maximum = 1.0
+        self.samplingSpinBox.singleStep = 0.05
+        self.samplingSpinBox.value = intensity_registration.DEFAULT_SAMPLING_PERCENTAGE
+        self.samplingSpinBox.setToolTip("掩膜内参与互信息计算的采样体素比例,1 为使用全部体素")
+        refineFormLayout.addRow("采样比例: ", self.samplingSpinBox)
+
+        # 选项顺序与 intensity_registration.SAMPLING_STRATEGIES 一致
+        self.samplingStrategyComboBox = qt.QComboBox()
+        self.samplingStrategyComboBox.addItem("随机采样")
+        self.samplingStrategyComboBox.addItem("规则网格采样 (分层)")
+        self.samplingStrategyComboBox.setToolTip("掩膜内采样点的选取方式,采样点在每层金字塔开始时计算一次;"
+                                                 "规则网格采样在每个网格单元内随机扰动,覆盖更均匀")
+        refineFormLayout.addRow("采样策略: ", self.samplingStrategyComboBox)
+
+        self.threadsSpinBox = qt.QSpinBox()
+        self.threadsSpinBox.minimum = 1
+        self.threadsSpinBox.maximum = max(1, os.cpu_count() or 1)
+        self.threadsSpinBox.value = self.threadsSpinBox.maximum
+        self.threadsSpinBox.setToolTip("计算互信息及其梯度的线程数")
+        refineFormLayout.addRow("线程数: ", self.threadsSpinBox)
+
+        self.refineButton = qt.QPushButton("执行强度精配准")
+        self.refineButton.toolTip = "以粗配准变换为初值,在 ROI 掩膜内优化 Mattes 互信息"
+        self.refineButton.enabled = False
+        self.refineButton.connect('clicked(bool)', self.onRefine)
+        refineFormLayout.addRow(self.refineButton)
+
+        # 保存结果
+        saveLabel = qt.QLabel("保存精配准结果:")
+        saveLabel.setStyleSheet("font-weight: bold; margin-top: 10px;")
+        refineFormLayout.addRow(saveLabel)
+
+        self.irModuleFolderNameEdit = qt.QLineEdit()
+        self.irModuleFolderNameEdit.text = "Intensity Refinement"
+        self.irModuleFolderNameEdit.setToolTip("Intensity Refinement 模块在总场景文件夹下的子文件夹名称")
+        refineFormLayout.addRow("Intensity Refinement场景子文件夹:", self.irModuleFolderNameEdit)
+
+        self.saveResultButton = qt.QPushButton("保存精配准结果到场景")
+        self.saveResultButton.toolTip = "将精配准变换和绑定变换的 Moving Volume 保存到场景文件夹"
+        self.saveResultButton.enabled = False
+        self.saveResultButton.connect('clicked(bool)', self.onSaveResult)
+        refineFormLayout.addRow(self.saveResultButton)
+
+        # 状态信息
+        self.irStatusLabel = qt.QLabel("状态: 等待选择数据")
+        self.irStatusLabel.setStyleSheet("color: gray;")
+        refineFormLayout.addRow(self.irStatusLabel)
+
+        # 添加模块末尾分隔线
+        separator = qt.QFrame()
+        separator.setFrameShape(qt.QFrame.HLine)
+        separator.setFrameShadow(qt.QFrame.Plain)
+        separator.setLineWidth(2)
+        separator.setMidLineWidth(0)
+        separator.setStyleSheet("QFrame { background-color: #000000; max-height: 2px; margin: 15px 0px; }")
+        refineFormLayout.addRow(separator)
+
+        # 连接信号
+        self.irFixedVolumeSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.updateButtonStates)
+        self.irMovingVolumeSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.updateButtonStates)
+        self.irInitialTransformSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.updateButtonStates)
+
+    def _createNodeSelector(self, nodeTypes, toolTip):
+        """
+        创建节点选择框
+
+        :param nodeTypes: 节点类型列表
+        :param toolTip: 提示信息
+        :return: qMRMLNodeComboBox
+        """
+        selector = slicer.qMRMLNodeComboBox()
+        selector.nodeTypes = nodeTypes
+        selector.selectNodeUponCreation = False
+        selector.addEnabled = False
+        selector.removeEnabled = False
+        selector.noneEnabled = True
+        selector.showHidden = False
+        selector.setMRMLScene(slicer.mrmlScene)
+        selector.setToolTip(toolTip)
+        return selector
+
+    def updateButtonStates(self):
+        """更新按钮状态"""
+        try:
+            hasFixed = self.irFixedVolumeSelector.currentNode() is not None
+            hasMoving = self.irMovingVolumeSelector.currentNode() is not None
+            hasTransform = self.irInitialTransformSelector.currentNode() is not None
+
+            self.refineButton.enabled = hasFixed and hasMoving
+
+            if not hasFixed or not hasMoving:
+                self.irStatusLabel.text = "状态: 请选择 Fixed Volume 和 Moving Volume"
+                self.irStatusLabel.setStyleSheet("color: orange;")
+            elif not hasTransform:
+                self.irStatusLabel.text = "状态: 建议选择粗配准变换作为初值"
+                self.irStatusLabel.setStyleSheet("color: #FF9800;")
+            else:
+                self.irStatusLabel.text = "状态: 准备就绪，可以执行精配准"
+                self.irStatusLabel.setStyleSheet("color: green;")
+
+        except Exception as e:
+            self.logCallback(f"更新按钮状态失败: {str(e)}")
+
+    def onRefine(self):
+        """执行强度精配准"""
+        try:
+            fixedVolume = self.irFixedVolumeSelector.currentNode()
+            movingVolume = self.irMovingVolumeSelector.currentNode()
+            if not fixedVolume or not movingVolume:
+                self.showError("请选择 Fixed Volume 和 Moving Volume")
+                return
+
+            self.logCallback(f"===== 开始强度精配准 =====")
+            self.refineButton.enabled = False
+            self.saveResultButton.enabled = False
+            self.irStatusLabel.text = "状态: 正在精配准..."
+            self.irStatusLabel.setStyleSheet("color: blue;")
+
+            # 未保存的上一次结果直接替换
+            if self.refinedTransform:
+                slicer.mrmlScene.RemoveNode(self.refinedTransform)
+                self.refinedTransform = None
+
+            self.refinedTransform = self.logic.refineRegistration(
+                fixedVolume, movingVolume,
+                self.irInitialTransformSelector.currentNode(),
+                maskVolume=self.irMaskSelector.currentNode(),
+                rigid=self.transformTypeComboBox.currentIndex == 1,
+                pyramidLevels=self.pyramidLevelsSpinBox.value,
+                iterations=self.iterationsSpinBox.value,
+                samplingPercentage=self.samplingSpinBox.value,
+                samplingStrategy=intensity_registration.SAMPLING_STRATEGIES[
+                    self.samplingStrategyComboBox.currentIndex],
+                numberOfThreads=self.threadsSpinBox.value,
+                iterationCallback=self.onIteration)
+
+            self.refineButton.enabled = True
+            result = self.logic.lastResult
+            self.irStatusLabel.text = (f"状态: 精配准完成 (互信息 {result['initial_metric']:.4f} → "
+                                       f"{result['final_metric']:.4f}),请保存到场景")
+            self.irStatusLabel.setStyleSheet("color: green;")
+            self.saveResultButton.enabled = True
+
+        except Exception as e:
+            self.refineButton.enabled = True
+            self.showError(f"强度精配准失败: {str(e)}")
+
+    def onIteration(self, level, iteration, metricValue):
+        """迭代进度回调,每10次迭代刷新一次界面"""
+        if iteration % 10 == 0:
+            self.irStatusLabel.text = (f"状态: 第 {level + 1}/{self.pyramidLevelsSpinBox.value} 层, "
+                                       f"迭代 {iteration}, 互信息 {metricValue:.4f}")
+            slicer.app.processEvents()
+
+    def onSaveResult(self):
+        """保存精配准结果到场景"""
+        try:
+            if not self.refinedTransform:
+                self.showError("请先执行强度精配准")
+                return
+
+            mainFolderName = self.getMainFolderNameCallback()
+            moduleFolderName = self.irModuleFolderNameEdit.text
+            if not mainFolderName or not moduleFolderName:
+                self.showError("请输入文件夹名称")
+                return
+
+            self.logCallback(f"正在保存精配准结果到场景...")
+            self.logCallback(f"  总文件夹: {mainFolderName}")
+            self.logCallback(f"  Intensity Refinement 子文件夹: {moduleFolderName}")
+
+            success = self.logic.saveRefinementToScene(
+                self.irMovingVolumeSelector.currentNode(), self.refinedTransform,
+                mainFolderName, moduleFolderName)
+
+            if success:
+                self.refinedTransform = None
+                self.irStatusLabel.text = "状态: 结果已保存到场景"
+                self.irStatusLabel.setStyleSheet("color: green;")
+                self.saveResultButton.enabled = False
+            else:
+                self.showError("保存结果失败")
+
+        except Exception as e:
+            self.showError(f"保存结果失败: {str(e)}")
+
+    def showError(self, errorMessage):
+        """显示错误信息"""
+        self.logCallback(f"✗ 错误: {errorMessage}")
+        self.irStatusLabel.text = f"状态: 错误"
+        self.irStatusLabel.setStyleSheet("color: red;")
+        slicer.util.errorDisplay(errorMessage)
+        import traceback
+        self.logCallback(traceback.format_exc())
@@ -0,0 +1,230 @@
+"""
+Intensity Registration - 基于图像强度的相似/刚体精配准
+以粗配准变换为初值,在 Fixed_ROI_Mask 区域内优化 CBCT 与 MRI 之间的 Mattes 互信息,
+使用多分辨率高斯金字塔,度量和梯度由 SimpleITK 多线程计算。
+只使用 SimpleITK 和 numpy,不访问 MRML 场景,可以在无界面的环境中运行
+"""
+import os
+import numpy as np
+
+
+# 默认金字塔层数 (下采样因子 4, 2, 1)
+DEFAULT_PYRAMID_LEVELS = 3
+
+# 每层最大迭代次数
+DEFAULT_ITERATIONS = 200
+
+# Mattes 互信息的直方图区间数
+DEFAULT_HISTOGRAM_BINS = 50
+
+# 掩膜内采样的体素比例
+DEFAULT_SAMPLING_PERCENTAGE = 0.2
+
+# 度量采样策略: 随机采样, 规则网格采样 (网格内随机扰动,即分层采样)
+SAMPLING_STRATEGIES = ("random", "regular")
+
+# 裁剪 Fixed 图像时在掩膜包围盒外保留的边距 (mm),为高斯平滑留出支撑范围
+_CROP_MARGIN_MM = 10.0
+
+# RAS 与 LPS 坐标系之间的转换矩阵 (自身的逆)
+_RAS_TO_LPS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+
+def pyramidSchedule(levels):
+    """
+    由金字塔层数生成下采样因子和平滑尺度
+
+    :param levels: 金字塔层数
+    :return: (下采样因子列表, 平滑尺度列表 (体素))
+    """
+    shrinkFactors = [2 ** level for level in reversed(range(levels))]
+    smoothingSigmas = [factor / 2.0 if factor > 1 else 0.0 for factor in shrinkFactors]
+    return shrinkFactors, smoothingSigmas
+
+
+def rasToParentToItkMatrix(matrixToParent):
+    """
+    Slicer 变换 (Moving → Fixed, RAS) 转换为 ITK 配准变换 (Fixed → Moving, LPS)
+
+    :param matrixToParent: 4x4 numpy 数组
+    :return: 4x4 numpy 数组
+    """
+    return _RAS_TO_LPS @ np.linalg.inv(matrixToParent) @ _RAS_TO_LPS
+
+
+def itkMatrixToRasToParent(itkMatrix):
+    """
+    ITK 配准变换 (Fixed → Moving, LPS) 转换为 Slicer 变换 (Moving → Fixed, RAS)
+
+    :param itkMatrix: 4x4 numpy 数组
+    :return: 4x4 numpy 数组
+    """
+    return np.linalg.inv(_RAS_TO_LPS @ itkMatrix @ _RAS_TO_LPS)
+
+
+def _transformToMatrix(transform):
+    """
+    ITK 仿射类变换 (矩阵、中心、平移) 转换为 4x4 齐次矩阵
+
+    :param transform: SimpleITK 变换
+    :return: 4x4 numpy 数组
+    """
+    matrix = np.array(transform.GetMatrix()).reshape(3, 3)
+    center = np.array(transform.GetCenter())
+    translation = np.array(transform.GetTranslation())
+    result = np.eye(4)
+    result[:3, :3] = matrix
+    result[:3, 3] = center + translation - matrix @ center
+    return result
+
+
+def _binaryMask(maskImage, referenceImage):
+    """
+    掩膜二值化并对齐到参考图像网格
+
+    :param maskImage: SimpleITK 掩膜图像
+    :param referenceImage: Fixed 图像
+    :return: sitkUInt8 掩膜
+    """
+    import SimpleITK as sitk
+    mask = sitk.Cast(maskImage > 0, sitk.sitkUInt8)
+    sameGrid = (mask.GetSize() == referenceImage.GetSize() and
+                np.allclose(mask.GetOrigin(), referenceImage.GetOrigin()) and
+                np.allclose(mask.GetSpacing(), referenceImage.GetSpacing()) and
+                np.allclose(mask.GetDirection(), referenceImage.GetDirection()))
+    if not sameGrid:
+        mask = sitk.Resample(mask, referenceImage, sitk.Transform(), sitk.sitkNearestNeighbor, 0, sitk.sitkUInt8)
+    return mask
+
+
+def _cropToMask(fixedImage, mask, marginMm):
+    """
+    将 Fixed 图像和掩膜裁剪到掩膜包围盒 (加边距),金字塔和梯度只在该区域内计算
+
+    :param fixedImage: Fixed 图像
+    :param mask: 与 Fixed 同网格的二值掩膜
+    :param marginMm: 边距 (mm)
+    :return: (裁剪后的 Fixed 图像, 裁剪后的掩膜)
+    """
+    import SimpleITK as sitk
+    shapeStatistics = sitk.LabelShapeStatisticsImageFilter()
+    shapeStatistics.Execute(mask)
+    if not shapeStatistics.HasLabel(1):
+        raise ValueError("ROI 掩膜为空")
+    boundingBox = shapeStatistics.GetBoundingBox(1)
+    dimension = fixedImage.GetDimension()
+    start, stop = boundingBox[:dimension], boundingBox[dimension:]
+    margin = [int(np.ceil(marginMm / spacing)) for spacing in fixedImage.GetSpacing()]
+    index = [max(0, s - m) for s, m in zip(start, margin)]
+    size = [min(imageSize, s + n + m) - i
+            for imageSize, s, n, m, i in zip(fixedImage.GetSize(), start, stop, margin, index)]
+    return sitk.RegionOfInterest(fixedImage, size, index), sitk.RegionOfInterest(mask, size, index)
+
+
+def registerMattesSimilarity(fixedImage, movingImage, initialMatrix, fixedMask=None, rigid=False,
+                             pyramidLevels=DEFAULT_PYRAMID_LEVELS, iterations=DEFAULT_ITERATIONS,
+                             histogramBins=DEFAULT_HISTOGRAM_BINS, samplingPercentage=DEFAULT_SAMPLING_PERCENTAGE,
+                             samplingStrategy="random", numberOfThreads=None, seed=42, logCallback=None,
+                             iterationCallback=None):
+    """
+    Mattes 互信息相似 (或刚体) 配准
+
+    刚体模式同样使用 Similarity3DTransform,但将缩放参数的优化权重设为 0,保留粗配准得到的缩放
+
+    :param fixedImage: Fixed 图像 (SimpleITK, LPS)
+    :param movingImage: Moving 图像 (SimpleITK, LPS)
+    :param initialMatrix: 初始变换,Slicer 约定的 4x4 矩阵 (Moving → Fixed, RAS)
+    :param fixedMask: Fixed 图像上的 ROI 掩膜 (SimpleITK),为 None 时使用整幅图像
+    :param rigid: 是否固定缩放只优化旋转和平移
+    :param pyramidLevels: 金字塔层数
+    :param iterations: 每层最大迭代次数
+    :param histogramBins: 直方图区间数
+    :param samplingPercentage: 采样比例 (0-1]
+    :param samplingStrategy: "random" 随机采样, "regular" 规则网格采样 (网格内随机扰动,即分层采样);
+                             采样点只取自掩膜内,每层金字塔开始时计算一次
+    :param numberOfThreads: 线程数,为 None 时使用全部 CPU 核心
+    :param seed: 随机采样种子,保证结果可复现
+    :param logCallback: 日志回调函数
+    :param iterationCallback: 每次迭代后调用 (level, iteration, metricValue),可用于刷新界面
+    :return: 结果字典 {matrix, initial_metric, final_metric, iterations, stop_condition, scale}
+    """
+    import SimpleITK as sitk
+    if samplingStrategy not in SAMPLING_STRATEGIES:
+        raise ValueError(f"不支持的采样策略: {samplingStrategy} (可选: {', '.join(SAMPLING_STRATEGIES)})")
+
+    def log(message):
+        if logCallback:
+            logCallback(message)
+
+    fixedImage = sitk.Cast(fixedImage, sitk.sitkFloat32)
+    movingImage = sitk.Cast(movingImage, sitk.sitkFloat32)
+    if fixedMask is not None:
+        fixedMask = _binaryMask(fixedMask, fixedImage)
+        fixedImage, fixedMask = _cropToMask(fixedImage, fixedMask, _CROP_MARGIN_MM)
+        log(f"  Fixed 图像裁剪到掩膜区域: {fixedImage.GetSize()}")
+
+    # 初始变换: 中心放在 Fixed 区域中心,使旋转与平移参数解耦
+    itkMatrix = rasToParentToItkMatrix(np.asarray(initialMatrix, dtype=float))
+    center = np.array(fixedImage.TransformContinuousIndexToPhysicalPoint(
+        [(size - 1) / 2.0 for size in fixedImage.GetSize()]))
+    linear = itkMatrix[:3, :3]
+    transform = sitk.Similarity3DTransform()
+    transform.SetCenter(center.tolist())
+    transform.SetMatrix(linear.ravel().tolist(), 1e-6)
+    transform.SetTranslation((itkMatrix[:3, 3] - center + linear @ center).tolist())
+
+    shrinkFactors, smoothingSigmas = pyramidSchedule(pyramidLevels)
+
+    registration = sitk.ImageRegistrationMethod()
+    registration.SetMetricAsMattesMutualInformation(numberOfHistogramBins=histogramBins)
+    if samplingPercentage < 1.0:
+        registration.SetMetricSamplingStrategy(
+            registration.REGULAR if samplingStrategy == "regular" else registration.RANDOM)
+        registration.SetMetricSamplingPercentage(samplingPercentage, seed)
+    else:
+        registration.SetMetricSamplingStrategy(registration.NONE)
+    if fixedMask is not None:
+        registration.SetMetricFixedMask(fixedMask)
+    registration.SetInterpolator(sitk.sitkLinear)
+    registration.SetOptimizerAsRegularStepGradientDescent(
+        learningRate=1.0, minStep=1e-4, numberOfIterations=iterations,
+        relaxationFactor=0.5, gradientMagnitudeTolerance=1e-8)
+    registration.SetOptimizerScalesFromPhysicalShift()
+    if rigid:
+        # 参数顺序: 版本向量 (3), 平移 (3), 缩放 (1)
+        registration.SetOptimizerWeights([1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0])
+    registration.SetShrinkFactorsPerLevel(shrinkFactors)
+    registration.SetSmoothingSigmasPerLevel(smoothingSigmas)
+    registration.SmoothingSigmasAreSpecifiedInPhysicalUnitsOff()
+    registration.SetInitialTransform(transform, inPlace=True)
+
+    state = {"level": -1, "iterations": 0}
+
+    def onLevel():
+        state["level"] += 1
+        level = state["level"]
+        log(f"  金字塔第 {level + 1}/{pyramidLevels} 层: 下采样 {shrinkFactors[level]}, "
+            f"平滑 {smoothingSigmas[level]:.1f} 体素")
+
+    def onIteration():
+        state["iterations"] += 1
+        if iterationCallback:
+            iterationCallback(state["level"], registration.GetOptimizerIteration(), registration.GetMetricValue())
+
+    registration.AddCommand(sitk.sitkMultiResolutionIterationEvent, onLevel)
+    registration.AddCommand(sitk.sitkIterationEvent, onIteration)
+
+    # 度量与梯度在 ITK 内部按线程分块计算,线程数只设置在本次配准对象上
+    registration.SetNumberOfThreads(numberOfThreads or os.cpu_count() or 1)
+    initialMetric = registration.MetricEvaluate(fixedImage, movingImage)
+    registration.Execute(fixedImage, movingImage)
+    finalMetric = registration.MetricEvaluate(fixedImage, movingImage)
+
+    return {
+        "matrix": itkMatrixToRasToParent(_transformToMatrix(transform)),
+        "initial_metric": float(initialMetric),
+        "final_metric": float(finalMetric),
+        "iterations": state["iterations"],
+        "stop_condition": registration.GetOptimizerStopConditionDescription(),
+        "scale": float(transform.GetScale()),
+    }
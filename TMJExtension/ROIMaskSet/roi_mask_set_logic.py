@@ -6,6 +6,9 @@ import vtk
 import slicer
 import numpy as np
 import qt
+from Common.scene_utils import sceneBatch, createModuleFolder, placeNodeInFolder
+from Common.transform_chain import getMatrixToParent, transformPoints
+from DataManager.memory_manager import markRegenerable, reloadEvictedVolume
 
 
 class ROIMaskSetLogic:
@@ -40,6 +43,10 @@ class ROIMaskSetLogic:
         try:
             if not roiMovingVolume:
                 raise ValueError("ROI Moving Volume 不能为空")
+            # 已换出到磁盘的体积先重新加载再读取图像数据
+            reloadEvictedVolume(roiMovingVolume)
+            if fixedVolume:
+                reloadEvictedVolume(fixedVolume)
 
             self.logCallback(f"步骤1: 根据ROI MRI生成LabelMap Volume")
             self.logCallback(f"  ROI MRI: {roiMovingVolume.GetName()}")
@@ -145,29 +152,8 @@ class ROIMaskSetLogic:
                 # 3.1 准备坐标变换
                 self.logCallback(f"  正在准备坐标变换...")
                 
-                # CBCT的IJK到RAS变换
-                cbctIjkToRas = vtk.vtkMatrix4x4()
-                fixedVolume.GetIJKToRASMatrix(cbctIjkToRas)
-                
-                # ROI LabelMap的RAS到IJK变换
-                roiRasToIjk = vtk.vtkMatrix4x4()
-                labelMapVolume.GetRASToIJKMatrix(roiRasToIjk)
-                
-                # 如果有变换，需要先应用变换
-                if transformNode:
-                    # 获取变换矩阵
-                    transformMatrix = vtk.vtkMatrix4x4()
-                    transformNode.GetMatrixTransformToParent(transformMatrix)
-                    
-                    # 组合变换: CBCT IJK -> RAS -> Transform -> ROI RAS -> ROI IJK
-                    rasToIjkWithTransform = vtk.vtkMatrix4x4()
-                    
-                    # 先应用变换的逆矩阵
-                    inverseTransform = vtk.vtkMatrix4x4()
-                    vtk.vtkMatrix4x4.Invert(transformMatrix, inverseTransform)
-                    
-                    vtk.vtkMatrix4x4.Multiply4x4(roiRasToIjk, inverseTransform, rasToIjkWithTransform)
-                    roiRasToIjk.DeepCopy(rasToIjkWithTransform)
+                # 组合变换: CBCT IJK -> RAS -> 逆变换 -> ROI RAS -> ROI IJK
+                cbctIjkToRoiIjk = self._getCBCTToROIIJKMatrix(fixedVolume, labelMapVolume, transformNode)
                 
                 # 3.2 创建与CBCT几何完全一致的LabelMap
                 self.logCallback(f"  正在创建CBCT ROI LabelMap...")
@@ -189,24 +175,10 @@ class ROIMaskSetLogic:
                 self.logCallback(f"  正在填充ROI区域...")
                 roiVoxelCount = 0
                 
+                # 逐层向量化变换体素坐标
                 for k in range(cbctDims[2]):
-                    for j in range(cbctDims[1]):
-                        for i in range(cbctDims[0]):
-                            # 将CBCT的IJK坐标转换为RAS物理坐标
-                            cbctIjkPoint = [i, j, k, 1.0]
-                            rasPoint = cbctIjkToRas.MultiplyPoint(cbctIjkPoint)
-                            
-                            # 将RAS坐标转换到ROI LabelMap的IJK坐标
-                            roiIjkPoint = roiRasToIjk.MultiplyPoint(rasPoint)
-                            
-                            # 检查是否在ROI LabelMap的范围内
-                            if (0 <= roiIjkPoint[0] < roiDims[0] and
-                                0 <= roiIjkPoint[1] < roiDims[1] and
-                                0 <= roiIjkPoint[2] < roiDims[2]):
-                                # 在ROI LabelMap范围内，标记为1
-                                idx = i + j * cbctDims[0] + k * cbctDims[0] * cbctDims[1]
-                                cbctLabelMapArray[idx] = 1
-                                roiVoxelCount += 1
+                    roiVoxelCount += self._markROIRows(cbctLabelMapArray, cbctDims, roiDims, cbctIjkToRoiIjk,
+                                                       k, 0, cbctDims[1])
                 
                 cbctLabelMapData.GetPointData().GetScalars().Modified()
                 
@@ -215,6 +187,8 @@ class ROIMaskSetLogic:
                 cbctROILabelMap.SetAndObserveImageData(cbctLabelMapData)
                 cbctROILabelMap.CopyOrientation(fixedVolume)
                 cbctROILabelMap.CreateDefaultDisplayNodes()
+                # 掩膜可由 ROI MRI 重新生成,内存不足时允许换出到磁盘
+                markRegenerable(cbctROILabelMap)
                 
                 # 3.5 设置显示颜色: 0=浅蓝色, 1=浅紫色，透明度1
                 displayNode = cbctROILabelMap.GetDisplayNode()
@@ -269,36 +243,21 @@ class ROIMaskSetLogic:
         try:
             self.logCallback(f"开始保存ROI掩膜到场景...")
             
-            # 1. 获取Subject Hierarchy节点
-            shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
-            sceneItemID = shNode.GetSceneItemID()
+            # 文件夹和所有节点在同一个批处理中创建,结束时只刷新一次
+            with sceneBatch():
+                # 1-3. 查找或创建主文件夹,删除旧的模块子文件夹后重新创建
+                shNode, mainFolderItemID, moduleFolderItemID = createModuleFolder(
+                    mainFolderName, moduleFolderName, replaceExisting=True, logCallback=self.logCallback)
             
-            # 2. 查找或创建主文件夹
-            mainFolderItemID = shNode.GetItemChildWithName(sceneItemID, mainFolderName)
-            if not mainFolderItemID:
-                mainFolderItemID = shNode.CreateFolderItem(sceneItemID, mainFolderName)
-                self.logCallback(f"✓ 创建主文件夹: {mainFolderName}")
-            else:
-                self.logCallback(f"  使用已存在的主文件夹: {mainFolderName}")
-            
-            # 3. 查找或创建模块子文件夹
-            moduleFolderItemID = shNode.GetItemChildWithName(mainFolderItemID, moduleFolderName)
-            if moduleFolderItemID:
-                # 删除旧文件夹内容
-                self.logCallback(f"  删除旧的 {moduleFolderName} 文件夹内容...")
-                shNode.RemoveItem(moduleFolderItemID)
-            
-            moduleFolderItemID = shNode.CreateFolderItem(mainFolderItemID, moduleFolderName)
-            self.logCallback(f"✓ 创建模块子文件夹: {moduleFolderName}")
+                # 4. 将掩膜节点添加到场景文件夹（创建深拷贝,保持原名称）
+                self.logCallback(f"  正在添加掩膜到场景文件夹...")
+                maskName = maskVolume.GetName()  # 使用掩膜的实际名称
+                maskCopy = self._createVolumeInFolder(maskVolume, maskName, shNode, moduleFolderItemID)
+                markRegenerable(maskCopy)
+                self.logCallback(f"✓ 掩膜已添加到场景: {maskCopy.GetName()}")
             
-            # 4. 将掩膜节点添加到场景文件夹（创建深拷贝,保持原名称）
-            self.logCallback(f"  正在添加掩膜到场景文件夹...")
-            maskName = maskVolume.GetName()  # 使用掩膜的实际名称
-            maskCopy = self._createVolumeInFolder(maskVolume, maskName, shNode, moduleFolderItemID)
-            self.logCallback(f"✓ 掩膜已添加到场景: {maskCopy.GetName()}")
-            
-            self.logCallback(f"✓ ROI掩膜已成功保存到场景文件夹")
-            self.logCallback(f"  路径: {mainFolderName}/{moduleFolderName}/{maskName}")
+                self.logCallback(f"✓ ROI掩膜已成功保存到场景文件夹")
+                self.logCallback(f"  路径: {mainFolderName}/{moduleFolderName}/{maskName}")
             
             return True
 
@@ -319,6 +278,7 @@ class ROIMaskSetLogic:
         :return: 新创建的volume节点
         """
         # 创建新的volume节点
+        reloadEvictedVolume(sourceVolume)
         if sourceVolume.IsA("vtkMRMLLabelMapVolumeNode"):
             newVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode", newName)
         else:
@@ -343,8 +303,7 @@ class ROIMaskSetLogic:
                 newDisplayNode.SetAndObserveColorNodeID(sourceDisplayNode.GetColorNode().GetID())
         
         # 将新节点添加到指定文件夹
-        volumeItemID = shNode.GetItemByDataNode(newVolume)
-        shNode.SetItemParent(volumeItemID, folderItemID)
+        placeNodeInFolder(shNode, newVolume, folderItemID)
         
         return newVolume
     
@@ -412,6 +371,7 @@ class ROIMaskSetLogic:
         try:
             if not roiMovingVolume:
                 raise ValueError("ROI Moving Volume 不能为空")
+            reloadEvictedVolume(roiMovingVolume)
 
             self.logCallback("步骤1: 根据ROI MRI生成LabelMap Volume")
             
@@ -494,23 +454,10 @@ class ROIMaskSetLogic:
         """
         try:
             self.logCallback("步骤3: 异步生成针对CBCT的ROI LabelMap")
+            reloadEvictedVolume(fixedVolume)
             
-            # 准备坐标变换矩阵
-            cbctIjkToRas = vtk.vtkMatrix4x4()
-            fixedVolume.GetIJKToRASMatrix(cbctIjkToRas)
-            
-            roiRasToIjk = vtk.vtkMatrix4x4()
-            labelMapVolume.GetRASToIJKMatrix(roiRasToIjk)
-            
-            # 如果有变换，组合变换矩阵
-            if transformNode:
-                transformMatrix = vtk.vtkMatrix4x4()
-                transformNode.GetMatrixTransformToParent(transformMatrix)
-                inverseTransform = vtk.vtkMatrix4x4()
-                vtk.vtkMatrix4x4.Invert(transformMatrix, inverseTransform)
-                rasToIjkWithTransform = vtk.vtkMatrix4x4()
-                vtk.vtkMatrix4x4.Multiply4x4(roiRasToIjk, inverseTransform, rasToIjkWithTransform)
-                roiRasToIjk.DeepCopy(rasToIjkWithTransform)
+            # 准备坐标变换矩阵: CBCT IJK -> ROI IJK
+            cbctIjkToRoiIjk = self._getCBCTToROIIJKMatrix(fixedVolume, labelMapVolume, transformNode)
             
             cbctImageData = fixedVolume.GetImageData()
             cbctDims = cbctImageData.GetDimensions()
@@ -528,8 +475,7 @@ class ROIMaskSetLogic:
             self.asyncData = {
                 'cbctDims': cbctDims,
                 'roiDims': roiDims,
-                'cbctIjkToRas': cbctIjkToRas,
-                'roiRasToIjk': roiRasToIjk,
+                'cbctIjkToRoiIjk': cbctIjkToRoiIjk,
                 'cbctLabelMapArray': cbctLabelMapArray,
                 'cbctLabelMapData': cbctLabelMapData,
                 'maskName': maskName,  # 添加掩膜名称
@@ -538,7 +484,7 @@ class ROIMaskSetLogic:
                 'roiVoxelCount': 0,
                 'currentK': 0,  # 当前K层
                 'currentJ': 0,  # 当前J行
-                'rowsPerChunk': 10,  # 每次处理10行
+                'rowsPerChunk': 128,  # 每次处理128行 (整块向量化计算)
                 'progressCallback': progressCallback,
                 'completedCallback': completedCallback,
                 'cancelled': False  # 取消标志
@@ -581,21 +527,9 @@ class ROIMaskSetLogic:
             # 处理当前块（若干行）
             endJ = min(currentJ + rowsPerChunk, cbctDims[1])
             
-            # 遍历当前块的所有体素
-            for j in range(currentJ, endJ):
-                for i in range(cbctDims[0]):
-                    # CBCT IJK -> RAS -> ROI IJK
-                    cbctIjkPoint = [i, j, currentK, 1.0]
-                    rasPoint = data['cbctIjkToRas'].MultiplyPoint(cbctIjkPoint)
-                    roiIjkPoint = data['roiRasToIjk'].MultiplyPoint(rasPoint)
-                    
-                    # 检查是否在ROI范围内
-                    if (0 <= roiIjkPoint[0] < roiDims[0] and
-                        0 <= roiIjkPoint[1] < roiDims[1] and
-                        0 <= roiIjkPoint[2] < roiDims[2]):
-                        idx = i + j * cbctDims[0] + currentK * cbctDims[0] * cbctDims[1]
-                        data['cbctLabelMapArray'][idx] = 1
-                        data['roiVoxelCount'] += 1
+            # 当前块的所有体素一次性变换 (CBCT IJK -> ROI IJK)
+            data['roiVoxelCount'] += self._markROIRows(data['cbctLabelMapArray'], cbctDims, roiDims,
+                                                       data['cbctIjkToRoiIjk'], currentK, currentJ, endJ)
             
             # 检查是否完成当前层
             if endJ >= cbctDims[1]:
@@ -630,6 +564,45 @@ class ROIMaskSetLogic:
                 self.asyncData['completedCallback'](None)
             self.asyncData = None
     
+    def _getCBCTToROIIJKMatrix(self, fixedVolume, labelMapVolume, transformNode):
+        """
+        CBCT IJK -> RAS -> (变换的逆) -> ROI RAS -> ROI IJK 的组合矩阵
+
+        :param fixedVolume: Fixed Volume (CBCT)
+        :param labelMapVolume: ROI LabelMap (MRI 几何)
+        :param transformNode: Moving → Fixed 变换节点,可为 None
+        :return: 4x4 numpy 数组
+        """
+        cbctIjkToRas = vtk.vtkMatrix4x4()
+        fixedVolume.GetIJKToRASMatrix(cbctIjkToRas)
+        roiRasToIjk = vtk.vtkMatrix4x4()
+        labelMapVolume.GetRASToIJKMatrix(roiRasToIjk)
+        matrix = slicer.util.arrayFromVTKMatrix(roiRasToIjk)
+        if transformNode:
+            matrix = matrix @ getMatrixToParent(transformNode, inverse=True)
+        return matrix @ slicer.util.arrayFromVTKMatrix(cbctIjkToRas)
+
+    def _markROIRows(self, labelMapArray, cbctDims, roiDims, cbctIjkToRoiIjk, k, startJ, endJ):
+        """
+        标记 CBCT 第 k 层 [startJ, endJ) 行中落在 ROI LabelMap 范围内的体素
+
+        :param labelMapArray: CBCT 掩膜的扁平数组 (i 变化最快)
+        :param cbctDims: CBCT 尺寸 (i, j, k)
+        :param roiDims: ROI LabelMap 尺寸 (i, j, k)
+        :param cbctIjkToRoiIjk: CBCT IJK → ROI IJK 的 4x4 矩阵
+        :param k: 层索引
+        :param startJ: 起始行
+        :param endJ: 结束行 (不含)
+        :return: 标记的体素数
+        """
+        j, i = np.mgrid[startJ:endJ, 0:cbctDims[0]]
+        cbctIjk = np.column_stack([i.ravel(), j.ravel(), np.full(i.size, k)])
+        roiIjk = transformPoints(cbctIjk, cbctIjkToRoiIjk)
+        inside = np.all((roiIjk >= 0) & (roiIjk < np.array(roiDims)), axis=1)
+        offset = startJ * cbctDims[0] + k * cbctDims[0] * cbctDims[1]
+        labelMapArray[offset:offset + i.size][inside] = 1
+        return int(inside.sum())
+
     def _finalizeCBCTMask(self, data):
         """
         完成CBCT掩膜生成，创建最终节点
@@ -650,6 +623,8 @@ class ROIMaskSetLogic:
             cbctROILabelMap.SetAndObserveImageData(data['cbctLabelMapData'])
             cbctROILabelMap.CopyOrientation(data['fixedVolume'])
             cbctROILabelMap.CreateDefaultDisplayNodes()
+            # 掩膜可由 ROI MRI 重新生成,内存不足时允许换出到磁盘
+            markRegenerable(cbctROILabelMap)
             
             # 设置自定义颜色表
             displayNode = cbctROILabelMap.GetDisplayNode()
@@ -25,6 +25,7 @@ from CoarseRegistration.coarse_registration_widget import CoarseRegistrationWidg
 from CoarseRegistration.coarse_registration_logic import CoarseRegistrationLogic
 from ROIMaskSet.roi_mask_set_widget import ROIMaskSetWidget
 from ROIMaskSet.roi_mask_set_logic import ROIMaskSetLogic
+from IntensityRefinement.intensity_refinement_widget import IntensityRefinementWidget
 
 
 #
@@ -46,6 +47,7 @@ Data Manager 模块用于导入、管理和导出医学影像数据，保留原
 Gold Standard Set 模块用于手动配准和金标准设置。
 Coarse Registration 模块用于基于基准点的粗配准。
 ROI Mask Set 模块用于生成颞下颌关节ROI区域的掩膜。
+Intensity Refinement 模块在ROI掩膜内基于互信息对粗配准结果进行精配准。
 """
         self.parent.acknowledgementText = """
 This module was developed for TMJ research.
@@ -69,6 +71,7 @@ class TMJExtensionWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.goldStandardWidget = None
         self.coarseRegistrationWidget = None
         self.roiMaskSetWidget = None
+        self.intensityRefinementWidget = None
 
     def setup(self):
         """设置主界面"""
@@ -104,6 +107,17 @@ class TMJExtensionWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             getMainFolderNameCallback=self.dataManagerWidget.getMainFolderName
         )
 
+        # 创建 Intensity Refinement 模块
+        self.intensityRefinementWidget = IntensityRefinementWidget(
+            parent=self.layout,
+            logCallback=self.addLog,
+            getMainFolderNameCallback=self.dataManagerWidget.getMainFolderName
+        )
+
+        # 各模块的体积选择框选中已换出的体积时自动重新加载
+        for comboBox in slicer.util.findChildren(self.parent, className="qMRMLNodeComboBox"):
+            comboBox.connect("currentNodeChanged(vtkMRMLNode*)", self.dataManagerWidget.memoryManager.touch)
+
         # 日志区域
         self.setupLogArea()
 
@@ -154,24 +168,54 @@ class TMJExtensionWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
                 self.addLog(f"✓ 清除了 {cache_cleared} 个缓存目录")
             
             # 步骤2: 重载所有子模块
+            import Common.scene_utils as common_scene_utils
+            import Common.transform_chain as common_transform_chain
+            import DataManager.volume_io as dm_volume_io
+            import DataManager.volume_index as dm_volume_index
+            import DataManager.dicom_io as dm_dicom_io
+            import DataManager.memory_manager as dm_memory_manager
+            import DataManager.session_snapshot as dm_session_snapshot
+            import DataManager.review_queue as dm_review_queue
             import DataManager.data_manager_logic as dm_logic
             import DataManager.data_manager_widget as dm_widget
             import GoldStandardSet.gold_standard_logic as gs_logic
             import GoldStandardSet.gold_standard_widget as gs_widget
+            import CoarseRegistration.landmark_registration as cr_landmark_registration
+            import CoarseRegistration.batch_registration as cr_batch_registration
+            import CoarseRegistration.landmark_proposals as cr_landmark_proposals
+            import CoarseRegistration.surface_icp as cr_surface_icp
             import CoarseRegistration.coarse_registration_logic as cr_logic
             import CoarseRegistration.coarse_registration_widget as cr_widget
             import ROIMaskSet.roi_mask_set_logic as rm_logic
             import ROIMaskSet.roi_mask_set_widget as rm_widget
+            import IntensityRefinement.intensity_registration as ir_intensity_registration
+            import IntensityRefinement.intensity_refinement_logic as ir_logic
+            import IntensityRefinement.intensity_refinement_widget as ir_widget
             
             modules_to_reload = [
+                ('Common.SceneUtils', common_scene_utils),
+                ('Common.TransformChain', common_transform_chain),
+                ('DataManager.VolumeIO', dm_volume_io),
+                ('DataManager.VolumeIndex', dm_volume_index),
+                ('DataManager.DicomIO', dm_dicom_io),
+                ('DataManager.ReviewQueue', dm_review_queue),
                 ('DataManager.Logic', dm_logic),
+                ('DataManager.MemoryManager', dm_memory_manager),
+                ('DataManager.SessionSnapshot', dm_session_snapshot),
                 ('DataManager.Widget', dm_widget),
                 ('GoldStandardSet.Logic', gs_logic),
                 ('GoldStandardSet.Widget', gs_widget),
+                ('CoarseRegistration.LandmarkRegistration', cr_landmark_registration),
+                ('CoarseRegistration.BatchRegistration', cr_batch_registration),
+                ('CoarseRegistration.LandmarkProposals', cr_landmark_proposals),
+                ('CoarseRegistration.SurfaceICP', cr_surface_icp),
                 ('CoarseRegistration.Logic', cr_logic),
                 ('CoarseRegistration.Widget', cr_widget),
                 ('ROIMaskSet.Logic', rm_logic),
                 ('ROIMaskSet.Widget', rm_widget),
+                ('IntensityRefinement.IntensityRegistration', ir_intensity_registration),
+                ('IntensityRefinement.Logic', ir_logic),
+                ('IntensityRefinement.Widget', ir_widget),
             ]
             
             for name, module in modules_to_reload:
@@ -232,6 +276,10 @@ class TMJExtensionWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     def cleanup(self):
         """清理资源"""
         self.removeObservers()
+        if self.dataManagerWidget:
+            self.dataManagerWidget.cleanup()
+        if self.coarseRegistrationWidget:
+            self.coarseRegistrationWidget.cleanup()
 
 
 #
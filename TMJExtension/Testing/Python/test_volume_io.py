@@ -0,0 +1,79 @@
+"""
+volume_io 中不依赖 Slicer 的函数的测试 (只需要 numpy,可在普通 Python 环境中运行)
+"""
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+
+def _loadVolumeIO():
+    """直接按路径加载 volume_io,不导入需要 Slicer 的 DataManager 包"""
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "DataManager", "volume_io.py")
+    spec = importlib.util.spec_from_file_location("volume_io", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+volume_io = _loadVolumeIO()
+
+
+def _ctLikeVolume(airFraction, boneFraction, shape=(40, 64, 64), dtype=np.int16, seed=0):
+    """CT 样数组: 空气 (-1000 HU)、软组织 (约 40 HU)、骨骼 (约 1200 HU),带噪声"""
+    rng = np.random.default_rng(seed)
+    size = int(np.prod(shape))
+    labels = rng.random(size)
+    values = rng.normal(40, 30, size)
+    values[labels < airFraction] = rng.normal(-1000, 20, int(np.sum(labels < airFraction)))
+    bone = (labels >= airFraction) & (labels < airFraction + boneFraction)
+    values[bone] = rng.normal(1200, 150, int(np.sum(bone)))
+    return values.astype(dtype).reshape(shape)
+
+
+def _mrLikeVolume(shape=(40, 64, 64), dtype=np.uint16, seed=0):
+    """MR 样数组: 零背景加 Rician 噪声,组织强度在数百到上千之间"""
+    rng = np.random.default_rng(seed)
+    size = int(np.prod(shape))
+    tissue = rng.random(size) < 0.6
+    signal = np.where(tissue, rng.normal(600, 200, size).clip(0), 0.0)
+    noisy = np.hypot(signal + rng.normal(0, 15, size), rng.normal(0, 15, size))
+    return noisy.astype(dtype).reshape(shape)
+
+
+@pytest.mark.parametrize("airFraction, boneFraction", [(0.3, 0.005), (0.5, 0.05), (0.1, 0.0), (0.06, 0.2)])
+def test_classify_ct_like(airFraction, boneFraction):
+    result = volume_io.classifyModality(_ctLikeVolume(airFraction, boneFraction))
+    assert result["data_type"] == "CT"
+    assert result["confidence"] >= 0.75
+
+
+def test_classify_ct_with_padding_and_float_storage():
+    volume = _ctLikeVolume(0.2, 0.02, dtype=np.float32)
+    volume[:, :8, :] = -3024
+    result = volume_io.classifyModality(volume)
+    assert result["data_type"] == "CT"
+    assert result["fractions"]["air"] > 0.1
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.int16, np.float32])
+def test_classify_mr_like(dtype):
+    result = volume_io.classifyModality(_mrLikeVolume(dtype=dtype))
+    assert result["data_type"] == "MR"
+    assert result["confidence"] >= 0.9
+
+
+def test_classify_mr_normalized_and_symmetric():
+    rng = np.random.default_rng(1)
+    # z-score 归一化的 MR 和以 0 为中心对称分布的相位图都不应判为 CT
+    normalized = rng.normal(0, 1, (32, 32, 32)).astype(np.float32)
+    phase = rng.uniform(-4096, 4096, (32, 32, 32)).astype(np.int16)
+    assert volume_io.classifyModality(normalized)["data_type"] == "MR"
+    assert volume_io.classifyModality(phase)["data_type"] == "MR"
+
+
+def test_classify_empty_volume():
+    result = volume_io.classifyModality(np.zeros((0,), dtype=np.int16))
+    assert result["data_type"] == "MR"
+    assert result["sample_count"] == 0